@@ -79,16 +79,23 @@ router.get('/overview', async (req: Request, res: Response) => {
       replacements: params,
     });
 
-    // 获取城市统计
+    // 获取城市统计（销售额读取 ETL 步骤11 维护的区域业绩立方体，不再逐单汇总 orders）
     const cityStatsQuery = `
       SELECT TOP 5
         s.city,
-        COUNT(DISTINCT s.id) as store_count,
-        ISNULL(SUM(o.total_amount), 0) as total_sales
-      FROM stores s
-      LEFT JOIN orders o ON s.id = o.store_id AND o.delflag = 0
-      WHERE s.delflag = 0 AND s.city IS NOT NULL AND s.city != ''
-      GROUP BY s.city
+        s.store_count,
+        ISNULL(c.total_sales, 0) as total_sales
+      FROM (
+        SELECT city, COUNT(DISTINCT id) as store_count
+        FROM stores
+        WHERE delflag = 0 AND city IS NOT NULL AND city != ''
+        GROUP BY city
+      ) s
+      LEFT JOIN (
+        SELECT city, SUM(revenue) as total_sales
+        FROM fact_perf_cube_monthly
+        GROUP BY city
+      ) c ON c.city = s.city
       ORDER BY total_sales DESC
     `;
 
@@ -0,0 +1,275 @@
+"""
+销售预测滚动起点回测
+完全离线运行：使用合成门店日销售数据，或从 vw_sales_store_daily 导出的 CSV（date_key, store_id, revenue）
+特征由步骤08的 make_features 生成；在多个截止日上各自训练、预测之后 horizon 天，多个 (模型, 截止日) 任务并行执行：
+- per-store 模型（xgboost / hgb）：与步骤08 forecast_per_store 相同，逐店调用 lib.forecast.forecast_store
+- pooled：全部门店共用的全局模型（含门店属性特征）
+输出各模型 WAPE/MAPE/区间覆盖率、按城市与门店的误差，以及训练/预测耗时，用于同时评估精度与计算成本
+
+用法:
+    python etl/benchmarks/bench_forecast.py --stores 200 --days 730 --cutoffs 4
+    python etl/benchmarks/bench_forecast.py --sales sales.csv --store-attrs stores.csv --models hgb,pooled --out-dir bt
+"""
+import sys
+import time
+import argparse
+import importlib.util
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加lib路径
+sys.path.append(str(Path(__file__).parent.parent))
+from lib.forecast import (HORIZON, DEFAULT_INTERVAL, PRED_COLUMNS, validate_horizon, interval_quantiles,
+                          set_model_type, model_name, limit_threads, forecast_store, split_stores,
+                          prepare_store_attrs, with_store_features, fit_global, forecast_origins,
+                          forecast_global)
+
+STEP_08 = Path(__file__).parent.parent / 'steps' / '08_forecast_sales.py'
+
+MODEL_CHOICES = ('xgboost', 'hgb', 'pooled')
+
+CITIES = ['沈阳', '大连', '鞍山', '抚顺', '营口', '锦州']
+
+# 子进程共享的数据，由进程池 initializer 一次性传入
+_data = {}
+
+
+def load_step_08():
+    """按文件路径导入步骤08（不连接数据库），复用其 make_features"""
+    spec = importlib.util.spec_from_file_location('etl_step_08', STEP_08)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_sales(n_stores: int, n_days: int, seed: int = 7):
+    """合成门店日销售：城市水平差异、周末效应、年季节性、趋势、新开门店与零星缺失日"""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(end='2025-09-30', periods=n_days)
+    city = rng.integers(0, len(CITIES), n_stores)
+    city_level = rng.uniform(0.7, 1.4, len(CITIES))
+    base = rng.lognormal(7.2, 0.35, n_stores) * city_level[city]
+    # 约 20% 门店在区间内新开，历史较短
+    open_offset = np.where(rng.random(n_stores) < 0.2, rng.integers(n_days // 2, n_days - 20, n_stores), 0)
+
+    store_idx = np.repeat(np.arange(n_stores), n_days)
+    day_idx = np.tile(np.arange(n_days), n_stores)
+    keep = (day_idx >= open_offset[store_idx]) & (rng.random(store_idx.size) > 0.02)
+    store_idx, day_idx = store_idx[keep], day_idx[keep]
+
+    weekday = days.weekday.to_numpy()[day_idx]
+    doy = days.dayofyear.to_numpy()[day_idx]
+    revenue = (base[store_idx]
+               * (1 + 0.3 * (weekday >= 5))
+               * (1 + 0.15 * np.sin(2 * np.pi * doy / 365.25))
+               * (1 + 0.1 * day_idx / n_days)
+               * rng.gamma(16, 1 / 16, store_idx.size))
+
+    sales = pd.DataFrame({
+        'date_key': days.strftime('%Y%m%d').astype('int64').to_numpy()[day_idx],
+        'store_id': store_idx.astype('int64') + 1,
+        'revenue': revenue.round(2),
+    })
+    stores = pd.DataFrame({
+        'store_id': np.arange(n_stores) + 1,
+        'city': np.array(CITIES)[city],
+        'rent_amount': rng.uniform(3000, 20000, n_stores).round(0),
+        'open_date': days[open_offset],
+        'is_close': 0,
+    })
+    return sales, stores
+
+
+def load_exported(sales_path: str, attrs_path: str = None):
+    """读取导出的 vw_sales_store_daily（及可选的门店属性 store_id, city, rent_amount, open_date）"""
+    sales = pd.read_csv(sales_path, usecols=['date_key', 'store_id', 'revenue'])
+    sales = sales.dropna(subset=['store_id'])
+    sales['store_id'] = sales['store_id'].astype('int64')
+    if attrs_path:
+        stores = pd.read_csv(attrs_path)
+    else:
+        stores = pd.DataFrame({'store_id': sales['store_id'].unique(), 'city': '未知',
+                               'rent_amount': np.nan, 'open_date': pd.NaT})
+    return sales, stores
+
+
+def pick_cutoffs(date_keys: pd.Series, horizon: int, n: int, step: int) -> list:
+    """最后一个截止日留出 horizon 天实际值，其余按 step 天向前滚动"""
+    last = pd.to_datetime(str(int(date_keys.max())), format='%Y%m%d') - pd.Timedelta(days=horizon)
+    cutoffs = [last - pd.Timedelta(days=step * i) for i in range(n)]
+    return sorted(int(c.strftime('%Y%m%d')) for c in cutoffs)
+
+
+def _init_worker(features, sales, attrs):
+    limit_threads(1)
+    _data.update(features=features, sales=sales, attrs=attrs)
+
+
+def run_task(model: str, cutoff: int, horizon: int, quantiles: tuple) -> dict:
+    """在一个截止日上训练并预测，返回预测明细与耗时"""
+    features, sales, attrs = _data['features'], _data['sales'], _data['attrs']
+    end = int((pd.to_datetime(str(cutoff), format='%Y%m%d') + pd.Timedelta(days=horizon)).strftime('%Y%m%d'))
+    train = features[features['date_key'] <= cutoff]
+    actual = sales[(sales['date_key'] > cutoff) & (sales['date_key'] <= end)]
+
+    start = time.perf_counter()
+    fit_s, predict_s = [], []
+    if model == 'pooled':
+        set_model_type('auto')
+        models, fit = fit_global(with_store_features(train, attrs), horizon, quantiles=quantiles)
+        t = time.perf_counter()
+        preds = forecast_global(models, forecast_origins(train, attrs, include_new_stores=False), attrs, horizon)
+        fit_s.append(fit)
+        predict_s.append(time.perf_counter() - t)
+        label = f"pooled-{model_name()}"
+    else:
+        set_model_type(model)
+        preds = []
+        for g in split_stores(train):
+            p, timing = forecast_store(g, horizon, quantiles=quantiles)
+            preds += p
+            fit_s.append(timing['fit_s'])
+            predict_s.append(timing['predict_s'])
+        label = model
+    wall = time.perf_counter() - start
+
+    # 不输出区间时 yhat_lower / yhat_upper 为 None，统一成 float 便于比较
+    pred_df = pd.DataFrame(preds, columns=PRED_COLUMNS).astype({'yhat_lower': 'float64', 'yhat_upper': 'float64'})
+    scored = actual.merge(pred_df, on=['date_key', 'store_id'], how='inner')
+    scored['model'] = label
+    scored['cutoff'] = cutoff
+    return {'model': label, 'cutoff': cutoff, 'scored': scored, 'fit_s': fit_s, 'predict_s': predict_s,
+            'points': len(preds), 'wall_s': wall}
+
+
+def grouped_errors(scored: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """按维度汇总 WAPE / MAPE / 区间覆盖率"""
+    abs_err = (scored['revenue'] - scored['yhat']).abs()
+    abs_act = scored['revenue'].abs()
+    frame = scored[keys].assign(
+        abs_err=abs_err, abs_act=abs_act,
+        ape=np.where(abs_act > 0, abs_err / abs_act.where(abs_act > 0), np.nan),
+        covered=(scored['revenue'] >= scored['yhat_lower']) & (scored['revenue'] <= scored['yhat_upper']),
+        has_interval=scored['yhat_lower'].notna(),
+    )
+    g = frame.groupby(keys)
+    out = g[['abs_err', 'abs_act']].sum()
+    out['wape'] = out['abs_err'] / out['abs_act']
+    out['mape'] = g['ape'].mean()
+    out['coverage'] = g['covered'].sum() / g['has_interval'].sum().replace(0, np.nan)
+    out['points'] = g.size()
+    return out.drop(columns=['abs_err', 'abs_act'])
+
+
+def latency_summary(results: list) -> pd.DataFrame:
+    rows = []
+    for model in dict.fromkeys(r['model'] for r in results):
+        rs = [r for r in results if r['model'] == model]
+        fit = np.concatenate([r['fit_s'] for r in rs])
+        predict = np.concatenate([r['predict_s'] for r in rs])
+        points = sum(r['points'] for r in rs)
+        rows.append({
+            'model': model,
+            'fits': len(fit),
+            'fit_total_s': fit.sum(),
+            'fit_p50_s': np.percentile(fit, 50),
+            'fit_p95_s': np.percentile(fit, 95),
+            'predict_total_s': predict.sum(),
+            'predict_us_per_point': predict.sum() / points * 1e6 if points else np.nan,
+            'task_wall_s': sum(r['wall_s'] for r in rs),
+        })
+    return pd.DataFrame(rows).set_index('model')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="销售预测滚动起点回测")
+    parser.add_argument('--sales', help="导出的 vw_sales_store_daily CSV；不指定时使用合成数据")
+    parser.add_argument('--store-attrs', help="门店属性 CSV（store_id, city, rent_amount, open_date）")
+    parser.add_argument('--stores', type=int, default=100, help="合成门店数")
+    parser.add_argument('--days', type=int, default=730, help="合成天数")
+    parser.add_argument('--models', default=','.join(MODEL_CHOICES), help="逗号分隔: xgboost,hgb,pooled")
+    parser.add_argument('--horizon', type=int, default=HORIZON)
+    parser.add_argument('--cutoffs', type=int, default=4, help="截止日个数")
+    parser.add_argument('--step', type=int, default=7, help="相邻截止日间隔天数")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="预测区间覆盖率，0 表示不训练分位数模型")
+    parser.add_argument('--workers', type=int, default=mp.cpu_count(), help="并行任务进程数")
+    parser.add_argument('--top', type=int, default=10, help="输出误差最大的门店数")
+    parser.add_argument('--out-dir', help="写出 summary/per_city/per_store CSV 的目录")
+    args = parser.parse_args()
+
+    horizon = validate_horizon(args.horizon)
+    quantiles = interval_quantiles(args.interval)
+    models = [m.strip() for m in args.models.split(',') if m.strip()]
+    for m in models:
+        if m not in MODEL_CHOICES:
+            parser.error(f"未知模型: {m}")
+    if 'xgboost' in models:
+        try:
+            import xgboost  # noqa: F401
+        except ImportError:
+            print("⚠️ 未安装 xgboost，跳过 xgboost 模型")
+            models.remove('xgboost')
+
+    if args.sales:
+        sales, stores = load_exported(args.sales, args.store_attrs)
+    else:
+        sales, stores = make_sales(args.stores, args.days)
+    attrs = prepare_store_attrs(stores)
+
+    step08 = load_step_08()
+    start = time.perf_counter()
+    features = step08.make_features(sales)
+    features['store_id'] = features['store_id'].astype('int64')
+    t_features = time.perf_counter() - start
+
+    cutoffs = pick_cutoffs(sales['date_key'], horizon, args.cutoffs, args.step)
+    tasks = [(m, c) for m in models for c in cutoffs]
+    print(f"数据: {sales['store_id'].nunique()} 个门店，{len(sales)} 行；make_features {t_features:.2f}s")
+    print(f"截止日: {cutoffs}，预测 {horizon} 天，模型 {models}，{len(tasks)} 个任务 / {args.workers} 进程")
+
+    start = time.perf_counter()
+    results = []
+    # spawn：与步骤08进程池一致，避免 fork 继承线程状态
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(tasks))), mp_context=ctx,
+                             initializer=_init_worker, initargs=(features, sales, attrs)) as pool:
+        futures = [pool.submit(run_task, m, c, horizon, quantiles) for m, c in tasks]
+        for future in as_completed(futures):
+            r = future.result()
+            results.append(r)
+            print(f"  ✓ {r['model']:<16} 截止 {r['cutoff']}  {r['wall_s']:.2f}s")
+    wall = time.perf_counter() - start
+
+    scored = pd.concat([r['scored'] for r in results], ignore_index=True)
+    scored = scored.merge(attrs[['store_id', 'city']], on='store_id', how='left')
+    scored['city'] = scored['city'].fillna('未知')
+
+    summary = grouped_errors(scored, ['model']).join(latency_summary(results))
+    per_city = grouped_errors(scored, ['model', 'city'])
+    per_store = grouped_errors(scored, ['model', 'store_id'])
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 20, 'display.float_format', '{:.4f}'.format):
+        print(f"\n总墙钟 {wall:.2f}s")
+        print("\n== 模型汇总 ==")
+        print(summary)
+        print("\n== 按城市 WAPE ==")
+        print(per_city['wape'].unstack('model'))
+        print(f"\n== 误差最大的 {args.top} 个门店（各模型）==")
+        worst = per_store.reset_index().sort_values(['model', 'wape'], ascending=[True, False])
+        print(worst.groupby('model').head(args.top).set_index(['model', 'store_id']))
+
+    if args.out_dir:
+        out = Path(args.out_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        summary.to_csv(out / 'summary.csv')
+        per_city.to_csv(out / 'per_city.csv')
+        per_store.to_csv(out / 'per_store.csv')
+        print(f"\n已写出 {out}/summary.csv, per_city.csv, per_store.csv")
+
+
+if __name__ == "__main__":
+    main()
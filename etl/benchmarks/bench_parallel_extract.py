@@ -0,0 +1,160 @@
+"""
+区间并行抽取基准测试
+用模拟的源库替换 lib.range_extract 的查询函数，走真实的区间规划、区间 SQL、重试与按序合并逻辑：
+- 单个会话的读取速度受网络往返与单线程执行限制（--conn-rate 行/秒）
+- 服务器总吞吐有上限（--server-rate 行/秒），并发会话平分
+因此理想耗时 ≈ 总行数 / min(连接数 × conn_rate, server_rate)，连接数增加到服务器饱和后不再提速
+--fail-rate 按比例让区间首次读取失败，验证单区间重试后行数与顺序仍然正确
+计时前先检查只规划出一个区间的情形（只有一行、所有行切分列取值相同、另有切分列为 NULL 的行）行数不丢不重
+
+用法:
+    python etl/benchmarks/bench_parallel_extract.py --rows 1000000 --conn-rate 200000 --server-rate 700000
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+from pathlib import Path
+
+# 连接数上限由连接池决定，基准测试按最大并发数放开
+os.environ.setdefault('ETL_POOL_MAX_SIZE', '64')
+
+# 添加lib路径
+sys.path.append(str(Path(__file__).parent.parent))
+from lib import range_extract
+from lib.range_extract import plan_ranges, iter_df_ranges
+
+COLUMNS = ['id', 'order_no', 'store_id', 'total_amount']
+
+
+class FakeServer:
+    """按 id 区间返回合成订单行；id 有空洞（每 7 个缺 1 个），模拟删除过的主键"""
+
+    def __init__(self, n_rows: int, conn_rate: float, server_rate: float, fail_rate: float, seed: int = 7):
+        self.max_id = n_rows * 7 // 6
+        self.conn_rate = conn_rate
+        self.server_rate = server_rate
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.failed = set()
+        self.failures = 0
+
+    def ids(self, lo, hi):
+        lo = 1 if lo is None else max(1, lo)
+        hi = self.max_id + 1 if hi is None else min(hi, self.max_id + 1)
+        return [i for i in range(lo, hi) if i % 7]
+
+    def _stream(self, n):
+        # 分片 sleep：每片按当前并发会话数平分服务器吞吐
+        done = 0
+        while done < n:
+            step = min(5000, n - done)
+            with self.lock:
+                rate = min(self.conn_rate, self.server_rate / max(1, self.active))
+            time.sleep(step / rate)
+            done += step
+
+    def query(self, database, sql, params):
+        if sql.startswith('SELECT MIN'):
+            ids = self.ids(None, None)
+            return ['min', 'max', 'non_null', 'total'], [(ids[0], ids[-1], len(ids), len(ids))]
+        lo = hi = None
+        params = list(params)
+        if '>= %s' in sql:
+            lo = params.pop(0)
+        if '< %s' in sql:
+            hi = params.pop(0)
+        with self.lock:
+            if (lo, hi) not in self.failed and self.random.random() < self.fail_rate:
+                self.failed.add((lo, hi))
+                self.failures += 1
+                raise ConnectionError(f"模拟连接中断 [{lo}, {hi})")
+            self.active += 1
+        try:
+            ids = self.ids(lo, hi)
+            self._stream(len(ids))
+        finally:
+            with self.lock:
+                self.active -= 1
+        return COLUMNS, [(i, f'NO{i}', i % 300, 10.0) for i in ids]
+
+
+class PointServer:
+    """所有非 NULL 行的 id 相同（或只有一行），另有 null_rows 行 id 为 NULL"""
+
+    def __init__(self, n_rows: int, key_value: int, null_rows: int = 0):
+        self.n_rows = n_rows
+        self.key_value = key_value
+        self.null_rows = null_rows
+
+    def query(self, database, sql, params):
+        if sql.startswith('SELECT MIN'):
+            return ['min', 'max', 'non_null', 'total'], [(self.key_value, self.key_value, self.n_rows,
+                                                          self.n_rows + self.null_rows)]
+        if 'IS NULL' in sql:
+            return COLUMNS, [(None, f'NULL{i}', 1, 10.0) for i in range(self.null_rows)]
+        params = list(params)
+        lo = params.pop(0) if '>= %s' in sql else None
+        hi = params.pop(0) if '< %s' in sql else None
+        if (lo is not None and self.key_value < lo) or (hi is not None and self.key_value >= hi):
+            return COLUMNS, []
+        return COLUMNS, [(self.key_value, f'NO{i}', 1, 10.0) for i in range(self.n_rows)]
+
+
+def check_single_range(connections):
+    """只有一个区间时不能被当成 "切分列为 NULL" 的区间而丢掉全部行"""
+    for n_rows, key_value, null_rows in ((1, 42, 0), (500, 7, 0), (500, 7, 3)):
+        server = PointServer(n_rows, key_value, null_rows)
+        range_extract._query = server.query
+        ranges = plan_ranges('SELECT * FROM Orders', 'bench', 'id', connections=connections)
+        rows = sum(len(df) for df in iter_df_ranges('SELECT * FROM Orders', 'bench', 'id', ranges,
+                                                    connections=connections))
+        assert rows == n_rows + null_rows, f"单区间行数不一致 {rows}/{n_rows + null_rows} (id={key_value})"
+    print("单区间检查通过: 1 行 / 500 行同一 id / 另有 NULL id 行")
+
+
+def run(server, connections, chunksize):
+    range_extract._query = server.query
+    ranges = plan_ranges('SELECT * FROM Orders', 'bench', 'id', connections=connections, range_rows=chunksize)
+    start = time.perf_counter()
+    rows, last_id = 0, 0
+    # 重试退避缩短，避免模拟失败拖长耗时
+    for df in iter_df_ranges('SELECT * FROM Orders', 'bench', 'id', ranges, connections=connections, backoff=0.01):
+        if len(df):
+            assert df['id'].iloc[0] > last_id, "区间乱序"
+            last_id = int(df['id'].iloc[-1])
+        rows += len(df)
+    return time.perf_counter() - start, rows, len(ranges)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="区间并行抽取 vs 单连接抽取")
+    parser.add_argument('--rows', type=int, default=1000000, help="源表行数")
+    parser.add_argument('--conn-rate', type=float, default=200000, help="单个会话读取速度（行/秒）")
+    parser.add_argument('--server-rate', type=float, default=700000, help="服务器总吞吐上限（行/秒）")
+    parser.add_argument('--connections', default='1,2,4,8', help="逗号分隔的连接数")
+    parser.add_argument('--chunksize', type=int, default=50000, help="每个区间的目标行数")
+    parser.add_argument('--fail-rate', type=float, default=0.05, help="区间首次读取失败的比例")
+    args = parser.parse_args()
+
+    check_single_range(4)
+    print(f"{'连接数':<8}{'区间数':>8}{'行数':>10}{'耗时(秒)':>12}{'条/秒':>12}{'理论(秒)':>10}{'重试':>6}{'加速比':>8}")
+    base = None
+    for connections in (int(n) for n in re.split(r'[,\s]+', args.connections) if n):
+        server = FakeServer(args.rows, args.conn_rate, args.server_rate, args.fail_rate)
+        elapsed, rows, n_ranges = run(server, connections, args.chunksize)
+        expected = len(server.ids(None, None))
+        assert rows == expected, f"行数不一致 {rows}/{expected}"
+        base = base or elapsed
+        ideal = rows / min(connections * args.conn_rate, args.server_rate)
+        print(f"{connections:<8}{n_ranges:>8}{rows:>10}{elapsed:>12.3f}{rows / elapsed:>12.0f}"
+              f"{ideal:>10.2f}{server.failures:>6}{base / elapsed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+RFM 分群基准测试
+使用合成客户数据与本地 SQLite 替身库，对比步骤07的原实现与向量化实现：
+- 评分:   原 rank + pd.cut 逐列分箱  vs  lib.rfm.score_rfm 一次向量化计算
+- 写入:   原逐行 upsert              vs  暂存表批量写入 + 一次集合化 upsert（只写分群变化的客户）
+
+用法:
+    python etl/benchmarks/bench_rfm.py --customers 1000000
+    python etl/benchmarks/bench_rfm.py --customers 200000 --changed-ratio 0.05 --skip-rowwise
+"""
+import sys
+import time
+import sqlite3
+import argparse
+import datetime as dt
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加lib路径
+sys.path.append(str(Path(__file__).parent.parent))
+from lib.bulk import df_to_rows, write_multirow
+from lib.rfm import score_rfm, changed_segments
+
+SEGMENT_DDL = """
+CREATE TABLE dim_customer_segment (
+    customer_id TEXT PRIMARY KEY, r_score INTEGER, f_score INTEGER, m_score INTEGER,
+    segment_code INTEGER, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+STAGE_DDL = """
+CREATE TEMP TABLE stg_segment (
+    customer_id TEXT, r_score INTEGER, f_score INTEGER, m_score INTEGER, segment_code INTEGER
+)
+"""
+
+COLUMNS = ['customer_id', 'r_score', 'f_score', 'm_score', 'segment_code']
+
+
+def make_customers(n: int, seed: int = 7) -> pd.DataFrame:
+    """生成与 load_rfm 输出结构一致的合成客户数据"""
+    rng = np.random.default_rng(seed)
+    last_day = pd.Timestamp('2025-10-01') - pd.to_timedelta(rng.integers(0, 720, n), unit='D')
+    return pd.DataFrame({
+        'customer_id': np.char.add('oid_', np.arange(n).astype(str)),
+        'last_date_key': last_day.strftime('%Y%m%d').astype(int),
+        'freq': rng.geometric(0.3, n),
+        'monetary': rng.gamma(2.0, 40.0, n).round(2),
+    })
+
+
+def legacy_qcut_to_score(s, q=5, ascending=True):
+    """步骤07原评分实现（F/M 取修正后的方向：数值越大评分越高）"""
+    s = s.rank(method='first', ascending=ascending)
+    bins = np.linspace(0, s.max(), q + 1)
+    labels = list(range(1, q + 1))
+    return pd.cut(s, bins=bins, labels=labels, include_lowest=True).astype(int)
+
+
+def legacy_score(df: pd.DataFrame, q: int) -> pd.DataFrame:
+    out = df[['customer_id']].copy()
+    out['r_score'] = legacy_qcut_to_score(df['last_date_key'], q=q, ascending=True)
+    out['f_score'] = legacy_qcut_to_score(df['freq'], q=q, ascending=True)
+    out['m_score'] = legacy_qcut_to_score(df['monetary'], q=q, ascending=True)
+    out['segment_code'] = out['r_score'] * 100 + out['f_score'] * 10 + out['m_score']
+    return out
+
+
+def write_rowwise(conn, out: pd.DataFrame) -> int:
+    """原实现：逐行 upsert"""
+    cur = conn.cursor()
+    for _, r in out.iterrows():
+        cur.execute("""
+INSERT INTO dim_customer_segment (customer_id, r_score, f_score, m_score, segment_code) VALUES (?,?,?,?,?)
+ON CONFLICT(customer_id) DO UPDATE SET r_score=excluded.r_score, f_score=excluded.f_score,
+  m_score=excluded.m_score, segment_code=excluded.segment_code, updated_at=CURRENT_TIMESTAMP
+""", (r['customer_id'], int(r['r_score']), int(r['f_score']), int(r['m_score']), int(r['segment_code'])))
+    conn.commit()
+    return len(out)
+
+
+def write_staged(conn, out: pd.DataFrame) -> int:
+    """新实现：只取变化客户，批量写入暂存表后一次集合化 upsert"""
+    current = pd.read_sql("SELECT customer_id, segment_code FROM dim_customer_segment", conn)
+    changed = changed_segments(out, current)
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS stg_segment")
+    cur.execute(STAGE_DDL)
+    write_multirow(cur, 'stg_segment', COLUMNS, df_to_rows(changed[COLUMNS]), placeholder='?')
+    cur.execute("""
+INSERT INTO dim_customer_segment (customer_id, r_score, f_score, m_score, segment_code)
+SELECT customer_id, r_score, f_score, m_score, segment_code FROM stg_segment WHERE true
+ON CONFLICT(customer_id) DO UPDATE SET r_score=excluded.r_score, f_score=excluded.f_score,
+  m_score=excluded.m_score, segment_code=excluded.segment_code, updated_at=CURRENT_TIMESTAMP
+""")
+    conn.commit()
+    return len(changed)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RFM 分群基准测试")
+    parser.add_argument('--customers', type=int, default=1000000, help="合成客户数")
+    parser.add_argument('--quantiles', type=int, default=5)
+    parser.add_argument('--changed-ratio', type=float, default=0.05,
+                        help="第二次运行时发生变化的客户比例（模拟日常增量）")
+    parser.add_argument('--skip-rowwise', action='store_true', help="跳过耗时的逐行写入基准")
+    args = parser.parse_args()
+
+    df = make_customers(args.customers)
+    ref = dt.date(2025, 10, 1)
+    print(f"合成客户数: {len(df)}")
+
+    legacy, t_legacy = timed(legacy_score, df, args.quantiles)
+    scores, t_vector = timed(score_rfm, df, args.quantiles, ref)
+    same = (legacy['segment_code'].to_numpy() == scores['segment_code'].to_numpy()).mean()
+    print(f"{'评分':<24}{'耗时(秒)':>12}")
+    print(f"{'legacy rank+cut':<24}{t_legacy:>12.3f}")
+    print(f"{'vectorized score_rfm':<24}{t_vector:>12.3f}   加速 {t_legacy / t_vector:.1f}x，结果一致率 {same:.2%}")
+
+    # 第二次运行：部分客户产生新订单，分群随之变化
+    rng = np.random.default_rng(11)
+    df2 = df.copy()
+    moved = rng.random(len(df2)) < args.changed_ratio
+    df2.loc[moved, 'freq'] += 3
+    df2.loc[moved, 'last_date_key'] = 20251001
+    scores2 = score_rfm(df2, args.quantiles, ref)
+
+    print(f"{'写入':<24}{'首次(秒)':>12}{'增量(秒)':>12}{'增量写入行':>12}")
+    if not args.skip_rowwise:
+        conn = sqlite3.connect(':memory:')
+        conn.execute(SEGMENT_DDL)
+        _, t_first = timed(write_rowwise, conn, scores)
+        n2, t_second = timed(write_rowwise, conn, scores2)
+        conn.close()
+        print(f"{'legacy row-by-row':<24}{t_first:>12.3f}{t_second:>12.3f}{n2:>12}")
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute(SEGMENT_DDL)
+    _, t_first = timed(write_staged, conn, scores)
+    n2, t_second = timed(write_staged, conn, scores2)
+    count = conn.execute("SELECT COUNT(*) FROM dim_customer_segment").fetchone()[0]
+    conn.close()
+    assert count == len(scores), f"写入行数不一致 {count}/{len(scores)}"
+    print(f"{'staged changed-only':<24}{t_first:>12.3f}{t_second:>12.3f}{n2:>12}")
+
+
+if __name__ == "__main__":
+    main()
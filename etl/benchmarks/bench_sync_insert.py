@@ -0,0 +1,197 @@
+"""
+同步写入基准测试：字符串拼接 INSERT vs 参数化批量写入
+对比 ultra_fast_sync 原来的 800 行 f-string 拼值 INSERT 与 lib.sync_writer 的参数化写入：
+- string:      原实现，每批把值拼进 SQL 文本（为了能跑完，这里对单引号做了转义；原实现遇到引号直接失败）
+- executemany: 逐行参数化 INSERT
+- multirow:    客户端参数化多行 INSERT
+- prepared:    sp_executesql 参数化多行 INSERT，满批语句文本固定（仅 SQL Server）
+SQLite 替身库只用来验证写法正确、粗看趋势：语句文本固定时命中 sqlite3 的预编译语句缓存，但 SQLite 没有网络往返，
+也不代表 SQL Server 的解析编译开销，其加速比不能当作 SQL Server 上的结论。
+SQL Server 上的对比（string / executemany / multirow / prepared）需要 --mssql-db 或环境变量 ETL_BENCH_MSSQL_DB
+指定数据库（连接参数同 lib.mssql），未指定时跳过并提示。
+pymssql 在客户端代入参数，multirow / executemany 在服务器看来每批语句文本都不同，只有 prepared 的文本固定；
+"不同语句文本数" 即服务器需要解析编译的批次数
+
+用法:
+    python etl/benchmarks/bench_sync_insert.py --rows 200000
+    python etl/benchmarks/bench_sync_insert.py --rows 50000 --mssql-db hotdog2030
+    ETL_BENCH_MSSQL_DB=hotdog2030 python etl/benchmarks/bench_sync_insert.py --rows 50000
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import datetime as dt
+from pathlib import Path
+
+import numpy as np
+
+# 添加lib路径
+sys.path.append(str(Path(__file__).parent.parent))
+from lib.bulk import write_multirow, rows_per_statement
+
+COLUMNS = ['id', 'order_no', 'customer_id', 'store_id', 'total_amount', 'pay_state', 'pay_mode',
+           'created_at', 'updated_at', 'delflag', 'cash', 'vipAmount', 'vipAmountZengSong', 'cardAmount',
+           'cardZengSong', 'couponAmount', 'discountAmount', 'orderRemarks']
+
+SQLITE_DDL = """
+CREATE TABLE [{table}] (
+    [id] INTEGER PRIMARY KEY, [order_no] TEXT, [customer_id] TEXT, [store_id] INTEGER, [total_amount] REAL,
+    [pay_state] INTEGER, [pay_mode] TEXT, [created_at] TIMESTAMP, [updated_at] TIMESTAMP, [delflag] INTEGER,
+    [cash] REAL, [vipAmount] REAL, [vipAmountZengSong] REAL, [cardAmount] REAL, [cardZengSong] REAL,
+    [couponAmount] REAL, [discountAmount] REAL, [orderRemarks] TEXT
+)
+"""
+
+MSSQL_DDL = """
+IF OBJECT_ID('{table}','U') IS NULL
+CREATE TABLE [{table}] (
+    [id] bigint PRIMARY KEY, [order_no] nvarchar(64), [customer_id] nvarchar(64), [store_id] int,
+    [total_amount] decimal(18,2), [pay_state] int, [pay_mode] nvarchar(32), [created_at] datetime2(3),
+    [updated_at] datetime2(3), [delflag] bit, [cash] decimal(18,2), [vipAmount] decimal(18,2),
+    [vipAmountZengSong] decimal(18,2), [cardAmount] decimal(18,2), [cardZengSong] decimal(18,2),
+    [couponAmount] decimal(18,2), [discountAmount] decimal(18,2), [orderRemarks] nvarchar(500)
+)
+"""
+
+LEGACY_BATCH = 800
+
+
+def make_rows(n_rows: int, quote_ratio: float = 0.01, seed: int = 42) -> list:
+    """生成与 order_row 输出结构相同的合成订单行，部分备注带单引号"""
+    rng = np.random.default_rng(seed)
+    base = dt.datetime(2024, 1, 1)
+    seconds = rng.integers(0, 365 * 24 * 3600, n_rows).tolist()
+    amount = rng.gamma(2.0, 15.0, n_rows).round(2).tolist()
+    store = rng.integers(1, 500, n_rows).tolist()
+    customer = rng.integers(0, n_rows // 3 + 1, n_rows).tolist()
+    pay_mode = rng.choice(['微信', '支付宝', '现金'], n_rows).tolist()
+    quoted = (rng.random(n_rows) < quote_ratio).tolist()
+    rows = []
+    for i in range(n_rows):
+        created = base + dt.timedelta(seconds=seconds[i])
+        remarks = "少放酱，加'辣'" if quoted[i] else ('少放酱' if i % 7 == 0 else '')
+        rows.append((i + 1, f'NO{i}', f'oid_{customer[i]}', store[i], amount[i], 2, pay_mode[i], created, created,
+                     0, amount[i], 0, 0, 0, 0, 0, 0, remarks))
+    return rows
+
+
+def _literal(value) -> str:
+    """原实现的拼值方式：字符串与时间加单引号，其余直接 str()"""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, dt.datetime):
+        return f"'{value}'"
+    return str(value)
+
+
+def write_string(cursor, table: str, rows: list, batch_rows: int = LEGACY_BATCH) -> tuple:
+    """原 ultra_fast_sync 写法：每批拼出完整 SQL 文本，返回 (写入行数, 不同语句文本数)"""
+    prefix = f"INSERT INTO [{table}] ({','.join(f'[{c}]' for c in COLUMNS)}) VALUES "
+    inserted, texts = 0, 0
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        values = ", ".join("(" + ", ".join(_literal(v) for v in row) + ")" for row in batch)
+        cursor.execute(prefix + values)
+        inserted += len(batch)
+        texts += 1
+    return inserted, texts
+
+
+def _run(name, conn, table, fn, n_rows):
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    inserted, texts = fn(cursor)
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    cursor.execute(f"SELECT COUNT(*) FROM [{table}]")
+    count = cursor.fetchone()[0]
+    assert count == inserted == n_rows, f"{name}: 写入行数不一致 {count}/{inserted}/{n_rows}"
+    return name, n_rows, elapsed, texts
+
+
+def bench_sqlite(rows: list) -> list:
+    """在 SQLite 替身库上对比拼值与参数化写入"""
+    table = 'bench_sync_orders'
+    batch_rows = rows_per_statement(len(COLUMNS))
+    n_batches = -(-len(rows) // batch_rows)
+    distinct = 1 if len(rows) % batch_rows == 0 else 2
+    single_sql = f"INSERT INTO [{table}] ({','.join(f'[{c}]' for c in COLUMNS)}) VALUES ({','.join(['?'] * len(COLUMNS))})"
+    strategies = {
+        'string': lambda cur: write_string(cur, table, rows),
+        'executemany': lambda cur: (cur.executemany(single_sql, rows).rowcount, 1),
+        'multirow': lambda cur: (write_multirow(cur, table, COLUMNS, rows, placeholder='?'),
+                                 min(n_batches, distinct)),
+    }
+    results = []
+    for name, fn in strategies.items():
+        conn = sqlite3.connect(':memory:', detect_types=0)
+        conn.execute(SQLITE_DDL.format(table=table))
+        results.append(_run(f"sqlite/{name}", conn, table, fn, len(rows)))
+        conn.close()
+    return results
+
+
+def bench_mssql(rows: list, database: str, table: str) -> list:
+    """在真实 SQL Server 上对比 string / executemany / multirow / prepared，测试表用后删除"""
+    from lib.mssql import get_conn
+    from lib.sync_writer import SyncWriter
+
+    batch_rows = rows_per_statement(len(COLUMNS))
+    n_batches = -(-len(rows) // batch_rows)
+    # 客户端代入参数的写法每条语句文本都不同；prepared 只有满批与尾批两种
+    texts = {'executemany': len(rows), 'multirow': n_batches,
+             'prepared': 1 if len(rows) % batch_rows == 0 else min(n_batches, 2)}
+    results = []
+    with get_conn(database) as conn:
+        cursor = conn.cursor()
+        cursor.execute(MSSQL_DDL.format(table=table))
+        conn.commit()
+        try:
+            for method in ('string', 'executemany', 'multirow', 'prepared'):
+                cursor.execute(f"TRUNCATE TABLE [{table}]")
+                conn.commit()
+                if method == 'string':
+                    fn = lambda cur: write_string(cur, table, rows)
+                else:
+                    writer = SyncWriter(conn, table, COLUMNS, method=method, label=method)
+                    fn = lambda cur, w=writer, m=method: (w.write(rows), texts[m])
+                results.append(_run(f"mssql/{method}", conn, table, fn, len(rows)))
+        finally:
+            cursor.execute(f"DROP TABLE [{table}]")
+            conn.commit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步写入：字符串拼接 vs 参数化批量写入")
+    parser.add_argument('--rows', type=int, default=100000, help="合成订单行数")
+    parser.add_argument('--quote-ratio', type=float, default=0.01, help="备注带单引号的订单比例")
+    parser.add_argument('--mssql-db', default=os.getenv('ETL_BENCH_MSSQL_DB'),
+                        help="可选：在该 SQL Server 数据库上追加测试（默认取 ETL_BENCH_MSSQL_DB）")
+    parser.add_argument('--mssql-table', default='bench_sync_orders', help="SQL Server 测试表（自动创建并删除）")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, args.quote_ratio)
+    quoted = [i for i, row in enumerate(rows) if "'" in row[-1]]
+    broken = len({i // LEGACY_BATCH for i in quoted})
+    print(f"合成 {len(rows)} 行，其中 {len(quoted)} 行备注带引号："
+          f"原实现（不转义）会有 {broken}/{-(-len(rows) // LEGACY_BATCH)} 个批次失败")
+
+    results = bench_sqlite(rows)
+    if args.mssql_db:
+        results += bench_mssql(rows, args.mssql_db, args.mssql_table)
+    else:
+        print("未指定 --mssql-db / ETL_BENCH_MSSQL_DB，跳过 SQL Server 测试；以下仅为 SQLite 替身库结果，"
+              "不代表 SQL Server 上的加速比")
+
+    baseline = {name.split('/')[0]: elapsed for name, _, elapsed, _ in results if name.endswith('/string')}
+    print(f"{'策略':<20}{'行数':>10}{'耗时(秒)':>12}{'条/秒':>12}{'不同语句文本数':>16}{'加速比':>10}")
+    for name, n, elapsed, texts in results:
+        speedup = baseline[name.split('/')[0]] / elapsed
+        print(f"{name:<20}{n:>10}{elapsed:>12.3f}{n / elapsed:>12.0f}{texts:>16}{speedup:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+流水线同步基准测试
+用模拟的源库游标（按块读取有固定延迟）与模拟写入器（按行写入有固定耗时）对比：
+- sequential: 原 ultra_fast_sync 写法，依次 fetchall 各源库、合并后再写入，内存持有全部行
+- pipeline:   lib.sync_pipeline，多源并发读取、转换与写入重叠，内存只持有队列中的少量数据块
+理想情况下流水线端到端耗时 ≈ max(最慢源库读取, 写入)，顺序写法 ≈ 各源读取之和 + 写入
+
+用法:
+    python etl/benchmarks/bench_sync_pipeline.py --rows 200000 --read-rate 150000 --write-rate 120000
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# 添加lib路径
+sys.path.append(str(Path(__file__).parent.parent))
+from lib.sync_pipeline import SyncPipeline, SyncSource, DEFAULT_CHUNK_ROWS, DEFAULT_QUEUE_CHUNKS
+
+
+class FakeCursor:
+    """按 rate 行/秒返回合成订单行的游标（sleep 模拟网络与服务器耗时，不占 GIL）"""
+
+    def __init__(self, n_rows: int, rate: float, offset: int):
+        self.n_rows = n_rows
+        self.rate = rate
+        self.offset = offset
+        self.pos = 0
+
+    def execute(self, sql, params=None):
+        self.pos = 0
+
+    def _take(self, n):
+        n = min(n, self.n_rows - self.pos)
+        time.sleep(n / self.rate)
+        rows = [(self.offset + i, f'NO{self.offset + i}', 'oid', 1, 10.0) for i in range(self.pos, self.pos + n)]
+        self.pos += n
+        return rows
+
+    def fetchmany(self, n):
+        return self._take(n)
+
+    def fetchall(self):
+        return self._take(self.n_rows - self.pos)
+
+
+class FakeConn:
+    def __init__(self, n_rows, rate, offset):
+        self._cursor = FakeCursor(n_rows, rate, offset)
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        pass
+
+
+class FakeWriter:
+    """按 rate 行/秒写入并提交"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.rows = 0
+
+    def write(self, rows):
+        time.sleep(len(rows) / self.rate)
+        self.rows += len(rows)
+        return len(rows)
+
+
+def transform(rows):
+    return [(r[0], r[1], r[2], r[3], r[4] if r[4] > 0 else 0) for r in rows]
+
+
+def run_sequential(sources, write_rate):
+    start = time.perf_counter()
+    all_rows = []
+    for name, n_rows, rate, offset in sources:
+        cursor = FakeConn(n_rows, rate, offset).cursor()
+        cursor.execute('')
+        all_rows += cursor.fetchall()
+    peak = len(all_rows)
+    FakeWriter(write_rate).write(transform(all_rows))
+    return time.perf_counter() - start, peak
+
+
+def run_pipeline(sources, write_rate, chunk_rows, queue_chunks, workers):
+    specs = [SyncSource(name, lambda n=n_rows, r=rate, o=offset: FakeConn(n, r, o), '')
+             for name, n_rows, rate, offset in sources]
+    pipeline = SyncPipeline(specs, transform, FakeWriter(write_rate), chunk_rows=chunk_rows,
+                            queue_chunks=queue_chunks, transform_workers=workers, dedup_key=lambda row: row[0])
+    start = time.perf_counter()
+    stats = pipeline.run()
+    elapsed = time.perf_counter() - start
+    # 内存中最多：两个队列 + 每个读取线程与转换线程手上各一块 + 写入线程一块 + 后续源库预读暂存的块
+    peak = (2 * queue_chunks + len(sources) + workers + 1 + (len(sources) - 1) * pipeline.gate_chunks) * chunk_rows
+    return elapsed, peak, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流水线同步 vs 顺序同步")
+    parser.add_argument('--rows', type=int, default=200000, help="每个源库的行数")
+    parser.add_argument('--read-rate', type=float, default=150000, help="单个源库读取速度（行/秒）")
+    parser.add_argument('--write-rate', type=float, default=120000, help="目标库写入速度（行/秒）")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--queue-chunks', type=int, default=DEFAULT_QUEUE_CHUNKS)
+    parser.add_argument('--workers', type=int, default=2, help="转换线程数")
+    args = parser.parse_args()
+
+    # 两个源库（cyrg2025 / cyrgweixin），id 区间不重叠
+    sources = [('cyrg2025', args.rows, args.read_rate, 0), ('cyrgweixin', args.rows, args.read_rate, args.rows)]
+    total = 2 * args.rows
+    read_s = args.rows / args.read_rate
+    write_s = total / args.write_rate
+    print(f"理论耗时: 单源读取 {read_s:.2f}s，写入 {write_s:.2f}s；顺序 ≈ {2 * read_s + write_s:.2f}s，"
+          f"流水线下限 ≈ {max(read_s, write_s):.2f}s")
+
+    seq_s, seq_peak = run_sequential(sources, args.write_rate)
+    pipe_s, pipe_peak, stats = run_pipeline(sources, args.write_rate, args.chunk_rows, args.queue_chunks, args.workers)
+    assert stats['written'] == total, f"流水线写入行数不一致 {stats['written']}/{total}"
+
+    print(f"{'模式':<12}{'行数':>10}{'耗时(秒)':>12}{'条/秒':>12}{'内存峰值(行)':>14}{'加速比':>10}")
+    for name, elapsed, peak in (('sequential', seq_s, seq_peak), ('pipeline', pipe_s, pipe_peak)):
+        print(f"{name:<12}{total:>10}{elapsed:>12.3f}{total / elapsed:>12.0f}{peak:>14}{seq_s / elapsed:>10.1f}x")
+    print(f"流水线: 写入 {stats['write_seconds']:.2f}s，写入等待 {stats['write_idle_seconds']:.2f}s，"
+          f"读取背压等待 {stats['read_blocked_seconds']:.2f}s，转换 {stats['transform_seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+to_sql 批量写入策略基准测试
+使用本地 SQLite 作为 SQL Server 的替身数据库，对比：
+- iterrows:    原 to_sql 的逐行 cursor.execute
+- executemany: 分块 executemany
+- multirow:    多行 VALUES 批量
+bcp 仅在 SQL Server 上可用，传入 --mssql-db 时对真实数据库追加测试
+
+用法:
+    python etl/benchmarks/bench_to_sql.py --rows 200000
+    python etl/benchmarks/bench_to_sql.py --rows 50000 --mssql-db hotdog2030 --mssql-table bench_orders
+"""
+import sys
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加lib路径
+sys.path.append(str(Path(__file__).parent.parent))
+from lib.bulk import df_to_rows, write_executemany, write_multirow, DEFAULT_CHUNKSIZE
+
+ORDERS_DDL = """
+CREATE TABLE [bench_orders] (
+    [order_no] TEXT, [store_id] INTEGER, [customer_id] TEXT, [total_amount] REAL,
+    [pay_state] INTEGER, [pay_mode] TEXT, [created_at] TIMESTAMP, [updated_at] TIMESTAMP
+)
+"""
+
+
+def make_orders(n_rows: int, seed: int = 42) -> pd.DataFrame:
+    """生成与 hotdog2030.orders 结构相近的合成订单数据"""
+    rng = np.random.default_rng(seed)
+    created = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, n_rows), unit='s')
+    amount = rng.gamma(2.0, 15.0, n_rows).round(2)
+    amount[rng.random(n_rows) < 0.01] = np.nan
+    return pd.DataFrame({
+        'order_no': np.char.add('NO', np.arange(n_rows).astype(str)),
+        'store_id': rng.integers(1, 500, n_rows),
+        'customer_id': np.char.add('oid_', rng.integers(0, n_rows // 3 + 1, n_rows).astype(str)),
+        'total_amount': amount,
+        'pay_state': rng.integers(0, 3, n_rows),
+        'pay_mode': rng.choice(['微信', '支付宝', '现金'], n_rows),
+        'created_at': created,
+        'updated_at': created,
+    })
+
+
+def write_iterrows(cursor, table, columns, df):
+    """原 to_sql 实现：逐行构造 Series 并单条 execute"""
+    cols = ",".join([f"[{col}]" for col in columns])
+    placeholders = ",".join(["?"] * len(columns))
+    insert_sql = f"INSERT INTO [{table}] ({cols}) VALUES ({placeholders})"
+    inserted = 0
+    for _, row in df.iterrows():
+        values = tuple(None if pd.isna(v) else (v.to_pydatetime() if isinstance(v, pd.Timestamp) else
+                       (v.item() if hasattr(v, 'item') else v)) for v in row)
+        cursor.execute(insert_sql, values)
+        inserted += 1
+    return inserted
+
+
+def bench_sqlite(df: pd.DataFrame, chunksize: int) -> list:
+    """在 SQLite 替身库上逐个策略计时"""
+    columns = list(df.columns)
+    results = []
+
+    strategies = {
+        'iterrows': lambda cur: write_iterrows(cur, 'bench_orders', columns, df),
+        'executemany': lambda cur: write_executemany(cur, 'bench_orders', columns, df_to_rows(df),
+                                                     chunksize=chunksize, placeholder='?'),
+        'multirow': lambda cur: write_multirow(cur, 'bench_orders', columns, df_to_rows(df),
+                                               chunksize=chunksize, placeholder='?'),
+    }
+
+    for name, fn in strategies.items():
+        conn = sqlite3.connect(':memory:')
+        conn.execute(ORDERS_DDL)
+        cur = conn.cursor()
+        start = time.perf_counter()
+        inserted = fn(cur)
+        conn.commit()
+        elapsed = time.perf_counter() - start
+        count = conn.execute("SELECT COUNT(*) FROM bench_orders").fetchone()[0]
+        conn.close()
+        assert count == inserted == len(df), f"{name}: 写入行数不一致 {count}/{inserted}/{len(df)}"
+        results.append((f"sqlite/{name}", len(df), elapsed))
+    return results
+
+
+def bench_mssql(df: pd.DataFrame, database: str, table: str, chunksize: int) -> list:
+    """在真实 SQL Server 上对比 executemany / multirow / bcp"""
+    from lib.mssql import execute_sql, to_sql
+
+    results = []
+    for method in ('executemany', 'multirow', 'bcp'):
+        execute_sql(f"IF OBJECT_ID('{table}','U') IS NOT NULL TRUNCATE TABLE [{table}]", database)
+        start = time.perf_counter()
+        ok = to_sql(df, table, database, method=method, chunksize=chunksize)
+        elapsed = time.perf_counter() - start
+        if ok:
+            results.append((f"mssql/{method}", len(df), elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="to_sql 批量写入策略基准测试")
+    parser.add_argument('--rows', type=int, default=100000, help="合成订单行数")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--mssql-db', default=None, help="可选：在该 SQL Server 数据库上追加测试")
+    parser.add_argument('--mssql-table', default='bench_orders', help="SQL Server 测试表（需预先创建）")
+    args = parser.parse_args()
+
+    df = make_orders(args.rows)
+
+    start = time.perf_counter()
+    df_to_rows(df)
+    convert_time = time.perf_counter() - start
+    print(f"列向量化转换 {len(df)} 行: {convert_time:.3f} 秒")
+
+    results = bench_sqlite(df, args.chunksize)
+    if args.mssql_db:
+        results += bench_mssql(df, args.mssql_db, args.mssql_table, args.chunksize)
+
+    baseline = results[0][2]
+    print(f"{'策略':<22}{'行数':>10}{'耗时(秒)':>12}{'条/秒':>12}{'加速比':>10}")
+    for name, n, elapsed in results:
+        print(f"{name:<22}{n:>10}{elapsed:>12.3f}{n / elapsed:>12.0f}{baseline / elapsed:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,19 +5,31 @@
 USE hotdog2030;
 GO
 
+-- 订单日期键：持久化计算列 + 索引，按日聚合/按日范围过滤时无需逐行 FORMAT
+IF COL_LENGTH('dbo.orders','date_key') IS NULL
+  ALTER TABLE dbo.orders ADD date_key AS CONVERT(int, CONVERT(char(8), created_at, 112)) PERSISTED;
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name='IX_orders_date_key' AND object_id=OBJECT_ID('dbo.orders'))
+  CREATE INDEX IX_orders_date_key ON dbo.orders(date_key, store_id) INCLUDE (total_amount);
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name='IX_orders_updated_at' AND object_id=OBJECT_ID('dbo.orders'))
+  CREATE INDEX IX_orders_updated_at ON dbo.orders(updated_at) INCLUDE (date_key);
+GO
+
 -- 统一：按"门店-日"的销售聚合视图
 IF OBJECT_ID('dbo.vw_sales_store_daily','V') IS NOT NULL DROP VIEW dbo.vw_sales_store_daily;
 GO
 CREATE VIEW dbo.vw_sales_store_daily AS
 SELECT
-  CONVERT(int, FORMAT(o.created_at, 'yyyyMMdd')) AS date_key,
+  o.date_key,
   o.store_id,
   COUNT(DISTINCT o.id)              AS orders_cnt,
   SUM(oi.quantity)                  AS items_qty,
   SUM(o.total_amount)               AS revenue
 FROM dbo.orders o
-JOIN dbo.order_items oi ON oi.order_id = o.id
-GROUP BY CONVERT(int, FORMAT(o.created_at, 'yyyyMMdd')), o.store_id;
+JOIN dbo.order_items oi ON oi.order_id = o.id AND oi.delflag = 0
+WHERE o.delflag = 0   -- 增量同步对源库已删除的订单/明细只做软删除
+GROUP BY o.date_key, o.store_id;
 GO
 
 -- 利润事实表（门店-日）；COGS 后续通过脚本写入/更新
@@ -121,4 +133,47 @@ JOIN (SELECT DISTINCT date_key FROM dbo.vw_sales_store_daily) d ON d.date_key=sd
 GROUP BY s.city, d.date_key;
 GO
 
+-- 区域业绩立方体（省/市/区/月），由 ETL 步骤11 增量刷新（lib/perf_cube.py）
+IF OBJECT_ID('dbo.fact_perf_cube_monthly','U') IS NULL
+CREATE TABLE dbo.fact_perf_cube_monthly (
+  month_key    int            NOT NULL,              -- yyyymm
+  province     nvarchar(100)  NOT NULL,
+  city         nvarchar(100)  NOT NULL,
+  district     nvarchar(100)  NOT NULL,
+  revenue      decimal(18,2)  NOT NULL DEFAULT(0),
+  orders_cnt   int            NOT NULL DEFAULT(0),
+  store_cnt    int            NOT NULL DEFAULT(0),   -- 当月有销售的门店数
+  store_days   int            NOT NULL DEFAULT(0),   -- 门店营业日数（门店-日 行数）
+  avg_ticket   AS (CONVERT(decimal(18,2), revenue / NULLIF(orders_cnt, 0))) PERSISTED,
+  refreshed_at datetime2      DEFAULT (sysutcdatetime()),
+  PRIMARY KEY (month_key, province, city, district)
+);
+GO
+
+-- ETL 水位线表：记录每个源库/源表上次抽取到的最大变更时间与最大主键
+IF OBJECT_ID('dbo.etl_watermark','U') IS NULL
+CREATE TABLE dbo.etl_watermark (
+  source_db    nvarchar(50)  NOT NULL,
+  source_table nvarchar(100) NOT NULL,
+  last_ts      datetime2     NULL,
+  last_id      bigint        NULL,
+  rows_loaded  bigint        NULL,
+  updated_at   datetime2     DEFAULT (sysutcdatetime()),
+  PRIMARY KEY (source_db, source_table)
+);
+GO
+
+-- 增量同步区间哈希：每个源库按主键区间记录的行数与 CHECKSUM_AGG，对账时与源库当前值比较找出变化区间
+IF OBJECT_ID('dbo.etl_delta_range_hash','U') IS NULL
+CREATE TABLE dbo.etl_delta_range_hash (
+  target_table nvarchar(100) NOT NULL,
+  source_db    nvarchar(50)  NOT NULL,
+  bucket       bigint        NOT NULL,              -- 主键 / 区间长度
+  row_cnt      bigint        NOT NULL,
+  row_hash     int           NULL,
+  updated_at   datetime2     DEFAULT (sysutcdatetime()),
+  PRIMARY KEY (target_table, source_db, bucket)
+);
+GO
+
 PRINT '分析层对象创建完成！';
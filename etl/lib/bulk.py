@@ -0,0 +1,273 @@
+"""
+批量写入引擎
+为 mssql.to_sql 提供可选的批量写入策略：
+- executemany: 分块 executemany
+- multirow:    多行 VALUES 批量（遵守 SQL Server 每条语句 1000 行 / 2100 参数上限）
+- prepared:    经 sp_executesql 发送带类型声明的参数化多行 INSERT，整批语句文本固定，服务器复用同一执行计划
+- bcp:         TDS 批量复制（pymssql Connection.bulk_copy）
+列数据直接从 NumPy 数组转换，不再逐行构造 Series
+"""
+import logging
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# SQL Server 限制：单条 INSERT ... VALUES 最多 1000 行，单次请求最多 2100 个参数
+MAX_ROWS_PER_INSERT = 1000
+MAX_PARAMS_PER_STATEMENT = 2100
+
+DEFAULT_CHUNKSIZE = 5000
+DEFAULT_METHOD = 'multirow'
+
+
+def _column_to_list(series: pd.Series) -> List[Any]:
+    """把一列转换为驱动可接受的 Python 对象列表，缺失值统一为 None"""
+    dtype = series.dtype
+
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        series = series.dt.tz_localize(None)
+        dtype = series.dtype
+
+    # 扩展类型（Int64 / boolean / string 等）自带 NA 语义
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and not isinstance(dtype, np.dtype):
+        return series.to_numpy(dtype=object, na_value=None).tolist()
+
+    arr = series.to_numpy()
+    kind = arr.dtype.kind
+
+    if kind in 'iub':
+        # 整数/布尔没有缺失值，tolist() 直接得到 Python int/bool
+        return arr.tolist()
+
+    if kind == 'f':
+        mask = np.isnan(arr)
+        if not mask.any():
+            return arr.tolist()
+        out = arr.astype(object)
+        out[mask] = None
+        return out.tolist()
+
+    if kind == 'M':
+        mask = np.isnat(arr)
+        out = arr.astype('datetime64[us]').astype(object)
+        if mask.any():
+            out[mask] = None
+        return out.tolist()
+
+    if kind == 'm':
+        mask = np.isnat(arr)
+        out = (arr / np.timedelta64(1, 's')).astype(object)
+        if mask.any():
+            out[mask] = None
+        return out.tolist()
+
+    # object 列：可能混有 NaN / NaT / pd.NA
+    out = arr.astype(object, copy=True)
+    mask = pd.isna(out)
+    if mask.any():
+        out[mask] = None
+    return out.tolist()
+
+
+def df_to_rows(df: pd.DataFrame) -> List[Tuple]:
+    """按列向量化转换 DataFrame 为行元组列表"""
+    if df.empty:
+        return []
+    columns = [_column_to_list(df.iloc[:, i]) for i in range(df.shape[1])]
+    return list(zip(*columns))
+
+
+def rows_per_statement(n_cols: int, max_rows: int = MAX_ROWS_PER_INSERT) -> int:
+    """计算单条多行 INSERT 可容纳的行数"""
+    if n_cols <= 0:
+        return max_rows
+    return max(1, min(max_rows, MAX_PARAMS_PER_STATEMENT // n_cols))
+
+
+def _insert_prefix(table: str, columns: Sequence[str]) -> str:
+    cols = ",".join([f"[{col}]" for col in columns])
+    return f"INSERT INTO [{table}] ({cols}) VALUES "
+
+
+def _insert_rows_one_by_one(cursor, single_sql: str, rows: Sequence[Tuple]) -> int:
+    """批次失败时逐行重试，跳过坏行（保持原 to_sql 的容错语义）"""
+    inserted = 0
+    for row in rows:
+        try:
+            cursor.execute(single_sql, row)
+            inserted += 1
+        except Exception as e:
+            logger.warning(f"⚠️ 跳过行插入: {str(e)}")
+    return inserted
+
+
+def write_executemany(cursor, table: str, columns: Sequence[str], rows: Sequence[Tuple],
+                      chunksize: int = DEFAULT_CHUNKSIZE, placeholder: str = '%s') -> int:
+    """分块 executemany 写入"""
+    single_sql = _insert_prefix(table, columns) + "(" + ",".join([placeholder] * len(columns)) + ")"
+    inserted = 0
+    for start in range(0, len(rows), chunksize):
+        chunk = rows[start:start + chunksize]
+        try:
+            cursor.executemany(single_sql, chunk)
+            inserted += len(chunk)
+        except Exception as e:
+            logger.warning(f"⚠️ 批次写入失败，改为逐行写入: {str(e)}")
+            inserted += _insert_rows_one_by_one(cursor, single_sql, chunk)
+    return inserted
+
+
+def write_multirow(cursor, table: str, columns: Sequence[str], rows: Sequence[Tuple],
+                   chunksize: int = DEFAULT_CHUNKSIZE, placeholder: str = '%s') -> int:
+    """多行 VALUES 批量写入，每条语句不超过 1000 行 / 2100 参数"""
+    n_cols = len(columns)
+    batch_rows = min(rows_per_statement(n_cols), max(1, chunksize))
+    prefix = _insert_prefix(table, columns)
+    row_tpl = "(" + ",".join([placeholder] * n_cols) + ")"
+    single_sql = prefix + row_tpl
+    full_sql = prefix + ",".join([row_tpl] * batch_rows)
+
+    inserted = 0
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        sql = full_sql if len(batch) == batch_rows else prefix + ",".join([row_tpl] * len(batch))
+        params = tuple(v for row in batch for v in row)
+        try:
+            cursor.execute(sql, params)
+            inserted += len(batch)
+        except Exception as e:
+            logger.warning(f"⚠️ 批次写入失败，改为逐行写入: {str(e)}")
+            inserted += _insert_rows_one_by_one(cursor, single_sql, batch)
+    return inserted
+
+
+def _sql_type(type_name: str, max_length: int, precision: int, scale: int) -> str:
+    """sys.columns 的类型信息 -> sp_executesql 参数声明类型"""
+    if type_name in ('nvarchar', 'nchar'):
+        return f"{type_name}({'max' if max_length == -1 else max_length // 2})"
+    if type_name in ('varchar', 'char', 'varbinary', 'binary'):
+        return f"{type_name}({'max' if max_length == -1 else max_length})"
+    if type_name in ('decimal', 'numeric'):
+        return f"{type_name}({precision},{scale})"
+    if type_name in ('datetime2', 'time', 'datetimeoffset'):
+        return f"{type_name}({scale})"
+    return type_name
+
+
+def table_param_types(cursor, table: str, columns: Sequence[str]) -> List[str]:
+    """查询目标表各列的参数声明类型，顺序与 columns 一致"""
+    cursor.execute(
+        """
+        SELECT c.name, t.name, c.max_length, c.precision, c.scale
+        FROM sys.columns c
+        JOIN sys.types t ON t.user_type_id = c.user_type_id
+        WHERE c.object_id = OBJECT_ID(%s)
+        """,
+        (table,)
+    )
+    types = {name: _sql_type(type_name, max_length, precision, scale)
+             for name, type_name, max_length, precision, scale in cursor.fetchall()}
+    missing = [col for col in columns if col not in types]
+    if missing:
+        raise ValueError(f"目标表 {table} 缺少列: {missing}")
+    return [types[col] for col in columns]
+
+
+def prepared_insert(table: str, columns: Sequence[str], param_types: Sequence[str], n_rows: int) -> Tuple[str, str]:
+    """n_rows 行的参数化 INSERT 文本与参数声明（@p0, @p1, ...），相同行数的批次文本完全一致"""
+    n_cols = len(columns)
+    values = ",".join(
+        "(" + ",".join(f"@p{r * n_cols + c}" for c in range(n_cols)) + ")" for r in range(n_rows)
+    )
+    declare = ",".join(f"@p{i} {param_types[i % n_cols]}" for i in range(n_rows * n_cols))
+    return _insert_prefix(table, columns) + values, declare
+
+
+def write_prepared(cursor, table: str, columns: Sequence[str], rows: Sequence[Tuple],
+                   chunksize: int = DEFAULT_CHUNKSIZE, param_types: Optional[Sequence[str]] = None) -> int:
+    """sp_executesql 参数化多行写入
+
+    多行 VALUES 直接拼值时每批语句文本不同，SQL Server 每批都要重新解析编译；这里语句文本只取决于行数，
+    满批共用一个缓存计划（最后不足一批的尾批另有一个），值作为类型化参数传递，引号等字符不会破坏语句
+    """
+    n_cols = len(columns)
+    # sp_executesql 自身的 @stmt、@params 也计入 2100 个参数上限
+    batch_rows = max(1, min(MAX_ROWS_PER_INSERT, (MAX_PARAMS_PER_STATEMENT - 2) // max(1, n_cols), chunksize))
+    if param_types is None:
+        param_types = table_param_types(cursor, table, columns)
+    single_sql = _insert_prefix(table, columns) + "(" + ",".join(["%s"] * n_cols) + ")"
+
+    statements = {}
+    inserted = 0
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        if len(batch) not in statements:
+            stmt, declare = prepared_insert(table, columns, param_types, len(batch))
+            assign = ",".join(f"@p{i}=%s" for i in range(len(batch) * n_cols))
+            statements[len(batch)] = ("EXEC sp_executesql %s, %s, " + assign, stmt, declare)
+        sql, stmt, declare = statements[len(batch)]
+        try:
+            cursor.execute(sql, (stmt, declare) + tuple(v for row in batch for v in row))
+            inserted += len(batch)
+        except Exception as e:
+            logger.warning(f"⚠️ 批次写入失败，改为逐行写入: {str(e)}")
+            inserted += _insert_rows_one_by_one(cursor, single_sql, batch)
+    return inserted
+
+
+def _table_column_ids(cursor, table: str) -> dict:
+    """查询目标表列名 -> column_id 映射（bulk_copy 需要按列序号指定）"""
+    cursor.execute(
+        "SELECT name, column_id FROM sys.columns WHERE object_id = OBJECT_ID(%s)",
+        (table,)
+    )
+    return {name: column_id for name, column_id in cursor.fetchall()}
+
+
+def write_bulk_copy(conn, table: str, columns: Sequence[str], rows: Sequence[Tuple],
+                    chunksize: int = DEFAULT_CHUNKSIZE) -> int:
+    """TDS 批量复制写入（需要 pymssql >= 2.2.8）"""
+    if not hasattr(conn, 'bulk_copy'):
+        raise RuntimeError("当前驱动不支持 bulk_copy")
+
+    column_map = _table_column_ids(conn.cursor(), table)
+    missing = [col for col in columns if col not in column_map]
+    if missing:
+        raise ValueError(f"目标表 {table} 缺少列: {missing}")
+
+    conn.bulk_copy(
+        table,
+        rows,
+        column_ids=[column_map[col] for col in columns],
+        batch_size=chunksize,
+        tablock=True
+    )
+    return len(rows)
+
+
+STRATEGIES = ('executemany', 'multirow', 'prepared', 'bcp')
+
+
+def bulk_write(conn, df: pd.DataFrame, table: str, method: str = DEFAULT_METHOD,
+               chunksize: int = DEFAULT_CHUNKSIZE, placeholder: str = '%s') -> int:
+    """按指定策略写入 DataFrame，返回写入行数（调用方负责 commit）"""
+    if method not in STRATEGIES:
+        raise ValueError(f"未知写入策略: {method}，可选: {', '.join(STRATEGIES)}")
+
+    columns = [str(col) for col in df.columns]
+    rows = df_to_rows(df)
+    if not rows:
+        return 0
+
+    if method == 'bcp':
+        return write_bulk_copy(conn, table, columns, rows, chunksize=chunksize)
+
+    cursor = conn.cursor()
+    if method == 'prepared':
+        return write_prepared(cursor, table, columns, rows, chunksize=chunksize)
+    if method == 'executemany':
+        return write_executemany(cursor, table, columns, rows, chunksize=chunksize, placeholder=placeholder)
+    return write_multirow(cursor, table, columns, rows, chunksize=chunksize, placeholder=placeholder)
@@ -0,0 +1,167 @@
+"""
+门店日特征工程
+一次构建移动平均、滞后、指数加权平均与日历（星期、月份、节假日）特征：
+- 每个门店从首个销售日到最后销售日补齐为连续自然日（无销售的日营收记 0），窗口按自然日计算
+- 补齐后各门店在数组中连续存放，移动平均用前缀和相减、滞后用数组位移，全程不调用 Python 回调
+- 移动平均、滞后与指数加权平均都只用当日之前的数据，第 t 天的特征与第 t 天的营收无关
+- 日历特征只按出现过的日期计算一次再映射回各行
+"""
+import logging
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ROLLING_WINDOWS = (7, 14, 28)
+LAGS = (1, 7, 14)
+EWM_SPANS = (7, 28)
+
+# 固定日期的法定节假日 (月, 日)
+FIXED_HOLIDAYS = [(1, 1)] + [(5, d) for d in range(1, 6)] + [(10, d) for d in range(1, 8)]
+
+# 农历节日的公历日期；春节按除夕前一日至初六计，端午/中秋按当日及前后各一天计
+SPRING_FESTIVAL = ['2019-02-05', '2020-01-25', '2021-02-12', '2022-02-01', '2023-01-22', '2024-02-10',
+                   '2025-01-29', '2026-02-17', '2027-02-06', '2028-01-26', '2029-02-13', '2030-02-03']
+DRAGON_BOAT = ['2019-06-07', '2020-06-25', '2021-06-14', '2022-06-03', '2023-06-22', '2024-06-10',
+               '2025-05-31', '2026-06-19', '2027-06-09', '2028-05-28', '2029-06-16', '2030-06-05']
+MID_AUTUMN = ['2019-09-13', '2020-10-01', '2021-09-21', '2022-09-10', '2023-09-29', '2024-09-17',
+              '2025-10-06', '2026-09-25', '2027-09-15', '2028-10-03', '2029-09-22', '2030-09-12']
+
+
+def day_numbers(date_keys) -> np.ndarray:
+    """yyyymmdd -> 1970-01-01 起的天数，纯整数运算不做字符串解析"""
+    k = np.asarray(date_keys, dtype='int64')
+    year, month, day = k // 10000, k // 100 % 100, k % 100
+    months = (year - 1970) * 12 + (month - 1)
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype('int64') + (day - 1)
+
+
+def day_to_key(days: np.ndarray) -> np.ndarray:
+    """1970-01-01 起的天数 -> yyyymmdd"""
+    d = np.asarray(days, dtype='int64').astype('datetime64[D]')
+    months = d.astype('datetime64[M]')
+    year = months.astype('int64') // 12 + 1970
+    month = months.astype('int64') % 12 + 1
+    day = (d - months.astype('datetime64[D]')).astype('int64') + 1
+    return year * 10000 + month * 100 + day
+
+
+def _holiday_days() -> np.ndarray:
+    lunar = []
+    for dates, before, after in ((SPRING_FESTIVAL, 2, 6), (DRAGON_BOAT, 1, 1), (MID_AUTUMN, 1, 1)):
+        base = np.array(dates, dtype='datetime64[D]').astype('int64')
+        lunar.append((base[:, None] + np.arange(-before, after + 1)).ravel())
+    return np.unique(np.concatenate(lunar))
+
+
+_HOLIDAYS = _holiday_days()
+
+
+def calendar_features(days: np.ndarray) -> Dict[str, np.ndarray]:
+    """星期（0=周一）、月份与是否节假日；农历节日表覆盖 2019~2030 年，区间外只标记固定日期节日"""
+    days = np.asarray(days, dtype='int64')
+    uniq, inverse = np.unique(days, return_inverse=True)
+    keys = day_to_key(uniq)
+    month, day = keys // 100 % 100, keys % 100
+    holiday = np.isin(uniq, _HOLIDAYS)
+    for m, d in FIXED_HOLIDAYS:
+        holiday |= (month == m) & (day == d)
+    return {
+        'dow': ((uniq + 3) % 7)[inverse].astype('int8'),  # 1970-01-01 为星期四
+        'month': month[inverse].astype('int8'),
+        'is_holiday': holiday[inverse].astype('int8'),
+    }
+
+
+def fill_store_days(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """把门店-日销售补齐为连续日历，返回按 门店、日期 排序的数组
+
+    同一门店同一天的多行营收相加；pos 为该行在门店内的序号，observed 标记原始数据中存在的行
+    """
+    store = df['store_id'].to_numpy(dtype='int64')
+    day = day_numbers(df['date_key'])
+    codes, stores = pd.factorize(store, sort=True)
+    bounds = pd.DataFrame({'code': codes, 'day': day}).groupby('code')['day'].agg(['min', 'max'])
+    first = bounds['min'].to_numpy()
+    lengths = bounds['max'].to_numpy() - first + 1
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    total = int(lengths.sum())
+
+    pos = np.arange(total) - np.repeat(starts, lengths)
+    idx = starts[codes] + (day - first[codes])
+    revenue = np.bincount(idx, weights=df['revenue'].to_numpy(dtype='float64'), minlength=total)
+    observed = np.bincount(idx, minlength=total) > 0
+    return {
+        'store_id': np.repeat(stores, lengths),
+        'day': np.repeat(first, lengths) + pos,
+        'pos': pos,
+        'revenue': revenue,
+        'observed': observed,
+    }
+
+
+def rolling_mean(values: np.ndarray, pos: np.ndarray, window: int) -> np.ndarray:
+    """门店内当日之前 window 个自然日的均值，前缀和相减，窗口不跨门店
+
+    不含当日，与滞后特征一样只用预测日之前的数据，否则训练时当日营收会混进特征（目标泄漏）；
+    min_periods=1：补齐后无销售的日按 0 计入窗口，只有开业后不足 window 天时才按已有天数求均值，
+    开业首日没有历史为 NaN
+    """
+    cs = np.concatenate([[0.0], np.cumsum(values)])
+    i = np.arange(values.size)
+    count = np.minimum(pos, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = (cs[i] - cs[i - count]) / count
+    out[count == 0] = np.nan
+    return out
+
+
+def lag(values: np.ndarray, pos: np.ndarray, k: int) -> np.ndarray:
+    """门店内 k 天前的值，不足 k 天为 NaN"""
+    out = np.full(values.size, np.nan)
+    out[k:] = values[:-k] if k else values
+    out[pos < k] = np.nan
+    return out
+
+
+def feature_columns():
+    return ([f'rev_ma_{w}' for w in ROLLING_WINDOWS] + [f'rev_lag_{k}' for k in LAGS]
+            + [f'rev_ewm_{s}' for s in EWM_SPANS] + ['dow', 'month', 'is_holiday'])
+
+
+def build_features(df: pd.DataFrame, keep_filled: bool = False) -> pd.DataFrame:
+    """门店日销售 (date_key, store_id, revenue) -> 特征表
+
+    输出列: date_key, store_id, revenue, date, rev_ma_*, rev_lag_*, rev_ewm_*, dow, month, is_holiday
+    默认只返回原始数据中存在的门店-日，补齐的日只参与窗口计算；keep_filled=True 时一并返回（营收为 0）
+    """
+    df = df.dropna(subset=['date_key', 'store_id', 'revenue'])
+    if df.empty:
+        return pd.DataFrame(columns=['date_key', 'store_id', 'revenue', 'date'] + feature_columns())
+
+    grid = fill_store_days(df)
+    revenue, pos = grid['revenue'], grid['pos']
+    out = {
+        'date_key': day_to_key(grid['day']),
+        'store_id': grid['store_id'],
+        'revenue': revenue,
+        'date': grid['day'].astype('datetime64[D]').astype('datetime64[ns]'),
+    }
+    for w in ROLLING_WINDOWS:
+        out[f'rev_ma_{w}'] = rolling_mean(revenue, pos, w)
+    for k in LAGS:
+        out[f'rev_lag_{k}'] = lag(revenue, pos, k)
+
+    # 门店在数组中连续存放，按门店分组后结果顺序与数组一致；与移动平均一样后移一天，不含当日营收
+    groups = pd.Series(revenue).groupby(grid['store_id'], sort=False)
+    for span in EWM_SPANS:
+        out[f'rev_ewm_{span}'] = lag(groups.ewm(span=span, adjust=False).mean().to_numpy(), pos, 1)
+
+    out.update(calendar_features(grid['day']))
+    features = pd.DataFrame(out)
+    if not keep_filled:
+        features = features[grid['observed']].reset_index(drop=True)
+    return features
+
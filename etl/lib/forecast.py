@@ -0,0 +1,672 @@
+"""
+门店销售预测训练/预测
+按门店并行训练：门店分组通过进程池分发，每个模型限定线程数，避免 进程数 × 模型线程数 超订 CPU
+多步预测默认采用直接法（direct）：预测步长作为特征，整个预测期的特征矩阵一次构建、每个模型一次批量 predict；
+另训练两个分位数模型给出 yhat_lower / yhat_upper
+指定缓存目录时，训练好的模型经 lib.model_cache 持久化，未过期、未漂移的模型直接加载预测，只重训需要的门店
+"""
+import os
+import time
+import logging
+import datetime as dt
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .features import day_numbers, day_to_key, calendar_features
+from .model_cache import (PREDICT_ONLY, DRIFT_MIN_DAYS, feature_set_version, read_meta, write_meta,
+                          load_models, save_artifact, stale_reason, drifted)
+
+logger = logging.getLogger(__name__)
+
+HORIZON = 7  # 预测未来7天
+MAX_HORIZON = 90
+MIN_HISTORY_DAYS = 30  # 历史数据少于该天数的门店不单独建模
+
+FEATURES = ['rev_ma_7', 'rev_ma_14', 'rev_ma_28', 'dow']
+
+# 直接法特征：预测起点的移动平均/滞后/指数加权平均 + 预测步长 + 目标日日历特征
+ORIGIN_FEATURES = ['rev_ma_7', 'rev_ma_14', 'rev_ma_28', 'rev_lag_1', 'rev_lag_7', 'rev_lag_14',
+                   'rev_ewm_7', 'rev_ewm_28']
+TARGET_FEATURES = ['target_dow', 'target_month', 'target_is_holiday']
+DIRECT_FEATURES = ORIGIN_FEATURES + ['horizon'] + TARGET_FEATURES
+
+# 全局模型额外使用的门店属性特征
+STORE_FEATURES = ['city_code', 'store_age_days', 'rent_amount']
+GLOBAL_FEATURES = DIRECT_FEATURES + STORE_FEATURES
+
+# 多步预测方式: direct 直接法（默认） / recursive 逐日递推（原实现）
+STRATEGIES = ('direct', 'recursive')
+DEFAULT_STRATEGY = os.getenv('ETL_FORECAST_STRATEGY', 'direct')
+
+# 预测区间覆盖率，0.8 对应 10% / 90% 分位数；0 表示不输出区间
+DEFAULT_INTERVAL = float(os.getenv('ETL_FORECAST_INTERVAL', '0.8'))
+
+# 直接法训练时每个起点抽样的预测步长个数（训练集规模 = 起点数 × 抽样数，与预测期长度无关）
+HORIZON_SAMPLES = int(os.getenv('ETL_FORECAST_HORIZON_SAMPLES', '3'))
+
+# 特征工程（make_features）口径变化时递增，使旧的模型缓存失效
+FEATURE_SET_REVISION = 3
+
+# 预测结果列（与 fact_forecast_daily 一致）
+PRED_COLUMNS = ['date_key', 'store_id', 'yhat', 'yhat_lower', 'yhat_upper']
+
+# 线程数相关环境变量：进程池子进程启动时按此限制 OpenMP/BLAS 线程
+_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+# 模型类型: auto（xgboost 可用时用 xgboost，否则 hgb） / xgboost / hgb
+MODEL_TYPES = ('auto', 'xgboost', 'hgb')
+MODEL_TYPE = os.getenv('ETL_FORECAST_MODEL', 'auto')
+
+_regressor = None
+
+
+def default_workers() -> int:
+    return int(os.getenv('ETL_FORECAST_WORKERS', str(os.cpu_count() or 1)))
+
+
+def default_model_threads(workers: int) -> int:
+    """每个模型的线程数：默认按 CPU 数均分给各进程"""
+    env = os.getenv('ETL_FORECAST_MODEL_THREADS')
+    if env:
+        return max(1, int(env))
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _build_regressor(model_type: str):
+    """返回 (模型工厂, 模型名)；auto 优先 xgboost，未安装时回退 sklearn"""
+    if model_type not in MODEL_TYPES:
+        raise ValueError(f"未知的模型类型: {model_type}，可选 {MODEL_TYPES}")
+    if model_type in ('auto', 'xgboost'):
+        try:
+            # 尝试使用XGBoost
+            from xgboost import XGBRegressor
+
+            def factory(n_jobs=1, quantile=None):
+                if quantile is not None:
+                    return XGBRegressor(n_estimators=300, max_depth=6, learning_rate=0.05, n_jobs=n_jobs,
+                                        objective='reg:quantileerror', quantile_alpha=quantile)
+                return XGBRegressor(n_estimators=300, max_depth=6, learning_rate=0.05, n_jobs=n_jobs)
+            return factory, "xgboost"
+        except Exception:
+            if model_type == 'xgboost':
+                raise
+    # 回退到sklearn（线程数由 OpenMP 限制控制）
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    def factory(n_jobs=1, quantile=None):
+        if quantile is not None:
+            return HistGradientBoostingRegressor(loss='quantile', quantile=quantile)
+        return HistGradientBoostingRegressor()
+    return factory, "hgb"
+
+
+def get_regressor():
+    """返回 (模型工厂, 模型名)，每个进程只导入一次 xgboost/sklearn"""
+    global _regressor
+    if _regressor is None:
+        _regressor = _build_regressor(MODEL_TYPE)
+    return _regressor
+
+
+def set_model_type(model_type: str):
+    """切换当前进程使用的模型类型（回测对比不同模型时使用）"""
+    global _regressor
+    _regressor = _build_regressor(model_type)
+
+
+def model_name() -> str:
+    return get_regressor()[1]
+
+
+def limit_threads(threads: int):
+    """限制当前进程内数值库的线程数"""
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+    except Exception:
+        pass
+
+
+def _init_worker(threads: int):
+    """进程池子进程初始化：先限制线程再导入模型库"""
+    limit_threads(threads)
+    get_regressor()
+
+
+def validate_horizon(horizon: int) -> int:
+    if not 1 <= horizon <= MAX_HORIZON:
+        raise ValueError(f"预测天数需在 1 ~ {MAX_HORIZON} 之间: {horizon}")
+    return horizon
+
+
+def interval_quantiles(interval: float = DEFAULT_INTERVAL) -> Tuple[float, ...]:
+    """区间覆盖率 -> (下分位, 上分位)"""
+    if not interval or interval <= 0:
+        return ()
+    if interval >= 1:
+        raise ValueError(f"预测区间覆盖率需小于 1: {interval}")
+    tail = (1 - interval) / 2
+    return (round(tail, 4), round(1 - tail, 4))
+
+
+def _target_features(target_day: np.ndarray) -> Dict[str, np.ndarray]:
+    """目标日的日历特征"""
+    cal = calendar_features(target_day)
+    return {'target_dow': cal['dow'], 'target_month': cal['month'], 'target_is_holiday': cal['is_holiday']}
+
+
+def direct_training_frame(df: pd.DataFrame, horizon: int, samples: int = HORIZON_SAMPLES,
+                          seed: int = 0) -> pd.DataFrame:
+    """构建直接法训练集：每个起点行抽样若干预测步长 h，目标为 h 天后同门店的实际营收
+
+    目标日没有销售记录的样本会被丢弃；store_age_days 等门店特征按目标日对齐
+    """
+    n = len(df)
+    if n == 0:
+        return pd.DataFrame(columns=DIRECT_FEATURES + ['target'])
+
+    store_ids = df['store_id'].to_numpy(dtype='int64')
+    days = day_numbers(df['date_key'])
+    # 门店-日 -> 营收 的整数键查找表
+    keys = pd.Index(store_ids * 100000 + days)
+    revenue = df['revenue'].to_numpy(dtype='float64')
+
+    rng = np.random.default_rng(seed)
+    samples = max(1, min(samples, horizon))
+    origin_idx = np.repeat(np.arange(n), samples)
+    h = rng.integers(1, horizon + 1, size=origin_idx.size)
+
+    pos = keys.get_indexer(store_ids[origin_idx] * 100000 + days[origin_idx] + h)
+    found = pos >= 0
+    origin_idx, h, pos = origin_idx[found], h[found], pos[found]
+
+    target_day = days[origin_idx] + h
+    out = pd.DataFrame({'store_id': store_ids[origin_idx]})
+    for col in ORIGIN_FEATURES:
+        out[col] = df[col].to_numpy()[origin_idx]
+    out['horizon'] = h
+    for col, values in _target_features(target_day).items():
+        out[col] = values
+    out['target'] = revenue[pos]
+    for col in STORE_FEATURES:
+        if col in df.columns:
+            values = df[col].to_numpy()[origin_idx]
+            out[col] = values + h if col == 'store_age_days' else values
+    return out
+
+
+def horizon_matrix(origins: pd.DataFrame, horizon: int) -> pd.DataFrame:
+    """把每个门店的预测起点展开为 门店 × 预测步长 的特征矩阵"""
+    n = len(origins)
+    idx = np.repeat(np.arange(n), horizon)
+    h = np.tile(np.arange(1, horizon + 1), n)
+    target_day = day_numbers(origins['date_key'])[idx] + h
+
+    out = pd.DataFrame({
+        'date_key': day_to_key(target_day),
+        'store_id': origins['store_id'].to_numpy(dtype='int64')[idx],
+    })
+    for col in ORIGIN_FEATURES:
+        out[col] = origins[col].to_numpy()[idx]
+    out['horizon'] = h
+    for col, values in _target_features(target_day).items():
+        out[col] = values
+    for col in STORE_FEATURES:
+        if col in origins.columns:
+            values = origins[col].to_numpy()[idx]
+            out[col] = values + h if col == 'store_age_days' else values
+    return out
+
+
+def fit_direct(train: pd.DataFrame, features: List[str], threads: int = 1,
+               quantiles: Tuple[float, ...] = ()) -> Tuple[Dict, float]:
+    """训练点预测模型与分位数模型，返回 ({'yhat': m, 0.1: m, 0.9: m}, 训练耗时)"""
+    factory, _ = get_regressor()
+    X, y = train[features], train['target']
+    start = time.perf_counter()
+    models = {'yhat': factory(n_jobs=threads).fit(X, y)}
+    for q in quantiles:
+        models[q] = factory(n_jobs=threads, quantile=q).fit(X, y)
+    return models, time.perf_counter() - start
+
+
+def predict_direct(models: Dict, X: pd.DataFrame, features: List[str]) -> List[tuple]:
+    """每个模型对整个特征矩阵一次批量预测，返回 (date_key, store_id, yhat, yhat_lower, yhat_upper)"""
+    if X.empty:
+        return []
+    Xf = X[features]
+    yhat = models['yhat'].predict(Xf).astype('float64')
+    quantiles = sorted(q for q in models if q != 'yhat')
+    if len(quantiles) >= 2:
+        lower = models[quantiles[0]].predict(Xf).astype('float64')
+        upper = models[quantiles[-1]].predict(Xf).astype('float64')
+        # 分位数模型独立训练，可能交叉，保证 lower <= yhat <= upper
+        lower, upper = np.minimum(lower, yhat), np.maximum(upper, yhat)
+        lower_list, upper_list = lower.tolist(), upper.tolist()
+    else:
+        lower_list = upper_list = [None] * len(yhat)
+    return list(zip(X['date_key'].tolist(), X['store_id'].tolist(), yhat.tolist(), lower_list, upper_list))
+
+
+def _forecast_store_recursive(model, g: pd.DataFrame, horizon: int) -> List[tuple]:
+    """逐日递推预测：用最后一日特征近似，每步把预测值纳入移动平均"""
+    store_id = int(g['store_id'].iloc[0])
+    last = g.iloc[-1:]
+    preds = []
+    base_date = pd.to_datetime(str(int(last['date_key'].iloc[0])), format='%Y%m%d')
+    ma7, ma14, ma28 = last[['rev_ma_7', 'rev_ma_14', 'rev_ma_28']].values[0]
+    # 特征不含当日营收，先把最后一日的实际值纳入移动平均，作为次日的特征
+    y = float(last['revenue'].iloc[0])
+    ma7 = y if np.isnan(ma7) else (ma7 * 6 + y) / 7
+    ma14 = y if np.isnan(ma14) else (ma14 * 13 + y) / 14
+    ma28 = y if np.isnan(ma28) else (ma28 * 27 + y) / 28
+
+    for i in range(1, horizon + 1):
+        d = base_date + dt.timedelta(days=i)
+        dow = d.weekday()
+        Xf = pd.DataFrame([[ma7, ma14, ma28, dow]], columns=FEATURES)
+        yhat = float(model.predict(Xf)[0])
+        preds.append((int(d.strftime('%Y%m%d')), store_id, yhat, None, None))
+
+        # 简单滚动：把预测纳入 ma7/14/28
+        ma7 = (ma7 * 6 + yhat) / 7
+        ma14 = (ma14 * 13 + yhat) / 14
+        ma28 = (ma28 * 27 + yhat) / 28
+    return preds
+
+
+def artifact_version(strategy: str, horizon: int, quantiles: Tuple[float, ...], features: List[str]) -> str:
+    """模型缓存的特征集版本：特征口径、特征列、模型类型与训练参数"""
+    return feature_set_version(revision=FEATURE_SET_REVISION, model=model_name(), strategy=strategy,
+                               features=features, horizon=horizon, quantiles=list(quantiles),
+                               samples=HORIZON_SAMPLES)
+
+
+def _store_version(strategy: str, horizon: int, quantiles: Tuple[float, ...]) -> str:
+    return artifact_version(strategy, horizon, quantiles, DIRECT_FEATURES if strategy == 'direct' else FEATURES)
+
+
+def _predict_store(models: Dict, g: pd.DataFrame, horizon: int, strategy: str) -> List[tuple]:
+    if strategy == 'direct':
+        return predict_direct(models, horizon_matrix(g.iloc[-1:], horizon), DIRECT_FEATURES)
+    return _forecast_store_recursive(models['yhat'], g, horizon)
+
+
+def _new_data_wape(models: Dict, strategy: str, df: pd.DataFrame, train_end_day: int, horizon: int,
+                   features: List[str]) -> Tuple[float, int]:
+    """缓存模型从训练截止日出发，对之后已有实际值的日期的预测误差，返回 (WAPE, 新数据天数)"""
+    days = day_numbers(df['date_key'])
+    new = (days > train_end_day) & (days <= train_end_day + horizon)
+    if not new.any():
+        return float('nan'), 0
+    actual = df[new][['date_key', 'store_id', 'revenue']]
+    if strategy == 'direct':
+        preds = predict_direct(models, horizon_matrix(df[days == train_end_day], horizon), features)
+    else:
+        preds = _forecast_store_recursive(models['yhat'], df[days <= train_end_day], horizon)
+    return score_preds(preds, actual)['wape'], int(actual['date_key'].nunique())
+
+
+def load_cached(cache_dir: str, version: str, key: str, df: pd.DataFrame, horizon: int,
+                features: List[str], predict_only: bool = PREDICT_ONLY) -> Tuple[Optional[Dict], Dict]:
+    """读取缓存模型，返回 (模型或 None, 缓存信息)
+
+    缓存信息含 cache（hit，或 missing/window/new_data/drift 等重训原因）、load_s 与缓存模型的 strategy
+    """
+    days = day_numbers(df['date_key'])
+    meta = read_meta(cache_dir, version, key)
+    reason = stale_reason(meta, int(days.min()), int(days.max()), predict_only)
+    if reason:
+        return None, {'cache': reason, 'load_s': 0.0}
+
+    models, load_s = load_models(cache_dir, version, key)
+    if models is None:
+        return None, {'cache': 'missing', 'load_s': load_s}
+
+    if not predict_only:
+        current, n_days = _new_data_wape(models, meta['strategy'], df, meta['train_end_day'], horizon, features)
+        if n_days >= DRIFT_MIN_DAYS:
+            if meta.get('wape') is None:
+                # 训练后首次在新数据上评估，作为该模型的误差基线
+                write_meta(cache_dir, version, key, dict(meta, wape=current))
+            elif drifted(current, meta['wape']):
+                return None, {'cache': 'drift', 'load_s': load_s, 'wape': current}
+    return models, {'cache': 'hit', 'load_s': load_s, 'strategy': meta['strategy']}
+
+
+def store_artifact(cache_dir: str, version: str, key: str, models: Dict, df: pd.DataFrame, strategy: str):
+    """保存模型及其训练窗口，误差基线留待下次运行在新数据上评估"""
+    days = day_numbers(df['date_key'])
+    save_artifact(cache_dir, version, key, models, {
+        'key': key,
+        'version': version,
+        'model': model_name(),
+        'strategy': strategy,
+        'train_start': int(df['date_key'].min()),
+        'train_end': int(df['date_key'].max()),
+        'train_start_day': int(days.min()),
+        'train_end_day': int(days.max()),
+        'rows': len(df),
+        'wape': None,
+    })
+
+
+def cached_forecast_store(g: pd.DataFrame, horizon: int, cache_dir: str, strategy: str = DEFAULT_STRATEGY,
+                          quantiles: Tuple[float, ...] = None,
+                          predict_only: bool = PREDICT_ONLY) -> Tuple[Optional[List[tuple]], Dict]:
+    """用缓存模型预测单个门店；缓存不可用时返回 (None, 缓存信息)，由调用方重训"""
+    quantiles = interval_quantiles() if quantiles is None else quantiles
+    store_id = int(g['store_id'].iloc[0])
+    models, info = load_cached(cache_dir, _store_version(strategy, horizon, quantiles), f"store_{store_id}",
+                               g, horizon, DIRECT_FEATURES, predict_only)
+    if models is None:
+        return None, info
+
+    start = time.perf_counter()
+    preds = _predict_store(models, g, horizon, info['strategy'])
+    timing = {'store_id': store_id, 'rows': len(g), 'model': model_name(), 'strategy': info['strategy'],
+              'fit_s': 0.0, 'predict_s': time.perf_counter() - start, 'cache': 'hit', 'load_s': info['load_s']}
+    return preds, timing
+
+
+def forecast_store(g: pd.DataFrame, horizon: int = HORIZON, threads: int = 1,
+                   strategy: str = DEFAULT_STRATEGY, quantiles: Tuple[float, ...] = None,
+                   cache_dir: Optional[str] = None, cache_info: Optional[Dict] = None) -> Tuple[List[tuple], Dict]:
+    """为单个门店训练模型并生成预测，返回 (预测行, 耗时统计)
+
+    预测行为 (date_key, store_id, yhat, yhat_lower, yhat_upper)，递推法不输出区间；
+    指定 cache_dir 时训练结果写入缓存，cache_info 为调用方检查缓存得到的重训原因
+    """
+    factory, name = get_regressor()
+    store_id = int(g['store_id'].iloc[0])
+    quantiles = interval_quantiles() if quantiles is None else quantiles
+    version = _store_version(strategy, horizon, quantiles)
+
+    train = direct_training_frame(g, horizon) if strategy == 'direct' else None
+    # 历史太短、凑不出足够直接法样本的门店退回递推法
+    if train is not None and len(train) < MIN_HISTORY_DAYS:
+        strategy = 'recursive'
+
+    start = time.perf_counter()
+    if strategy == 'direct':
+        models, _ = fit_direct(train, DIRECT_FEATURES, threads, quantiles)
+    else:
+        models = {'yhat': factory(n_jobs=threads).fit(g[FEATURES], g['revenue'])}
+    fit_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preds = _predict_store(models, g, horizon, strategy)
+    predict_s = time.perf_counter() - start
+
+    timing = {'store_id': store_id, 'rows': len(g), 'model': name, 'strategy': strategy,
+              'fit_s': fit_s, 'predict_s': predict_s}
+    if cache_dir:
+        store_artifact(cache_dir, version, f"store_{store_id}", models, g, strategy)
+        timing['cache'] = (cache_info or {}).get('cache', 'missing')
+    return preds, timing
+
+
+def _forecast_batch(items: List[Tuple[pd.DataFrame, Optional[Dict]]], horizon: int, threads: int,
+                    strategy: str = DEFAULT_STRATEGY, cache_dir: Optional[str] = None):
+    """子进程内处理一批门店（门店数据, 缓存信息），减少进程间往返次数"""
+    out = []
+    for g, cache_info in items:
+        try:
+            out.append(forecast_store(g, horizon, threads, strategy, cache_dir=cache_dir, cache_info=cache_info))
+        except Exception as e:
+            out.append(([], {'store_id': int(g['store_id'].iloc[0]), 'rows': len(g), 'error': str(e)}))
+    return out
+
+
+def split_stores(df: pd.DataFrame, min_history: int = MIN_HISTORY_DAYS) -> List[pd.DataFrame]:
+    """按门店拆分训练数据，跳过历史过短的门店"""
+    cols = list(dict.fromkeys(['date_key', 'store_id', 'revenue'] + ORIGIN_FEATURES + FEATURES))
+    groups = [g[cols] for _, g in df.groupby('store_id', sort=False) if len(g) >= min_history]
+    # 数据量大的门店先提交，缩短长尾
+    groups.sort(key=len, reverse=True)
+    return groups
+
+
+def forecast_stores(groups: List[pd.DataFrame], horizon: int = HORIZON, workers: Optional[int] = None,
+                    threads: Optional[int] = None, batch_size: int = 4,
+                    strategy: str = DEFAULT_STRATEGY, cache_dir: Optional[str] = None,
+                    predict_only: bool = PREDICT_ONLY) -> Tuple[List[tuple], List[Dict]]:
+    """并行训练并预测所有门店，返回 (全部预测行, 每店耗时统计)
+
+    指定 cache_dir 时先在当前进程用缓存模型预测，只把需要重训的门店交给进程池
+    """
+    all_preds, timings = [], []
+    items = [(g, None) for g in groups]
+    if cache_dir:
+        items = []
+        for g in groups:
+            try:
+                preds, info = cached_forecast_store(g, horizon, cache_dir, strategy, predict_only=predict_only)
+            except Exception as e:
+                preds, info = None, {'cache': 'error', 'load_s': 0.0}
+                logger.warning(f"⚠️ 门店{int(g['store_id'].iloc[0])}缓存模型不可用: {e}")
+            if preds is None:
+                items.append((g, info))
+            else:
+                all_preds += preds
+                timings.append(info)
+        if not items:
+            return all_preds, timings
+
+    workers = max(1, min(workers or default_workers(), len(items) or 1))
+    threads = threads or default_model_threads(workers)
+
+    if workers == 1:
+        limit_threads(threads)
+        for preds, timing in _forecast_batch(items, horizon, threads, strategy, cache_dir):
+            all_preds += preds
+            timings.append(timing)
+        return all_preds, timings
+
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    # spawn：调度进程可能已有多个线程（run_etl 进程内模式），fork 不安全
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(_forecast_batch, batch, horizon, threads, strategy, cache_dir) for batch in batches]
+        for future in as_completed(futures):
+            for preds, timing in future.result():
+                all_preds += preds
+                timings.append(timing)
+    return all_preds, timings
+
+
+def log_timings(timings: List[Dict], wall_s: float, workers: int, threads: int):
+    """输出每店训练/预测耗时汇总"""
+    ok = [t for t in timings if 'error' not in t]
+    failed = [t for t in timings if 'error' in t]
+    for t in failed:
+        logger.warning(f"⚠️ 门店{t['store_id']}预测失败: {t['error']}")
+    if not ok:
+        return
+
+    fit = np.array([t['fit_s'] for t in ok])
+    predict = np.array([t['predict_s'] for t in ok])
+    busy = fit.sum() + predict.sum()
+    logger.info(f"⏱️ 门店模型耗时（{len(ok)} 店，{workers} 进程 × {threads} 线程，模型 {ok[0]['model']}）:")
+    logger.info(f"   - 训练: 合计 {fit.sum():.2f}s，P50 {np.percentile(fit, 50):.3f}s，"
+                f"P95 {np.percentile(fit, 95):.3f}s，最大 {fit.max():.3f}s")
+    logger.info(f"   - 预测: 合计 {predict.sum():.2f}s，P50 {np.percentile(predict, 50):.3f}s，"
+                f"最大 {predict.max():.3f}s")
+    logger.info(f"   - 墙钟 {wall_s:.2f}s，累计 {busy:.2f}s，并行加速 {busy / wall_s if wall_s else 0:.1f}x")
+    slowest = sorted(ok, key=lambda t: t['fit_s'] + t['predict_s'], reverse=True)[:5]
+    logger.info("   - 最慢门店: " + ", ".join(
+        f"{t['store_id']}({t['fit_s'] + t['predict_s']:.2f}s/{t['rows']}行)" for t in slowest))
+
+
+# ---------------------------------------------------------------------------
+# 全局模型：所有门店共用一个模型，加入门店属性特征
+# ---------------------------------------------------------------------------
+
+def prepare_store_attrs(stores: pd.DataFrame) -> pd.DataFrame:
+    """整理门店属性：store_id, city_code, open_date, rent_amount
+
+    city_code 按城市名排序编码，同一批门店数据下编码稳定
+    """
+    attrs = stores.copy()
+    attrs['store_id'] = pd.to_numeric(attrs['store_id'], errors='coerce')
+    attrs = attrs.dropna(subset=['store_id']).drop_duplicates('store_id', keep='last')
+    attrs['store_id'] = attrs['store_id'].astype('int64')
+    city = attrs['city'].fillna('未知').astype(str)
+    attrs['city_code'] = pd.Categorical(city, categories=sorted(city.unique())).codes.astype('int32')
+    attrs['open_date'] = pd.to_datetime(attrs['open_date'], errors='coerce')
+    attrs['rent_amount'] = pd.to_numeric(attrs['rent_amount'], errors='coerce')
+    return attrs
+
+
+def add_store_features(df: pd.DataFrame, attrs: pd.DataFrame) -> pd.DataFrame:
+    """为门店-日特征表追加门店属性特征（未知门店的属性为缺失值，树模型可直接处理）"""
+    out = df.merge(attrs[['store_id', 'city_code', 'open_date', 'rent_amount']], on='store_id', how='left')
+    out['city_code'] = out['city_code'].fillna(-1).astype('int32')
+    date = pd.to_datetime(out['date_key'].astype(str), format='%Y%m%d')
+    out['store_age_days'] = (date - out['open_date']).dt.days.clip(lower=0)
+    return out.drop(columns=['open_date'])
+
+
+def fit_global(df: pd.DataFrame, horizon: int = HORIZON, threads: int = 1,
+               quantiles: Tuple[float, ...] = None) -> Tuple[Dict, float]:
+    """用全部门店数据训练一组直接法模型（点预测 + 分位数），返回 (模型, 训练耗时)"""
+    quantiles = interval_quantiles() if quantiles is None else quantiles
+    train = direct_training_frame(df, horizon)
+    return fit_direct(train, GLOBAL_FEATURES, threads, quantiles)
+
+
+def fit_or_load_global(train: pd.DataFrame, horizon: int = HORIZON, threads: int = 1,
+                       quantiles: Tuple[float, ...] = None, cache_dir: Optional[str] = None,
+                       predict_only: bool = PREDICT_ONLY) -> Tuple[Dict, Dict]:
+    """全局模型：缓存有效时直接加载，否则训练并写入缓存，返回 (模型, 信息)
+
+    train 需已追加门店属性特征；信息含 fit_s、cache、load_s
+    """
+    quantiles = interval_quantiles() if quantiles is None else quantiles
+    info = {'fit_s': 0.0, 'load_s': 0.0}
+    if cache_dir:
+        version = artifact_version('direct', horizon, quantiles, GLOBAL_FEATURES)
+        models, cache_info = load_cached(cache_dir, version, 'global', train, horizon, GLOBAL_FEATURES, predict_only)
+        info.update(cache_info)
+        if models is not None:
+            return models, info
+
+    models, info['fit_s'] = fit_global(train, horizon, threads, quantiles)
+    if cache_dir:
+        store_artifact(cache_dir, version, 'global', models, train, 'direct')
+    return models, info
+
+
+def forecast_origins(df: pd.DataFrame, attrs: Optional[pd.DataFrame] = None,
+                     include_new_stores: bool = True) -> pd.DataFrame:
+    """每个门店的预测起点（最后一日特征）
+
+    include_new_stores=True 时，门店表中尚无销售记录的营业门店也生成起点：
+    起点特征取同城门店起点的中位数（无同城门店时取全局中位数）
+    """
+    origins = df.sort_values('date_key').groupby('store_id', sort=False).tail(1)
+    origins = origins[['date_key', 'store_id'] + ORIGIN_FEATURES].reset_index(drop=True)
+
+    if attrs is None or not include_new_stores:
+        return origins
+
+    active = attrs
+    if 'is_close' in attrs.columns:
+        active = attrs[attrs['is_close'].fillna(0).astype(int) == 0]
+    new_ids = np.setdiff1d(active['store_id'].to_numpy(), origins['store_id'].to_numpy())
+    if len(new_ids) == 0:
+        return origins
+
+    with_city = origins.merge(attrs[['store_id', 'city_code']], on='store_id', how='left')
+    city_median = with_city.groupby('city_code')[ORIGIN_FEATURES].median()
+    new = active[active['store_id'].isin(new_ids)][['store_id', 'city_code']].copy()
+    new = new.join(city_median, on='city_code')
+    for col in ORIGIN_FEATURES:
+        new[col] = new[col].fillna(origins[col].median())
+    new['date_key'] = int(origins['date_key'].max())
+    return pd.concat([origins, new[origins.columns]], ignore_index=True)
+
+
+def forecast_global(models: Dict, origins: pd.DataFrame, attrs: Optional[pd.DataFrame] = None,
+                    horizon: int = HORIZON) -> List[tuple]:
+    """全局模型预测：所有门店 × 全部预测步长一次构建特征矩阵，每个模型一次批量 predict"""
+    if origins.empty:
+        return []
+    origins = with_store_features(origins, attrs)
+    return predict_direct(models, horizon_matrix(origins, horizon), GLOBAL_FEATURES)
+
+
+def with_store_features(df: pd.DataFrame, attrs: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """追加门店属性特征；没有门店属性时填缺失值"""
+    if attrs is not None:
+        return add_store_features(df, attrs)
+    return df.assign(city_code=-1, rent_amount=np.nan, store_age_days=np.nan)
+
+
+# ---------------------------------------------------------------------------
+# 回测：留出最后若干天，对比分店模型与全局模型
+# ---------------------------------------------------------------------------
+
+def wape(actual, forecast) -> float:
+    """加权绝对百分比误差 sum|e| / sum|y|"""
+    actual, forecast = np.asarray(actual, dtype='float64'), np.asarray(forecast, dtype='float64')
+    denom = np.abs(actual).sum()
+    return float(np.abs(actual - forecast).sum() / denom) if denom else float('nan')
+
+
+def mape(actual, forecast) -> float:
+    """平均绝对百分比误差（忽略实际值为 0 的日）"""
+    actual, forecast = np.asarray(actual, dtype='float64'), np.asarray(forecast, dtype='float64')
+    mask = actual != 0
+    return float(np.mean(np.abs((actual[mask] - forecast[mask]) / actual[mask]))) if mask.any() else float('nan')
+
+
+def score_preds(preds: List[tuple], actual: pd.DataFrame) -> Dict:
+    """预测与实际值对齐后计算误差，只统计有实际值的门店-日"""
+    pred_df = pd.DataFrame(preds, columns=PRED_COLUMNS)
+    joined = actual.merge(pred_df, on=['date_key', 'store_id'], how='inner')
+    return {
+        'wape': wape(joined['revenue'], joined['yhat']),
+        'mape': mape(joined['revenue'], joined['yhat']),
+        'stores': int(joined['store_id'].nunique()),
+        'points': len(joined),
+    }
+
+
+def backtest_modes(df: pd.DataFrame, attrs: Optional[pd.DataFrame], holdout_days: int = HORIZON,
+                   workers: Optional[int] = None, threads: Optional[int] = None) -> Dict[str, Dict]:
+    """留出最后 holdout_days 天，分别用分店模式与全局模式训练并预测，比较训练耗时与留出期误差"""
+    dates = pd.to_datetime(df['date_key'].astype(str), format='%Y%m%d')
+    cutoff = dates.max() - pd.Timedelta(days=holdout_days)
+    train = df[dates <= cutoff]
+    actual = df[dates > cutoff][['date_key', 'store_id', 'revenue']]
+    total_stores = actual['store_id'].nunique()
+
+    results = {}
+
+    groups = split_stores(train)
+    start = time.perf_counter()
+    preds, timings = forecast_stores(groups, holdout_days, workers=workers, threads=threads)
+    wall = time.perf_counter() - start
+    results['per_store'] = dict(score_preds(preds, actual), wall_s=wall,
+                                fit_s=sum(t.get('fit_s', 0) for t in timings))
+
+    start = time.perf_counter()
+    models, fit_s = fit_global(with_store_features(train, attrs), holdout_days,
+                               threads=threads or default_model_threads(1))
+    preds = forecast_global(models, forecast_origins(train, attrs, include_new_stores=False), attrs, holdout_days)
+    wall = time.perf_counter() - start
+    results['global'] = dict(score_preds(preds, actual), wall_s=wall, fit_s=fit_s)
+
+    logger.info(f"🧪 回测（截止 {cutoff.date()}，留出 {holdout_days} 天，{total_stores} 个门店有实际值）:")
+    for mode, r in results.items():
+        logger.info(f"   - {mode:<9} WAPE {r['wape']:.2%}  MAPE {r['mape']:.2%}  覆盖门店 {r['stores']}/{total_stores}  "
+                    f"训练 {r['fit_s']:.2f}s  墙钟 {r['wall_s']:.2f}s")
+    return results
@@ -0,0 +1,129 @@
+"""
+预测模型本地缓存
+训练好的模型按 特征集版本 / 门店 存放在本地目录：模型为 joblib 文件，元数据（训练窗口、行数、误差基线）为同名 json
+下次运行先读元数据判断是否过期，未过期则加载模型直接预测；
+新增数据天数超过阈值、训练窗口不再匹配，或新数据上的误差相对基线漂移时才重训
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import datetime as dt
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 缓存目录，设置 ETL_FORECAST_CACHE=0 关闭缓存
+CACHE_DIR = os.getenv('ETL_FORECAST_CACHE_DIR', str(Path(__file__).parent.parent / 'artifacts' / 'forecast'))
+CACHE_ENABLED = os.getenv('ETL_FORECAST_CACHE', '1') == '1'
+
+# 训练截止日之后新增的天数达到该值即重训
+REFIT_DAYS = int(os.getenv('ETL_FORECAST_REFIT_DAYS', '7'))
+
+# 新数据上的 WAPE 超过 max(基线 × 倍数, 下限) 视为漂移；新数据少于 DRIFT_MIN_DAYS 天时不判断
+DRIFT_RATIO = float(os.getenv('ETL_FORECAST_DRIFT_RATIO', '1.5'))
+DRIFT_MIN_WAPE = float(os.getenv('ETL_FORECAST_DRIFT_MIN_WAPE', '0.2'))
+DRIFT_MIN_DAYS = 3
+
+# 只预测：有缓存就用，不做过期与漂移判断（只有缺失的模型才训练）
+PREDICT_ONLY = os.getenv('ETL_FORECAST_PREDICT_ONLY', '0') == '1'
+
+
+def default_cache_dir() -> Optional[str]:
+    return CACHE_DIR if CACHE_ENABLED else None
+
+
+def feature_set_version(**params) -> str:
+    """特征列、模型类型、预测步长、分位数等训练参数的短哈希，任一变化都会落到新的缓存目录"""
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+
+def _paths(root: str, version: str, key: str) -> Tuple[Path, Path]:
+    base = Path(root) / version
+    return base / f"{key}.joblib", base / f"{key}.json"
+
+
+def read_meta(root: str, version: str, key: str) -> Optional[Dict]:
+    _, meta_path = _paths(root, version, key)
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(root: str, version: str, key: str, meta: Dict):
+    _, meta_path = _paths(root, version, key)
+    meta_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = meta_path.with_suffix(f".json.{os.getpid()}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, default=str)
+    os.replace(tmp, meta_path)
+
+
+def load_models(root: str, version: str, key: str) -> Tuple[Optional[Dict], float]:
+    """加载模型，返回 (模型, 加载耗时)；文件损坏或不存在时返回 (None, 耗时)"""
+    import joblib
+    model_path, _ = _paths(root, version, key)
+    start = time.perf_counter()
+    try:
+        models = joblib.load(model_path)
+    except Exception as e:
+        logger.warning(f"⚠️ 模型缓存加载失败 {model_path}: {e}")
+        models = None
+    return models, time.perf_counter() - start
+
+
+def save_artifact(root: str, version: str, key: str, models: Dict, meta: Dict):
+    """先写模型再写元数据（均为临时文件 + 原子替换），元数据存在即表示模型完整可用"""
+    import joblib
+    model_path, _ = _paths(root, version, key)
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = model_path.with_suffix(f".joblib.{os.getpid()}.tmp")
+    joblib.dump(models, tmp)
+    os.replace(tmp, model_path)
+    write_meta(root, version, key, dict(meta, saved_at=dt.datetime.now().isoformat(timespec='seconds')))
+
+
+def stale_reason(meta: Optional[Dict], first_day: int, last_day: int,
+                 predict_only: bool = PREDICT_ONLY) -> Optional[str]:
+    """只看元数据判断是否需要重训（天数为 1970-01-01 起的日序号），不需要时返回 None"""
+    if meta is None:
+        return 'missing'
+    if predict_only:
+        return None
+    # 数据被回滚或历史起点后移，缓存的训练窗口已不对应当前数据
+    if last_day < meta['train_end_day'] or first_day > meta['train_start_day']:
+        return 'window'
+    if last_day - meta['train_end_day'] >= REFIT_DAYS:
+        return 'new_data'
+    return None
+
+
+def drifted(current_wape: float, baseline_wape: Optional[float]) -> bool:
+    if baseline_wape is None or np.isnan(current_wape):
+        return False
+    return current_wape > max(baseline_wape * DRIFT_RATIO, DRIFT_MIN_WAPE)
+
+
+def log_cache_stats(timings: List[Dict]):
+    """输出缓存命中率、加载耗时与重训原因"""
+    stats = [t for t in timings if 'cache' in t]
+    if not stats:
+        return
+    hits = [t for t in stats if t['cache'] == 'hit']
+    reasons = {}
+    for t in stats:
+        if t['cache'] != 'hit':
+            reasons[t['cache']] = reasons.get(t['cache'], 0) + 1
+    load = np.array([t.get('load_s', 0.0) for t in hits]) if hits else np.zeros(1)
+    logger.info(f"🗃️ 模型缓存: 命中 {len(hits)}/{len(stats)}（{len(hits) / len(stats):.1%}），"
+                f"加载合计 {load.sum():.2f}s，P50 {np.percentile(load, 50) * 1000:.1f}ms，"
+                f"最大 {load.max() * 1000:.1f}ms")
+    if reasons:
+        logger.info("   - 重训原因: " + ", ".join(f"{k} {v}" for k, v in sorted(reasons.items())))
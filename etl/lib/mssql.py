@@ -3,104 +3,512 @@ MSSQL数据库连接和操作库
 支持多数据库连接、数据提取和写入
 """
 import os
+import time
+import atexit
+import threading
 import pandas as pd
 import pymssql
 import logging
-from typing import Optional, Dict, Any
+from collections import deque
+from typing import Optional, Dict, Any, Iterator, Callable, List, Sequence
 from contextlib import contextmanager
 
+from .bulk import bulk_write, DEFAULT_METHOD, DEFAULT_CHUNKSIZE
+from .shadow import ShadowTable
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class ConnectionPool:
+    """单个数据库的连接池
+
+    - max_size:        最大连接数，超过后 checkout 阻塞等待
+    - idle_timeout:    空闲超过该秒数的连接被关闭回收
+    - ping_interval:   空闲超过该秒数的连接在 checkout 时先执行 SELECT 1 健康检查
+    - connect_retries: 建连失败时按指数退避重试的次数
+    """
+    
+    def __init__(self, connect_fn: Callable[[], Any], name: str, max_size: int = 5,
+                 idle_timeout: float = 300, ping_interval: float = 30, checkout_timeout: float = 60,
+                 connect_retries: int = 3, backoff: float = 0.5):
+        self._connect_fn = connect_fn
+        self.name = name
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.checkout_timeout = checkout_timeout
+        self.connect_retries = connect_retries
+        self.backoff = backoff
+        
+        self._idle = deque()  # (conn, 归还时间)
+        self._size = 0
+        self._cond = threading.Condition()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'reconnects': 0,
+            'health_check_failures': 0,
+            'evicted_idle': 0,
+            'discarded': 0,
+        }
+    
+    def _connect(self):
+        """建立新连接，失败时指数退避重试"""
+        last_error = None
+        for attempt in range(self.connect_retries + 1):
+            try:
+                conn = self._connect_fn()
+                logger.debug(f"✅ 连接池新建连接: {self.name}")
+                return conn
+            except Exception as e:
+                last_error = e
+                if attempt < self.connect_retries:
+                    delay = self.backoff * (2 ** attempt)
+                    logger.warning(f"⚠️ 连接 {self.name} 失败，{delay:.1f} 秒后重试 "
+                                   f"({attempt + 1}/{self.connect_retries}): {str(e)}")
+                    time.sleep(delay)
+        raise last_error
+    
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    @staticmethod
+    def _is_alive(conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+    
+    def _evict_idle_locked(self, now: float):
+        """关闭空闲超时的连接（调用方需持有锁）"""
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self.stats['evicted_idle'] += 1
+            self._close_quietly(conn)
+    
+    def acquire(self):
+        """借出连接：优先复用空闲连接，否则新建；连接数已满时等待归还"""
+        start = time.monotonic()
+        waited = False
+        while True:
+            conn, returned_at = None, None
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    self._evict_idle_locked(now)
+                    if self._idle:
+                        # 取最近归还的连接，让较旧的连接自然空闲超时
+                        conn, returned_at = self._idle.pop()
+                        self.stats['hits'] += 1
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        self.stats['misses'] += 1
+                        break
+                    remaining = self.checkout_timeout - (now - start)
+                    if remaining <= 0:
+                        raise TimeoutError(f"连接池 {self.name} 等待连接超时 ({self.checkout_timeout} 秒)")
+                    if not waited:
+                        self.stats['waits'] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+                if waited:
+                    self.stats['wait_time'] += time.monotonic() - start
+            
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            
+            if time.monotonic() - returned_at < self.ping_interval or self._is_alive(conn):
+                return conn
+            
+            # 健康检查失败：丢弃后重新获取
+            with self._cond:
+                self.stats['health_check_failures'] += 1
+                self.stats['reconnects'] += 1
+                self._size -= 1
+                self._cond.notify()
+            self._close_quietly(conn)
+            logger.warning(f"⚠️ 连接池 {self.name} 检测到失效连接，重新建立")
+    
+    def release(self, conn, discard: bool = False):
+        """归还连接；未提交的事务一律回滚，回滚失败则视为坏连接丢弃"""
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self.stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        
+        if discard:
+            self._close_quietly(conn)
+    
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close_quietly(conn)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self.stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['max_size'] = self.max_size
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        return stats
+
+_pools: Dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host: str, port: int, user: str, password: str, database: str = None,
+             **connect_kwargs) -> ConnectionPool:
+    """获取（或创建）指定数据库的共享连接池，同一进程内所有调用方复用"""
+    key = (host, int(port), user, database, tuple(sorted(connect_kwargs.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            def connect():
+                return pymssql.connect(
+                    server=host,
+                    port=int(port),
+                    user=user,
+                    password=password,
+                    database=database,
+                    as_dict=False,
+                    **connect_kwargs
+                )
+            pool = ConnectionPool(
+                connect,
+                name=f"{host}/{database}",
+                max_size=int(os.getenv('ETL_POOL_MAX_SIZE', '5')),
+                idle_timeout=float(os.getenv('ETL_POOL_IDLE_TIMEOUT', '300')),
+                ping_interval=float(os.getenv('ETL_POOL_PING_INTERVAL', '30')),
+                connect_retries=int(os.getenv('ETL_POOL_CONNECT_RETRIES', '3')),
+            )
+            _pools[key] = pool
+            logger.info(f"🏊 创建连接池: {pool.name} (max_size={pool.max_size})")
+        return pool
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """返回所有连接池的命中/未命中/等待时间等计数"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.get_stats() for pool in pools}
+
+def log_pool_stats():
+    """输出连接池统计"""
+    for name, stats in get_pool_stats().items():
+        logger.info(f"🏊 连接池 {name}: 命中 {stats['hits']}, 新建 {stats['misses']}, "
+                    f"命中率 {stats['hit_rate']:.0%}, 等待 {stats['waits']} 次/{stats['wait_time']:.2f} 秒, "
+                    f"重连 {stats['reconnects']}")
+
+def close_all_pools():
+    """关闭所有连接池中的空闲连接"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+atexit.register(close_all_pools)
+
 class MSSQLConnector:
-    """MSSQL数据库连接器"""
+    """MSSQL数据库连接器（连接来自进程内共享连接池）"""
     
-    def __init__(self, host: str = None, port: str = None, user: str = None, password: str = None):
+    def __init__(self, host: str = None, port: str = None, user: str = None, password: str = None,
+                 **connect_kwargs):
         self.host = host or os.getenv('MSSQL_HOST', 'rm-uf660d00xovkm30678o.sqlserver.rds.aliyuncs.com')
         self.port = port or os.getenv('MSSQL_PORT', '1433')
         self.user = user or os.getenv('MSSQL_USER', 'hotdog')
         self.password = password or os.getenv('MSSQL_PASS', 'Zhkj@62102218')
+        self.connect_kwargs = connect_kwargs
+    
+    def get_pool(self, database: str = None) -> ConnectionPool:
+        return get_pool(self.host, self.port, self.user, self.password, database, **self.connect_kwargs)
     
     @contextmanager
     def get_conn(self, database: str = None):
-        """获取数据库连接（上下文管理器）"""
-        conn = None
+        """获取数据库连接（上下文管理器），退出时归还连接池而不是关闭"""
+        pool = self.get_pool(database)
         try:
-            conn = pymssql.connect(
-                server=self.host,
-                port=int(self.port),
-                user=self.user,
-                password=self.password,
-                database=database,
-                as_dict=False
-            )
-            logger.info(f"✅ 成功连接到数据库: {database}")
-            yield conn
+            conn = pool.acquire()
         except Exception as e:
             logger.error(f"❌ 数据库连接失败: {database}, 错误: {str(e)}")
             raise
+        
+        try:
+            yield conn
         finally:
-            if conn:
-                conn.close()
-                logger.info(f"🔒 数据库连接已关闭: {database}")
+            pool.release(conn)
 
 def get_conn(database: str = None):
     """便捷函数：获取数据库连接"""
     connector = MSSQLConnector()
     return connector.get_conn(database)
 
-def fetch_df(sql: str, database: str) -> pd.DataFrame:
-    """从数据库提取数据到DataFrame"""
+DEFAULT_FETCH_CHUNKSIZE = 50000
+
+def _apply_dtypes(df: pd.DataFrame, dtypes: Optional[Dict[str, Any]]) -> pd.DataFrame:
+    """按预先声明的类型转换列，避免 Decimal/字符串 列以 object 形式驻留内存"""
+    if not dtypes:
+        return df
+    for col, dtype in dtypes.items():
+        if col not in df.columns:
+            continue
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+def iter_df(sql: str, database: str, chunksize: int = DEFAULT_FETCH_CHUNKSIZE,
+            dtypes: Optional[Dict[str, Any]] = None, params: Optional[tuple] = None) -> Iterator[pd.DataFrame]:
+    """流式提取：按 chunksize 分块 fetchmany，逐块产出 DataFrame
+
+    pymssql 不缓存整个结果集，游标按需从 TDS 流中读取行，
+    因此内存占用只与 chunksize 有关，与结果集总行数无关。
+    """
+    with get_conn(database) as conn:
+        cursor = conn.cursor()
+        logger.info(f"📊 执行流式查询: {database} (每块 {chunksize} 行)")
+        try:
+            if params:
+                cursor.execute(sql, params)
+            else:
+                cursor.execute(sql)
+            columns = [col[0] for col in cursor.description]
+            total = 0
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                total += len(rows)
+                df = pd.DataFrame.from_records(rows, columns=columns)
+                yield _apply_dtypes(df, dtypes)
+            logger.info(f"✅ 流式提取完成: {total} 行数据")
+        except Exception as e:
+            logger.error(f"❌ 流式提取失败: {str(e)}")
+            raise
+
+def fetch_df(sql: str, database: str, chunksize: Optional[int] = None,
+             dtypes: Optional[Dict[str, Any]] = None, params: Optional[tuple] = None):
+    """从数据库提取数据到DataFrame
+
+    指定 chunksize 时返回 DataFrame 迭代器（见 iter_df），否则一次性返回完整 DataFrame
+    """
+    if chunksize:
+        return iter_df(sql, database, chunksize=chunksize, dtypes=dtypes, params=params)
+    
     try:
         with get_conn(database) as conn:
             logger.info(f"📊 执行查询: {database}")
-            df = pd.read_sql(sql, conn)
+            df = pd.read_sql(sql, conn, params=params)
             logger.info(f"✅ 成功提取 {len(df)} 行数据")
-            return df
+            return _apply_dtypes(df, dtypes)
     except Exception as e:
         logger.error(f"❌ 数据提取失败: {str(e)}")
         return pd.DataFrame()
 
-def to_sql(df: pd.DataFrame, table: str, database: str, if_exists: str = 'append') -> bool:
-    """将DataFrame写入数据库"""
+def _df_sql_type(series: pd.Series) -> str:
+    """DataFrame 列 -> 建表列类型"""
+    if pd.api.types.is_bool_dtype(series):
+        return "bit"
+    if pd.api.types.is_integer_dtype(series):
+        return "bigint"
+    if pd.api.types.is_float_dtype(series):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime2(3)"
+    width = int(series.dropna().astype(str).str.len().max() or 0) if series.notna().any() else 0
+    return "nvarchar(max)" if width > 2000 else f"nvarchar({max(50, width * 2)})"
+
+def create_table_from_df(cursor, table: str, df: pd.DataFrame):
+    """按 DataFrame 的列与类型建表（目标表不存在时的首次全量写入）"""
+    cols = ",".join(f"[{col}] {_df_sql_type(df[col])} NULL" for col in df.columns)
+    cursor.execute(f"CREATE TABLE dbo.[{table}] ({cols})")
+
+def to_sql(df: pd.DataFrame, table: str, database: str, if_exists: str = 'append',
+           method: Optional[str] = None, chunksize: Optional[int] = None, min_ratio: float = 0) -> bool:
+    """将DataFrame写入数据库
+
+    method 可选 executemany / multirow / prepared / bcp，默认取环境变量 ETL_BULK_METHOD（未设置时为 multirow）
+    if_exists='replace' 时写入影子表，建索引并校验后原子切换（lib.shadow），读者不会看到写了一半的表；
+    目标表不存在时按 DataFrame 建表后直接写入
+    min_ratio 为切换前 "影子表行数 / 线上表行数" 的下限（见 ShadowTable），默认 0 不检查：
+    dstores / dproducts 等表以前按追加方式重复写入，线上行数远多于去重后的行数，首次重载按比例检查总会被拒绝
+    """
     if df.empty:
         logger.warning("⚠️ DataFrame为空，跳过写入")
         return False
     
+    method = method or os.getenv('ETL_BULK_METHOD', DEFAULT_METHOD)
+    chunksize = chunksize or int(os.getenv('ETL_BULK_CHUNKSIZE', DEFAULT_CHUNKSIZE))
+    
+    try:
+        with get_conn(database) as conn:
+            start = time.perf_counter()
+            if if_exists == 'replace' and not _table_columns(conn.cursor(), table):
+                logger.info(f"🆕 {database}.{table} 不存在，按 DataFrame 建表")
+                create_table_from_df(conn.cursor(), table, df)
+                conn.commit()
+                rows_inserted = bulk_write(conn, df, table, method=method, chunksize=chunksize)
+                conn.commit()
+            elif if_exists == 'replace':
+                with ShadowTable(conn, table, min_ratio=min_ratio) as shadow:
+                    rows_inserted = shadow.write(df, method=method, chunksize=chunksize)
+                    shadow.swap(expected_rows=rows_inserted)
+            else:
+                rows_inserted = bulk_write(conn, df, table, method=method, chunksize=chunksize)
+                conn.commit()
+            elapsed = time.perf_counter() - start
+            speed = rows_inserted / elapsed if elapsed > 0 else 0
+            logger.info(f"✅ 成功插入 {rows_inserted} 行数据到 {database}.{table} "
+                        f"(策略: {method}, 耗时: {elapsed:.2f} 秒, 速度: {speed:.0f} 条/秒)")
+            return True
+            
+    except Exception as e:
+        logger.error(f"❌ 数据写入失败: {str(e)}")
+        return False
+
+def _table_columns(cursor, table: str) -> List[str]:
+    """查询目标表列名（按列序）"""
+    cursor.execute(
+        "SELECT name FROM sys.columns WHERE object_id = OBJECT_ID(%s) ORDER BY column_id",
+        (table,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def merge_df(df: pd.DataFrame, table: str, database: str, key_cols: Sequence[str],
+             update_cols: Optional[Sequence[str]] = None, only_changed: bool = False,
+             update_extra: Optional[Dict[str, str]] = None, method: Optional[str] = None) -> Dict[str, int]:
+    """批量装载到临时表后执行一次集合化 MERGE
+
+    - 仅装载目标表中存在的列，多余列记录告警后忽略
+    - 同一键值在暂存数据中只保留最后一行，避免 MERGE 多源匹配错误
+    - only_changed=True 时仅更新值确实发生变化的行
+    - update_extra 为额外的 SET 表达式，例如 {'updated_at': 'sysutcdatetime()'}
+
+    返回 {'inserted': n, 'updated': n, 'failed': n}
+    """
+    stats = {'inserted': 0, 'updated': 0, 'failed': 0}
+    if df.empty:
+        logger.warning("⚠️ DataFrame为空，跳过合并")
+        return stats
+    
+    method = method or os.getenv('ETL_BULK_METHOD', DEFAULT_METHOD)
+    if method in ('bcp', 'prepared'):
+        # 临时表不在当前库的 sys.columns 中，bcp 列序号与 prepared 参数类型都无法查询，暂存阶段退回多行 VALUES
+        method = DEFAULT_METHOD
+    stage = f"#stg_{table.replace('.', '_')}"
+    
     try:
         with get_conn(database) as conn:
             cursor = conn.cursor()
+            target_cols = _table_columns(cursor, table)
+            if not target_cols:
+                raise ValueError(f"目标表不存在: {database}.{table}")
             
-            # 构建插入语句 - pymssql使用%s占位符
-            cols = ",".join([f"[{col}]" for col in df.columns])
-            placeholders = ",".join(["%s"] * len(df.columns))
-            insert_sql = f"INSERT INTO [{table}] ({cols}) VALUES ({placeholders})"
+            cols = [col for col in df.columns if col in target_cols]
+            ignored = [col for col in df.columns if col not in target_cols]
+            if ignored:
+                logger.warning(f"⚠️ {table} 不包含列 {ignored}，合并时忽略")
+            missing_keys = [col for col in key_cols if col not in cols]
+            if missing_keys:
+                raise ValueError(f"合并键缺失: {missing_keys}")
             
-            # 批量插入
-            rows_inserted = 0
-            for _, row in df.iterrows():
-                try:
-                    cursor.execute(insert_sql, tuple(row))
-                    rows_inserted += 1
-                except Exception as e:
-                    logger.warning(f"⚠️ 跳过行插入: {str(e)}")
-                    continue
+            data = df[cols].drop_duplicates(subset=list(key_cols), keep='last')
+            if len(data) < len(df):
+                logger.info(f"🔄 暂存前按 {list(key_cols)} 去重: {len(df) - len(data)} 行")
             
-            conn.commit()
-            logger.info(f"✅ 成功插入 {rows_inserted} 行数据到 {database}.{table}")
-            return True
+            # UNION ALL 的 TOP 0 副本不会继承 IDENTITY 属性
+            col_list = ",".join([f"[{col}]" for col in cols])
+            cursor.execute(f"""
+IF OBJECT_ID('tempdb..{stage}') IS NOT NULL DROP TABLE {stage};
+SELECT TOP 0 {col_list} INTO {stage} FROM [{table}]
+UNION ALL
+SELECT TOP 0 {col_list} FROM [{table}];
+""")
+            staged = bulk_write(conn, data, stage, method=method)
+            stats['failed'] += len(data) - staged
+            
+            update_cols = [col for col in (update_cols or cols) if col in cols and col not in key_cols]
+            set_parts = [f"T.[{col}] = S.[{col}]" for col in update_cols]
+            set_parts += [f"T.[{col}] = {expr}" for col, expr in (update_extra or {}).items()]
+            on_clause = " AND ".join([f"T.[{col}] = S.[{col}]" for col in key_cols])
+            
+            matched = ""
+            if set_parts:
+                condition = ""
+                if only_changed and update_cols:
+                    src = ",".join([f"S.[{col}]" for col in update_cols])
+                    tgt = ",".join([f"T.[{col}]" for col in update_cols])
+                    condition = f" AND EXISTS (SELECT {src} EXCEPT SELECT {tgt})"
+                matched = f"WHEN MATCHED{condition} THEN UPDATE SET {', '.join(set_parts)}"
             
+            cursor.execute(f"""
+SET NOCOUNT ON;
+DECLARE @merge_actions TABLE (action nvarchar(10));
+MERGE [{table}] AS T
+USING {stage} AS S
+ON ({on_clause})
+{matched}
+WHEN NOT MATCHED BY TARGET THEN INSERT ({col_list})
+VALUES ({",".join([f"S.[{col}]" for col in cols])})
+OUTPUT $action INTO @merge_actions;
+SELECT
+  ISNULL(SUM(CASE WHEN action = 'INSERT' THEN 1 ELSE 0 END), 0),
+  ISNULL(SUM(CASE WHEN action = 'UPDATE' THEN 1 ELSE 0 END), 0)
+FROM @merge_actions;
+DROP TABLE {stage};
+""")
+            inserted, updated = cursor.fetchone()
+            conn.commit()
+            stats['inserted'], stats['updated'] = int(inserted), int(updated)
+            logger.info(f"✅ 合并到 {database}.{table}: 新增 {stats['inserted']}, "
+                        f"更新 {stats['updated']}, 失败 {stats['failed']}")
+            return stats
+    
     except Exception as e:
-        logger.error(f"❌ 数据写入失败: {str(e)}")
-        return False
+        logger.error(f"❌ 数据合并失败: {str(e)}")
+        return {'inserted': 0, 'updated': 0, 'failed': len(df)}
 
-def execute_sql(sql: str, database: str) -> bool:
+def execute_sql(sql: str, database: str, params: Optional[tuple] = None) -> bool:
     """执行SQL语句"""
     try:
         with get_conn(database) as conn:
             cursor = conn.cursor()
-            cursor.execute(sql)
+            if params:
+                cursor.execute(sql, params)
+            else:
+                cursor.execute(sql)
             conn.commit()
             logger.info(f"✅ SQL执行成功: {database}")
             return True
@@ -0,0 +1,227 @@
+"""
+超参数搜索
+随机搜索 / 逐次减半（successive halving）在进程池中并行评估候选配置：
+- objective(configs, resource) 在子进程中一次评估一批配置，返回每个配置的得分（越大越好）；
+  resource 为评估所用资源（如交叉验证折数），逐次减半时逐轮增加；大数据经 initializer 一次性传给子进程
+- 墙钟预算：到期后不再提交新批次，已提交未开始的批次取消，以已完成的试验为准
+- 早停：随机搜索连续 patience 轮最佳得分提升不足 min_delta 时停止；逐次减半每轮只保留前 1/eta 的配置
+- 每个试验的参数、得分、资源与耗时逐行写入 JSON Lines 试验日志
+"""
+import os
+import json
+import time
+import logging
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('halving', 'random', 'grid')
+
+# 每个子任务评估的配置数：越小越能及时响应预算，越大向量化越充分
+DEFAULT_CHUNK_SIZE = 256
+
+
+class TrialLog:
+    """JSON Lines 试验日志，每次搜索覆盖写入"""
+
+    def __init__(self, path: Optional[str], run_id: str, strategy: str):
+        self.run_id = run_id
+        self.strategy = strategy
+        self.count = 0
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, trial: Dict[str, Any]):
+        self.count += 1
+        if self._file:
+            record = {'run_id': self.run_id, 'trial': self.count, 'strategy': self.strategy, **trial}
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def _evaluate_chunk(objective: Callable, configs: List[Dict], resource: int):
+    start = time.perf_counter()
+    scores = objective(configs, resource)
+    return [float(s) for s in scores], time.perf_counter() - start, os.getpid()
+
+
+class _Runner:
+    """在进程池（jobs > 1）或当前进程中分块评估配置，遵守墙钟截止时间"""
+
+    def __init__(self, objective: Callable, jobs: int, deadline: float, chunk_size: int,
+                 initializer: Optional[Callable], initargs: tuple):
+        self.objective = objective
+        self.jobs = max(1, jobs)
+        self.deadline = deadline
+        self.chunk_size = max(1, chunk_size)
+        self.pool = None
+        if self.jobs > 1:
+            # spawn：调用方可能已有多个线程，fork 不安全
+            self.pool = ProcessPoolExecutor(max_workers=self.jobs, mp_context=mp.get_context('spawn'),
+                                            initializer=initializer, initargs=initargs)
+        elif initializer is not None:
+            initializer(*initargs)
+        self.expired = False
+
+    def evaluate(self, configs: Sequence[Dict], resource: int) -> List[Dict]:
+        """评估一批配置，返回已完成的 [{'config', 'score', 'seconds', 'worker'}]；预算到期时可能少于输入"""
+        chunks = [list(configs[i:i + self.chunk_size]) for i in range(0, len(configs), self.chunk_size)]
+        done = []
+
+        def collect(chunk, result):
+            scores, elapsed, worker = result
+            for config, score in zip(chunk, scores):
+                done.append({'config': config, 'score': score, 'seconds': elapsed / len(chunk), 'worker': worker})
+
+        if self.pool is None:
+            for chunk in chunks:
+                if time.perf_counter() >= self.deadline:
+                    self.expired = True
+                    break
+                collect(chunk, _evaluate_chunk(self.objective, chunk, resource))
+            return done
+
+        # 同时在途的子任务数不超过 2 × 进程数，预算到期后不再提交
+        pending, queue = {}, list(chunks)
+        while queue or pending:
+            while queue and len(pending) < self.jobs * 2 and time.perf_counter() < self.deadline:
+                chunk = queue.pop(0)
+                pending[self.pool.submit(_evaluate_chunk, self.objective, chunk, resource)] = chunk
+            if queue and time.perf_counter() >= self.deadline:
+                self.expired = True
+                queue = []
+            if not pending:
+                break
+            timeout = max(0.0, self.deadline - time.perf_counter())
+            finished, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                # 预算到期：取消未开始的子任务，已在运行的不再等待
+                self.expired = True
+                for future in pending:
+                    future.cancel()
+                break
+            for future in finished:
+                collect(pending.pop(future), future.result())
+        return done
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=not self.expired, cancel_futures=True)
+            self.pool = None
+
+
+def _record(log: TrialLog, results: List[Dict], rung: int, resource: int):
+    for r in results:
+        log.write({'rung': rung, 'resource': resource, 'params': r['config'], 'score': r['score'],
+                   'seconds': round(r['seconds'], 6), 'worker': r['worker']})
+
+
+def _summary(strategy, best, trials, started, budget_s, stopped, **extra) -> Dict[str, Any]:
+    return {
+        'strategy': strategy,
+        'best_params': best['config'] if best else None,
+        'best_score': best['score'] if best else None,
+        'trials': trials,
+        'seconds': round(time.perf_counter() - started, 3),
+        'budget_seconds': budget_s,
+        'stopped': stopped,
+        **extra,
+    }
+
+
+def random_search(objective: Callable, sampler: Callable[[int], List[Dict]], resource: int,
+                  max_trials: int = 20000, batch_size: int = 1024, jobs: int = 1, budget_s: float = 60.0,
+                  patience: int = 5, min_delta: float = 1e-4, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  initializer: Optional[Callable] = None, initargs: tuple = (),
+                  log: Optional[TrialLog] = None, strategy: str = 'random') -> Dict[str, Any]:
+    """随机搜索：每轮从 sampler 取 batch_size 个配置并行评估，预算到期、连续 patience 轮无提升或 sampler 耗尽时停止
+
+    sampler(n) 返回最多 n 个配置，返回空列表表示候选已耗尽（网格搜索即用有限的 sampler）
+    """
+    started = time.perf_counter()
+    log = log or TrialLog(None, '', strategy)
+    runner = _Runner(objective, jobs, started + budget_s, chunk_size, initializer, initargs)
+    best, trials, stale, rounds, stopped = None, 0, 0, 0, 'max_trials'
+    try:
+        while trials < max_trials:
+            configs = sampler(min(batch_size, max_trials - trials))
+            if not configs:
+                stopped = 'exhausted'
+                break
+            results = runner.evaluate(configs, resource)
+            _record(log, results, 0, resource)
+            trials += len(results)
+            rounds += 1
+            round_best = max(results, key=lambda r: r['score'], default=None)
+            if round_best and (best is None or round_best['score'] > best['score'] + min_delta):
+                best, stale = round_best, 0
+            else:
+                if round_best and round_best['score'] > best['score']:
+                    best = round_best
+                stale += 1
+            if runner.expired:
+                stopped = 'budget'
+                break
+            if patience and stale >= patience:
+                stopped = 'patience'
+                break
+    finally:
+        runner.close()
+    logger.info(f"🔍 {strategy} 搜索结束（{stopped}）: {trials} 个试验，{rounds} 轮，"
+                f"最佳得分 {best['score'] if best else float('nan'):.4f}，耗时 {time.perf_counter() - started:.2f}s")
+    return _summary(strategy, best, trials, started, budget_s, stopped, rounds=rounds, resource=resource)
+
+
+def halving_resources(max_resource: int, eta: int = 3, min_resource: int = 1) -> List[int]:
+    """逐次减半各轮资源：从 max_resource 按 eta 逐级缩小，去重后升序，如 (9, 3) -> [1, 3, 9]，(5, 3) -> [2, 5]"""
+    levels, r = [], float(max_resource)
+    while r >= min_resource:
+        levels.append(max(min_resource, int(round(r))))
+        r /= eta
+    return sorted(set(levels))
+
+
+def successive_halving(objective: Callable, sampler: Callable[[int], List[Dict]], resources: Sequence[int],
+                       n_configs: int = 6561, eta: int = 3, jobs: int = 1, budget_s: float = 60.0,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE, initializer: Optional[Callable] = None,
+                       initargs: tuple = (), log: Optional[TrialLog] = None) -> Dict[str, Any]:
+    """逐次减半：n_configs 个配置先用最少资源评估，每轮保留前 1/eta 进入更多资源的下一轮
+
+    预算到期时以已完成评估的最高一轮中得分最高的配置为结果
+    """
+    started = time.perf_counter()
+    log = log or TrialLog(None, '', 'halving')
+    runner = _Runner(objective, jobs, started + budget_s, chunk_size, initializer, initargs)
+    survivors = sampler(n_configs)
+    best, trials, stopped, rungs = None, 0, 'completed', []
+    try:
+        for rung, resource in enumerate(resources):
+            results = runner.evaluate(survivors, resource)
+            _record(log, results, rung, resource)
+            trials += len(results)
+            if results:
+                best = max(results, key=lambda r: r['score'])
+                rungs.append({'rung': rung, 'resource': resource, 'configs': len(results),
+                              'best_score': best['score']})
+                logger.info(f"   - 第{rung + 1}轮: 资源 {resource}，评估 {len(results)} 个配置，"
+                            f"最佳得分 {best['score']:.4f}")
+            if runner.expired:
+                stopped = 'budget'
+                break
+            if rung + 1 < len(resources):
+                keep = max(1, len(results) // eta)
+                survivors = [r['config'] for r in sorted(results, key=lambda r: r['score'], reverse=True)[:keep]]
+    finally:
+        runner.close()
+    logger.info(f"🔍 逐次减半搜索结束（{stopped}）: {trials} 个试验，{len(rungs)} 轮，"
+                f"最佳得分 {best['score'] if best else float('nan'):.4f}，耗时 {time.perf_counter() - started:.2f}s")
+    return _summary('halving', best, trials, started, budget_s, stopped, rungs=rungs, eta=eta,
+                    n_configs=n_configs, final_resource=rungs[-1]['resource'] if rungs else None)
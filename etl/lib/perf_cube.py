@@ -0,0 +1,266 @@
+"""
+区域业绩立方体
+按 省 / 市 / 区 / 月 物化营收、订单数、有销售门店数、门店营业日数与客单价（dbo.fact_perf_cube_monthly），
+选址评分与仪表板从立方体读取，不再每次扫描订单与 vw_sales_store_daily：
+- 增量刷新：只重建上次刷新以来有新增或变更订单的月份（水位线同步骤06，按 "立方体 + 上游表" 记录）
+- 订单改到别的月份后，旧月份按 "立方体订单数 ≠ 订单表订单数" 找出并一并重建
+- 门店省市区归属或删除标记变化（门店区域指纹变化）或无水位线时全量重建，已删除门店不计入立方体
+- 每个月份在同一事务内先删后插，区域归属变化后旧区域的行不会残留
+营收直接按订单汇总，不经过 order_items，避免多明细订单的金额被重复累计
+"""
+import datetime as dt
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from .mssql import get_conn, fetch_df
+from .watermark import get_watermark, set_watermark, reset_watermark, lookback
+
+logger = logging.getLogger(__name__)
+
+CUBE_DB = "hotdog2030"
+CUBE_TABLE = "fact_perf_cube_monthly"
+
+LEVELS = ('province', 'city', 'district')
+
+UNKNOWN = {'province': '未知省份', 'city': '未知城市', 'district': '未知区域'}
+
+# 变化月份拆成的最大区间数，超过时合并为一个 [最小, 最大] 区间
+MAX_MONTH_RANGES = 24
+
+_DDL = f"""
+IF OBJECT_ID('dbo.{CUBE_TABLE}','U') IS NULL
+CREATE TABLE dbo.{CUBE_TABLE} (
+  month_key    int            NOT NULL,
+  province     nvarchar(100)  NOT NULL,
+  city         nvarchar(100)  NOT NULL,
+  district     nvarchar(100)  NOT NULL,
+  revenue      decimal(18,2)  NOT NULL DEFAULT(0),
+  orders_cnt   int            NOT NULL DEFAULT(0),
+  store_cnt    int            NOT NULL DEFAULT(0),
+  store_days   int            NOT NULL DEFAULT(0),
+  avg_ticket   AS (CONVERT(decimal(18,2), revenue / NULLIF(orders_cnt, 0))) PERSISTED,
+  refreshed_at datetime2      DEFAULT (sysutcdatetime()),
+  PRIMARY KEY (month_key, province, city, district)
+);
+"""
+
+# 先汇总到 门店-日 再按 月-区域 汇总，store_days 即门店营业日数（城市日均营收 = revenue / store_days）
+_REBUILD_SQL = """
+SET NOCOUNT ON;
+DELETE FROM dbo.{table} {delete_where};
+WITH store_day AS (
+  SELECT o.date_key, o.store_id, SUM(o.total_amount) AS revenue, COUNT(*) AS orders_cnt
+  FROM dbo.orders o
+  WHERE o.delflag = 0 AND o.date_key IS NOT NULL AND o.store_id IS NOT NULL {order_where}
+  GROUP BY o.date_key, o.store_id
+), region_day AS (
+  SELECT d.date_key / 100 AS month_key,
+         ISNULL(NULLIF(s.province, N''), N'{province}') AS province,
+         ISNULL(NULLIF(s.city, N''), N'{city}') AS city,
+         ISNULL(NULLIF(s.district, N''), N'{district}') AS district,
+         d.store_id, d.revenue, d.orders_cnt
+  FROM store_day d
+  JOIN dbo.stores s ON s.id = d.store_id AND s.delflag = 0
+)
+INSERT INTO dbo.{table} (month_key, province, city, district, revenue, orders_cnt, store_cnt, store_days)
+SELECT month_key, province, city, district,
+       ISNULL(SUM(revenue), 0), SUM(orders_cnt), COUNT(DISTINCT store_id), COUNT(*)
+FROM region_day
+GROUP BY month_key, province, city, district;
+SELECT @@ROWCOUNT;
+"""
+
+# 订单数与立方体不一致的月份：订单的 date_key 改到别的月份后，旧月份不在 "新增或变更订单所在月份" 之中，
+# 但其订单数会减少；过滤条件须与 _REBUILD_SQL 一致
+_STALE_MONTHS_SQL = """
+SELECT COALESCE(o.month_key, c.month_key) AS month_key
+FROM (
+  SELECT o.date_key / 100 AS month_key, COUNT(*) AS orders_cnt
+  FROM dbo.orders o
+  JOIN dbo.stores s ON s.id = o.store_id AND s.delflag = 0
+  WHERE o.delflag = 0 AND o.date_key IS NOT NULL
+  GROUP BY o.date_key / 100
+) o
+FULL JOIN (
+  SELECT month_key, SUM(orders_cnt) AS orders_cnt FROM dbo.{table} GROUP BY month_key
+) c ON c.month_key = o.month_key
+WHERE ISNULL(o.orders_cnt, 0) <> ISNULL(c.orders_cnt, 0)
+"""
+
+_table_ready = False
+
+
+def ensure_cube_table(database: str = CUBE_DB):
+    """首次使用时创建立方体表"""
+    global _table_ready
+    if _table_ready:
+        return
+    with get_conn(database) as conn:
+        cursor = conn.cursor()
+        cursor.execute(_DDL)
+        conn.commit()
+    _table_ready = True
+
+
+def capture_high_water(database: str = CUBE_DB) -> Dict[str, Tuple[Optional[dt.datetime], Optional[int]]]:
+    """记录刷新开始时订单的最大主键与变更时间，以及门店区域指纹（CHECKSUM_AGG）"""
+    df = fetch_df(f"""
+    SELECT
+      (SELECT MAX(id) FROM dbo.orders)         AS orders_id,
+      (SELECT MAX(updated_at) FROM dbo.orders) AS orders_ts,
+      (SELECT CHECKSUM_AGG(CHECKSUM(id, province, city, district, delflag)) FROM dbo.stores) AS regions
+    """, database)
+    if df.empty:
+        return {}
+    r = df.iloc[0]
+    ts = None if pd.isna(r['orders_ts']) else pd.Timestamp(r['orders_ts']).to_pydatetime()
+    return {
+        'orders': (ts, None if pd.isna(r['orders_id']) else int(r['orders_id'])),
+        'stores': (None, 0 if pd.isna(r['regions']) else int(r['regions'])),
+    }
+
+
+def find_touched_months(high_water, database: str = CUBE_DB) -> Optional[List[int]]:
+    """上次刷新以来新增或变更订单所在的月份 (yyyymm)，加上订单移出后订单数对不上的旧月份；需要全量重建时返回 None"""
+    orders_wm = get_watermark(CUBE_TABLE, "orders")
+    stores_wm = get_watermark(CUBE_TABLE, "stores")
+    if orders_wm == (None, None) or stores_wm == (None, None):
+        return None
+    if high_water.get('stores') and stores_wm[1] != high_water['stores'][1]:
+        logger.info("🗺️ 门店省市区归属发生变化，全量重建立方体")
+        return None
+
+    df = fetch_df("""
+    SELECT DISTINCT o.date_key / 100 AS month_key
+    FROM dbo.orders o
+    WHERE o.id > %s OR o.updated_at > %s
+    """, database, params=(orders_wm[1] if orders_wm[1] is not None else -1,
+                           lookback(orders_wm[0]) or dt.datetime(1900, 1, 1)))
+    months = set() if df.empty else {int(m) for m in df['month_key'].dropna().unique()}
+
+    stale = fetch_df(_STALE_MONTHS_SQL.format(table=CUBE_TABLE), database)
+    stale_months = set() if stale.empty else {int(m) for m in stale['month_key'].dropna().unique()}
+    if stale_months - months:
+        logger.info(f"🧹 {len(stale_months - months)} 个月份的订单数与立方体不一致（订单改到了别的月份），一并重建")
+    return sorted(months | stale_months)
+
+
+def to_month_ranges(months: Sequence[int], max_ranges: int = MAX_MONTH_RANGES) -> List[Tuple[int, int]]:
+    """把 yyyymm 列表合并为连续月份闭区间 [(start, end)]"""
+    if not months:
+        return []
+    ordinals = sorted({m // 100 * 12 + m % 100 - 1 for m in months})
+    ranges, start, prev = [], ordinals[0], ordinals[0]
+    for o in ordinals[1:]:
+        if o != prev + 1:
+            ranges.append((start, prev))
+            start = o
+        prev = o
+    ranges.append((start, prev))
+
+    def key(o):
+        return o // 12 * 100 + o % 12 + 1
+
+    ranges = [(key(a), key(b)) for a, b in ranges]
+    if len(ranges) > max_ranges:
+        ranges = [(ranges[0][0], ranges[-1][1])]
+    return ranges
+
+
+def build_rebuild_sql(ranges: Optional[Sequence[Tuple[int, int]]] = None) -> Tuple[str, tuple]:
+    """构建 删除 + 重新汇总 SQL；ranges 为 yyyymm 闭区间列表，None 表示全量"""
+    fmt = dict(table=CUBE_TABLE, **UNKNOWN)
+    if ranges is None:
+        return _REBUILD_SQL.format(delete_where="", order_where="", **fmt), ()
+    # 订单按 date_key 区间过滤，可走 IX_orders_date_key
+    delete_where = "WHERE " + " OR ".join(["month_key BETWEEN %s AND %s"] * len(ranges))
+    order_where = "AND (" + " OR ".join(["o.date_key BETWEEN %s AND %s"] * len(ranges)) + ")"
+    params = tuple(v for r in ranges for v in r)
+    params += tuple(v for a, b in ranges for v in (a * 100 + 1, b * 100 + 31))
+    return _REBUILD_SQL.format(delete_where=delete_where, order_where=order_where, **fmt), params
+
+
+def rebuild(ranges: Optional[Sequence[Tuple[int, int]]] = None, database: str = CUBE_DB) -> int:
+    """在一个事务内重建指定月份区间（None 为全部），返回写入的立方体行数"""
+    sql, params = build_rebuild_sql(ranges)
+    with get_conn(database) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, params or None)
+            row = cursor.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return int(row[0]) if row else 0
+
+
+def advance_watermarks(high_water, rows_loaded: int, full: bool):
+    """重建成功后推进水位线；全量重建时先清除，门店区域指纹可以前后不同"""
+    for source_table, (last_ts, last_id) in high_water.items():
+        if full:
+            reset_watermark(CUBE_TABLE, source_table)
+        set_watermark(CUBE_TABLE, source_table, last_ts, last_id, rows_loaded)
+
+
+def refresh_perf_cube(full: bool = False, database: str = CUBE_DB) -> Dict[str, object]:
+    """增量刷新立方体，返回 {'mode': 'full'|'incremental'|'noop', 'months': n, 'rows': n}"""
+    ensure_cube_table(database)
+    # 先记录高水位，刷新期间新到的订单留给下次运行
+    high_water = capture_high_water(database)
+
+    months = None if full else find_touched_months(high_water, database)
+    if months == []:
+        logger.info("✅ 上次刷新以来没有新增或变更的订单，立方体无需重建")
+        advance_watermarks(high_water, 0, full=False)
+        return {'mode': 'noop', 'months': 0, 'rows': 0}
+
+    ranges = None if months is None else to_month_ranges(months)
+    if ranges is None:
+        logger.info(f"📅 全量重建 {CUBE_TABLE}")
+    else:
+        logger.info(f"📅 增量重建 {len(months)} 个月份，{len(ranges)} 个月份区间")
+
+    rows = rebuild(ranges, database)
+    advance_watermarks(high_water, rows, full=ranges is None)
+    return {'mode': 'full' if ranges is None else 'incremental',
+            'months': 0 if months is None else len(months), 'rows': rows}
+
+
+def rollup_sql(level: str = 'city', start_month: Optional[int] = None, end_month: Optional[int] = None) -> Tuple[str, tuple]:
+    """按 province / city / district 汇总立方体的 SQL；store_cnt 为区间内各月有销售门店数的最大值"""
+    if level not in LEVELS:
+        raise ValueError(f"不支持的汇总层级: {level}")
+    group = ", ".join(LEVELS[:LEVELS.index(level) + 1])
+    where, params = [], []
+    if start_month is not None:
+        where.append("month_key >= %s")
+        params.append(start_month)
+    if end_month is not None:
+        where.append("month_key <= %s")
+        params.append(end_month)
+    sql = f"""
+    SELECT {group},
+           SUM(revenue) AS revenue, SUM(orders_cnt) AS orders_cnt, MAX(store_cnt) AS store_cnt,
+           SUM(store_days) AS store_days,
+           SUM(revenue) / NULLIF(SUM(orders_cnt), 0) AS avg_ticket,
+           SUM(revenue) / NULLIF(SUM(store_days), 0) AS avg_store_day_revenue
+    FROM (
+      SELECT month_key, {group}, SUM(revenue) AS revenue, SUM(orders_cnt) AS orders_cnt,
+             SUM(store_cnt) AS store_cnt, SUM(store_days) AS store_days
+      FROM dbo.{CUBE_TABLE}
+      {"WHERE " + " AND ".join(where) if where else ""}
+      GROUP BY month_key, {group}
+    ) m
+    GROUP BY {group}
+    """
+    return sql, tuple(params)
+
+
+def load_rollup(level: str = 'city', start_month: Optional[int] = None, end_month: Optional[int] = None,
+                database: str = CUBE_DB) -> pd.DataFrame:
+    """读取按层级汇总的区域业绩"""
+    sql, params = rollup_sql(level, start_month, end_month)
+    return fetch_df(sql, database, params=params or None)
@@ -0,0 +1,259 @@
+"""
+按主键/日期区间并行抽取大表
+Orders / OrderGoods 等数百万行的源表单条查询只能用到一个连接、一个服务器会话，
+这里先按切分列的边界（MIN/MAX/COUNT）或直方图把查询切成若干区间，
+再用 N 个连接池连接并发读取各区间，按区间顺序产出 DataFrame：
+- 每个区间整段读完后才交给调用方，失败时只重试该区间（丢弃出错的连接，指数退避）
+- 同时在途的区间数有上限，内存占用约为 (并发数 + 预取数) × 每区间行数
+- 区间数多于连接数，慢区间不会拖住其他连接（线程空闲即领取下一个区间）
+切分列须可比较且最好有索引（主键 id、记录时间等）；该列为 NULL 的行单独作为一个区间读取
+"""
+import os
+import time
+import math
+import logging
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from .mssql import MSSQLConnector, _apply_dtypes, DEFAULT_FETCH_CHUNKSIZE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECTIONS = 4
+
+# 区间数至少为连接数的倍数，数据分布不均时由动态领取摊平
+MIN_RANGES_PER_CONNECTION = 4
+
+# 直方图桶数：桶越多区间行数越均匀，直方图查询返回的行也越多
+HISTOGRAM_BUCKETS = 1024
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+
+SPLIT_MODES = ('even', 'histogram')
+
+
+class KeyRange(NamedTuple):
+    """切分列上的左闭右开区间 [lo, hi)；lo/hi 为 None 表示该侧不设界（只有一个区间时两侧都不设界）
+
+    null_only=True 表示切分列为 NULL 的行，此时忽略 lo/hi
+    """
+    lo: Any
+    hi: Any
+    rows: int = 0
+    null_only: bool = False
+
+
+def _wrap(sql: str) -> str:
+    # 原查询可能带 WHERE / 参数，包一层派生表后再加区间条件，SQL Server 会把条件下推到基表
+    return f"SELECT * FROM ({sql}) q"
+
+
+def range_sql(sql: str, key: str, key_range: KeyRange) -> Tuple[str, tuple]:
+    """给查询加上区间条件，返回 (SQL, 区间参数)；区间参数追加在原查询参数之后"""
+    base = _wrap(sql)
+    if key_range.null_only:
+        return f"{base} WHERE q.[{key}] IS NULL", ()
+    conditions, params = [f"q.[{key}] IS NOT NULL"], []
+    if key_range.lo is not None:
+        conditions.append(f"q.[{key}] >= %s")
+        params.append(key_range.lo)
+    if key_range.hi is not None:
+        conditions.append(f"q.[{key}] < %s")
+        params.append(key_range.hi)
+    return f"{base} WHERE {' AND '.join(conditions)}", tuple(params)
+
+
+def _query(database: str, sql: str, params: tuple) -> Tuple[List[str], List[tuple]]:
+    """借一个连接池连接执行查询，返回 (列名, 全部行)；出错的连接直接丢弃，不再归还复用"""
+    pool = MSSQLConnector().get_pool(database)
+    conn = pool.acquire()
+    discard = False
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params or None)
+        return [col[0] for col in cursor.description], cursor.fetchall()
+    except Exception:
+        discard = True
+        raise
+    finally:
+        pool.release(conn, discard=discard)
+
+
+def key_bounds(sql: str, database: str, key: str, params: Optional[tuple] = None) -> Tuple[Any, Any, int, int]:
+    """查询切分列的 (最小值, 最大值, 非空行数, NULL 行数)"""
+    _, rows = _query(database, f"SELECT MIN(q.[{key}]), MAX(q.[{key}]), COUNT_BIG(q.[{key}]), COUNT_BIG(*) "
+                               f"FROM ({sql}) q", params or ())
+    lo, hi, non_null, total = rows[0]
+    return lo, hi, int(non_null or 0), int(total or 0) - int(non_null or 0)
+
+
+def _is_datetime(value) -> bool:
+    return isinstance(value, dt.datetime)
+
+
+def _offset_expr(key: str, lo) -> str:
+    # 日期列按分钟换算为相对最小值的偏移量，数值列直接相减
+    if _is_datetime(lo):
+        return f"DATEDIFF(minute, %s, q.[{key}])"
+    return f"(q.[{key}] - %s)"
+
+
+def _offset(lo, value):
+    if _is_datetime(lo):
+        return (value - lo).total_seconds() / 60
+    return value - lo
+
+
+def _at(lo, offset):
+    if _is_datetime(lo):
+        return lo + dt.timedelta(minutes=offset)
+    if isinstance(lo, int):
+        return lo + int(offset)
+    return lo + offset
+
+
+def split_even(lo, hi, n_ranges: int, rows: int = 0) -> List[KeyRange]:
+    """把 [lo, hi] 等宽切成 n_ranges 段；首段不设下界、末段不设上界，规划之后新增的行也不会漏抽"""
+    width = _offset(lo, hi)
+    n_ranges = max(1, n_ranges)
+    if isinstance(lo, int):
+        n_ranges = min(n_ranges, int(width) + 1)
+    step = width / n_ranges
+    per_range = rows // n_ranges
+    cuts = [_at(lo, math.ceil(step * i) if isinstance(lo, int) else step * i) for i in range(1, n_ranges)]
+    bounds = [None] + cuts + [None]
+    return [KeyRange(bounds[i], bounds[i + 1], per_range) for i in range(n_ranges)]
+
+
+def split_histogram(sql: str, database: str, key: str, lo, hi, n_ranges: int,
+                    params: Optional[tuple] = None, buckets: int = HISTOGRAM_BUCKETS) -> List[KeyRange]:
+    """按切分列的等宽直方图累计行数切分，使各区间行数接近；适合主键稀疏或按日期分布不均的表"""
+    width = _offset(lo, hi)
+    bucket_width = max(1, math.ceil((width + 1) / buckets))
+    expr = _offset_expr(key, lo)
+    _, rows = _query(database,
+                     f"SELECT {expr} / %s AS bucket, COUNT_BIG(*) FROM ({sql}) q "
+                     f"WHERE q.[{key}] IS NOT NULL GROUP BY {expr} / %s ORDER BY bucket",
+                     (lo, bucket_width) + tuple(params or ()) + (lo, bucket_width))
+    total = sum(int(count) for _, count in rows)
+    if not total:
+        return split_even(lo, hi, 1)
+    target = total / max(1, n_ranges)
+    ranges: List[KeyRange] = []
+    start, acc = None, 0
+    for bucket, count in rows:
+        acc += int(count)
+        if acc >= target and len(ranges) < n_ranges - 1:
+            cut = _at(lo, (int(bucket) + 1) * bucket_width)
+            ranges.append(KeyRange(start, cut, acc))
+            start, acc = cut, 0
+    ranges.append(KeyRange(start, None, acc))
+    return ranges
+
+
+def plan_ranges(sql: str, database: str, key: str = 'id', params: Optional[tuple] = None,
+                connections: int = DEFAULT_CONNECTIONS, range_rows: int = DEFAULT_FETCH_CHUNKSIZE,
+                split: str = 'even') -> List[KeyRange]:
+    """规划抽取区间：区间数约为 总行数 / range_rows，且不少于 连接数 × MIN_RANGES_PER_CONNECTION
+
+    split='even' 只需一次 MIN/MAX/COUNT 查询；'histogram' 多一次分组计数，区间行数更均匀
+    """
+    if split not in SPLIT_MODES:
+        raise ValueError(f"未知切分方式: {split}，可选: {', '.join(SPLIT_MODES)}")
+    lo, hi, rows, null_rows = key_bounds(sql, database, key, params)
+    ranges: List[KeyRange] = []
+    if rows:
+        n_ranges = max(connections * MIN_RANGES_PER_CONNECTION, math.ceil(rows / max(1, range_rows)))
+        n_ranges = min(n_ranges, rows)
+        if split == 'histogram':
+            ranges = split_histogram(sql, database, key, lo, hi, n_ranges, params)
+        else:
+            ranges = split_even(lo, hi, n_ranges, rows)
+    if null_rows:
+        ranges.append(KeyRange(None, None, null_rows, null_only=True))
+    logger.info(f"🧩 {database}: 按 {key} 切分为 {len(ranges)} 个区间 "
+                f"(范围 {lo} ~ {hi}, {rows + null_rows} 行, 方式 {split})")
+    return ranges
+
+
+def fetch_range(sql: str, database: str, key: str, key_range: KeyRange,
+                dtypes: Optional[Dict[str, Any]] = None, params: Optional[tuple] = None,
+                retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF) -> pd.DataFrame:
+    """读取一个区间；失败时丢弃该连接并按指数退避重试，区间读取幂等，重试不会产生重复行"""
+    query, range_params = range_sql(sql, key, key_range)
+    query_params = tuple(params or ()) + range_params
+    attempt = 0
+    while True:
+        try:
+            columns, rows = _query(database, query, query_params)
+            return _apply_dtypes(pd.DataFrame.from_records(rows, columns=columns), dtypes)
+        except Exception as e:
+            attempt += 1
+            if attempt > retries:
+                logger.error(f"❌ 区间 [{key_range.lo}, {key_range.hi}) 抽取失败，已重试 {retries} 次: {str(e)}")
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            logger.warning(f"⚠️ 区间 [{key_range.lo}, {key_range.hi}) 抽取失败，{delay:.1f} 秒后第 {attempt} 次重试: {str(e)}")
+            time.sleep(delay)
+
+
+def iter_df_ranges(sql: str, database: str, key: str, ranges: List[KeyRange],
+                   connections: int = DEFAULT_CONNECTIONS, dtypes: Optional[Dict[str, Any]] = None,
+                   params: Optional[tuple] = None, prefetch: Optional[int] = None,
+                   retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                   fetch=None) -> Iterator[pd.DataFrame]:
+    """用 connections 个线程并发读取各区间，按区间顺序逐个产出 DataFrame
+
+    同时提交的区间不超过 connections + prefetch 个，调用方处理慢时读取自然停下；
+    调用方提前结束迭代时取消尚未开始的区间。fetch 可替换区间读取函数（基准测试用）
+    """
+    fetch = fetch or fetch_range
+    pool_size = MSSQLConnector().get_pool(database).max_size if fetch is fetch_range else connections
+    if connections > pool_size:
+        logger.warning(f"⚠️ 并发数 {connections} 超过连接池上限 {pool_size}（ETL_POOL_MAX_SIZE），按 {pool_size} 执行")
+        connections = pool_size
+    connections = max(1, min(connections, len(ranges) or 1))
+    window = connections + (connections if prefetch is None else prefetch)
+
+    start = time.perf_counter()
+    total = 0
+    executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix=f"extract-{database}")
+    pending = []
+    try:
+        queued = iter(ranges)
+        for key_range in queued:
+            pending.append(executor.submit(fetch, sql, database, key, key_range, dtypes, params, retries, backoff))
+            if len(pending) >= window:
+                break
+        while pending:
+            df = pending.pop(0).result()
+            next_range = next(queued, None)
+            if next_range is not None:
+                pending.append(executor.submit(fetch, sql, database, key, next_range, dtypes, params, retries, backoff))
+            total += len(df)
+            yield df
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+    speed = total / elapsed if elapsed > 0 else 0
+    logger.info(f"✅ 并行抽取完成: {database} {total} 行, {len(ranges)} 个区间, {connections} 个连接, "
+                f"耗时 {elapsed:.2f} 秒 ({speed:.0f} 行/秒)")
+
+
+def iter_df_parallel(sql: str, database: str, key: str = 'id', connections: Optional[int] = None,
+                     chunksize: int = DEFAULT_FETCH_CHUNKSIZE, dtypes: Optional[Dict[str, Any]] = None,
+                     params: Optional[tuple] = None, split: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """规划区间并并行抽取，按切分列顺序产出 DataFrame（每块约 chunksize 行），用法同 mssql.iter_df
+
+    connections 默认取环境变量 ETL_EXTRACT_CONNECTIONS，split 默认取 ETL_EXTRACT_SPLIT
+    """
+    connections = connections or int(os.getenv('ETL_EXTRACT_CONNECTIONS', DEFAULT_CONNECTIONS))
+    split = split or os.getenv('ETL_EXTRACT_SPLIT', 'even')
+    ranges = plan_ranges(sql, database, key, params, connections=connections, range_rows=chunksize, split=split)
+    return iter_df_ranges(sql, database, key, ranges, connections=connections, dtypes=dtypes, params=params)
@@ -0,0 +1,277 @@
+"""
+影子表全量重载
+全量重载不再清空并重灌正在被查询的表，而是：
+1. 按线上表结构建一张空的影子表 {table}__shadow（不建索引的堆表，只补上计算列与默认值约束）
+2. 调用方把全部数据写入影子表（bcp / 多行 VALUES 写堆表，不维护索引）
+3. 一次性按线上表定义重建主键、唯一约束与索引
+4. 校验行数、数值列合计（control_sums）与相对线上表的最小行数比例；影子表与线上表 CHECKSUM 完全一致时不切换
+5. 在一个短事务内用 sp_rename 交换表名与约束名，读者只在切换的毫秒级窗口内等待架构锁
+失败时线上表保持不变，影子表被删除；被外键引用的表拒绝切换
+"""
+import os
+import time
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from .bulk import bulk_write, DEFAULT_METHOD, DEFAULT_CHUNKSIZE
+
+logger = logging.getLogger(__name__)
+
+SHADOW_SUFFIX = "__shadow"
+OLD_SUFFIX = "__old"
+
+# 切换时等待架构锁的最长毫秒数，超时则放弃本次切换，避免排队的 Sch-M 锁长时间阻塞读者
+DEFAULT_LOCK_TIMEOUT_MS = 10000
+
+# 影子表行数低于线上表行数的该比例时拒绝切换，可用环境变量 ETL_SHADOW_MIN_RATIO 调整，0 表示不检查
+DEFAULT_MIN_RATIO = 0.5
+
+# 数值列合计的允许误差：每行半分（decimal(18,2) 写入时的舍入）
+SUM_TOLERANCE_PER_ROW = 0.005
+
+
+def _name(base: str, suffix: str) -> str:
+    """对象名加后缀，超过 128 个字符时截断"""
+    return (base[:128 - len(suffix)] + suffix) if len(base) + len(suffix) > 128 else base + suffix
+
+
+def _columns_sql(cols: Sequence[Tuple[str, bool]]) -> str:
+    return ",".join(f"[{name}]{' DESC' if desc else ''}" for name, desc in cols)
+
+
+class ShadowTable:
+    """一张线上表的影子表重载，连接由调用方管理
+
+    with ShadowTable(conn, 'orders') as shadow:
+        shadow.write(df)                     # 可多次调用
+        shadow.swap(expected_rows=len(df))
+    """
+
+    def __init__(self, conn, table: str, min_ratio: Optional[float] = None, keep_old: bool = False,
+                 lock_timeout_ms: int = DEFAULT_LOCK_TIMEOUT_MS):
+        """
+        - min_ratio: 影子表行数低于线上表行数 × min_ratio 时拒绝切换（防止源库异常导致的大量丢数），
+                     默认取环境变量 ETL_SHADOW_MIN_RATIO（未设置时为 DEFAULT_MIN_RATIO），0 表示不检查
+        - keep_old:  切换后保留旧表 {table}__old，默认删除
+        """
+        self.conn = conn
+        self.table = table
+        self.name = _name(table, SHADOW_SUFFIX)
+        self.old_name = _name(table, OLD_SUFFIX)
+        self.min_ratio = float(os.getenv('ETL_SHADOW_MIN_RATIO', DEFAULT_MIN_RATIO)) if min_ratio is None else min_ratio
+        self.keep_old = keep_old
+        self.lock_timeout_ms = lock_timeout_ms
+        self.cursor = conn.cursor()
+        self.rows = 0
+        self.swapped = False
+        self._columns: List[str] = []
+        self._constraints: List[Tuple[str, str]] = []  # (线上约束名, 影子表约束名)
+        self._index_ddl: List[str] = []
+
+    def __enter__(self) -> 'ShadowTable':
+        self.create()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None or not self.swapped:
+            self.drop()
+        return False
+
+    def _exec(self, sql: str, params: Optional[tuple] = None):
+        self.cursor.execute(sql, params)
+
+    def _fetch(self, sql: str, params: Optional[tuple] = None) -> list:
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def _drop_if_exists(self, name: str):
+        self._exec(f"IF OBJECT_ID(N'dbo.{name}','U') IS NOT NULL DROP TABLE dbo.[{name}]")
+
+    def create(self):
+        """建空影子表：普通列沿用线上表定义（含 IDENTITY 与可空性），补上计算列与默认值约束，不建索引"""
+        if not self._fetch("SELECT OBJECT_ID(N'dbo.' + %s, 'U')", (self.table,))[0][0]:
+            raise ValueError(f"线上表不存在: {self.table}")
+        referenced = self._fetch("SELECT COUNT(*) FROM sys.foreign_keys WHERE referenced_object_id = OBJECT_ID(N'dbo.' + %s)",
+                                 (self.table,))[0][0]
+        if referenced:
+            raise ValueError(f"{self.table} 被 {referenced} 个外键引用，不能通过换表重载")
+
+        # 上次失败残留的影子表/旧表
+        self._drop_if_exists(self.name)
+        self._drop_if_exists(self.old_name)
+
+        columns = self._fetch("""
+        SELECT c.name, c.is_computed, cc.definition, cc.is_persisted
+        FROM sys.columns c
+        LEFT JOIN sys.computed_columns cc ON cc.object_id = c.object_id AND cc.column_id = c.column_id
+        WHERE c.object_id = OBJECT_ID(N'dbo.' + %s)
+        ORDER BY c.column_id
+        """, (self.table,))
+        self._columns = [name for name, is_computed, _, _ in columns if not is_computed]
+        col_list = ",".join(f"[{c}]" for c in self._columns)
+        self._exec(f"SELECT TOP 0 {col_list} INTO dbo.[{self.name}] FROM dbo.[{self.table}]")
+        for name, is_computed, definition, persisted in columns:
+            if is_computed:
+                self._exec(f"ALTER TABLE dbo.[{self.name}] ADD [{name}] AS {definition}{' PERSISTED' if persisted else ''}")
+
+        for constraint, column, definition in self._fetch("""
+        SELECT dc.name, c.name, dc.definition
+        FROM sys.default_constraints dc
+        JOIN sys.columns c ON c.object_id = dc.parent_object_id AND c.column_id = dc.parent_column_id
+        WHERE dc.parent_object_id = OBJECT_ID(N'dbo.' + %s)
+        """, (self.table,)):
+            shadow_constraint = _name(constraint, SHADOW_SUFFIX)
+            self._exec(f"ALTER TABLE dbo.[{self.name}] ADD CONSTRAINT [{shadow_constraint}] "
+                       f"DEFAULT {definition} FOR [{column}]")
+            self._constraints.append((constraint, shadow_constraint))
+
+        self._index_ddl = self._script_indexes()
+        self.conn.commit()
+        logger.info(f"🪞 已创建影子表 {self.name}（{len(self._columns)} 列，待重建 {len(self._index_ddl)} 个索引/约束）")
+
+    def _script_indexes(self) -> List[str]:
+        """按线上表的主键、唯一约束与行存储索引生成影子表 DDL，聚集索引在前"""
+        rows = self._fetch("""
+        SELECT i.index_id, i.name, i.type, i.is_primary_key, i.is_unique_constraint, i.is_unique,
+               i.filter_definition, c.name, ic.is_descending_key, ic.is_included_column
+        FROM sys.indexes i
+        JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+        JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+        WHERE i.object_id = OBJECT_ID(N'dbo.' + %s) AND i.type IN (1, 2) AND i.is_hypothetical = 0
+        ORDER BY i.type, i.index_id, ic.is_included_column, ic.key_ordinal, ic.index_column_id
+        """, (self.table,))
+        indexes: Dict[int, dict] = {}
+        for index_id, name, itype, is_pk, is_uq, is_unique, filter_def, column, desc, included in rows:
+            idx = indexes.setdefault(index_id, {'name': name, 'type': itype, 'pk': is_pk, 'uq': is_uq,
+                                                'unique': is_unique, 'filter': filter_def, 'keys': [], 'include': []})
+            if included:
+                idx['include'].append(column)
+            else:
+                idx['keys'].append((column, desc))
+
+        ddl = []
+        for idx in sorted(indexes.values(), key=lambda i: i['type']):
+            kind = 'CLUSTERED' if idx['type'] == 1 else 'NONCLUSTERED'
+            if idx['pk'] or idx['uq']:
+                shadow_constraint = _name(idx['name'], SHADOW_SUFFIX)
+                ddl.append(f"ALTER TABLE dbo.[{self.name}] ADD CONSTRAINT [{shadow_constraint}] "
+                           f"{'PRIMARY KEY' if idx['pk'] else 'UNIQUE'} {kind} ({_columns_sql(idx['keys'])})")
+                self._constraints.append((idx['name'], shadow_constraint))
+                continue
+            sql = (f"CREATE {'UNIQUE ' if idx['unique'] else ''}{kind} INDEX [{idx['name']}] "
+                   f"ON dbo.[{self.name}] ({_columns_sql(idx['keys'])})")
+            if idx['include']:
+                sql += " INCLUDE (" + ",".join(f"[{c}]" for c in idx['include']) + ")"
+            if idx['filter']:
+                sql += f" WHERE {idx['filter']}"
+            ddl.append(sql)
+        return ddl
+
+    def write(self, df: pd.DataFrame, method: Optional[str] = None, chunksize: int = DEFAULT_CHUNKSIZE) -> int:
+        """写入一批数据并提交；只写影子表中存在的列"""
+        if df.empty:
+            return 0
+        cols = [c for c in df.columns if c in self._columns]
+        ignored = [c for c in df.columns if c not in self._columns]
+        if ignored:
+            logger.warning(f"⚠️ {self.table} 不包含列 {ignored}，写入时忽略")
+        written = bulk_write(self.conn, df[cols], self.name, method=method or DEFAULT_METHOD, chunksize=chunksize)
+        self.conn.commit()
+        self.rows += written
+        return written
+
+    def build_indexes(self) -> float:
+        """数据写完后一次性建索引，返回耗时秒数"""
+        start = time.perf_counter()
+        for sql in self._index_ddl:
+            self._exec(sql)
+        self.conn.commit()
+        return time.perf_counter() - start
+
+    def _stats(self, name: str, sum_cols: Sequence[str]) -> dict:
+        checksum_cols = ",".join(f"[{c}]" for c in self._columns)
+        sums = "".join(f", SUM(CONVERT(float, [{c}]))" for c in sum_cols)
+        row = self._fetch(f"SELECT COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM({checksum_cols})){sums} "
+                          f"FROM dbo.[{name}]")[0]
+        return {'rows': int(row[0]), 'checksum': row[1],
+                'sums': {c: (float(v) if v is not None else 0.0) for c, v in zip(sum_cols, row[2:])}}
+
+    def validate(self, expected_rows: Optional[int] = None,
+                 control_sums: Optional[Dict[str, float]] = None) -> Dict[str, object]:
+        """校验影子表，不通过时抛出 ValueError；返回影子表与线上表的行数与 CHECKSUM"""
+        sum_cols = list(control_sums or {})
+        shadow = self._stats(self.name, sum_cols)
+        live = self._stats(self.table, [])
+        if expected_rows is not None and shadow['rows'] != expected_rows:
+            raise ValueError(f"{self.name} 行数 {shadow['rows']} 与写入行数 {expected_rows} 不一致")
+        for col, expected in (control_sums or {}).items():
+            actual = shadow['sums'][col]
+            if abs(actual - expected) > SUM_TOLERANCE_PER_ROW * max(1, shadow['rows']):
+                raise ValueError(f"{self.name}.{col} 合计 {actual:.2f} 与源数据合计 {expected:.2f} 不一致")
+        if self.min_ratio and live['rows'] and shadow['rows'] < live['rows'] * self.min_ratio:
+            raise ValueError(f"{self.name} 行数 {shadow['rows']} 低于线上表 {live['rows']} 的 {self.min_ratio:.0%}，拒绝切换")
+        return {'rows': shadow['rows'], 'live_rows': live['rows'],
+                'checksum': shadow['checksum'], 'live_checksum': live['checksum'],
+                'unchanged': shadow['rows'] == live['rows'] and shadow['checksum'] == live['checksum']}
+
+    def _swap_sql(self) -> Tuple[str, tuple]:
+        """交换表名与约束名；旧表约束先改名让出名字"""
+        steps, params = [], []
+        for live_constraint, shadow_constraint in self._constraints:
+            steps.append("EXEC sp_rename %s, %s, N'OBJECT';")
+            params += [f"dbo.{live_constraint}", _name(live_constraint, OLD_SUFFIX)]
+        steps.append("EXEC sp_rename %s, %s;")
+        params += [f"dbo.{self.table}", self.old_name]
+        steps.append("EXEC sp_rename %s, %s;")
+        params += [f"dbo.{self.name}", self.table]
+        for live_constraint, shadow_constraint in self._constraints:
+            steps.append("EXEC sp_rename %s, %s, N'OBJECT';")
+            params += [f"dbo.{shadow_constraint}", live_constraint]
+        sql = f"SET XACT_ABORT ON;\nSET LOCK_TIMEOUT {int(self.lock_timeout_ms)};\n" + "\n".join(steps)
+        return sql, tuple(params)
+
+    def swap(self, expected_rows: Optional[int] = None, control_sums: Optional[Dict[str, float]] = None,
+             force: bool = False) -> Dict[str, object]:
+        """重建索引、校验并切换，返回 {'rows', 'live_rows', 'index_seconds', 'swap_ms', 'swapped'}
+
+        影子表与线上表内容一致（行数与 CHECKSUM 相同）时不切换，force=True 时总是切换
+        """
+        index_s = self.build_indexes()
+        result = self.validate(expected_rows if expected_rows is not None else self.rows, control_sums)
+        result['index_seconds'] = round(index_s, 3)
+        if result['unchanged'] and not force:
+            logger.info(f"✅ {self.table} 内容未变化（{result['rows']} 行，CHECKSUM 一致），保留线上表")
+            result.update(swap_ms=0.0, swapped=False)
+            return result
+
+        sql, params = self._swap_sql()
+        start = time.perf_counter()
+        try:
+            self._exec(sql, params)
+            self.conn.commit()
+            swap_ms = (time.perf_counter() - start) * 1000
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            # 连接可能归还连接池，恢复会话设置
+            self._exec("SET XACT_ABORT OFF; SET LOCK_TIMEOUT -1;")
+        self.swapped = True
+        if not self.keep_old:
+            self._drop_if_exists(self.old_name)
+            self.conn.commit()
+        result.update(swap_ms=round(swap_ms, 1), swapped=True)
+        logger.info(f"🔀 {self.table} 已切换为新数据: {result['rows']} 行（原 {result['live_rows']} 行），"
+                    f"建索引 {index_s:.2f}s，切换 {swap_ms:.1f}ms")
+        return result
+
+    def drop(self):
+        """删除影子表（线上表不受影响）"""
+        try:
+            self.conn.rollback()
+            self._drop_if_exists(self.name)
+            self.conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ 删除影子表 {self.name} 失败: {e}")
@@ -0,0 +1,175 @@
+"""
+选址候选点批量评分
+SiteScorer 一次加载城市表现、城市门店密度与门店空间索引，之后任意一批候选点一次调用完成评分：
+- match_score:    候选点所在城市的历史日均营收 / 各城市最高值（城市未知时取各城市中位数）
+- cannibal_score: 周边门店按距离衰减加权的蚕食度（lib.spatial）；无坐标时退回城市门店数占比
+- total_score:    0.6 × match + 0.4 × (1 - cannibal)
+各项归一化基准只取决于预先加载的城市/门店数据，与本批候选点的构成无关，分批评分结果一致
+"""
+import time
+import logging
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .spatial import (StoreIndex, parse_location, radius_column, DEFAULT_RADII_KM,
+                      DEFAULT_CANNIBAL_RADIUS_KM)
+
+logger = logging.getLogger(__name__)
+
+MATCH_WEIGHT = 0.6
+CANNIBAL_WEIGHT = 0.4
+
+# 最近门店在该距离内时，候选点城市取该门店的城市
+DEFAULT_CITY_MATCH_KM = 30.0
+
+DEFAULT_BATCH_SIZE = 500
+
+STORES_SQL = """
+SELECT id AS store_id, city, longitude, latitude
+FROM dbo.stores
+WHERE delflag = 0 AND (is_close = 0 OR is_close IS NULL)
+"""
+
+# 城市门店日均营收 = 营收 / 门店营业日数，读取区域业绩立方体（lib.perf_cube，步骤11刷新）而不扫描销售视图
+CITY_PERF_SQL = """
+SELECT city, SUM(revenue) / NULLIF(SUM(store_days), 0) AS city_avg_revenue
+FROM dbo.fact_perf_cube_monthly
+GROUP BY city
+"""
+
+CITY_DENSITY_SQL = "SELECT city, COUNT(*) AS store_cnt FROM dbo.stores GROUP BY city"
+
+SCORE_COLUMNS = ['match_score', 'cannibal_score', 'total_score']
+
+
+def to_candidate_frame(candidates, start_id: int = 1) -> pd.DataFrame:
+    """把候选点统一为 DataFrame
+
+    支持 DataFrame、dict 列表（location / longitude,latitude / address / city / candidate_id 等键）、
+    位置文本列表、(经度, 纬度) 元组列表；缺少 candidate_id 时按输入顺序从 start_id 起编号
+    """
+    if isinstance(candidates, pd.DataFrame):
+        df = candidates.reset_index(drop=True)
+    else:
+        items = list(candidates)
+        if items and isinstance(items[0], str):
+            df = pd.DataFrame({'location': items})
+        elif items and isinstance(items[0], (tuple, list)):
+            df = pd.DataFrame([tuple(x)[:2] for x in items], columns=['longitude', 'latitude'])
+        else:
+            df = pd.DataFrame(items)
+    if 'candidate_id' not in df.columns:
+        df.insert(0, 'candidate_id', np.arange(start_id, start_id + len(df)))
+    return df
+
+
+def candidate_coordinates(df: pd.DataFrame):
+    """优先使用 longitude/latitude 列，缺失时解析 location 文本"""
+    def column(name):
+        if name not in df:
+            return np.full(len(df), np.nan)
+        return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype='float64')
+
+    lng, lat = column('longitude'), column('latitude')
+    if 'location' in df:
+        missing = np.isnan(lng) | np.isnan(lat)
+        if missing.any():
+            p_lng, p_lat = parse_location(df['location'])
+            lng, lat = np.where(missing, p_lng, lng), np.where(missing, p_lat, lat)
+    return lng, lat
+
+
+class SiteScorer:
+    """共享城市表现与门店索引的批量评分器
+
+    - stores:     store_id, city, longitude, latitude
+    - city_perf:  city, city_avg_revenue
+    - city_density: city, store_cnt；不传时按 stores 统计
+    """
+
+    def __init__(self, stores: pd.DataFrame, city_perf: pd.DataFrame, city_density: Optional[pd.DataFrame] = None,
+                 radii_km: Sequence[float] = DEFAULT_RADII_KM,
+                 cannibal_radius_km: float = DEFAULT_CANNIBAL_RADIUS_KM,
+                 city_match_km: float = DEFAULT_CITY_MATCH_KM):
+        start = time.perf_counter()
+        self.radii_km = tuple(radii_km)
+        self.cannibal_radius_km = cannibal_radius_km
+        self.city_match_km = city_match_km
+
+        self.index = StoreIndex(pd.to_numeric(stores['longitude'], errors='coerce'),
+                                pd.to_numeric(stores['latitude'], errors='coerce'),
+                                store_ids=stores['store_id'].to_numpy())
+        self.store_city = stores.drop_duplicates('store_id').set_index('store_id')['city']
+
+        perf = pd.to_numeric(city_perf.set_index('city')['city_avg_revenue'], errors='coerce').dropna()
+        top = perf.max() if len(perf) and perf.max() > 0 else np.nan
+        self.city_match = (perf / top).groupby(level=0).max() if len(perf) else pd.Series(dtype='float64')
+        self.default_match = float(self.city_match.median()) if len(self.city_match) else 0.0
+
+        if city_density is None:
+            city_density = stores.groupby('city').size().rename('store_cnt').reset_index()
+        cnt = pd.to_numeric(city_density.set_index('city')['store_cnt'], errors='coerce').dropna()
+        self.city_cannibal = (cnt / cnt.max()).groupby(level=0).max() if len(cnt) and cnt.max() > 0 \
+            else pd.Series(dtype='float64')
+        self.default_cannibal = float(self.city_cannibal.median()) if len(self.city_cannibal) else 0.0
+
+        self.build_s = time.perf_counter() - start
+        logger.info(f"🗺️ 选址评分器就绪: 门店索引 {len(self.index)} 店（{self.index.method}，缺少坐标 "
+                    f"{self.index.skipped}），{len(self.city_match)} 个城市表现，耗时 {self.build_s * 1000:.1f}ms")
+
+    @classmethod
+    def from_db(cls, database: str = "hotdog2030", **kwargs) -> 'SiteScorer':
+        """从数仓加载门店、城市表现与门店密度"""
+        from .mssql import fetch_df
+        return cls(fetch_df(STORES_SQL, database), fetch_df(CITY_PERF_SQL, database),
+                   fetch_df(CITY_DENSITY_SQL, database), **kwargs)
+
+    def score(self, candidates, start_id: int = 1) -> pd.DataFrame:
+        """一次评分一批候选点，返回输入列 + 坐标、城市、邻近门店指标、各项评分与说明"""
+        df = to_candidate_frame(candidates, start_id)
+        if df.empty:
+            return df.assign(**{col: pd.Series(dtype='float64') for col in SCORE_COLUMNS})
+
+        lng, lat = candidate_coordinates(df)
+        spatial = self.index.score(lng, lat, self.radii_km, self.cannibal_radius_km)
+        df = df.drop(columns=[c for c in spatial.columns if c in df.columns])
+        # 门店ID与门店数为整数，无坐标时为缺失值
+        int_cols = ['nearest_store_id'] + [radius_column(r) for r in self.radii_km]
+        spatial[int_cols] = spatial[int_cols].round().astype('Int64')
+        df = df.join(spatial.set_axis(df.index))
+        df['longitude'], df['latitude'] = lng, lat
+
+        # 城市：附近有门店时取最近门店的城市，其次用输入的 city，最后从地址前两个字粗略提取
+        nearby = df['nearest_km'] <= self.city_match_km
+        city = df['nearest_store_id'].where(nearby).map(self.store_city)
+        if 'city' in df:
+            city = city.fillna(df['city'])
+        if 'address' in df:
+            city = city.fillna(df['address'].astype(str).str.slice(0, 2))
+        df['city'] = city
+
+        df['match_score'] = df['city'].map(self.city_match).fillna(self.default_match).astype(float)
+        fallback = df['city'].map(self.city_cannibal).fillna(self.default_cannibal)
+        df['cannibal_score'] = df['cannibal_score'].fillna(fallback).astype(float)
+        df['total_score'] = MATCH_WEIGHT * df['match_score'] + CANNIBAL_WEIGHT * (1 - df['cannibal_score'])
+
+        far = self.radii_km[-1]
+        note = ("同城历史营收匹配 + 周边门店距离加权蚕食（越稀疏越优）；"
+                + f"{far:g}km 内 " + df[radius_column(far)].fillna(0).astype(int).astype(str) + " 店，最近门店 "
+                + df['nearest_km'].round(2).astype(str) + "km")
+        df['rationale'] = note.where(df['nearest_km'].notna(), "同城历史营收匹配 + 门店密度校正（越稀疏越优）")
+        return df
+
+    def score_stream(self, candidates: Iterable, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+        """流式评分：按 batch_size 个候选点一批产出结果，索引只构建一次"""
+        batch, start_id = [], 1
+        for item in candidates:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield self.score(batch, start_id)
+                start_id += len(batch)
+                batch = []
+        if batch:
+            yield self.score(batch, start_id)
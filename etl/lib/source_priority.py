@@ -0,0 +1,147 @@
+"""
+多源库主键归属
+cyrg2025 与 cyrgweixin 的 id 各自自增、会重叠，而 hotdog2030 的 orders / order_items 只以 id 为主键。
+同一 id 归属于按 SOURCE_PRIORITY 排在最前、且该 id 仍是有效行的源库（与 ultra_fast_sync 一致）：
+- 本源库的有效行：归属本源库时写入，否则跳过（更高优先级的源库占用了该 id）
+- 本源库已删除 / 不再有效的行：若更低优先级的源库有同 id 的有效行，改由该源库的行写入（交接）；
+  所有源库都没有有效行时，把目标表中的该 id 标记为 delflag = 1
+"有效行" 由调用方给出的 live_sql（全量抽取用的、带有效条件的查询）决定
+"""
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import pandas as pd
+
+from .mssql import get_conn, _apply_dtypes
+
+logger = logging.getLogger(__name__)
+
+SOURCE_PRIORITY = ("cyrg2025", "cyrgweixin")
+
+# 按 id 查询时每条 IN 列表的长度
+ID_LOOKUP_BATCH = 1000
+
+
+def _batches(ids: Sequence[int], size: int = ID_LOOKUP_BATCH):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _in_sql(live_sql: str, key: str, n: int, select: str = "*") -> str:
+    return f"SELECT {select} FROM ({live_sql}) q WHERE q.[{key}] IN ({','.join(['%s'] * n)})"
+
+
+def live_ids(database: str, live_sql: str, ids: Iterable[int], key: str = 'id') -> Set[int]:
+    """ids 中在该源库仍为有效行（live_sql 能查到）的 id"""
+    ids = sorted({int(i) for i in ids})
+    found: Set[int] = set()
+    if not ids:
+        return found
+    with get_conn(database) as conn:
+        cursor = conn.cursor()
+        for batch in _batches(ids):
+            cursor.execute(_in_sql(live_sql, key, len(batch), select=f"q.[{key}]"), tuple(batch))
+            found.update(int(row[0]) for row in cursor.fetchall())
+    return found
+
+
+def fetch_live_rows(database: str, live_sql: str, ids: Iterable[int], key: str = 'id',
+                    dtypes: Optional[Dict[str, object]] = None) -> pd.DataFrame:
+    """按 id 从源库读取有效行（交接给该源库的行）"""
+    ids = sorted({int(i) for i in ids})
+    frames = []
+    with get_conn(database) as conn:
+        cursor = conn.cursor()
+        for batch in _batches(ids):
+            cursor.execute(_in_sql(live_sql, key, len(batch)), tuple(batch))
+            columns = [col[0] for col in cursor.description]
+            frames.append(pd.DataFrame.from_records(cursor.fetchall(), columns=columns))
+    if not frames:
+        return pd.DataFrame()
+    return _apply_dtypes(pd.concat(frames, ignore_index=True), dtypes)
+
+
+def resolve_owners(ids: Iterable[int], live_sql: Callable[[str], str], source_db: Optional[str] = None,
+                   own_live: Optional[Set[int]] = None, key: str = 'id') -> Dict[int, Optional[str]]:
+    """每个 id 的归属源库（优先级最高且仍有有效行的源库，都没有时为 None）
+
+    own_live 为 source_db 中已知仍有效的 id（取自抽取结果本身），给出时不再查询 source_db；
+    按优先级逐个源库查询，已确定归属的 id 不再查询后面的源库
+    """
+    pending = {int(i) for i in ids}
+    owners: Dict[int, Optional[str]] = {}
+    for db in SOURCE_PRIORITY:
+        if not pending:
+            break
+        if db == source_db and own_live is not None:
+            hit = pending & own_live
+        else:
+            hit = live_ids(db, live_sql(db), pending, key)
+        owners.update((i, db) for i in hit)
+        pending -= hit
+    owners.update((i, None) for i in pending)
+    return owners
+
+
+def split_by_owner(df: pd.DataFrame, source_db: str, live_sql: Callable[[str], str],
+                   key: str = 'id') -> Tuple[pd.DataFrame, List[int], Dict[str, List[int]]]:
+    """按 id 归属拆分一块抽取结果（df 须含 delflag 列，0 为有效行）
+
+    返回 (归属本源库、应写入的有效行, 应在目标表标记删除的 id, {交接源库: id 列表})
+    """
+    if df.empty:
+        return df, [], {}
+    ids = df[key].dropna().astype('int64')
+    own_live = set(ids[df.loc[ids.index, 'delflag'] == 0].tolist())
+    owners = resolve_owners(ids.tolist(), live_sql, source_db, own_live, key)
+
+    owner = [owners.get(int(i)) if pd.notna(i) else None for i in df[key]]
+    live = (df['delflag'] == 0).tolist()
+    keep = df[[o == source_db and ok for o, ok in zip(owner, live)]].copy()
+    dead = sorted({int(i) for i, o in zip(df[key], owner) if pd.notna(i) and o is None})
+    handover: Dict[str, List[int]] = {}
+    skipped = 0
+    for i, o in zip(df[key], owner):
+        if o is None or o == source_db:
+            continue
+        if SOURCE_PRIORITY.index(o) > SOURCE_PRIORITY.index(source_db):
+            handover.setdefault(o, []).append(int(i))
+        else:
+            skipped += 1
+    if skipped:
+        logger.info(f"🔀 {source_db}: {skipped} 行 id 已被更高优先级源库占用，跳过")
+    if handover:
+        logger.info(f"🔀 {source_db}: {sum(len(v) for v in handover.values())} 行已失效，同 id 改由 "
+                    f"{'/'.join(handover)} 的有效行写入")
+    return keep, dead, handover
+
+
+def flag_deleted(database: str, table: str, ids: Sequence[int], key: str = 'id') -> int:
+    """把目标表中已没有任何源库有效行的 id 标记为 delflag = 1，返回标记行数"""
+    ids = sorted({int(i) for i in ids})
+    flagged = 0
+    if not ids:
+        return flagged
+    with get_conn(database) as conn:
+        cursor = conn.cursor()
+        for batch in _batches(ids):
+            cursor.execute(f"UPDATE [{table}] SET delflag = 1 WHERE delflag <> 1 AND [{key}] IN "
+                           f"({','.join(['%s'] * len(batch))})", tuple(batch))
+            flagged += max(cursor.rowcount, 0)
+        conn.commit()
+    if flagged:
+        logger.info(f"🗑️ {database}.{table}: {flagged} 行在源库已删除或失效，标记 delflag = 1")
+    return flagged
+
+
+def foreign_parent(df: pd.DataFrame, source_db: str, parent_col: str,
+                   parent_live_sql: Callable[[str], str]) -> pd.Series:
+    """标出父键（如明细的 order_id）归属其他源库的行
+
+    明细只以自身 id 判断归属时，低优先级源库的明细会带着与高优先级源库订单相同的 order_id 写入，
+    被错算到别的订单上；父键在所有源库都没有有效行时不视为冲突
+    """
+    parents = df[parent_col].dropna().astype('int64')
+    owners = resolve_owners(parents.tolist(), parent_live_sql)
+    owner = [owners.get(int(i)) if pd.notna(i) else None for i in df[parent_col]]
+    return pd.Series([o is not None and o != source_db for o in owner], index=df.index)
@@ -0,0 +1,203 @@
+"""
+门店空间索引
+经纬度转换为地心三维坐标后建立 KD-tree（scipy 不可用时退回分块暴力计算），球面距离由弦长精确换算：
+- 一次查询得到所有候选点在最大半径内的 (候选点, 门店, 距离) 对，按半径统计邻近门店数
+- 蚕食度按距离衰减加权：单店权重 w = 1 - d/R，合并为 1 - Π(1 - w)，取值 0 ~ 1，紧贴门店时为 1
+位置文本解析规则与 sync_candidate_locations.js 的 parseCoordinates 一致
+"""
+import re
+import logging
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+DEFAULT_RADII_KM = (0.5, 1.0, 3.0)
+DEFAULT_CANNIBAL_RADIUS_KM = 3.0
+
+# 暴力计算时每块候选点数，控制 候选点 × 门店 距离矩阵的内存
+_BRUTE_BLOCK = 2048
+
+_LNG_RE = re.compile(r'(?:lon|lng|经度)\s*:?\s*(-?\d+\.?\d*)', re.I)
+_LAT_RE = re.compile(r'(?:lat|纬度)\s*:?\s*(-?\d+\.?\d*)', re.I)
+_NUM_RE = re.compile(r'(-?\d+\.?\d*)')
+
+
+def _valid(lng: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    # 0,0 是门店表未回填坐标时的默认值，视为无效
+    return (np.isfinite(lng) & np.isfinite(lat) & (np.abs(lng) <= 180) & (np.abs(lat) <= 90)
+            & ~((lng == 0) & (lat == 0)))
+
+
+def finalize_coordinates(lng, lat) -> Tuple[np.ndarray, np.ndarray]:
+    """校验经纬度范围；经纬度写反时交换，仍无效则置为 NaN"""
+    lng, lat = np.asarray(lng, dtype='float64'), np.asarray(lat, dtype='float64')
+    ok = _valid(lng, lat)
+    swap = ~ok & _valid(lat, lng)
+    out_lng = np.where(ok, lng, np.where(swap, lat, np.nan))
+    out_lat = np.where(ok, lat, np.where(swap, lng, np.nan))
+    return out_lng, out_lat
+
+
+def parse_location(location: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """解析位置文本（"lng,lat"、"POINT(lng lat)"、"经度:..;纬度:.."、"lat:..,lng:.." 等）为 (经度, 纬度)"""
+    text = (location.fillna('').astype(str).str.strip()
+            .str.replace(r'POINT\s*\(', '', regex=True, flags=re.I)
+            .str.replace(')', '', regex=False)
+            .str.replace(r'；|;|、|\|', ',', regex=True)
+            .str.replace('：', ':', regex=False))
+
+    # 带标签的写法
+    lng = pd.to_numeric(text.str.extract(_LNG_RE, expand=False), errors='coerce').to_numpy()
+    lat = pd.to_numeric(text.str.extract(_LAT_RE, expand=False), errors='coerce').to_numpy()
+    labeled = ~np.isnan(lng) & ~np.isnan(lat)
+
+    # 无标签时取前两个数字，默认先经度后纬度；第一个数字前出现"lat/纬"时先纬度
+    # 全部文本都不含数字时 unstack 结果没有列，reindex 补出前两列
+    nums = text.str.extractall(_NUM_RE)[0].unstack().reindex(index=text.index, columns=[0, 1])
+    first = pd.to_numeric(nums[0], errors='coerce').to_numpy(dtype='float64')
+    second = pd.to_numeric(nums[1], errors='coerce').to_numpy(dtype='float64')
+    prefix = text.str.extract(r'^([^\d-]*)', expand=False).fillna('').str.lower()
+    lat_first = (prefix.str.contains('lat|纬') & ~prefix.str.contains('lon|lng|经')).to_numpy()
+
+    lng = np.where(labeled, lng, np.where(lat_first, second, first))
+    lat = np.where(labeled, lat, np.where(lat_first, first, second))
+    return finalize_coordinates(lng, lat)
+
+
+def to_xyz(lng, lat) -> np.ndarray:
+    """经纬度 -> 地心三维坐标（km）"""
+    lng, lat = np.radians(np.asarray(lng, dtype='float64')), np.radians(np.asarray(lat, dtype='float64'))
+    cos_lat = np.cos(lat)
+    return EARTH_RADIUS_KM * np.column_stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)])
+
+
+def _chord(km):
+    """球面距离 -> 弦长"""
+    return 2 * EARTH_RADIUS_KM * np.sin(np.asarray(km, dtype='float64') / (2 * EARTH_RADIUS_KM))
+
+
+def _arc(chord):
+    """弦长 -> 球面距离"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / (2 * EARTH_RADIUS_KM), 0, 1))
+
+
+class StoreIndex:
+    """现有门店的空间索引
+
+    - lng/lat:   门店经纬度，无效坐标的门店不进入索引
+    - store_ids: 门店ID，查询结果中的门店下标对应 self.store_ids
+    - weights:   门店蚕食权重（如日均营收占比），默认每店 1
+    """
+
+    def __init__(self, lng, lat, store_ids=None, weights=None):
+        lng, lat = finalize_coordinates(lng, lat)
+        ok = ~np.isnan(lng)
+        n = len(ok)
+        self.store_ids = np.asarray(store_ids if store_ids is not None else np.arange(n))[ok]
+        self.weights = np.ones(ok.sum()) if weights is None else np.asarray(weights, dtype='float64')[ok]
+        self.lng, self.lat = lng[ok], lat[ok]
+        self.xyz = to_xyz(self.lng, self.lat)
+        self.skipped = int(n - ok.sum())
+        try:
+            from scipy.spatial import cKDTree
+            self.tree = cKDTree(self.xyz) if len(self.xyz) else None
+            self.method = 'kdtree'
+        except ImportError:
+            self.tree = None
+            self.method = 'brute'
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def pairs_within(self, xyz: np.ndarray, radius_km: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """所有 (候选点下标, 门店下标, 球面距离km) 中距离不超过 radius_km 的对"""
+        empty = (np.empty(0, dtype='int64'), np.empty(0, dtype='int64'), np.empty(0))
+        if len(self) == 0 or len(xyz) == 0:
+            return empty
+        chord = float(_chord(radius_km))
+        if self.tree is not None:
+            from scipy.spatial import cKDTree
+            pairs = cKDTree(xyz).sparse_distance_matrix(self.tree, chord, output_type='ndarray')
+            return pairs['i'].astype('int64'), pairs['j'].astype('int64'), _arc(pairs['v'])
+
+        parts = []
+        for start in range(0, len(xyz), _BRUTE_BLOCK):
+            block = xyz[start:start + _BRUTE_BLOCK]
+            d2 = ((block[:, None, :] - self.xyz[None, :, :]) ** 2).sum(axis=2)
+            i, j = np.nonzero(d2 <= chord * chord)
+            parts.append((i + start, j, _arc(np.sqrt(d2[i, j]))))
+        if not parts:
+            return empty
+        return tuple(np.concatenate(p) for p in zip(*parts))
+
+    def nearest(self, xyz: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """每个候选点最近门店的 (球面距离km, 门店下标)；索引为空时距离为 inf、下标为 -1"""
+        if len(self) == 0:
+            return np.full(len(xyz), np.inf), np.full(len(xyz), -1)
+        if self.tree is not None:
+            chord, idx = self.tree.query(xyz, k=1)
+            return _arc(chord), idx.astype('int64')
+        dist, idx = np.empty(len(xyz)), np.empty(len(xyz), dtype='int64')
+        for start in range(0, len(xyz), _BRUTE_BLOCK):
+            block = xyz[start:start + _BRUTE_BLOCK]
+            d2 = ((block[:, None, :] - self.xyz[None, :, :]) ** 2).sum(axis=2)
+            idx[start:start + len(block)] = d2.argmin(axis=1)
+            dist[start:start + len(block)] = _arc(np.sqrt(d2.min(axis=1)))
+        return dist, idx
+
+    def score(self, lng, lat, radii_km: Sequence[float] = DEFAULT_RADII_KM,
+              cannibal_radius_km: float = DEFAULT_CANNIBAL_RADIUS_KM) -> pd.DataFrame:
+        """批量计算候选点的空间指标，一次半径查询覆盖所有半径
+
+        输出列: nearest_store_id, nearest_km, stores_within_{r}km..., cannibal_score（坐标无效的候选点为 NaN）
+        """
+        lng, lat = finalize_coordinates(lng, lat)
+        ok = ~np.isnan(lng)
+        n = len(ok)
+        xyz = to_xyz(lng[ok], lat[ok])
+        out = pd.DataFrame(index=np.arange(n))
+
+        dist, idx = self.nearest(xyz)
+        nearest_id, nearest_km = np.full(n, np.nan), np.full(n, np.nan)
+        if len(self):
+            nearest_id[ok] = self.store_ids[idx]
+            nearest_km[ok] = dist
+        out['nearest_store_id'] = nearest_id
+        out['nearest_km'] = nearest_km
+
+        max_radius = max(list(radii_km) + [cannibal_radius_km])
+        i, j, d = self.pairs_within(xyz, max_radius)
+        rows = np.flatnonzero(ok)
+        for r in radii_km:
+            counts = np.full(n, np.nan)
+            counts[ok] = np.bincount(i[d <= r], minlength=len(xyz))
+            out[radius_column(r)] = counts
+
+        # 1 - Π(1 - w_i)，对数求和避免逐候选点循环；w=1（同一位置）截断避免 log(0)
+        near = d <= cannibal_radius_km
+        w = np.clip((1 - d[near] / cannibal_radius_km) * self.weights[j[near]], 0, 1 - 1e-12)
+        log_keep = np.bincount(i[near], weights=np.log1p(-w), minlength=len(xyz))
+        cannibal = np.full(n, np.nan)
+        cannibal[rows] = 1 - np.exp(log_keep)
+        out['cannibal_score'] = cannibal
+        return out
+
+
+def radius_column(radius_km: float) -> str:
+    return f"stores_within_{radius_km:g}km"
+
+
+def parse_radii(text: Optional[str], default: Sequence[float] = DEFAULT_RADII_KM) -> Tuple[float, ...]:
+    """"0.5,1,3" -> (0.5, 1.0, 3.0)"""
+    if not text:
+        return tuple(default)
+    radii = tuple(sorted(float(r) for r in text.split(',') if r.strip()))
+    if not radii or min(radii) <= 0:
+        raise ValueError(f"半径需为正数: {text}")
+    return radii
+
@@ -0,0 +1,264 @@
+"""
+流水线同步
+读取、转换、写入三段并行，段间经有界队列传递数据块：
+- 每个源库一个读取线程，用独立连接 fetchmany 按块读取，多个源库并发读取
+- 若干转换线程把源行规范化为目标行元组
+- 调用线程作为唯一写入者（SyncWriter 逐块提交），主键去重与顺序编号都在写入线程完成，无需加锁
+写入顺序是确定的：按 sources 的排列顺序（即优先级）逐个源库写入，同一源库内按读取顺序写入，
+因此多源同键时总是保留排在前面的源库的行（与逐源批量同步一致），顺序编号也不随线程调度变化；
+排在后面的源库可与前面的源库并发读取，但最多预读 gate 个数据块，等前面的源库写完后再写入
+队列满时上游阻塞等待（背压），内存峰值约为 (读取队列 + 写入队列 + 在途 + 各后续源库预读) 个数据块，
+端到端耗时趋近于读取与写入中较慢的一段；任一线程出错时通知其余线程停止并在调用线程重新抛出
+"""
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 5000
+DEFAULT_QUEUE_CHUNKS = 4
+DEFAULT_TRANSFORM_WORKERS = 2
+
+_DONE = object()
+
+# 阻塞的 put/get 每隔该秒数检查一次停止信号
+_POLL_S = 0.2
+
+
+@dataclass
+class SyncSource:
+    """一个源库查询：connect() 返回新连接，读取完成后由读取线程关闭"""
+    name: str
+    connect: Callable[[], Any]
+    sql: str
+    params: Optional[tuple] = None
+
+
+class _Stopped(Exception):
+    pass
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> float:
+    """放入队列，返回因队列满而等待的秒数；收到停止信号时抛出 _Stopped"""
+    start = time.perf_counter()
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            q.put(item, timeout=_POLL_S)
+            return time.perf_counter() - start
+        except queue.Full:
+            continue
+
+
+def _acquire(gate: threading.Semaphore, stop: threading.Event):
+    while not gate.acquire(timeout=_POLL_S):
+        if stop.is_set():
+            raise _Stopped()
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            return q.get(timeout=_POLL_S)
+        except queue.Empty:
+            continue
+
+
+class SyncPipeline:
+    """多源并发读取 -> 并行转换 -> 单写入者提交"""
+
+    def __init__(self, sources: Sequence[SyncSource], transform: Callable[[List[Tuple]], List[Tuple]], writer,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, queue_chunks: int = DEFAULT_QUEUE_CHUNKS,
+                 transform_workers: int = DEFAULT_TRANSFORM_WORKERS,
+                 dedup_key: Optional[Callable[[Tuple], Any]] = None, assign_ids: bool = False,
+                 label: str = "同步"):
+        """
+        - writer:      具有 write(rows) -> int 方法的写入器（通常为 SyncWriter），每次调用提交一个数据块
+        - sources:     排列顺序即优先级
+        - dedup_key:   写入线程按该键跳过重复行（多源同键时保留排在前面的源库的行，同一源库内保留先读到的行）
+        - assign_ids:  写入线程把每行第一列替换为从 1 开始的连续编号
+        """
+        self.sources = list(sources)
+        self.transform = transform
+        self.writer = writer
+        self.chunk_rows = max(1, chunk_rows)
+        self.transform_workers = max(1, transform_workers)
+        self.dedup_key = dedup_key
+        self.assign_ids = assign_ids
+        self.label = label
+        self.raw_q = queue.Queue(maxsize=max(1, queue_chunks))
+        self.out_q = queue.Queue(maxsize=max(1, queue_chunks))
+        self.stop = threading.Event()
+        # 每个源库已读出、尚未写入的数据块上限；后续源库的块在前面的源库写完前暂存在写入线程
+        self.gate_chunks = 2 * max(1, queue_chunks) + self.transform_workers
+        self._gates = [threading.Semaphore(self.gate_chunks) for _ in self.sources]
+        self._emitted = [0] * len(self.sources)
+        self._read_done = [threading.Event() for _ in self.sources]
+        self.stats = {
+            'read_rows': {s.name: 0 for s in self.sources},
+            'read_seconds': {s.name: 0.0 for s in self.sources},
+            'read_blocked_seconds': 0.0,
+            'transform_seconds': 0.0,
+            'write_seconds': 0.0,
+            'write_idle_seconds': 0.0,
+            'written': 0,
+            'duplicates': 0,
+            'chunks': 0,
+            'max_out_queue': 0,
+        }
+        self._lock = threading.Lock()
+
+    def _read(self, rank: int, source: SyncSource):
+        conn = None
+        busy, blocked = 0.0, 0.0
+        try:
+            start = time.perf_counter()
+            conn = source.connect()
+            cursor = conn.cursor()
+            cursor.execute(source.sql, source.params)
+            while True:
+                rows = cursor.fetchmany(self.chunk_rows)
+                if not rows:
+                    break
+                self.stats['read_rows'][source.name] += len(rows)
+                wait_start = time.perf_counter()
+                _acquire(self._gates[rank], self.stop)
+                blocked += time.perf_counter() - wait_start
+                blocked += _put(self.raw_q, (rank, self._emitted[rank], rows), self.stop)
+                self._emitted[rank] += 1
+            self._read_done[rank].set()
+            # 通知写入线程本源库已读完：最后一块可能早已写出，否则写入线程不会再被唤醒去切换到下一个源库
+            _put(self.out_q, (rank, None, None), self.stop)
+            busy = time.perf_counter() - start - blocked
+            logger.info(f"📥 {self.label}: {source.name} 读取完成 {self.stats['read_rows'][source.name]} 行，"
+                        f"读取耗时 {busy:.2f}s（背压等待 {blocked:.2f}s）")
+        except _Stopped:
+            pass
+        except Exception:
+            self.stop.set()
+            raise
+        finally:
+            self.stats['read_seconds'][source.name] = busy
+            with self._lock:
+                self.stats['read_blocked_seconds'] += blocked
+            if conn is not None:
+                conn.close()
+
+    def _transform_loop(self):
+        try:
+            while True:
+                item = _get(self.raw_q, self.stop)
+                if item is _DONE:
+                    break
+                rank, seq, rows = item
+                start = time.perf_counter()
+                out = self.transform(rows)
+                with self._lock:
+                    self.stats['transform_seconds'] += time.perf_counter() - start
+                _put(self.out_q, (rank, seq, out), self.stop)
+            _put(self.out_q, _DONE, self.stop)
+        except _Stopped:
+            pass
+        except Exception:
+            self.stop.set()
+            raise
+
+    def _close_readers(self, readers):
+        """全部读取线程结束后给每个转换线程发送结束标记"""
+        wait(readers)
+        try:
+            for _ in range(self.transform_workers):
+                _put(self.raw_q, _DONE, self.stop)
+        except _Stopped:
+            pass
+
+    def _prepare(self, rows: List[Tuple], seen: set) -> List[Tuple]:
+        if self.dedup_key is not None:
+            kept = []
+            for row in rows:
+                key = self.dedup_key(row)
+                if key in seen:
+                    self.stats['duplicates'] += 1
+                    continue
+                seen.add(key)
+                kept.append(row)
+            rows = kept
+        if self.assign_ids:
+            first = self.stats['written'] + 1
+            rows = [(first + i,) + tuple(row[1:]) for i, row in enumerate(rows)]
+        return rows
+
+    def _write(self, rows: List[Tuple], seen: set):
+        rows = self._prepare(rows, seen)
+        if not rows:
+            return
+        start = time.perf_counter()
+        self.stats['written'] += self.writer.write(rows)
+        self.stats['write_seconds'] += time.perf_counter() - start
+        self.stats['chunks'] += 1
+
+    def _drain(self, pending: Dict[Tuple[int, int], List[Tuple]], position: List[int], seen: set):
+        """按 (源库顺序, 块序号) 写出所有已就绪的块；当前源库读完且全部写出后转到下一个源库"""
+        while position[0] < len(self.sources):
+            rank, seq = position
+            if (rank, seq) in pending:
+                self._write(pending.pop((rank, seq)), seen)
+                self._gates[rank].release()
+                position[1] += 1
+            elif self._read_done[rank].is_set() and seq == self._emitted[rank]:
+                position[0], position[1] = rank + 1, 0
+            else:
+                return
+
+    def run(self) -> Dict[str, Any]:
+        """运行流水线直到所有源读完并写入，返回各段统计"""
+        started = time.perf_counter()
+        n_threads = len(self.sources) + self.transform_workers + 1
+        seen = set()
+        pending: Dict[Tuple[int, int], List[Tuple]] = {}
+        position = [0, 0]
+        with ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix='sync') as pool:
+            readers = [pool.submit(self._read, rank, s) for rank, s in enumerate(self.sources)]
+            workers = [pool.submit(self._transform_loop) for _ in range(self.transform_workers)]
+            closer = pool.submit(self._close_readers, readers)
+            try:
+                finished = 0
+                while finished < self.transform_workers:
+                    idle_start = time.perf_counter()
+                    self.stats['max_out_queue'] = max(self.stats['max_out_queue'], self.out_q.qsize())
+                    item = _get(self.out_q, self.stop)
+                    self.stats['write_idle_seconds'] += time.perf_counter() - idle_start
+                    if item is _DONE:
+                        finished += 1
+                        continue
+                    rank, seq, rows = item
+                    if seq is not None:
+                        pending[rank, seq] = rows
+                    self._drain(pending, position, seen)
+                # 全部转换线程结束时所有读取线程均已结束，写出剩余的块
+                self._drain(pending, position, seen)
+            except _Stopped:
+                pass
+            except BaseException:
+                self.stop.set()
+                raise
+            finally:
+                wait(readers + workers + [closer])
+            # 读取或转换线程的异常在调用线程重新抛出
+            for future in readers + workers:
+                future.result()
+
+        self.stats['seconds'] = time.perf_counter() - started
+        read_s = max(self.stats['read_seconds'].values(), default=0.0)
+        logger.info(f"🚰 {self.label}: 流水线写入 {self.stats['written']} 行（跳过重复 {self.stats['duplicates']}），"
+                    f"端到端 {self.stats['seconds']:.2f}s，最慢读取 {read_s:.2f}s，"
+                    f"写入 {self.stats['write_seconds']:.2f}s，写入等待 {self.stats['write_idle_seconds']:.2f}s")
+        return self.stats
@@ -0,0 +1,83 @@
+"""
+同步工具共享的批量写入器
+ultra_fast_sync 等整表同步脚本把源库行映射为元组后交给 SyncWriter 写入目标表：
+- prepared（默认）: sp_executesql 参数化多行 INSERT，满批语句文本固定，SQL Server 复用同一执行计划
+- multirow / executemany: 客户端参数化（值经驱动转义，引号不会破坏语句）
+- bcp: TDS 批量复制
+按 commit_rows 行提交一次，逐批与汇总记录每张表的写入速度（条/秒）
+pymssql 不支持表值参数（TVP），参数化批次即为该驱动下可复用计划的写法
+"""
+import os
+import time
+import logging
+from typing import Dict, Optional, Sequence, Tuple
+
+from .bulk import (STRATEGIES, write_executemany, write_multirow, write_prepared, write_bulk_copy,
+                   table_param_types)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYNC_METHOD = 'prepared'
+
+# 每次提交的行数：过小时提交开销占比高，过大时单个事务日志占用多
+DEFAULT_COMMIT_ROWS = 20000
+
+
+class SyncWriter:
+    """一张目标表的批量写入器，连接由调用方管理"""
+
+    def __init__(self, conn, table: str, columns: Sequence[str], method: Optional[str] = None,
+                 commit_rows: Optional[int] = None, label: Optional[str] = None):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        self.method = method or os.getenv('ETL_SYNC_METHOD', DEFAULT_SYNC_METHOD)
+        if self.method not in STRATEGIES:
+            raise ValueError(f"未知写入策略: {self.method}，可选: {', '.join(STRATEGIES)}")
+        self.commit_rows = commit_rows or int(os.getenv('ETL_SYNC_COMMIT_ROWS', DEFAULT_COMMIT_ROWS))
+        self.label = label or table
+        self.cursor = conn.cursor()
+        # 参数类型只查询一次，各批次共用
+        self.param_types = table_param_types(self.cursor, table, self.columns) if self.method == 'prepared' else None
+        self.rows = 0
+        self.seconds = 0.0
+
+    def _write(self, rows: Sequence[Tuple]) -> int:
+        if self.method == 'bcp':
+            return write_bulk_copy(self.conn, self.table, self.columns, rows, chunksize=self.commit_rows)
+        if self.method == 'prepared':
+            return write_prepared(self.cursor, self.table, self.columns, rows, param_types=self.param_types)
+        if self.method == 'executemany':
+            return write_executemany(self.cursor, self.table, self.columns, rows)
+        return write_multirow(self.cursor, self.table, self.columns, rows)
+
+    def write(self, rows: Sequence[Tuple], total: Optional[int] = None) -> int:
+        """写入行元组（顺序与 columns 一致），每 commit_rows 行提交一次，返回写入行数
+
+        total 为本表预期总行数，仅用于进度日志；流水线逐块写入时总数未知可不传
+        """
+        inserted = 0
+        for start in range(0, len(rows), self.commit_rows):
+            batch = rows[start:start + self.commit_rows]
+            batch_start = time.perf_counter()
+            inserted += self._write(batch)
+            self.conn.commit()
+            elapsed = time.perf_counter() - batch_start
+            self.seconds += elapsed
+            speed = len(batch) / elapsed if elapsed > 0 else 0
+            progress = f"{self.rows + inserted}/{total}" if total else f"{self.rows + inserted}"
+            logger.info(f"📦 {self.label}: 已写入 {progress} 条 (速度: {speed:.0f} 条/秒)")
+        self.rows += inserted
+        return inserted
+
+    def stats(self) -> Dict[str, object]:
+        """累计写入行数、写入耗时与速度"""
+        speed = self.rows / self.seconds if self.seconds > 0 else 0.0
+        return {'table': self.table, 'method': self.method, 'rows': self.rows,
+                'seconds': round(self.seconds, 3), 'rows_per_s': round(speed, 1)}
+
+    def log_summary(self) -> Dict[str, object]:
+        stats = self.stats()
+        logger.info(f"🚀 {self.label} 写入 {stats['rows']} 条，策略 {stats['method']}，"
+                    f"写入耗时 {stats['seconds']:.2f} 秒，速度 {stats['rows_per_s']:.0f} 条/秒")
+        return stats
@@ -0,0 +1,103 @@
+"""
+ETL水位线存储
+按 源数据库 + 源表 记录上次抽取到的最大变更时间与最大主键，
+供增量抽取只拉取新增或变更的数据
+"""
+import os
+import datetime as dt
+import logging
+from typing import Optional, Tuple
+
+from .mssql import get_conn
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_DB = "hotdog2030"
+WATERMARK_TABLE = "etl_watermark"
+
+# 回看窗口：变更时间水位线向前回退的分钟数，覆盖源端延迟提交的数据（MERGE 保证幂等）
+LOOKBACK_MINUTES = int(os.getenv('ETL_WATERMARK_LOOKBACK_MINUTES', '10'))
+
+_DDL = f"""
+IF OBJECT_ID('dbo.{WATERMARK_TABLE}','U') IS NULL
+CREATE TABLE dbo.{WATERMARK_TABLE} (
+  source_db    nvarchar(50)  NOT NULL,
+  source_table nvarchar(100) NOT NULL,
+  last_ts      datetime2     NULL,
+  last_id      bigint        NULL,
+  rows_loaded  bigint        NULL,
+  updated_at   datetime2     DEFAULT (sysutcdatetime()),
+  PRIMARY KEY (source_db, source_table)
+);
+"""
+
+_table_ready = False
+
+
+def ensure_watermark_table():
+    """首次使用时创建水位线表"""
+    global _table_ready
+    if _table_ready:
+        return
+    with get_conn(WATERMARK_DB) as conn:
+        cursor = conn.cursor()
+        cursor.execute(_DDL)
+        conn.commit()
+    _table_ready = True
+
+
+def get_watermark(source_db: str, source_table: str) -> Tuple[Optional[dt.datetime], Optional[int]]:
+    """读取水位线，返回 (last_ts, last_id)；从未抽取过时返回 (None, None)"""
+    ensure_watermark_table()
+    with get_conn(WATERMARK_DB) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT last_ts, last_id FROM dbo.{WATERMARK_TABLE} WHERE source_db=%s AND source_table=%s",
+            (source_db, source_table)
+        )
+        row = cursor.fetchone()
+    if not row:
+        return None, None
+    return row[0], row[1]
+
+
+def lookback(last_ts: Optional[dt.datetime]) -> Optional[dt.datetime]:
+    """应用回看窗口后的变更时间下界"""
+    if last_ts is None:
+        return None
+    return last_ts - dt.timedelta(minutes=LOOKBACK_MINUTES)
+
+
+def set_watermark(source_db: str, source_table: str, last_ts: Optional[dt.datetime],
+                  last_id: Optional[int], rows_loaded: int = 0):
+    """推进水位线（只前进不后退）"""
+    ensure_watermark_table()
+    with get_conn(WATERMARK_DB) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+MERGE dbo.{WATERMARK_TABLE} AS T
+USING (SELECT %s AS source_db, %s AS source_table) AS S
+ON (T.source_db = S.source_db AND T.source_table = S.source_table)
+WHEN MATCHED THEN UPDATE SET
+  last_ts = CASE WHEN T.last_ts IS NULL OR %s > T.last_ts THEN %s ELSE T.last_ts END,
+  last_id = CASE WHEN T.last_id IS NULL OR %s > T.last_id THEN %s ELSE T.last_id END,
+  rows_loaded = %s,
+  updated_at = sysutcdatetime()
+WHEN NOT MATCHED THEN INSERT (source_db, source_table, last_ts, last_id, rows_loaded)
+VALUES (S.source_db, S.source_table, %s, %s, %s);
+""", (source_db, source_table, last_ts, last_ts, last_id, last_id, rows_loaded,
+              last_ts, last_id, rows_loaded))
+        conn.commit()
+    logger.info(f"📌 水位线已更新: {source_db}.{source_table} -> ts={last_ts}, id={last_id}")
+
+
+def reset_watermark(source_db: str, source_table: str):
+    """清除水位线，下次运行将全量抽取"""
+    ensure_watermark_table()
+    with get_conn(WATERMARK_DB) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"DELETE FROM dbo.{WATERMARK_TABLE} WHERE source_db=%s AND source_table=%s",
+            (source_db, source_table)
+        )
+        conn.commit()
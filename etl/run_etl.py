@@ -1,104 +1,405 @@
 """
 ETL主执行脚本
-按顺序执行所有ETL步骤
+按步骤依赖关系（DAG）调度所有ETL步骤，无依赖关系的步骤并行执行
+
+用法:
+    python etl/run_etl.py                 # 默认并行度 ETL_WORKERS（默认4）
+    python etl/run_etl.py --workers 1     # 串行执行
+    python etl/run_etl.py --steps 1 2 6   # 只执行指定步骤（未选中的上游步骤视为已完成）
+    python etl/run_etl.py --mode inprocess --startup-report
+                                          # 在同一进程内执行步骤并报告节省的启动开销
 """
 import sys
 import os
+import argparse
+import importlib.util
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def run_etl_step(step_number, step_name):
-    """运行单个ETL步骤"""
+# 并行执行的步骤数
+DEFAULT_WORKERS = int(os.getenv('ETL_WORKERS', '4'))
+
+# 默认单步超时（秒），可用 ETL_STEP_TIMEOUT_<步骤号> 单独覆盖，如 ETL_STEP_TIMEOUT_08=3600
+DEFAULT_STEP_TIMEOUT = int(os.getenv('ETL_STEP_TIMEOUT', '300'))
+
+# ETL步骤列表: (步骤号, 名称, 描述, 依赖步骤, 超时秒数)
+ETL_STEPS = [
+    (1, "extract_orders", "订单数据提取", (), DEFAULT_STEP_TIMEOUT),
+    (2, "extract_order_items", "订单明细提取", (1,), DEFAULT_STEP_TIMEOUT),
+    (3, "extract_stores", "门店信息提取", (), DEFAULT_STEP_TIMEOUT),
+    (4, "extract_products", "商品信息提取", (), DEFAULT_STEP_TIMEOUT),
+    (5, "extract_customers", "客户信息提取", (), DEFAULT_STEP_TIMEOUT),
+    (6, "profit_analysis", "利润分析", (1, 2, 4), DEFAULT_STEP_TIMEOUT),
+    (7, "customer_segmentation", "客户细分分析", (1,), DEFAULT_STEP_TIMEOUT),
+    (8, "forecast_sales", "销售预测", (1, 2), max(DEFAULT_STEP_TIMEOUT, 1800)),
+    (9, "site_selection", "智能选址分析", (1, 2, 3, 11), DEFAULT_STEP_TIMEOUT),
+    (10, "dashboard_metrics", "仪表板指标聚合", (1, 3, 5), DEFAULT_STEP_TIMEOUT),
+    (11, "perf_cube", "区域业绩立方体", (1, 3), DEFAULT_STEP_TIMEOUT),
+]
+
+# 步骤执行方式: subprocess 每步独立解释器（隔离）；inprocess 同一进程内调用 main()（共享已加载的库与连接池）
+STEP_MODES = ('subprocess', 'inprocess')
+DEFAULT_STEP_MODE = os.getenv('ETL_STEP_MODE', 'subprocess')
+
+# 步骤状态
+SUCCESS = 'success'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+SKIPPED = 'skipped'
+
+def step_timeout(step_number, default):
+    """读取单步超时配置"""
+    return int(os.getenv(f'ETL_STEP_TIMEOUT_{step_number:02d}', default))
+
+def run_etl_step(step_number, step_name, timeout=DEFAULT_STEP_TIMEOUT):
+    """运行单个ETL步骤，返回步骤状态"""
     logger.info(f"🚀 开始执行ETL步骤{step_number}: {step_name}")
     
-    script_path = Path(__file__).parent / "steps" / f"{step_number:02d}_{step_name}.py"
+    script_path = step_script_path(step_number, step_name)
     
     if not script_path.exists():
         logger.error(f"❌ 脚本文件不存在: {script_path}")
-        return False
+        return FAILED
     
     try:
         # 执行脚本
-        result = subprocess.run([sys.executable, str(script_path)], 
-                              capture_output=True, text=True, timeout=300)
+        result = subprocess.run([sys.executable, str(script_path)],
+                              capture_output=True, text=True, timeout=timeout)
         
         if result.returncode == 0:
             logger.info(f"✅ ETL步骤{step_number}执行成功")
             if result.stdout:
                 logger.info(f"输出: {result.stdout}")
-            return True
+            return SUCCESS
         else:
             logger.error(f"❌ ETL步骤{step_number}执行失败")
             if result.stderr:
                 logger.error(f"错误: {result.stderr}")
-            return False
-            
+            return FAILED
+    
     except subprocess.TimeoutExpired:
-        logger.error(f"❌ ETL步骤{step_number}执行超时")
-        return False
+        logger.error(f"❌ ETL步骤{step_number}执行超时（{timeout} 秒）")
+        return TIMEOUT
     except Exception as e:
         logger.error(f"❌ ETL步骤{step_number}执行异常: {str(e)}")
-        return False
+        return FAILED
+
+def step_script_path(step_number, step_name):
+    return Path(__file__).parent / "steps" / f"{step_number:02d}_{step_name}.py"
+
+# 进程内已加载的步骤模块与加载耗时
+_step_modules = {}
+_step_load_times = {}
+_step_modules_lock = threading.Lock()
+
+def load_step_module(step_number, step_name):
+    """按文件路径导入步骤模块（不触发 __main__ 分支），同一进程内只加载一次"""
+    with _step_modules_lock:
+        module = _step_modules.get(step_number)
+        if module is not None:
+            return module
+        
+        script_path = step_script_path(step_number, step_name)
+        start = time.perf_counter()
+        spec = importlib.util.spec_from_file_location(f"etl_step_{step_number:02d}", script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _step_load_times[step_number] = time.perf_counter() - start
+        _step_modules[step_number] = module
+        return module
+
+def run_etl_step_inprocess(step_number, step_name, timeout=DEFAULT_STEP_TIMEOUT):
+    """在当前进程内运行单个ETL步骤，返回步骤状态
+    
+    Python 线程无法被强制终止：超时的步骤会被标记为 timeout，但会在后台继续运行直到结束
+    """
+    logger.info(f"🚀 开始执行ETL步骤{step_number}（进程内）: {step_name}")
+    
+    script_path = step_script_path(step_number, step_name)
+    if not script_path.exists():
+        logger.error(f"❌ 脚本文件不存在: {script_path}")
+        return FAILED
+    
+    outcome = {}
+    
+    def target():
+        try:
+            module = load_step_module(step_number, step_name)
+            module.main()
+            outcome['status'] = SUCCESS
+        except SystemExit as e:
+            outcome['status'] = SUCCESS if e.code in (None, 0) else FAILED
+        except Exception as e:
+            logger.error(f"❌ ETL步骤{step_number}执行异常: {str(e)}")
+            outcome['status'] = FAILED
+    
+    worker = threading.Thread(target=target, name=f"etl-step-{step_number:02d}", daemon=True)
+    worker.start()
+    worker.join(timeout)
+    
+    if worker.is_alive():
+        logger.error(f"❌ ETL步骤{step_number}执行超时（{timeout} 秒），该步骤仍在后台运行")
+        return TIMEOUT
+    
+    status = outcome.get('status', FAILED)
+    if status == SUCCESS:
+        logger.info(f"✅ ETL步骤{step_number}执行成功")
+    else:
+        logger.error(f"❌ ETL步骤{step_number}执行失败")
+    return status
+
+STEP_RUNNERS = {
+    'subprocess': run_etl_step,
+    'inprocess': run_etl_step_inprocess,
+}
+
+# 子进程中只导入步骤模块、不执行 main()，用于测量每步的解释器启动 + 导入开销
+_STARTUP_PROBE = (
+    "import importlib.util, sys; "
+    "spec = importlib.util.spec_from_file_location('etl_step_probe', sys.argv[1]); "
+    "spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+)
+
+def probe_subprocess_startup(step_number, step_name):
+    """测量独立子进程执行该步骤前的启动开销（秒），失败时返回 None"""
+    start = time.perf_counter()
+    try:
+        result = subprocess.run([sys.executable, "-c", _STARTUP_PROBE, str(step_script_path(step_number, step_name))],
+                                capture_output=True, text=True, timeout=120)
+    except Exception:
+        return None
+    if result.returncode != 0:
+        return None
+    return time.perf_counter() - start
+
+def startup_report(steps, results):
+    """对比每步子进程启动开销与进程内加载开销"""
+    logger.info("🚦 启动开销对比（子进程启动+导入 vs 进程内加载）:")
+    total_saved = 0.0
+    for number, name, desc, _, _ in steps:
+        if results.get(number, {}).get('status') == SKIPPED:
+            continue
+        subprocess_cost = probe_subprocess_startup(number, name)
+        if number not in _step_load_times:
+            try:
+                load_step_module(number, name)
+            except Exception as e:
+                logger.warning(f"⚠️ 步骤{number}模块加载失败: {str(e)}")
+                continue
+        inprocess_cost = _step_load_times[number]
+        if subprocess_cost is None:
+            logger.info(f"   - 步骤{number:>2} {desc:<10} 子进程 -        进程内 {inprocess_cost:6.3f}s")
+            continue
+        saved = subprocess_cost - inprocess_cost
+        total_saved += saved
+        logger.info(f"   - 步骤{number:>2} {desc:<10} 子进程 {subprocess_cost:6.3f}s  "
+                    f"进程内 {inprocess_cost:6.3f}s  节省 {saved:6.3f}s")
+    logger.info(f"   - 合计节省启动开销: {total_saved:.2f} 秒")
+
+def log_connection_reuse():
+    """进程内模式下输出共享连接池的复用情况"""
+    try:
+        from lib.mssql import log_pool_stats
+    except Exception:
+        return
+    log_pool_stats()
+
+def validate_dag(steps):
+    """检查依赖是否存在且无环"""
+    numbers = {s[0] for s in steps}
+    for number, _, _, deps, _ in steps:
+        unknown = [d for d in deps if d not in numbers]
+        if unknown:
+            raise ValueError(f"步骤{number}依赖未知步骤: {unknown}")
+    
+    deps_of = {s[0]: set(s[3]) for s in steps}
+    visited, visiting = set(), set()
+    
+    def visit(number):
+        if number in visited:
+            return
+        if number in visiting:
+            raise ValueError(f"步骤依赖存在环: 步骤{number}")
+        visiting.add(number)
+        for dep in deps_of[number]:
+            visit(dep)
+        visiting.discard(number)
+        visited.add(number)
+    
+    for number in deps_of:
+        visit(number)
+
+def select_steps(steps, only=None):
+    """按步骤号筛选；未选中的上游步骤视为已完成，不参与调度"""
+    if not only:
+        return list(steps)
+    only = set(only)
+    selected = []
+    for number, name, desc, deps, timeout in steps:
+        if number in only:
+            selected.append((number, name, desc, tuple(d for d in deps if d in only), timeout))
+    return selected
+
+def _timed(runner, step_number, step_name, timeout):
+    """在工作线程内计时，排队等待时间不计入步骤耗时"""
+    start = time.perf_counter()
+    status = runner(step_number, step_name, timeout)
+    return status, start, time.perf_counter()
+
+def run_dag(steps, workers=DEFAULT_WORKERS, runner=run_etl_step):
+    """按依赖关系调度步骤
+    
+    上游步骤全部成功后才提交下游步骤；上游失败/超时/跳过时下游直接标记为跳过。
+    返回 {步骤号: {'status', 'start', 'end'}}（start/end 为 time.perf_counter 时间）
+    """
+    validate_dag(steps)
+    by_number = {s[0]: s for s in steps}
+    pending = {s[0]: set(s[3]) for s in steps}
+    results = {}
+    
+    def propagate_skips():
+        changed = True
+        while changed:
+            changed = False
+            for number, deps in list(pending.items()):
+                bad = [d for d in deps if d in results and results[d]['status'] != SUCCESS]
+                if bad:
+                    del pending[number]
+                    now = time.perf_counter()
+                    results[number] = {'status': SKIPPED, 'start': now, 'end': now}
+                    logger.warning(f"⏭️ 跳过步骤{number}: 上游步骤 {bad} 未成功")
+                    changed = True
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        running = {}
+        while pending or running:
+            # 提交所有依赖已满足的步骤
+            ready = sorted(n for n, deps in pending.items()
+                           if all(d in results and results[d]['status'] == SUCCESS for d in deps))
+            for number in ready:
+                del pending[number]
+                _, name, desc, _, timeout = by_number[number]
+                logger.info(f"📋 提交步骤 {number}/{len(steps)}: {desc}")
+                future = pool.submit(_timed, runner, number, name, step_timeout(number, timeout))
+                running[future] = number
+            
+            if not running:
+                break
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                number = running.pop(future)
+                try:
+                    status, start, end = future.result()
+                except Exception as e:
+                    logger.error(f"❌ ETL步骤{number}调度异常: {str(e)}")
+                    status, start, end = FAILED, time.perf_counter(), time.perf_counter()
+                results[number] = {'status': status, 'start': start, 'end': end}
+                if status != SUCCESS:
+                    logger.warning(f"⚠️ 步骤{number}{'超时' if status == TIMEOUT else '失败'}，下游步骤将被跳过")
+            propagate_skips()
+    
+    # 依赖无法满足的剩余步骤（理论上不会出现）
+    for number in pending:
+        now = time.perf_counter()
+        results[number] = {'status': SKIPPED, 'start': now, 'end': now}
+    return results
+
+def critical_path(steps, results):
+    """按实际耗时计算关键路径：从最晚结束的步骤沿最晚结束的上游步骤回溯"""
+    deps_of = {s[0]: s[3] for s in steps}
+    executed = {n: r for n, r in results.items() if r['status'] != SKIPPED}
+    if not executed:
+        return []
+    
+    path = []
+    current = max(executed, key=lambda n: executed[n]['end'])
+    while current is not None:
+        path.append(current)
+        upstream = [d for d in deps_of.get(current, ()) if d in executed]
+        current = max(upstream, key=lambda n: executed[n]['end']) if upstream else None
+    return list(reversed(path))
+
+def report(steps, results, wall_time):
+    """输出执行统计与关键路径耗时报告"""
+    by_number = {s[0]: s for s in steps}
+    t0 = min((r['start'] for r in results.values()), default=0)
+    
+    logger.info("⏱️ 步骤耗时:")
+    for number in sorted(results):
+        r = results[number]
+        desc = by_number[number][2]
+        logger.info(f"   - 步骤{number:>2} {desc:<10} {r['status']:<8} "
+                    f"开始 +{r['start'] - t0:7.2f}s  耗时 {r['end'] - r['start']:7.2f}s")
+    
+    path = critical_path(steps, results)
+    if path:
+        chain = " -> ".join(f"{n}({results[n]['end'] - results[n]['start']:.1f}s)" for n in path)
+        path_time = sum(results[n]['end'] - results[n]['start'] for n in path)
+        serial_time = sum(r['end'] - r['start'] for r in results.values())
+        logger.info(f"🧭 关键路径: {chain}")
+        logger.info(f"   - 关键路径耗时: {path_time:.2f} 秒")
+        logger.info(f"   - 串行累计耗时: {serial_time:.2f} 秒")
+        logger.info(f"   - 实际墙钟耗时: {wall_time:.2f} 秒（并行节省 {serial_time - wall_time:.2f} 秒）")
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="执行ETL流程")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="并行执行的步骤数")
+    parser.add_argument('--steps', type=int, nargs='*', default=None, help="只执行指定步骤号")
+    parser.add_argument('--mode', choices=STEP_MODES, default=DEFAULT_STEP_MODE,
+                        help="步骤执行方式: subprocess 独立进程 / inprocess 同一进程内调用 main()")
+    parser.add_argument('--startup-report', action='store_true', help="报告每步节省的启动开销")
+    args = parser.parse_args()
+    
     logger.info("🎯 开始执行完整ETL流程")
-    start_time = time.time()
-    
-    # ETL步骤列表
-    etl_steps = [
-        (1, "extract_orders", "订单数据提取"),
-        (2, "extract_order_items", "订单明细提取"),
-        (3, "extract_stores", "门店信息提取"),
-        (4, "extract_products", "商品信息提取"),
-        (5, "extract_customers", "客户信息提取"),
-        (6, "profit_analysis", "利润分析"),
-        (7, "customer_segmentation", "客户细分分析"),
-        (8, "forecast_sales", "销售预测"),
-        (9, "site_selection", "智能选址分析"),
-        (10, "dashboard_metrics", "仪表板指标聚合")
-    ]
-    
-    success_count = 0
-    failed_steps = []
-    
-    for step_number, step_name, step_description in etl_steps:
-        logger.info(f"📋 执行步骤 {step_number}/10: {step_description}")
-        
-        if run_etl_step(step_number, step_name):
-            success_count += 1
-        else:
-            failed_steps.append((step_number, step_name, step_description))
-            logger.warning(f"⚠️ 步骤{step_number}失败，继续执行后续步骤")
-        
-        # 步骤间暂停
-        time.sleep(2)
+    start_time = time.perf_counter()
+    
+    etl_steps = select_steps(ETL_STEPS, args.steps)
+    logger.info(f"📋 共 {len(etl_steps)} 个步骤，并行度 {args.workers}，执行方式 {args.mode}")
+    
+    results = run_dag(etl_steps, workers=args.workers, runner=STEP_RUNNERS[args.mode])
     
     # 输出执行结果
-    end_time = time.time()
-    execution_time = end_time - start_time
+    execution_time = time.perf_counter() - start_time
+    success_count = sum(1 for r in results.values() if r['status'] == SUCCESS)
+    failed_steps = [s for s in etl_steps if results[s[0]]['status'] in (FAILED, TIMEOUT)]
+    skipped_steps = [s for s in etl_steps if results[s[0]]['status'] == SKIPPED]
     
     logger.info("🎉 ETL流程执行完成!")
     logger.info(f"📊 执行统计:")
     logger.info(f"   - 总步骤数: {len(etl_steps)}")
     logger.info(f"   - 成功步骤: {success_count}")
     logger.info(f"   - 失败步骤: {len(failed_steps)}")
+    logger.info(f"   - 跳过步骤: {len(skipped_steps)}")
     logger.info(f"   - 执行时间: {execution_time:.2f} 秒")
     
+    report(etl_steps, results, execution_time)
+    if args.mode == 'inprocess':
+        log_connection_reuse()
+    if args.startup_report:
+        startup_report(etl_steps, results)
+    
     if failed_steps:
         logger.warning("⚠️ 失败的步骤:")
-        for step_number, step_name, step_description in failed_steps:
+        for step_number, step_name, step_description, _, _ in failed_steps:
+            logger.warning(f"   - 步骤{step_number}: {step_description}（{results[step_number]['status']}）")
+    if skipped_steps:
+        logger.warning("⚠️ 因上游失败而跳过的步骤:")
+        for step_number, step_name, step_description, _, _ in skipped_steps:
             logger.warning(f"   - 步骤{step_number}: {step_description}")
     
     if success_count == len(etl_steps):
         logger.info("🎊 所有ETL步骤执行成功!")
     else:
-        logger.warning(f"⚠️ 有 {len(failed_steps)} 个步骤执行失败，请检查日志")
+        logger.warning(f"⚠️ 有 {len(etl_steps) - success_count} 个步骤未成功，请检查日志")
 
 if __name__ == "__main__":
     main()
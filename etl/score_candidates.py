@@ -0,0 +1,113 @@
+"""
+选址候选点批量评分接口
+一次加载城市表现与门店空间索引，对整批候选点一次评分，替代逐个位置调用 /analyze、/ml-predict
+
+输入为 JSON 数组、JSON Lines 或 CSV；每个候选点可给出 location 文本、longitude/latitude、address、city、candidate_id
+结果以 JSON 数组输出（JSON Lines 输入时逐批输出 JSON Lines），日志写到 stderr，便于后端 exec 调用
+
+用法:
+    python etl/score_candidates.py --input candidates.json
+    cat candidates.jsonl | python etl/score_candidates.py --input - --format jsonl --batch-size 500
+    python etl/score_candidates.py --input candidates.csv --stores stores.csv --city-perf city_perf.csv
+"""
+import sys
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+import logging
+
+import pandas as pd
+
+# 添加lib路径
+sys.path.append(str(Path(__file__).parent))
+from lib.spatial import parse_radii
+from lib.site_scoring import SiteScorer, DEFAULT_BATCH_SIZE, DEFAULT_CITY_MATCH_KM
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+logger = logging.getLogger(__name__)
+
+OUTPUT_COLUMNS = ['candidate_id', 'city', 'longitude', 'latitude', 'nearest_store_id', 'nearest_km',
+                  'match_score', 'cannibal_score', 'total_score', 'rationale']
+
+
+def detect_format(path):
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith('.jsonl'):
+        return 'jsonl'
+    return 'json'
+
+
+def iter_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def to_records(df):
+    """评分结果 -> JSON 可序列化的记录（NaN 转为 null）"""
+    cols = [c for c in OUTPUT_COLUMNS if c in df.columns]
+    cols += [c for c in df.columns if c.startswith('stores_within_')]
+    out = df[cols].astype(object).where(df[cols].notna(), None)
+    return out.to_dict(orient='records')
+
+
+def build_scorer(args):
+    kwargs = dict(radii_km=parse_radii(args.radii), cannibal_radius_km=args.cannibal_radius,
+                  city_match_km=args.city_match_km)
+    if args.stores:
+        perf = pd.read_csv(args.city_perf) if args.city_perf else pd.DataFrame(columns=['city', 'city_avg_revenue'])
+        return SiteScorer(pd.read_csv(args.stores), perf, **kwargs)
+    return SiteScorer.from_db(**kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="选址候选点批量评分")
+    parser.add_argument('--input', required=True, help="候选点文件，- 表示标准输入")
+    parser.add_argument('--format', choices=('json', 'jsonl', 'csv'), help="输入格式，默认按扩展名判断")
+    parser.add_argument('--output', help="结果文件，默认写到标准输出")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="JSON Lines 输入时每批候选点数")
+    parser.add_argument('--radii', default=os.getenv('ETL_SITE_RADII_KM'), help="邻近门店统计半径（km），如 0.5,1,3")
+    parser.add_argument('--cannibal-radius', type=float,
+                        default=float(os.getenv('ETL_SITE_CANNIBAL_RADIUS_KM', '3')), help="蚕食半径（km）")
+    parser.add_argument('--city-match-km', type=float,
+                        default=float(os.getenv('ETL_SITE_CITY_MATCH_KM', str(DEFAULT_CITY_MATCH_KM))))
+    parser.add_argument('--stores', help="离线运行：门店 CSV（store_id, city, longitude, latitude）")
+    parser.add_argument('--city-perf', help="离线运行：城市表现 CSV（city, city_avg_revenue）")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.input)
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    sink = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+
+    scorer = build_scorer(args)
+    start = time.perf_counter()
+    total = 0
+    try:
+        if fmt == 'jsonl':
+            # 流式：逐批评分逐批输出
+            for scored in scorer.score_stream(iter_jsonl(source), args.batch_size):
+                for record in to_records(scored):
+                    sink.write(json.dumps(record, ensure_ascii=False) + '\n')
+                total += len(scored)
+        else:
+            candidates = pd.read_csv(source) if fmt == 'csv' else json.load(source)
+            scored = scorer.score(candidates)
+            json.dump(to_records(scored), sink, ensure_ascii=False)
+            sink.write('\n')
+            total = len(scored)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+    logger.info(f"🎉 完成 {total} 个候选点评分，评分耗时 {(time.perf_counter() - start) * 1000:.1f}ms"
+                f"（评分器准备 {scorer.build_s * 1000:.1f}ms）")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """
 ETL步骤01: 合并订单数据
 从 cyrg2025 和 cyrgweixin 提取订单数据，合并到 hotdog2030.orders
+按水位线增量抽取新增/变更订单，并 MERGE 到目标表；设置 ETL_FULL_REFRESH=1 时全量重抽
 """
 import sys
 import os
@@ -10,18 +11,44 @@ from pathlib import Path
 
 # 添加lib路径
 sys.path.append(str(Path(__file__).parent.parent))
-from lib.mssql import fetch_df, to_sql, get_table_count
+from lib.mssql import fetch_df, merge_df, get_table_count
+from lib.watermark import get_watermark, set_watermark, lookback
+from lib.range_extract import iter_df_parallel
+from lib.source_priority import split_by_owner, fetch_live_rows, flag_deleted
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def extract_orders_from_cyrg2025():
-    """从cyrg2025提取订单数据"""
-    logger.info("📊 开始从cyrg2025提取订单数据...")
-    
-    sql = """
-    SELECT 
+# 流式提取每块行数，0 表示一次性提取
+CHUNK_SIZE = int(os.getenv('ETL_CHUNK_SIZE', '50000'))
+
+# 全量抽取时按 id 区间并行读取的连接数，1 表示单连接流式读取
+EXTRACT_CONNECTIONS = int(os.getenv('ETL_EXTRACT_CONNECTIONS', '4'))
+
+# 忽略水位线，全量重抽
+FULL_REFRESH = os.getenv('ETL_FULL_REFRESH', '0') == '1'
+
+SOURCE_TABLE = "Orders"
+
+# 提取时预先声明列类型，避免 Decimal/字符串 以 object 驻留内存
+ORDER_DTYPES = {
+    'id': 'int64',
+    'store_id': 'float64',
+    'total_amount': 'float64',
+    'pay_state': 'float64',
+    'created_at': 'datetime64[ns]',
+    'updated_at': 'datetime64[ns]',
+}
+
+# 有效订单条件；增量抽取不带这些条件，已删除 / 不再有效的订单以 delflag = 1 抽出并同步到目标表
+VALID_ORDER = "delflag = 0 AND total > 0 AND total < 10000 AND success_time IS NOT NULL"
+
+def build_orders_sql(source_system, watermark=None):
+    """构建订单抽取SQL；给定水位线时只抽取主键更大或变更时间更新的订单（包括已删除 / 不再有效的订单）"""
+    select_sql = f"""
+    SELECT
+        id,
         orderNo AS order_no,
         shopId AS store_id,
         openId AS customer_id,
@@ -30,52 +57,68 @@ def extract_orders_from_cyrg2025():
         payMode AS pay_mode,
         success_time AS created_at,
         recordTime AS updated_at,
-        'cyrg2025' AS source_system
-    FROM Orders 
-    WHERE delflag = 0 
-    AND total > 0 
-    AND total < 10000
-    AND success_time IS NOT NULL
+        CASE WHEN {VALID_ORDER} THEN 0 ELSE 1 END AS delflag,
+        '{source_system}' AS source_system
+    FROM Orders
+    """
+    if watermark is None:
+        return f"{select_sql} WHERE {VALID_ORDER}", None
+    
+    # 两个分支各自走 id / recordTime 上的索引，UNION 去掉两边都命中的行；
+    # OR 加 TRY_CONVERT(recordTime) 会让整个条件无法使用索引，每次增量都扫全表
+    # recordTime 在源库中为 varchar，按 'yyyy-MM-dd HH:mm:ss' 文本比较与时间先后一致
+    last_ts, last_id = watermark
+    sql = f"""{select_sql}
+    WHERE id > %s
+    UNION
+    {select_sql}
+    WHERE recordTime >= %s
     """
+    params = (last_id if last_id is not None else -1,
+              (lookback(last_ts) or dt.datetime(1900, 1, 1)).strftime('%Y-%m-%d %H:%M:%S'))
+    return sql, params
+
+def live_orders_sql(source_db):
+    """源库中有效订单的查询，用于判断同一 id 归属哪个源库"""
+    return build_orders_sql(source_db)[0]
+
+def extract_orders_from_cyrg2025(chunksize=None, watermark=None):
+    """从cyrg2025提取订单数据（指定 chunksize 时返回分块迭代器，全量抽取按 id 区间并行读取）"""
+    logger.info("📊 开始从cyrg2025提取订单数据...")
     
-    df = fetch_df(sql, "cyrg2025")
+    sql, params = build_orders_sql('cyrg2025', watermark)
+    
+    if chunksize:
+        if watermark is None and EXTRACT_CONNECTIONS > 1:
+            return iter_df_parallel(sql, "cyrg2025", key='id', connections=EXTRACT_CONNECTIONS,
+                                    chunksize=chunksize, dtypes=ORDER_DTYPES, params=params)
+        return fetch_df(sql, "cyrg2025", chunksize=chunksize, dtypes=ORDER_DTYPES, params=params)
+    
+    df = fetch_df(sql, "cyrg2025", dtypes=ORDER_DTYPES, params=params)
     logger.info(f"✅ cyrg2025订单数据提取完成: {len(df)} 条记录")
     return df
 
-def extract_orders_from_cyrgweixin():
-    """从cyrgweixin提取订单数据"""
+def extract_orders_from_cyrgweixin(chunksize=None, watermark=None):
+    """从cyrgweixin提取订单数据（指定 chunksize 时返回分块迭代器，全量抽取按 id 区间并行读取）"""
     logger.info("📊 开始从cyrgweixin提取订单数据...")
     
-    sql = """
-    SELECT 
-        orderNo AS order_no,
-        shopId AS store_id,
-        openId AS customer_id,
-        total AS total_amount,
-        payState AS pay_state,
-        payMode AS pay_mode,
-        success_time AS created_at,
-        recordTime AS updated_at,
-        'cyrgweixin' AS source_system
-    FROM Orders 
-    WHERE delflag = 0 
-    AND total > 0 
-    AND total < 10000
-    AND success_time IS NOT NULL
-    """
+    sql, params = build_orders_sql('cyrgweixin', watermark)
+    
+    if chunksize:
+        if watermark is None and EXTRACT_CONNECTIONS > 1:
+            return iter_df_parallel(sql, "cyrgweixin", key='id', connections=EXTRACT_CONNECTIONS,
+                                    chunksize=chunksize, dtypes=ORDER_DTYPES, params=params)
+        return fetch_df(sql, "cyrgweixin", chunksize=chunksize, dtypes=ORDER_DTYPES, params=params)
     
-    df = fetch_df(sql, "cyrgweixin")
+    df = fetch_df(sql, "cyrgweixin", dtypes=ORDER_DTYPES, params=params)
     logger.info(f"✅ cyrgweixin订单数据提取完成: {len(df)} 条记录")
     return df
 
-def clean_and_merge_orders(df1, df2):
-    """清洗和合并订单数据"""
-    logger.info("🔄 开始清洗和合并订单数据...")
-    
-    # 合并数据
-    df = pd.concat([df1, df2], ignore_index=True)
-    logger.info(f"📊 合并后总记录数: {len(df)}")
+def clean_orders(df, seen_order_nos=None):
+    """清洗订单数据
     
+    seen_order_nos 为跨块共享的已写入订单号集合，用于分块处理时全局去重
+    """
     # 数据类型转换
     df['created_at'] = pd.to_datetime(df['created_at'], errors='coerce')
     df['updated_at'] = pd.to_datetime(df['updated_at'], errors='coerce')
@@ -89,40 +132,101 @@ def clean_and_merge_orders(df1, df2):
     
     # 去重
     df = df.drop_duplicates(subset=['order_no'], keep='first')
+    if seen_order_nos is not None:
+        df = df[~df['order_no'].isin(seen_order_nos)]
+        seen_order_nos.update(df['order_no'].tolist())
     
     # 添加处理时间戳
+    df = df.copy()
     df['processed_at'] = dt.datetime.now()
+    return df
+
+def clean_and_merge_orders(df1, df2):
+    """清洗和合并订单数据"""
+    logger.info("🔄 开始清洗和合并订单数据...")
+    
+    # 合并数据
+    df = pd.concat([df1, df2], ignore_index=True)
+    logger.info(f"📊 合并后总记录数: {len(df)}")
+    
+    df = clean_orders(df)
     
     logger.info(f"✅ 数据清洗完成: {len(df)} 条有效记录")
     return df
 
+def sync_source(source_db, extract, chunksize, seen_order_nos, full_refresh=False):
+    """按水位线增量抽取一个源库的订单并 MERGE 到 hotdog2030.orders，成功后推进水位线"""
+    watermark = None if full_refresh else get_watermark(source_db, SOURCE_TABLE)
+    if watermark == (None, None):
+        watermark = None
+    logger.info(f"📌 {source_db}.{SOURCE_TABLE} 水位线: {watermark or '无（全量抽取）'}")
+    
+    result = extract(chunksize=chunksize or None, watermark=watermark)
+    chunks = result if chunksize else [result]
+    
+    stats = {'extracted': 0, 'inserted': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+    max_ts, max_id = None, None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        stats['extracted'] += len(chunk)
+        
+        # 水位线以抽取到的原始数据为准，被清洗过滤掉的行也不再重复抽取
+        chunk_ts = pd.to_datetime(chunk['updated_at'], errors='coerce').max()
+        if pd.notna(chunk_ts):
+            max_ts = chunk_ts if max_ts is None else max(max_ts, chunk_ts)
+        chunk_id = int(chunk['id'].max())
+        max_id = chunk_id if max_id is None else max(max_id, chunk_id)
+        
+        # 先按 id 归属拆分再清洗，避免跳过的行占用跨块去重集合：
+        # 被更高优先级源库占用的 id 跳过；本源库已失效的 id 改写低优先级源库的同 id 订单，都没有时标记删除
+        keep, dead, handover = split_by_owner(chunk, source_db, live_orders_sql)
+        for db, ids in handover.items():
+            keep = pd.concat([keep, fetch_live_rows(db, live_orders_sql(db), ids, dtypes=ORDER_DTYPES)],
+                             ignore_index=True)
+        df_clean = clean_orders(keep, seen_order_nos)
+        stats['deleted'] += flag_deleted("hotdog2030", "orders", dead)
+        if df_clean.empty:
+            continue
+        
+        result = merge_df(df_clean, "orders", "hotdog2030", key_cols=['id'])
+        if result['failed'] == len(df_clean):
+            raise RuntimeError(f"{source_db} 订单合并失败")
+        for key in ('inserted', 'updated', 'failed'):
+            stats[key] += result[key]
+    
+    if stats['extracted']:
+        set_watermark(source_db, SOURCE_TABLE,
+                      max_ts.to_pydatetime() if max_ts is not None else None,
+                      max_id, stats['extracted'])
+    logger.info(f"✅ {source_db} 订单同步完成: 抽取 {stats['extracted']}, 新增 {stats['inserted']}, "
+                f"更新 {stats['updated']}, 标记删除 {stats['deleted']}, 失败 {stats['failed']}")
+    return stats
+
 def main():
     """主函数"""
     logger.info("🚀 开始ETL步骤01: 订单数据提取")
     
     try:
-        # 提取数据
-        df_cyrg2025 = extract_orders_from_cyrg2025()
-        df_cyrgweixin = extract_orders_from_cyrgweixin()
+        seen_order_nos = set()
+        totals = {'extracted': 0, 'inserted': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
         
-        # 清洗合并
-        df_merged = clean_and_merge_orders(df_cyrg2025, df_cyrgweixin)
+        for source_db, extract in (("cyrg2025", extract_orders_from_cyrg2025),
+                                   ("cyrgweixin", extract_orders_from_cyrgweixin)):
+            stats = sync_source(source_db, extract, CHUNK_SIZE, seen_order_nos, full_refresh=FULL_REFRESH)
+            for key in totals:
+                totals[key] += stats[key]
         
-        if df_merged.empty:
-            logger.warning("⚠️ 没有有效数据可写入")
+        if totals['extracted'] == 0:
+            logger.info("✅ 没有新增或变更的订单")
             return
         
-        # 写入目标数据库
-        logger.info("💾 开始写入hotdog2030.orders...")
-        success = to_sql(df_merged, "orders", "hotdog2030", if_exists='replace')
-        
-        if success:
-            # 验证结果
-            count = get_table_count("hotdog2030", "orders")
-            logger.info(f"🎉 ETL步骤01完成! hotdog2030.orders 现在有 {count} 条记录")
-        else:
-            logger.error("❌ 数据写入失败")
-            
+        # 验证结果
+        count = get_table_count("hotdog2030", "orders")
+        logger.info(f"🎉 ETL步骤01完成! hotdog2030.orders 现在有 {count} 条记录")
+        logger.info(f"📊 本次: 抽取 {totals['extracted']}, 新增 {totals['inserted']}, "
+                    f"更新 {totals['updated']}, 标记删除 {totals['deleted']}, 失败 {totals['failed']}")
+    
     except Exception as e:
         logger.error(f"❌ ETL步骤01执行失败: {str(e)}")
         raise
@@ -1,6 +1,7 @@
 """
 ETL步骤02: 提取订单明细数据
 从 cyrg2025 和 cyrgweixin 提取订单明细，合并到 hotdog2030.order_items
+按水位线增量抽取新增/变更明细，并 MERGE 到目标表；设置 ETL_FULL_REFRESH=1 时全量重抽
 """
 import sys
 import os
@@ -10,18 +11,48 @@ from pathlib import Path
 
 # 添加lib路径
 sys.path.append(str(Path(__file__).parent.parent))
-from lib.mssql import fetch_df, to_sql, get_table_count
+from lib.mssql import fetch_df, merge_df, get_table_count
+from lib.watermark import get_watermark, set_watermark, lookback
+from lib.range_extract import iter_df_parallel
+from lib.source_priority import split_by_owner, fetch_live_rows, flag_deleted, foreign_parent
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def extract_order_items_from_cyrg2025():
-    """从cyrg2025提取订单明细数据"""
-    logger.info("📊 开始从cyrg2025提取订单明细数据...")
-    
-    sql = """
-    SELECT 
+# 流式提取每块行数，0 表示一次性提取
+CHUNK_SIZE = int(os.getenv('ETL_CHUNK_SIZE', '50000'))
+
+# 全量抽取时按 id 区间并行读取的连接数，1 表示单连接流式读取
+EXTRACT_CONNECTIONS = int(os.getenv('ETL_EXTRACT_CONNECTIONS', '4'))
+
+# 忽略水位线，全量重抽
+FULL_REFRESH = os.getenv('ETL_FULL_REFRESH', '0') == '1'
+
+SOURCE_TABLE = "OrderGoods"
+
+# 提取时预先声明列类型，避免 Decimal/字符串 以 object 驻留内存
+ORDER_ITEM_DTYPES = {
+    'id': 'int64',
+    'order_id': 'float64',
+    'product_id': 'float64',
+    'quantity': 'float64',
+    'price': 'float64',
+    'total_price': 'float64',
+    'created_at': 'datetime64[ns]',
+}
+
+# 有效明细条件；增量抽取不带这些条件，已删除 / 不再有效的明细以 delflag = 1 抽出并同步到目标表
+VALID_ITEM = "delflag = 0 AND goodsNumber > 0 AND goodsPrice > 0"
+
+# 有效订单的 id，与步骤01的有效订单条件一致，用于判断明细的 order_id 归属哪个源库
+ORDERS_LIVE_SQL = "SELECT id FROM Orders WHERE delflag = 0 AND total > 0 AND total < 10000 AND success_time IS NOT NULL"
+
+def build_order_items_sql(source_system, watermark=None):
+    """构建订单明细抽取SQL；给定水位线时只抽取主键更大或变更时间更新的明细（包括已删除 / 不再有效的明细）"""
+    select_sql = f"""
+    SELECT
+        id,
         orderId AS order_id,
         goodsId AS product_id,
         goodsName AS product_name,
@@ -29,49 +60,82 @@ def extract_order_items_from_cyrg2025():
         goodsPrice AS price,
         goodsTotal AS total_price,
         recordTime AS created_at,
-        'cyrg2025' AS source_system
-    FROM OrderGoods 
-    WHERE delflag = 0 
-    AND goodsNumber > 0 
-    AND goodsPrice > 0
+        CASE WHEN {VALID_ITEM} THEN 0 ELSE 1 END AS delflag,
+        '{source_system}' AS source_system
+    FROM OrderGoods
     """
+    if watermark is None:
+        return f"{select_sql} WHERE {VALID_ITEM}", None
     
-    df = fetch_df(sql, "cyrg2025")
+    # 两个分支各自走 id / recordTime 上的索引，UNION 去掉两边都命中的行；
+    # OR 加 TRY_CONVERT(recordTime) 会让整个条件无法使用索引，每次增量都扫全表
+    # recordTime 在源库中为 varchar，按 'yyyy-MM-dd HH:mm:ss' 文本比较与时间先后一致
+    last_ts, last_id = watermark
+    sql = f"""{select_sql}
+    WHERE id > %s
+    UNION
+    {select_sql}
+    WHERE recordTime >= %s
+    """
+    params = (last_id if last_id is not None else -1,
+              (lookback(last_ts) or dt.datetime(1900, 1, 1)).strftime('%Y-%m-%d %H:%M:%S'))
+    return sql, params
+
+def live_items_sql(source_db):
+    """源库中有效明细的查询，用于判断同一 id 归属哪个源库"""
+    return build_order_items_sql(source_db)[0]
+
+def drop_foreign_orders(df, source_db):
+    """order_id 归属其他源库的明细视为无效（delflag = 1）
+
+    两个源库的订单 id 同样会重叠，这样的明细写入后会挂到别的源库的订单上
+    """
+    if df.empty:
+        return df
+    foreign = foreign_parent(df, source_db, 'order_id', lambda db: ORDERS_LIVE_SQL)
+    if foreign.any():
+        logger.info(f"🔀 {source_db}: {int(foreign.sum())} 条订单明细的 order_id 已归属其他源库的订单，不再写入")
+        df = df.copy()
+        df.loc[foreign, 'delflag'] = 1
+    return df
+
+def extract_order_items_from_cyrg2025(chunksize=None, watermark=None):
+    """从cyrg2025提取订单明细数据（指定 chunksize 时返回分块迭代器，全量抽取按 id 区间并行读取）"""
+    logger.info("📊 开始从cyrg2025提取订单明细数据...")
+    
+    sql, params = build_order_items_sql('cyrg2025', watermark)
+    
+    if chunksize:
+        if watermark is None and EXTRACT_CONNECTIONS > 1:
+            return iter_df_parallel(sql, "cyrg2025", key='id', connections=EXTRACT_CONNECTIONS,
+                                    chunksize=chunksize, dtypes=ORDER_ITEM_DTYPES, params=params)
+        return fetch_df(sql, "cyrg2025", chunksize=chunksize, dtypes=ORDER_ITEM_DTYPES, params=params)
+    
+    df = fetch_df(sql, "cyrg2025", dtypes=ORDER_ITEM_DTYPES, params=params)
     logger.info(f"✅ cyrg2025订单明细数据提取完成: {len(df)} 条记录")
     return df
 
-def extract_order_items_from_cyrgweixin():
-    """从cyrgweixin提取订单明细数据"""
+def extract_order_items_from_cyrgweixin(chunksize=None, watermark=None):
+    """从cyrgweixin提取订单明细数据（指定 chunksize 时返回分块迭代器，全量抽取按 id 区间并行读取）"""
     logger.info("📊 开始从cyrgweixin提取订单明细数据...")
     
-    sql = """
-    SELECT 
-        orderId AS order_id,
-        goodsId AS product_id,
-        goodsName AS product_name,
-        goodsNumber AS quantity,
-        goodsPrice AS price,
-        goodsTotal AS total_price,
-        recordTime AS created_at,
-        'cyrgweixin' AS source_system
-    FROM OrderGoods 
-    WHERE delflag = 0 
-    AND goodsNumber > 0 
-    AND goodsPrice > 0
-    """
+    sql, params = build_order_items_sql('cyrgweixin', watermark)
+    
+    if chunksize:
+        if watermark is None and EXTRACT_CONNECTIONS > 1:
+            return iter_df_parallel(sql, "cyrgweixin", key='id', connections=EXTRACT_CONNECTIONS,
+                                    chunksize=chunksize, dtypes=ORDER_ITEM_DTYPES, params=params)
+        return fetch_df(sql, "cyrgweixin", chunksize=chunksize, dtypes=ORDER_ITEM_DTYPES, params=params)
     
-    df = fetch_df(sql, "cyrgweixin")
+    df = fetch_df(sql, "cyrgweixin", dtypes=ORDER_ITEM_DTYPES, params=params)
     logger.info(f"✅ cyrgweixin订单明细数据提取完成: {len(df)} 条记录")
     return df
 
-def clean_and_merge_order_items(df1, df2):
-    """清洗和合并订单明细数据"""
-    logger.info("🔄 开始清洗和合并订单明细数据...")
-    
-    # 合并数据
-    df = pd.concat([df1, df2], ignore_index=True)
-    logger.info(f"📊 合并后总记录数: {len(df)}")
-    
+def clean_order_items(df, seen_keys=None):
+    """清洗订单明细数据
+
+    seen_keys 为跨块共享的 (order_id, product_id, created_at) 集合，用于分块处理时全局去重
+    """
     # 数据类型转换
     df['quantity'] = pd.to_numeric(df['quantity'], errors='coerce')
     df['price'] = pd.to_numeric(df['price'], errors='coerce')
@@ -84,44 +148,109 @@ def clean_and_merge_order_items(df1, df2):
     df = df[df['price'] > 0]
     
     # 计算总价（如果为空）
+    df = df.copy()
     df['total_price'] = df['total_price'].fillna(df['quantity'] * df['price'])
     
     # 去重
     df = df.drop_duplicates(subset=['order_id', 'product_id', 'created_at'], keep='first')
+    if seen_keys is not None:
+        keys = pd.Series(list(zip(df['order_id'], df['product_id'], df['created_at'])), index=df.index)
+        df = df[~keys.isin(seen_keys)]
+        seen_keys.update(keys[df.index].tolist())
     
     # 添加处理时间戳
     df['processed_at'] = dt.datetime.now()
+    return df
+
+def clean_and_merge_order_items(df1, df2):
+    """清洗和合并订单明细数据"""
+    logger.info("🔄 开始清洗和合并订单明细数据...")
+    
+    # 合并数据
+    df = pd.concat([df1, df2], ignore_index=True)
+    logger.info(f"📊 合并后总记录数: {len(df)}")
+    
+    df = clean_order_items(df)
     
     logger.info(f"✅ 订单明细数据清洗完成: {len(df)} 条有效记录")
     return df
 
+def sync_source(source_db, extract, chunksize, seen_keys, full_refresh=False):
+    """按水位线增量抽取一个源库的订单明细并 MERGE 到 hotdog2030.order_items，成功后推进水位线"""
+    watermark = None if full_refresh else get_watermark(source_db, SOURCE_TABLE)
+    if watermark == (None, None):
+        watermark = None
+    logger.info(f"📌 {source_db}.{SOURCE_TABLE} 水位线: {watermark or '无（全量抽取）'}")
+    
+    result = extract(chunksize=chunksize or None, watermark=watermark)
+    chunks = result if chunksize else [result]
+    
+    stats = {'extracted': 0, 'inserted': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+    max_ts, max_id = None, None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        stats['extracted'] += len(chunk)
+        
+        # 水位线以抽取到的原始数据为准，被清洗过滤掉的行也不再重复抽取
+        chunk_ts = pd.to_datetime(chunk['created_at'], errors='coerce').max()
+        if pd.notna(chunk_ts):
+            max_ts = chunk_ts if max_ts is None else max(max_ts, chunk_ts)
+        chunk_id = int(chunk['id'].max())
+        max_id = chunk_id if max_id is None else max(max_id, chunk_id)
+        
+        # 先按 id 归属拆分再清洗，避免跳过的行占用跨块去重集合：
+        # 被更高优先级源库占用的 id 跳过；本源库已失效的 id 改写低优先级源库的同 id 明细，都没有时标记删除；
+        # order_id 归属其他源库的明细按失效处理
+        keep, dead, handover = split_by_owner(drop_foreign_orders(chunk, source_db), source_db, live_items_sql)
+        for db, ids in handover.items():
+            rows = drop_foreign_orders(fetch_live_rows(db, live_items_sql(db), ids, dtypes=ORDER_ITEM_DTYPES), db)
+            keep = pd.concat([keep, rows[rows['delflag'] == 0]], ignore_index=True)
+            dead += rows.loc[rows['delflag'] != 0, 'id'].astype('int64').tolist()
+        df_clean = clean_order_items(keep, seen_keys)
+        stats['deleted'] += flag_deleted("hotdog2030", "order_items", dead)
+        if df_clean.empty:
+            continue
+        
+        result = merge_df(df_clean, "order_items", "hotdog2030", key_cols=['id'])
+        if result['failed'] == len(df_clean):
+            raise RuntimeError(f"{source_db} 订单明细合并失败")
+        for key in ('inserted', 'updated', 'failed'):
+            stats[key] += result[key]
+        logger.info(f"📦 {source_db} 已处理 {stats['extracted']} 条订单明细")
+    
+    if stats['extracted']:
+        set_watermark(source_db, SOURCE_TABLE,
+                      max_ts.to_pydatetime() if max_ts is not None else None,
+                      max_id, stats['extracted'])
+    logger.info(f"✅ {source_db} 订单明细同步完成: 抽取 {stats['extracted']}, 新增 {stats['inserted']}, "
+                f"更新 {stats['updated']}, 标记删除 {stats['deleted']}, 失败 {stats['failed']}")
+    return stats
+
 def main():
     """主函数"""
     logger.info("🚀 开始ETL步骤02: 订单明细数据提取")
     
     try:
-        # 提取数据
-        df_cyrg2025 = extract_order_items_from_cyrg2025()
-        df_cyrgweixin = extract_order_items_from_cyrgweixin()
+        seen_keys = set()
+        totals = {'extracted': 0, 'inserted': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
         
-        # 清洗合并
-        df_merged = clean_and_merge_order_items(df_cyrg2025, df_cyrgweixin)
+        for source_db, extract in (("cyrg2025", extract_order_items_from_cyrg2025),
+                                   ("cyrgweixin", extract_order_items_from_cyrgweixin)):
+            stats = sync_source(source_db, extract, CHUNK_SIZE, seen_keys, full_refresh=FULL_REFRESH)
+            for key in totals:
+                totals[key] += stats[key]
         
-        if df_merged.empty:
-            logger.warning("⚠️ 没有有效数据可写入")
+        if totals['extracted'] == 0:
+            logger.info("✅ 没有新增或变更的订单明细")
             return
         
-        # 写入目标数据库
-        logger.info("💾 开始写入hotdog2030.order_items...")
-        success = to_sql(df_merged, "dorder_items", "hotdog2030", if_exists='replace')
-        
-        if success:
-            # 验证结果
-            count = get_table_count("hotdog2030", "order_items")
-            logger.info(f"🎉 ETL步骤02完成! hotdog2030.order_items 现在有 {count} 条记录")
-        else:
-            logger.error("❌ 数据写入失败")
-            
+        # 验证结果
+        count = get_table_count("hotdog2030", "order_items")
+        logger.info(f"🎉 ETL步骤02完成! hotdog2030.order_items 现在有 {count} 条记录")
+        logger.info(f"📊 本次: 抽取 {totals['extracted']}, 新增 {totals['inserted']}, "
+                    f"更新 {totals['updated']}, 标记删除 {totals['deleted']}, 失败 {totals['failed']}")
+    
     except Exception as e:
         logger.error(f"❌ ETL步骤02执行失败: {str(e)}")
         raise
@@ -10,14 +10,26 @@ from pathlib import Path
 
 # 添加lib路径
 sys.path.append(str(Path(__file__).parent.parent))
-from lib.mssql import fetch_df, to_sql, get_table_count
+from lib.mssql import fetch_df, to_sql, get_table_count, get_conn
+from lib.shadow import ShadowTable
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def extract_customers_from_cyrg2025():
-    """从cyrg2025提取VIP客户数据"""
+# 流式提取每块行数，0 表示一次性提取
+CHUNK_SIZE = int(os.getenv('ETL_CHUNK_SIZE', '50000'))
+
+# 提取时预先声明列类型，避免 Decimal/字符串 以 object 驻留内存
+CUSTOMER_DTYPES = {
+    'score': 'float64',
+    'balance': 'float64',
+    'created_at': 'datetime64[ns]',
+    'birthday': 'datetime64[ns]',
+}
+
+def extract_customers_from_cyrg2025(chunksize=None):
+    """从cyrg2025提取VIP客户数据（指定 chunksize 时返回分块迭代器）"""
     logger.info("📊 开始从cyrg2025提取VIP客户数据...")
     
     sql = """
@@ -38,12 +50,15 @@ def extract_customers_from_cyrg2025():
     AND vipTel != ''
     """
     
-    df = fetch_df(sql, "cyrg2025")
+    if chunksize:
+        return fetch_df(sql, "cyrg2025", chunksize=chunksize, dtypes=CUSTOMER_DTYPES)
+    
+    df = fetch_df(sql, "cyrg2025", dtypes=CUSTOMER_DTYPES)
     logger.info(f"✅ cyrg2025 VIP客户数据提取完成: {len(df)} 条记录")
     return df
 
-def extract_customers_from_cyrgweixin():
-    """从cyrgweixin提取微信用户数据"""
+def extract_customers_from_cyrgweixin(chunksize=None):
+    """从cyrgweixin提取微信用户数据（指定 chunksize 时返回分块迭代器）"""
     logger.info("📊 开始从cyrgweixin提取微信用户数据...")
     
     sql = """
@@ -65,17 +80,22 @@ def extract_customers_from_cyrgweixin():
     AND Tel != ''
     """
     
-    df = fetch_df(sql, "cyrgweixin")
+    if chunksize:
+        return fetch_df(sql, "cyrgweixin", chunksize=chunksize, dtypes=CUSTOMER_DTYPES)
+    
+    df = fetch_df(sql, "cyrgweixin", dtypes=CUSTOMER_DTYPES)
     logger.info(f"✅ cyrgweixin微信用户数据提取完成: {len(df)} 条记录")
     return df
 
-def clean_and_merge_customers(df1, df2):
-    """清洗和合并客户数据"""
-    logger.info("🔄 开始清洗和合并客户数据...")
-    
-    # 合并数据
-    df = pd.concat([df1, df2], ignore_index=True)
-    logger.info(f"📊 合并后总记录数: {len(df)}")
+def clean_customers(df, seen_phones=None):
+    """清洗客户数据
+
+    seen_phones 为跨块共享的已写入手机号集合，用于分块处理时全局去重
+    """
+    df = df.copy()
+    for col in ('score', 'balance', 'birthday', 'openid'):
+        if col not in df.columns:
+            df[col] = None
     
     # 数据类型转换
     df['score'] = pd.to_numeric(df['score'], errors='coerce')
@@ -94,6 +114,9 @@ def clean_and_merge_customers(df1, df2):
     
     # 去重（基于手机号）
     df = df.drop_duplicates(subset=['phone'], keep='first')
+    if seen_phones is not None:
+        df = df[~df['phone'].isin(seen_phones)].copy()
+        seen_phones.update(df['phone'].tolist())
     
     # 计算客户年龄（如果有生日）
     current_year = dt.datetime.now().year
@@ -108,15 +131,67 @@ def clean_and_merge_customers(df1, df2):
     
     # 添加处理时间戳
     df['processed_at'] = dt.datetime.now()
+    return df
+
+def clean_and_merge_customers(df1, df2):
+    """清洗和合并客户数据"""
+    logger.info("🔄 开始清洗和合并客户数据...")
+    
+    # 合并数据
+    df = pd.concat([df1, df2], ignore_index=True)
+    logger.info(f"📊 合并后总记录数: {len(df)}")
+    
+    df = clean_customers(df)
     
     logger.info(f"✅ 客户数据清洗完成: {len(df)} 条有效记录")
     return df
 
+def run_chunked(chunksize):
+    """分块执行：逐块提取、清洗、写入影子表，全部写完后校验并原子切换，返回按客户类型累计的统计"""
+    seen_phones = set()
+    stats = {'total': 0, 'vip': 0, 'high_value': 0, 'with_openid': 0}
+    
+    with get_conn("hotdog2030") as conn, ShadowTable(conn, "customers") as shadow:
+        for extract in (extract_customers_from_cyrg2025, extract_customers_from_cyrgweixin):
+            for chunk in extract(chunksize=chunksize):
+                df_clean = clean_customers(chunk, seen_phones)
+                if df_clean.empty:
+                    continue
+                
+                if shadow.write(df_clean) < len(df_clean):
+                    raise RuntimeError("客户数据分块写入失败")
+                
+                stats['total'] += len(df_clean)
+                stats['vip'] += int((df_clean['customer_type'] == 'VIP客户').sum())
+                stats['high_value'] += int((df_clean['customer_type'] == '高价值客户').sum())
+                stats['with_openid'] += int(df_clean['openid'].notna().sum())
+                logger.info(f"📦 已写入 {stats['total']} 个客户")
+        
+        # 没有数据时不切换，保留线上表
+        if stats['total']:
+            shadow.swap(expected_rows=stats['total'])
+    
+    return stats
+
 def main():
     """主函数"""
     logger.info("🚀 开始ETL步骤05: 客户信息提取")
     
     try:
+        if CHUNK_SIZE > 0:
+            stats = run_chunked(CHUNK_SIZE)
+            if stats['total'] == 0:
+                logger.warning("⚠️ 没有有效数据可写入")
+                return
+            count = get_table_count("hotdog2030", "customers")
+            logger.info(f"🎉 ETL步骤05完成! hotdog2030.customers 现在有 {count} 条记录")
+            logger.info(f"📊 客户统计:")
+            logger.info(f"   - 总客户数: {count}")
+            logger.info(f"   - VIP客户: {stats['vip']}")
+            logger.info(f"   - 高价值客户: {stats['high_value']}")
+            logger.info(f"   - 有微信ID的客户: {stats['with_openid']}")
+            return
+        
         # 提取数据
         df_cyrg2025 = extract_customers_from_cyrg2025()
         df_cyrgweixin = extract_customers_from_cyrgweixin()
@@ -130,7 +205,7 @@ def main():
         
         # 写入目标数据库
         logger.info("💾 开始写入hotdog2030.customers...")
-        success = to_sql(df_merged, "dcustomers", "hotdog2030", if_exists='replace')
+        success = to_sql(df_merged, "customers", "hotdog2030", if_exists='replace')
         
         if success:
             # 验证结果
@@ -2,6 +2,7 @@
 ETL步骤06: 利润分析模块
 计算门店毛利、净利，生成利润分析报表
 基于OpenAI建议的优化版本
+只重算上次运行以来订单/明细发生变化的 date_key；设置 ETL_FULL_REFRESH=1 时全量重建
 """
 import sys
 import os
@@ -12,7 +13,8 @@ from pathlib import Path
 
 # 添加lib路径
 sys.path.append(str(Path(__file__).parent.parent))
-from lib.mssql import fetch_df, to_sql, get_conn, get_table_count, execute_sql
+from lib.mssql import fetch_df, merge_df, get_conn, get_table_count
+from lib.watermark import get_watermark, set_watermark, lookback
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,80 +22,315 @@ logger = logging.getLogger(__name__)
 
 DW = "hotdog2030"
 
-def calc_profit_daily():
-    """计算每日利润数据"""
-    logger.info("📊 开始计算每日利润数据...")
-    
-    sql = """
+# 设置为 1 时整个聚合在服务端完成，一条 MERGE 直接写入 fact_profit_daily，不回传明细行
+SERVER_SIDE = os.getenv('ETL_PROFIT_SERVER_SIDE', '0') == '1'
+
+# 忽略水位线，全量重建
+FULL_REFRESH = os.getenv('ETL_FULL_REFRESH', '0') == '1'
+
+# 水位线按 "消费方 + 上游表" 记录本步骤已处理到的订单/明细
+WATERMARK_NAME = "fact_profit_daily"
+
+# 变化日期拆成的最大区间数，超过时合并为一个 [最小, 最大] 区间
+MAX_DATE_RANGES = 50
+
+# orders.date_key 为持久化计算列（见 ddl/create_analysis_objects.sql），分组与区间过滤均可走索引
+# 增量同步对源库已删除的订单/明细只做软删除，delflag = 1 的行不计入
+PROFIT_AGG_SQL = """
     SELECT
-      CONVERT(int, FORMAT(o.created_at, 'yyyyMMdd')) AS date_key,
+      o.date_key,
       o.store_id,
       SUM(o.total_amount) AS revenue,
       SUM(oi.quantity * ISNULL(p.cost_price,0)) AS cogs
     FROM dbo.orders o
-    JOIN dbo.order_items oi ON oi.order_id = o.id
+    JOIN dbo.order_items oi ON oi.order_id = o.id AND oi.delflag = 0
     LEFT JOIN dbo.products p ON p.id = oi.product_id
-    GROUP BY CONVERT(int, FORMAT(o.created_at, 'yyyyMMdd')), o.store_id
+    WHERE o.delflag = 0
+    {where}
+    GROUP BY o.date_key, o.store_id
+"""
+
+# 每个门店日的收入与 fact_profit_daily 不一致的 date_key：订单改了日期 / 门店或被删除后，
+# 原来所在的门店日不会出现在按当前 date_key 找到的变化日期里，靠对账找回
+STALE_DATE_KEYS_SQL = """
+    SELECT DISTINCT COALESCE(a.date_key, f.date_key) AS date_key
+    FROM (
+      SELECT o.date_key, o.store_id, SUM(o.total_amount) AS revenue
+      FROM dbo.orders o
+      JOIN dbo.order_items oi ON oi.order_id = o.id AND oi.delflag = 0
+      WHERE o.delflag = 0 AND o.date_key IS NOT NULL AND o.store_id IS NOT NULL
+      GROUP BY o.date_key, o.store_id
+    ) a
+    FULL JOIN dbo.fact_profit_daily f ON f.date_key = a.date_key AND f.store_id = a.store_id
+    WHERE ABS(ISNULL(a.revenue, 0) - ISNULL(f.revenue, 0)) > 0.005
+"""
+
+# 重算区间内已没有订单的门店日：收入/成本清零，保留外部导入的 operating_exp
+ZERO_MISSING_SQL = """
+    UPDATE T SET revenue = 0, cogs = 0
+    FROM dbo.fact_profit_daily T
+    WHERE (T.revenue <> 0 OR T.cogs <> 0)
+    {where}
+    AND NOT EXISTS (
+      SELECT 1
+      FROM dbo.orders o
+      JOIN dbo.order_items oi ON oi.order_id = o.id AND oi.delflag = 0
+      WHERE o.delflag = 0 AND o.date_key = T.date_key AND o.store_id = T.store_id
+    )
+"""
+
+def range_predicate(column, ranges):
+    """date_key 闭区间列表对应的 SQL 条件与参数"""
+    predicate = " OR ".join([f"{column} BETWEEN %s AND %s"] * len(ranges))
+    return f"({predicate})", tuple(v for r in ranges for v in r)
+
+def build_profit_agg_sql(ranges=None):
+    """构建利润聚合SQL；ranges 为 [(起始date_key, 结束date_key)] 闭区间列表，None 表示全量"""
+    if ranges is None:
+        return PROFIT_AGG_SQL.format(where=""), ()
+    predicate, params = range_predicate("o.date_key", ranges)
+    return PROFIT_AGG_SQL.format(where=f"AND {predicate}"), params
+
+def capture_high_water():
+    """记录本次运行开始时订单/明细的最大主键与变更时间，作为下次增量的起点"""
+    df = fetch_df("""
+    SELECT
+      (SELECT MAX(id) FROM dbo.orders)         AS orders_id,
+      (SELECT MAX(updated_at) FROM dbo.orders) AS orders_ts,
+      (SELECT MAX(id) FROM dbo.order_items)         AS items_id,
+      (SELECT MAX(created_at) FROM dbo.order_items) AS items_ts
+    """, DW)
+    if df.empty:
+        return None
+    r = df.iloc[0]
+    
+    def ts(v):
+        return None if pd.isna(v) else pd.Timestamp(v).to_pydatetime()
+    
+    def ident(v):
+        return None if pd.isna(v) else int(v)
+    
+    return {
+        'orders': (ts(r['orders_ts']), ident(r['orders_id'])),
+        'order_items': (ts(r['items_ts']), ident(r['items_id'])),
+    }
+
+def find_touched_date_keys():
+    """找出上次运行以来新增或变更的订单/明细所属的 date_key；无水位线时返回 None（需全量）"""
+    orders_wm = get_watermark(WATERMARK_NAME, "orders")
+    items_wm = get_watermark(WATERMARK_NAME, "order_items")
+    if orders_wm == (None, None) or items_wm == (None, None):
+        return None
+    
+    sql = """
+    SELECT DISTINCT o.date_key
+    FROM dbo.orders o
+    WHERE o.id > %s OR o.updated_at > %s
+    UNION
+    SELECT DISTINCT o.date_key
+    FROM dbo.order_items oi
+    JOIN dbo.orders o ON o.id = oi.order_id
+    WHERE oi.id > %s OR oi.created_at > %s
     """
+    floor = dt.datetime(1900, 1, 1)
+    params = (orders_wm[1] if orders_wm[1] is not None else -1, lookback(orders_wm[0]) or floor,
+              items_wm[1] if items_wm[1] is not None else -1, lookback(items_wm[0]) or floor)
+    df = fetch_df(sql, DW, params=params)
+    if df.empty:
+        return []
+    return sorted(int(k) for k in df['date_key'].dropna().unique())
+
+def find_stale_date_keys():
+    """对账找出 fact_profit_daily 与订单不一致的 date_key（订单移出 / 删除后留下的旧门店日）"""
+    df = fetch_df(STALE_DATE_KEYS_SQL, DW)
+    if df.empty:
+        return []
+    return sorted(int(k) for k in df['date_key'].dropna().unique())
+
+def to_date_ranges(date_keys, max_ranges=MAX_DATE_RANGES):
+    """把 date_key 列表合并为连续日期闭区间 [(start, end)]"""
+    if not date_keys:
+        return []
+    days = pd.to_datetime(pd.Series(date_keys).astype(str), format='%Y%m%d').sort_values().reset_index(drop=True)
+    # 与前一天不连续处开始新区间
+    group = (days.diff() != pd.Timedelta(days=1)).cumsum()
+    ranges = [(int(g.iloc[0].strftime('%Y%m%d')), int(g.iloc[-1].strftime('%Y%m%d'))) for _, g in days.groupby(group)]
+    if len(ranges) > max_ranges:
+        ranges = [(ranges[0][0], ranges[-1][1])]
+    return ranges
+
+def advance_watermarks(high_water, rows_loaded):
+    """重算成功后推进水位线"""
+    if not high_water:
+        return
+    for source_table, (last_ts, last_id) in high_water.items():
+        set_watermark(WATERMARK_NAME, source_table, last_ts, last_id, rows_loaded)
+
+def calc_profit_daily(ranges=None):
+    """计算每日利润数据（ranges 为需要重算的 date_key 区间，None 表示全量）"""
+    logger.info("📊 开始计算每日利润数据...")
     
-    df = fetch_df(sql, DW)
+    sql, params = build_profit_agg_sql(ranges)
+    df = fetch_df(sql, DW, params=params or None)
     logger.info(f"✅ 每日利润数据计算完成: {len(df)} 条记录")
     return df
 
 def upsert_profit(df):
-    """更新或插入利润数据"""
+    """批量装载利润数据并执行一次集合化 MERGE，返回 {'inserted', 'updated', 'failed'}"""
+    stats = {'inserted': 0, 'updated': 0, 'failed': 0}
     if df.empty: 
         logger.warning("⚠️ 没有利润数据可处理")
-        return
+        return stats
     
     logger.info("💾 开始更新利润数据...")
     
-    # operating_exp 初期置 0；后续可外部表导入再合并
-    df['operating_exp'] = 0
+    df = df.copy()
+    df['revenue'] = pd.to_numeric(df['revenue'], errors='coerce').fillna(0)
+    df['cogs'] = pd.to_numeric(df['cogs'], errors='coerce').fillna(0)
+    
+    # 主键为空的行无法写入，计入失败
+    invalid = df['date_key'].isna() | df['store_id'].isna()
+    if invalid.any():
+        logger.warning(f"⚠️ {int(invalid.sum())} 条记录缺少 date_key/store_id，跳过")
+        stats['failed'] += int(invalid.sum())
+        df = df[~invalid]
+    df['date_key'] = df['date_key'].astype('int64')
+    df['store_id'] = df['store_id'].astype('int64')
     
+    # operating_exp 不在暂存数据中：新增行取表默认值 0，已有行保留外部导入的值
+    result = merge_df(df[['date_key', 'store_id', 'revenue', 'cogs']], "fact_profit_daily", DW,
+                      key_cols=['date_key', 'store_id'], update_cols=['revenue', 'cogs'], only_changed=True)
+    for key in stats:
+        stats[key] += result[key]
+    
+    logger.info(f"✅ 利润数据更新完成: 新增 {stats['inserted']}, 更新 {stats['updated']}, "
+                f"未变化 {len(df) - result['inserted'] - result['updated'] - result['failed']}, "
+                f"失败 {stats['failed']}")
+    return stats
+
+def zero_missing_profit(ranges=None):
+    """重算区间内聚合结果中已没有的门店日收入/成本清零，返回清零行数"""
+    where, params = "", ()
+    if ranges is not None:
+        where, params = range_predicate("T.date_key", ranges)
+        where = f"AND {where}"
     with get_conn(DW) as conn:
         cur = conn.cursor()
-        success_count = 0
-        
-        for _, r in df.iterrows():
-            try:
-                cur.execute("""
+        cur.execute(ZERO_MISSING_SQL.format(where=where), params or None)
+        zeroed = max(cur.rowcount, 0)
+        conn.commit()
+    if zeroed:
+        logger.info(f"🧹 {zeroed} 个门店日已没有订单，收入/成本清零")
+    return zeroed
+
+def upsert_profit_server_side(ranges=None):
+    """在服务端完成聚合并直接 MERGE，返回 {'inserted', 'updated', 'failed'}"""
+    logger.info("💾 开始服务端聚合并更新利润数据...")
+    
+    agg_sql, params = build_profit_agg_sql(ranges)
+    # 重算区间内聚合结果中已没有的门店日收入/成本清零
+    stale_filter, stale_params = "", ()
+    if ranges is not None:
+        stale_filter, stale_params = range_predicate("T.date_key", ranges)
+        stale_filter = f"AND {stale_filter}"
+    with get_conn(DW) as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+SET NOCOUNT ON;
+DECLARE @merge_actions TABLE (action nvarchar(10), zeroed bit);
 MERGE dbo.fact_profit_daily AS T
-USING (SELECT ? AS date_key, ? AS store_id) AS S
-ON (T.date_key=S.date_key AND T.store_id=S.store_id)
-WHEN MATCHED THEN UPDATE SET revenue=?, cogs=?, operating_exp=ISNULL(T.operating_exp,0)
-WHEN NOT MATCHED THEN INSERT (date_key, store_id, revenue, cogs, operating_exp)
-VALUES (S.date_key, S.store_id, ?, ?, 0);
-""", 
-                    int(r['date_key']), 
-                    int(r['store_id']),
-                    float(r['revenue'] or 0), 
-                    float(r['cogs'] or 0),
-                    float(r['revenue'] or 0), 
-                    float(r['cogs'] or 0)
-                )
-                success_count += 1
-            except Exception as e:
-                logger.warning(f"⚠️ 跳过行插入: {str(e)}")
-                continue
-        
+USING (
+    SELECT date_key, store_id, ISNULL(revenue, 0) AS revenue, ISNULL(cogs, 0) AS cogs
+    FROM ({agg_sql}) AS agg
+    WHERE date_key IS NOT NULL AND store_id IS NOT NULL
+) AS S
+ON (T.date_key = S.date_key AND T.store_id = S.store_id)
+WHEN MATCHED AND EXISTS (SELECT S.revenue, S.cogs EXCEPT SELECT T.revenue, T.cogs)
+  THEN UPDATE SET revenue = S.revenue, cogs = S.cogs
+WHEN NOT MATCHED BY TARGET THEN INSERT (date_key, store_id, revenue, cogs, operating_exp)
+  VALUES (S.date_key, S.store_id, S.revenue, S.cogs, 0)
+WHEN NOT MATCHED BY SOURCE AND (T.revenue <> 0 OR T.cogs <> 0) {stale_filter}
+  THEN UPDATE SET revenue = 0, cogs = 0
+OUTPUT $action, CASE WHEN S.date_key IS NULL THEN 1 ELSE 0 END INTO @merge_actions;
+SELECT
+  ISNULL(SUM(CASE WHEN action = 'INSERT' THEN 1 ELSE 0 END), 0),
+  ISNULL(SUM(CASE WHEN action = 'UPDATE' AND zeroed = 0 THEN 1 ELSE 0 END), 0),
+  ISNULL(SUM(CASE WHEN zeroed = 1 THEN 1 ELSE 0 END), 0)
+FROM @merge_actions;
+""", (params + stale_params) or None)
+        inserted, updated, zeroed = cur.fetchone()
         conn.commit()
-        logger.info(f"✅ 利润数据更新完成: {success_count} 条记录")
+    
+    stats = {'inserted': int(inserted), 'updated': int(updated), 'zeroed': int(zeroed), 'failed': 0}
+    logger.info(f"✅ 利润数据更新完成（服务端）: 新增 {stats['inserted']}, 更新 {stats['updated']}, "
+                f"清零 {stats['zeroed']}")
+    return stats
+
+def log_profit_summary():
+    """服务端模式下从事实表读取统计信息"""
+    df = fetch_df("""
+    SELECT COUNT(*) AS rows_cnt, AVG(revenue) AS avg_revenue, AVG(cogs) AS avg_cogs,
+           AVG(CASE WHEN revenue > 0 THEN (revenue - cogs) / revenue * 100 END) AS avg_margin
+    FROM dbo.fact_profit_daily
+    """, DW)
+    if df.empty:
+        return
+    r = df.iloc[0]
+    logger.info(f"📊 利润分析统计:")
+    logger.info(f"   - 事实表记录数: {int(r['rows_cnt'])}")
+    logger.info(f"   - 平均收入: {float(r['avg_revenue'] or 0):.2f}")
+    logger.info(f"   - 平均成本: {float(r['avg_cogs'] or 0):.2f}")
+    logger.info(f"   - 平均毛利率: {float(r['avg_margin'] or 0):.2f}%")
 
 def main():
     """主函数"""
     logger.info("🚀 开始ETL步骤06: 利润分析")
     
     try:
+        # 先记录高水位，重算期间新到的数据留给下次运行
+        high_water = capture_high_water()
+        
+        ranges = None
+        if not FULL_REFRESH:
+            touched = find_touched_date_keys()
+            if touched is not None:
+                stale = sorted(set(find_stale_date_keys()) - set(touched))
+                if stale:
+                    logger.info(f"🧹 {len(stale)} 个 date_key 的收入与订单不一致（订单改了日期/门店或被删除），一并重算")
+                touched = sorted(set(touched) | set(stale))
+                if not touched:
+                    logger.info("✅ 上次运行以来没有新增或变更的订单，无需重算")
+                    advance_watermarks(high_water, 0)
+                    return
+                ranges = to_date_ranges(touched)
+                logger.info(f"📅 增量重算 {len(touched)} 个 date_key，{len(ranges)} 个日期区间")
+        if ranges is None:
+            logger.info("📅 全量重建 fact_profit_daily")
+        
+        if SERVER_SIDE:
+            stats = upsert_profit_server_side(ranges)
+            advance_watermarks(high_water, stats['inserted'] + stats['updated'] + stats['zeroed'])
+            count = get_table_count(DW, "fact_profit_daily")
+            logger.info(f"🎉 ETL步骤06完成! fact_profit_daily表现在有 {count} 条记录")
+            log_profit_summary()
+            return
+        
         # 计算每日利润数据
-        df_profits = calc_profit_daily()
+        df_profits = calc_profit_daily(ranges)
+        
+        # 重算区间内已没有订单的门店日不在聚合结果中，单独清零
+        zeroed = zero_missing_profit(ranges)
         
         if df_profits.empty:
             logger.warning("⚠️ 没有数据可分析")
+            advance_watermarks(high_water, zeroed)
             return
         
         # 更新利润数据
-        upsert_profit(df_profits)
+        stats = upsert_profit(df_profits)
+        if stats['failed'] >= len(df_profits):
+            raise RuntimeError(f"利润数据写入失败: {stats['failed']} 条")
+        advance_watermarks(high_water, len(df_profits))
         
         # 验证结果
         count = get_table_count(DW, "fact_profit_daily")
@@ -102,10 +339,11 @@ def main():
         # 输出统计信息
         logger.info(f"📊 利润分析统计:")
         logger.info(f"   - 处理记录数: {len(df_profits)}")
+        logger.info(f"   - 新增/更新/失败: {stats['inserted']}/{stats['updated']}/{stats['failed']}")
         logger.info(f"   - 平均收入: {df_profits['revenue'].mean():.2f}")
         logger.info(f"   - 平均成本: {df_profits['cogs'].mean():.2f}")
         logger.info(f"   - 平均毛利率: {((df_profits['revenue'] - df_profits['cogs']) / df_profits['revenue'] * 100).mean():.2f}%")
-            
+    
     except Exception as e:
         logger.error(f"❌ ETL步骤06执行失败: {str(e)}")
         raise
@@ -1,6 +1,7 @@
 """
 ETL步骤07: 客户分群（RFM）
 基于OpenAI建议的优化版本
+评分由 lib.rfm 向量化计算，只把新客户和 segment_code 变化的客户批量 MERGE 到 dim_customer_segment
 """
 import sys
 import os
@@ -11,7 +12,8 @@ from pathlib import Path
 
 # 添加lib路径
 sys.path.append(str(Path(__file__).parent.parent))
-from lib.mssql import fetch_df, to_sql, get_conn, get_table_count, execute_sql
+from lib.mssql import fetch_df, merge_df, get_table_count
+from lib.rfm import score_rfm, changed_segments, DEFAULT_QUANTILES
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,31 +21,42 @@ logger = logging.getLogger(__name__)
 
 DW = "hotdog2030"
 
-def load_rfm():
+# RFM 分位数（评分 1 ~ q）
+RFM_QUANTILES = int(os.getenv('ETL_RFM_QUANTILES', str(DEFAULT_QUANTILES)))
+
+# 最近消费参考日期（YYYY-MM-DD），默认今天；只统计该日期及之前的订单
+RFM_REFERENCE_DATE = os.getenv('ETL_RFM_REFERENCE_DATE')
+
+def reference_date():
+    """解析RFM参考日期"""
+    if RFM_REFERENCE_DATE:
+        return dt.datetime.strptime(RFM_REFERENCE_DATE, '%Y-%m-%d').date()
+    return dt.date.today()
+
+def load_rfm(ref_date):
     """加载RFM数据"""
     logger.info("📊 开始加载RFM数据...")
     
     sql = """
     SELECT
       o.customer_id,
-      MAX(CONVERT(int, FORMAT(o.created_at,'yyyyMMdd'))) AS last_date_key,
+      MAX(o.date_key) AS last_date_key,
       COUNT(*) AS freq,
       SUM(o.total_amount) AS monetary
     FROM dbo.orders o
     WHERE o.customer_id IS NOT NULL
+    AND o.delflag = 0
+    AND o.created_at < %s
     GROUP BY o.customer_id
     """
     
-    df = fetch_df(sql, DW)
+    df = fetch_df(sql, DW, params=(dt.datetime.combine(ref_date + dt.timedelta(days=1), dt.time()),))
     logger.info(f"✅ RFM数据加载完成: {len(df)} 个客户")
     return df
 
-def qcut_to_score(s, q=5, ascending=True):
-    """分位数评分：1 ~ q"""
-    s = s.rank(method='first', ascending=ascending)  # 防止重复边界
-    bins = np.linspace(0, s.max(), q+1)
-    labels = list(range(1, q+1))
-    return pd.cut(s, bins=bins, labels=labels, include_lowest=True).astype(int)
+def load_current_segments():
+    """加载目标表中现有的分群结果，用于只写入发生变化的客户"""
+    return fetch_df("SELECT customer_id, segment_code FROM dbo.dim_customer_segment", DW)
 
 def main():
     """主函数"""
@@ -51,55 +64,32 @@ def main():
     
     try:
         # 加载RFM数据
-        df = load_rfm()
+        ref_date = reference_date()
+        df = load_rfm(ref_date)
         
         if df.empty:
             logger.warning("⚠️ 没有客户数据可分析")
             return
         
-        # R 越新越好：last_date_key 越大评分越高
-        df['r_score'] = qcut_to_score(df['last_date_key'], q=5, ascending=True)
-        # F/M 越大越好
-        df['f_score'] = qcut_to_score(df['freq'], q=5, ascending=False)
-        df['m_score'] = qcut_to_score(df['monetary'], q=5, ascending=False)
-        df['segment_code'] = df['r_score']*100 + df['f_score']*10 + df['m_score']
+        out = score_rfm(df, q=RFM_QUANTILES, reference_date=ref_date)
+        logger.info(f"📐 RFM评分完成: {RFM_QUANTILES} 分位，参考日期 {ref_date}")
         
-        out = df[['customer_id','r_score','f_score','m_score','segment_code']].copy()
+        # 只写入新客户和分群变化的客户
+        changed = changed_segments(out, load_current_segments())
+        logger.info(f"🔄 分群变化客户: {len(changed)} / {len(out)}")
         
-        # 写入数据库
-        logger.info("💾 开始写入客户分群结果...")
-        
-        with get_conn(DW) as conn:
-            cur = conn.cursor()
-            success_count = 0
-            
-            for _,r in out.iterrows():
-                try:
-                    cur.execute("""
-MERGE dbo.dim_customer_segment AS T
-USING (SELECT ? AS customer_id) AS S
-ON (T.customer_id=S.customer_id)
-WHEN MATCHED THEN UPDATE SET r_score=?, f_score=?, m_score=?, segment_code=?, updated_at=sysutcdatetime()
-WHEN NOT MATCHED THEN INSERT (customer_id, r_score, f_score, m_score, segment_code)
-VALUES (S.customer_id, ?, ?, ?, ?);
-""", 
-                        r['customer_id'], 
-                        int(r['r_score']), 
-                        int(r['f_score']), 
-                        int(r['m_score']), 
-                        int(r['segment_code']),
-                        int(r['r_score']), 
-                        int(r['f_score']), 
-                        int(r['m_score']), 
-                        int(r['segment_code'])
-                    )
-                    success_count += 1
-                except Exception as e:
-                    logger.warning(f"⚠️ 跳过客户分群: {str(e)}")
-                    continue
-            
-            conn.commit()
-            logger.info(f"✅ 客户分群数据更新完成: {success_count} 个客户")
+        if changed.empty:
+            logger.info("✅ 没有客户分群发生变化")
+        else:
+            # 写入数据库
+            logger.info("💾 开始写入客户分群结果...")
+            result = merge_df(changed[['customer_id', 'r_score', 'f_score', 'm_score', 'segment_code']],
+                              "dim_customer_segment", DW, key_cols=['customer_id'],
+                              update_extra={'updated_at': 'sysutcdatetime()'})
+            if result['failed'] >= len(changed):
+                raise RuntimeError("客户分群写入失败")
+            logger.info(f"✅ 客户分群数据更新完成: 新增 {result['inserted']}, 更新 {result['updated']}, "
+                        f"失败 {result['failed']}")
         
         # 验证结果
         count = get_table_count(DW, "dim_customer_segment")
@@ -117,7 +107,7 @@ VALUES (S.customer_id, ?, ?, ?, ?);
         logger.info(f"   - 主要分群分布:")
         for segment, count in segment_dist.items():
             logger.info(f"     {segment}: {count} 人")
-            
+    
     except Exception as e:
         logger.error(f"❌ ETL步骤07执行失败: {str(e)}")
         raise
@@ -1,24 +1,43 @@
 """
 ETL步骤08: 销量/营收预测
 基于OpenAI建议的优化版本
+门店模型通过 lib.forecast 在进程池中并行训练（ETL_FORECAST_WORKERS / ETL_FORECAST_MODEL_THREADS）
+ETL_FORECAST_MODE=global 时改用全部门店共用的全局模型（含城市/店龄/租金特征），新门店也能得到预测
+ETL_FORECAST_BACKTEST=1 时先留出最近 HORIZON 天对比两种模式的训练耗时与误差
+ETL_FORECAST_HORIZON 设置预测天数（1~90，默认7），同时输出 yhat_lower / yhat_upper 预测区间
+训练好的模型缓存在 ETL_FORECAST_CACHE_DIR（默认 etl/artifacts/forecast），新增数据不足 ETL_FORECAST_REFIT_DAYS 天
+且误差未漂移时直接加载预测；ETL_FORECAST_PREDICT_ONLY=1 只用缓存预测，ETL_FORECAST_CACHE=0 关闭缓存
 """
 import sys
 import os
 import pandas as pd
 import numpy as np
 import datetime as dt
+import time
 from pathlib import Path
 
 # 添加lib路径
 sys.path.append(str(Path(__file__).parent.parent))
-from lib.mssql import fetch_df, to_sql, get_conn, get_table_count, execute_sql
+from lib.mssql import fetch_df, merge_df, get_table_count
+from lib.forecast import (MIN_HISTORY_DAYS, PRED_COLUMNS, DEFAULT_STRATEGY, forecast_store, forecast_stores,
+                          split_stores, default_workers, default_model_threads, model_name, log_timings,
+                          validate_horizon, prepare_store_attrs, fit_or_load_global, forecast_origins,
+                          forecast_global, with_store_features, backtest_modes)
+from lib.model_cache import default_cache_dir, log_cache_stats
+from lib.features import build_features
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 DW = "hotdog2030"
-HORIZON = 7  # 预测未来7天
+
+# 预测天数
+HORIZON = validate_horizon(int(os.getenv('ETL_FORECAST_HORIZON', '7')))
+
+# 预测模式: per_store 每店一个模型 / global 全部门店一个模型
+FORECAST_MODE = os.getenv('ETL_FORECAST_MODE', 'per_store')
+RUN_BACKTEST = os.getenv('ETL_FORECAST_BACKTEST', '0') == '1'
 
 def load_store_daily():
     """加载门店每日销售数据"""
@@ -33,99 +52,66 @@ def load_store_daily():
     logger.info(f"✅ 门店每日销售数据加载完成: {len(df)} 条记录")
     return df
 
+def load_store_attrs():
+    """加载门店属性（城市、开业日期、租金），供全局模型使用"""
+    base = "SELECT id AS store_id, city, rent_amount, is_close, {open_col} AS open_date FROM dbo.stores WHERE delflag = 0"
+    # open_date 由 scripts/update_store_open_dates.py 回填，缺失时退回 created_at
+    df = fetch_df(base.format(open_col="COALESCE(open_date, created_at)"), DW)
+    if df.empty:
+        df = fetch_df(base.format(open_col="created_at"), DW)
+    if df.empty:
+        logger.warning("⚠️ 未加载到门店属性，全局模型将不使用门店特征")
+        return None
+    logger.info(f"✅ 门店属性加载完成: {len(df)} 个门店")
+    return prepare_store_attrs(df)
+
+def forecast_with_global_model(df, attrs):
+    """全局模式：一次训练覆盖全部门店（含历史较短的新门店）"""
+    threads = default_model_threads(1)
+    train = with_store_features(df, attrs)
+    logger.info(f"🤖 准备全局模型: {train['store_id'].nunique()} 个门店，{len(train)} 行，{threads} 线程")
+    models, info = fit_or_load_global(train, HORIZON, threads=threads, cache_dir=default_cache_dir())
+    if 'cache' in info:
+        logger.info(f"🗃️ 全局模型缓存: {info['cache']}，加载 {info['load_s'] * 1000:.1f}ms")
+    
+    start = time.perf_counter()
+    origins = forecast_origins(df, attrs, include_new_stores=True)
+    preds = forecast_global(models, origins, attrs, HORIZON)
+    logger.info(f"⏱️ 全局模型: 训练 {info['fit_s']:.2f}s（{len(models)} 个模型），预测 {time.perf_counter() - start:.2f}s，"
+                f"覆盖 {len(origins)} 个门店 × {HORIZON} 天")
+    return preds
+
 def make_features(df):
-    """创建特征工程"""
+    """创建特征工程（移动平均/滞后/指数加权/日历特征，缺失的门店-日按 0 补齐后计算）"""
     logger.info("🔧 开始特征工程...")
     
-    df = df.copy()
-    df['date'] = pd.to_datetime(df['date_key'].astype(str))
-    df = df.sort_values(['store_id','date'])
+    start = time.perf_counter()
+    df = build_features(df)
     
-    # 移动平均特征
-    for w in [7,14,28]:
-        df[f'rev_ma_{w}'] = df.groupby('store_id')['revenue'].transform(lambda s: s.rolling(w, min_periods=1).mean())
-    
-    # 时间特征
-    df['dow'] = df['date'].dt.weekday
-    
-    df = df.dropna()
-    logger.info(f"✅ 特征工程完成: {len(df)} 条记录")
+    logger.info(f"✅ 特征工程完成: {len(df)} 条记录，{df['store_id'].nunique()} 个门店，"
+                f"耗时 {time.perf_counter() - start:.2f}s")
     return df
 
 def forecast_per_store(g):
-    """为单个门店生成预测"""
-    try:
-        # 尝试使用XGBoost
-        from xgboost import XGBRegressor
-        MODEL = "xgboost"
-    except Exception:
-        # 回退到sklearn
-        from sklearn.ensemble import HistGradientBoostingRegressor
-        def XGBRegressor(**kw): return HistGradientBoostingRegressor()
-        MODEL = "hgb"
-    
-    X = g[['rev_ma_7','rev_ma_14','rev_ma_28','dow']]
-    y = g['revenue']
-    
-    model = XGBRegressor(n_estimators=300, max_depth=6, learning_rate=0.05)
-    model.fit(X, y)
-    
-    # 逐日滚动预测简单版：用最后一日特征近似
-    last = g.iloc[-1:].copy()
-    preds = []
-    base_date = pd.to_datetime(str(int(last['date_key'].iloc[0])), format='%Y%m%d')
-    ma7, ma14, ma28 = last[['rev_ma_7','rev_ma_14','rev_ma_28']].values[0]
-    
-    for i in range(1, HORIZON+1):
-        d = base_date + dt.timedelta(days=i)
-        dow = d.weekday()
-        Xf = [[ma7, ma14, ma28, dow]]
-        yhat = float(model.predict(Xf)[0])
-        preds.append((int(d.strftime('%Y%m%d')), int(g['store_id'].iloc[0]), yhat))
-        
-        # 简单滚动：把预测纳入 ma7/14/28
-        ma7 = (ma7*6 + yhat)/7
-        ma14 = (ma14*13 + yhat)/14
-        ma28 = (ma28*27 + yhat)/28
-    
+    """为单个门店生成预测，返回 (date_key, store_id, yhat, yhat_lower, yhat_upper)"""
+    preds, _ = forecast_store(g, HORIZON)
     return preds
 
-def write_preds(rows):
-    """写入预测结果"""
+def write_preds(rows, model_label):
+    """写入预测结果（批量暂存 + 一次 MERGE）"""
     if not rows: 
         logger.warning("⚠️ 没有预测结果可写入")
         return
     
     logger.info("💾 开始写入预测结果...")
     
-    try:
-        from xgboost import XGBRegressor
-        MODEL = "xgboost"
-    except Exception:
-        MODEL = "hgb"
-    
-    with get_conn(DW) as conn:
-        cur = conn.cursor()
-        success_count = 0
-        
-        for date_key, store_id, yhat in rows:
-            try:
-                cur.execute("""
-MERGE dbo.fact_forecast_daily AS T
-USING (SELECT ? AS date_key, ? AS store_id) AS S
-ON (T.date_key=S.date_key AND T.store_id=S.store_id)
-WHEN MATCHED THEN UPDATE SET yhat=?, model_name=?, created_at=sysutcdatetime()
-WHEN NOT MATCHED THEN INSERT (date_key, store_id, yhat, model_name) VALUES (?, ?, ?, ?);
-""", 
-                    date_key, store_id, yhat, MODEL, date_key, store_id, yhat, MODEL
-                )
-                success_count += 1
-            except Exception as e:
-                logger.warning(f"⚠️ 跳过预测写入: {str(e)}")
-                continue
-        
-        conn.commit()
-        logger.info(f"✅ 预测结果写入完成: {success_count} 条记录")
+    df = pd.DataFrame(rows, columns=PRED_COLUMNS)
+    df['model_name'] = model_label
+    result = merge_df(df, "fact_forecast_daily", DW, key_cols=['date_key', 'store_id'],
+                      update_extra={'created_at': 'sysutcdatetime()'})
+    if result['failed'] >= len(df):
+        raise RuntimeError("预测结果写入失败")
+    logger.info(f"✅ 预测结果写入完成: 新增 {result['inserted']}, 更新 {result['updated']}, 失败 {result['failed']}")
 
 def main():
     """主函数"""
@@ -146,15 +132,29 @@ def main():
             logger.warning("⚠️ 特征工程后没有数据可预测")
             return
         
-        # 为每个门店生成预测
-        all_preds = []
-        for _, g in df.groupby('store_id'):
-            if len(g) < 30:  # 数据太少跳过
-                continue
-            all_preds += forecast_per_store(g)
+        df['store_id'] = df['store_id'].astype('int64')
+        attrs = load_store_attrs() if (FORECAST_MODE == 'global' or RUN_BACKTEST) else None
+        
+        if RUN_BACKTEST:
+            backtest_modes(df, attrs, holdout_days=HORIZON)
+        
+        if FORECAST_MODE == 'global':
+            all_preds = forecast_with_global_model(df, attrs)
+        else:
+            # 为每个门店并行生成预测（数据太少的门店跳过）
+            groups = split_stores(df, MIN_HISTORY_DAYS)
+            workers = min(default_workers(), max(1, len(groups)))
+            threads = default_model_threads(workers)
+            logger.info(f"🤖 开始训练 {len(groups)} 个门店模型: {workers} 进程 × {threads} 线程")
+            start = time.perf_counter()
+            all_preds, timings = forecast_stores(groups, HORIZON, workers=workers, threads=threads,
+                                                 cache_dir=default_cache_dir())
+            log_timings(timings, time.perf_counter() - start, workers, threads)
+            log_cache_stats(timings)
         
         # 写入预测结果
-        write_preds(all_preds)
+        strategy = 'direct' if FORECAST_MODE == 'global' else DEFAULT_STRATEGY
+        write_preds(all_preds, f"{model_name()}-{FORECAST_MODE}-{strategy}")
         
         # 验证结果
         count = get_table_count(DW, "fact_forecast_daily")
@@ -167,7 +167,7 @@ def main():
             avg_pred = np.mean([pred[2] for pred in all_preds])
             logger.info(f"   - 平均预测金额: {avg_pred:.2f}")
             logger.info(f"   - 预测门店数: {len(set([pred[1] for pred in all_preds]))}")
-            
+    
     except Exception as e:
         logger.error(f"❌ ETL步骤08执行失败: {str(e)}")
         raise
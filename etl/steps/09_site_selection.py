@@ -1,17 +1,25 @@
 """
 ETL步骤09: 选址评分
 基于OpenAI建议的优化版本
+候选点坐标解析自 Rg_SeekShop.location，现有门店（dbo.stores 经纬度）建立空间索引（lib.spatial）：
+- 一次批量查询得到每个候选点 ETL_SITE_RADII_KM（默认 0.5,1,3）半径内的门店数与最近门店
+- 蚕食度按 ETL_SITE_CANNIBAL_RADIUS_KM（默认 3km）内门店的距离衰减加权
+- 候选点城市取 ETL_SITE_CITY_MATCH_KM（默认 30km）内最近门店的城市，坐标缺失时退回地址前两个字
+评分逻辑在 lib.site_scoring.SiteScorer 中，与 score_candidates.py 批量评分接口共用
 """
 import sys
 import os
 import pandas as pd
 import numpy as np
 import datetime as dt
+import time
 from pathlib import Path
 
 # 添加lib路径
 sys.path.append(str(Path(__file__).parent.parent))
-from lib.mssql import fetch_df, to_sql, get_conn, get_table_count, execute_sql
+from lib.mssql import fetch_df, merge_df, get_table_count
+from lib.spatial import parse_radii, radius_column
+from lib.site_scoring import SiteScorer, STORES_SQL, CITY_PERF_SQL, CITY_DENSITY_SQL
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,6 +28,13 @@ logger = logging.getLogger(__name__)
 WX = "cyrgweixin"
 DW = "hotdog2030"
 
+# 邻近门店统计半径与蚕食半径（km）
+RADII_KM = parse_radii(os.getenv('ETL_SITE_RADII_KM'))
+CANNIBAL_RADIUS_KM = float(os.getenv('ETL_SITE_CANNIBAL_RADIUS_KM', '3'))
+
+# 最近门店在该距离内时，候选点城市取该门店的城市
+CITY_MATCH_KM = float(os.getenv('ETL_SITE_CITY_MATCH_KM', '30'))
+
 def load_candidates():
     """加载选址候选点数据"""
     logger.info("📊 开始加载选址候选点数据...")
@@ -35,14 +50,7 @@ def city_perf():
     """获取城市表现数据"""
     logger.info("📊 开始加载城市表现数据...")
     
-    sql = """
-    SELECT s.city, AVG(d.revenue) AS city_avg_revenue
-    FROM dbo.stores s
-    JOIN dbo.vw_sales_store_daily d ON d.store_id = s.id
-    GROUP BY s.city
-    """
-    
-    df = fetch_df(sql, DW)
+    df = fetch_df(CITY_PERF_SQL, DW)
     logger.info(f"✅ 城市表现数据加载完成: {len(df)} 个城市")
     return df
 
@@ -50,12 +58,18 @@ def store_density():
     """获取门店密度数据"""
     logger.info("📊 开始加载门店密度数据...")
     
-    sql = "SELECT city, COUNT(*) AS store_cnt FROM dbo.stores GROUP BY city"
-    
-    df = fetch_df(sql, DW)
+    df = fetch_df(CITY_DENSITY_SQL, DW)
     logger.info(f"✅ 门店密度数据加载完成: {len(df)} 个城市")
     return df
 
+def load_stores():
+    """加载营业中门店的城市与经纬度，用于建立空间索引"""
+    logger.info("📊 开始加载门店坐标数据...")
+    
+    df = fetch_df(STORES_SQL, DW)
+    logger.info(f"✅ 门店坐标数据加载完成: {len(df)} 个门店")
+    return df
+
 def main():
     """主函数"""
     logger.info("🚀 开始ETL步骤09: 选址评分")
@@ -68,37 +82,29 @@ def main():
             logger.warning("⚠️ 没有候选选址点数据")
             return
         
-        # 加载城市表现和密度数据
-        perf = city_perf()
-        dens = store_density()
+        # 加载城市表现、密度与门店坐标，构建共享的批量评分器
+        scorer = SiteScorer(load_stores(), city_perf(), store_density(),
+                            radii_km=RADII_KM, cannibal_radius_km=CANNIBAL_RADIUS_KM, city_match_km=CITY_MATCH_KM)
         
-        # 合并数据
-        df = cand.merge(perf, how='left', left_on=None, right_on=None)
-        
-        # 粗略城市提取：从 address 或 name 中提取城市关键词（示例简化）
-        df['city'] = df['address'].str.slice(0,2)  # 你可替换为更准确的城市解析
-        df = df.merge(perf, how='left', on='city').merge(dens, how='left', on='city')
-        
-        # 规则：match_score 高=好（有城市均值→给较高基础分）
-        df['match_score'] = df['city_avg_revenue'].fillna(df['city_avg_revenue'].median() if 'city_avg_revenue' in df else 0)
-        
-        # 规则：同城门店越多，蚕食越高（0~1 之间）
-        max_cnt = df['store_cnt'].max() if 'store_cnt' in df and df['store_cnt'].notna().any() else 1
-        df['cannibal_score'] = (df['store_cnt'] / max_cnt).fillna(0)
-        
-        # 归一化
-        if df['match_score'].max() > 0:
-            df['match_score'] = df['match_score'] / df['match_score'].max()
-        
-        df['total_score'] = 0.6*df['match_score'] + 0.4*(1 - df['cannibal_score'])
-        df['rationale'] = "同城历史营收匹配 + 门店密度校正（越稀疏越优）"
+        # 一次调用完成全部候选点的匹配、蚕食与总评分
+        start = time.perf_counter()
+        df = scorer.score(cand)
+        logger.info(f"✅ 候选点评分完成: {len(df)} 个候选点（有效坐标 {int(df['nearest_km'].notna().sum())} 个），"
+                    f"耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
         
         # 准备输出数据
         out = df[['candidate_id','city','match_score','cannibal_score','total_score','rationale']].copy()
+        out['candidate_id'] = pd.to_numeric(out['candidate_id'], errors='coerce')
+        out = out.dropna(subset=['candidate_id']).drop_duplicates('candidate_id', keep='last')
+        out['candidate_id'] = out['candidate_id'].astype('int64')
+        for col in ('match_score', 'cannibal_score', 'total_score'):
+            out[col] = out[col].astype(float).round(4)
         
-        # 写入数据库
+        # 写入数据库（按 candidate_id 合并，重跑时更新评分）
         logger.info("💾 开始写入选址评分结果...")
-        success = to_sql(out, "dfact_site_score", DW, if_exists='append')
+        result = merge_df(out, "fact_site_score", DW, key_cols=['candidate_id'],
+                          update_extra={'created_at': 'sysutcdatetime()'})
+        success = result['failed'] < len(out)
         
         if success:
             # 验证结果
@@ -107,10 +113,12 @@ def main():
             
             # 输出统计信息
             logger.info(f"📊 选址评分统计:")
-            logger.info(f"   - 分析候选点数: {len(out)}")
+            logger.info(f"   - 分析候选点数: {len(out)}（新增 {result['inserted']}，更新 {result['updated']}）")
             logger.info(f"   - 平均匹配评分: {out['match_score'].mean():.4f}")
             logger.info(f"   - 平均蚕食评分: {out['cannibal_score'].mean():.4f}")
             logger.info(f"   - 平均总评分: {out['total_score'].mean():.4f}")
+            for r in RADII_KM:
+                logger.info(f"   - {r:g}km 内平均门店数: {df[radius_column(r)].mean():.2f}")
             
             # 输出高分候选点
             top_candidates = out.nlargest(5, 'total_score')
@@ -119,7 +127,7 @@ def main():
                 logger.info(f"     ID {candidate['candidate_id']}: {candidate['total_score']:.4f}")
         else:
             logger.error("❌ 数据写入失败")
-            
+    
     except Exception as e:
         logger.error(f"❌ ETL步骤09执行失败: {str(e)}")
         raise
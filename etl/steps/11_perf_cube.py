@@ -0,0 +1,59 @@
+"""
+ETL步骤11: 区域业绩立方体
+按 省/市/区/月 汇总营收、订单数、门店数与客单价到 hotdog2030.fact_perf_cube_monthly，
+供选址评分（步骤09）与仪表板读取
+只重建上次运行以来订单发生变化的月份；设置 ETL_FULL_REFRESH=1 时全量重建
+"""
+import sys
+import os
+from pathlib import Path
+
+# 添加lib路径
+sys.path.append(str(Path(__file__).parent.parent))
+from lib.mssql import get_table_count
+from lib.perf_cube import refresh_perf_cube, load_rollup, CUBE_TABLE
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DW = "hotdog2030"
+
+# 忽略水位线，全量重建
+FULL_REFRESH = os.getenv('ETL_FULL_REFRESH', '0') == '1'
+
+def log_cube_summary():
+    """输出各城市汇总"""
+    cities = load_rollup('city', database=DW)
+    if cities.empty:
+        return
+    cities = cities.sort_values('revenue', ascending=False)
+    logger.info(f"📊 区域业绩统计:")
+    logger.info(f"   - 城市数: {len(cities)}")
+    logger.info(f"   - 总营收: {float(cities['revenue'].sum()):.2f}")
+    logger.info(f"   - 营收前5城市:")
+    for _, row in cities.head(5).iterrows():
+        logger.info(f"     {row['province']} {row['city']}: 营收 {float(row['revenue']):.2f}，"
+                    f"订单 {int(row['orders_cnt'])}，客单价 {float(row['avg_ticket'] or 0):.2f}")
+
+def main():
+    """主函数"""
+    logger.info("🚀 开始ETL步骤11: 区域业绩立方体")
+    
+    try:
+        result = refresh_perf_cube(full=FULL_REFRESH, database=DW)
+        if result['mode'] == 'noop':
+            return
+        
+        # 验证结果
+        count = get_table_count(DW, CUBE_TABLE)
+        logger.info(f"🎉 ETL步骤11完成! {CUBE_TABLE}表现在有 {count} 条记录"
+                    f"（本次{'全量' if result['mode'] == 'full' else '增量'}写入 {result['rows']} 行）")
+        log_cube_summary()
+    
+    except Exception as e:
+        logger.error(f"❌ ETL步骤11执行失败: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -1,152 +1,395 @@
 #!/usr/bin/env python3
 """
-基于实际数据的机器学习模型优化（简化版）
-使用真实的意向铺位数据训练更准确的选址预测模型
+基于实际数据的机器学习模型优化
+从 hotdog2030（或导出的 Parquet 快照）加载意向铺位特征与已开门店的实际营收，训练选址预测模型，
+输出 ml_models/*.json，结构与 OptimizedMLPredictionService.js 读取的一致：
+- score:      五项子评分的非负权重（和为 1），交叉验证搜索使营收预测 R² 最高的组合
+- revenue:    月营收 = intercept + coefficient × score 的线性回归
+- confidence: 置信度 = base_confidence + score_factor × score / 100，拟合营收预测的样本外准确度
+- risk:       score 的 low / medium 阈值，交叉验证选取分类准确率最高的一组
+
+意向铺位与 300 米（--match-km）内已开业门店配对，以门店实际月营收作为标签；
+配对样本不足 --min-labeled 时退回意向铺位的 predicted_revenue / confidence_score / risk_level
+
+特征矩阵一次构建，每折的一元回归用闭式解对一批候选配置同时计算；
+超参数（评分权重、营收标签截断分位数）由 lib.param_search 在进程池中按墙钟预算搜索：
+默认逐次减半（少折数初筛、逐轮加折），也可选随机搜索（早停）或网格搜索，每个试验记录到 ml_models/search_trials.jsonl
+
+用法:
+    python ml_model_optimizer.py                               # 从 hotdog2030 加载
+    python ml_model_optimizer.py --export-snapshot snapshot/   # 从数据库导出快照（Parquet，需 pyarrow）
+    python ml_model_optimizer.py --snapshot snapshot/ --jobs 8 # 离线从快照训练
+    python ml_model_optimizer.py --search random --budget 30   # 随机搜索，30 秒预算
 """
 
+import argparse
+import itertools
 import json
+import logging
 import os
-import numpy as np
+import sys
+import time
 from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).parent
+sys.path.append(str(ROOT / 'etl'))
+from lib.spatial import StoreIndex, parse_location, finalize_coordinates
+from lib.param_search import (TrialLog, random_search, successive_halving, halving_resources,
+                              STRATEGIES)
+
+SCORE_FEATURES = ['poi_density_score', 'traffic_score', 'population_score', 'competition_score', 'rental_cost_score']
+RISK_LEVELS = ['low', 'medium', 'high']
+
+DW = "hotdog2030"
+
+CANDIDATES_SQL = """
+SELECT id AS candidate_id, shop_name, province, city, district, location, longitude, latitude,
+       rent_amount, area_size, analysis_score,
+       poi_density_score, traffic_score, population_score, competition_score, rental_cost_score,
+       predicted_revenue, confidence_score, risk_level
+FROM dbo.candidate_locations
+WHERE delflag = 0
+"""
+
+# 门店月营收 = 日均营收 × 30（fact_profit_daily 为门店-日营收）
+STORES_SQL = """
+SELECT s.id AS store_id, s.city, s.district, s.longitude, s.latitude,
+       p.revenue_days, p.revenue * 30.0 / NULLIF(p.revenue_days, 0) AS monthly_revenue
+FROM dbo.stores s
+LEFT JOIN (
+  SELECT store_id, SUM(revenue) AS revenue, COUNT(*) AS revenue_days
+  FROM dbo.fact_profit_daily
+  GROUP BY store_id
+) p ON p.store_id = s.id
+WHERE s.delflag = 0
+"""
+
+# 门店至少有这么多天营收才作为标签
+MIN_REVENUE_DAYS = 30
+
+DEFAULT_JOBS = int(os.getenv('ML_OPTIMIZER_JOBS', str(os.cpu_count() or 1)))
+
+# 搜索墙钟预算（秒）
+DEFAULT_BUDGET = float(os.getenv('ML_SEARCH_BUDGET', '60'))
+
+# 营收回归拟合前对标签的截断分位数候选（0 为不截断），抑制个别异常门店对系数的影响
+WINSOR_CHOICES = (0.0, 0.01, 0.025, 0.05)
+
+TRIALS_FILE = 'search_trials.jsonl'
+
+
+def simplex_grid(n_features, step):
+    """和为 1、步长为 step 的全部非负权重组合，返回 (组合数, n_features)"""
+    units = int(round(1 / step))
+    rows = [c for c in itertools.product(range(units + 1), repeat=n_features - 1) if sum(c) <= units]
+    grid = np.array([list(c) + [units - sum(c)] for c in rows], dtype='float64')
+    return grid / units
+
+
+def make_folds(n, k, seed=42):
+    """打乱后切分的 k 折，返回每个样本所属折号"""
+    fold = np.empty(n, dtype='int64')
+    fold[np.random.default_rng(seed).permutation(n)] = np.arange(n) % k
+    return fold
+
+
+def winsorize(y, q):
+    """把 y 截断到 [q, 1-q] 分位数，q=0 时原样返回"""
+    if not q:
+        return y
+    low, high = np.quantile(y, [q, 1 - q])
+    return np.clip(y, low, high)
+
+
+def cv_linear_r2(s, y, fold, n_folds=None, winsor=0.0):
+    """对每一列得分做 y ~ a + b·s 的 k 折交叉验证，返回 (样本外 R², 样本外预测)
+    
+    s: (n, m) 个候选得分，全部候选在每折中用同一组矩阵运算求闭式解
+    n_folds: 只用前 n_folds 折作测试折（逐次减半的低资源评估），R² 按这些折的样本计算
+    winsor: 拟合前把训练折的 y 截断到 [winsor, 1-winsor] 分位数，评估仍用原始 y
+    """
+    s = np.asarray(s, dtype='float64')
+    if s.ndim == 1:
+        s = s[:, None]
+    pred = np.full_like(s, np.nan)
+    folds = np.unique(fold)
+    for f in folds[:n_folds] if n_folds else folds:
+        train, test = fold != f, fold == f
+        s_tr, y_tr = s[train], winsorize(y[train], winsor)
+        s_mean, y_mean = s_tr.mean(axis=0), y_tr.mean()
+        s_c = s_tr - s_mean
+        var = (s_c ** 2).sum(axis=0)
+        b = np.divide(s_c.T @ (y_tr - y_mean), var, out=np.zeros_like(var), where=var > 0)
+        a = y_mean - b * s_mean
+        pred[test] = a + s[test] * b
+    used = ~np.isnan(pred[:, 0])
+    y_used = y[used]
+    sse = ((y_used[:, None] - pred[used]) ** 2).sum(axis=0)
+    sst = ((y_used - y_used.mean()) ** 2).sum()
+    return 1 - sse / sst if sst > 0 else np.zeros(s.shape[1]), pred
+
+
+# 搜索子进程共享的训练数据，由进程池 initializer 一次性传入
+_search_data = {}
+
+
+def _init_search_worker(X, y, fold):
+    _search_data.update(X=X, y=y, fold=fold)
+
+
+def config_weights(config):
+    return np.array([config[name] for name in SCORE_FEATURES], dtype='float64')
+
+
+def search_objective(configs, resource):
+    """一批配置（五项权重 + winsor）的交叉验证 R²；相同 winsor 的配置合并为一次矩阵运算"""
+    X, y, fold = _search_data['X'], _search_data['y'], _search_data['fold']
+    scores = np.empty(len(configs))
+    by_winsor = {}
+    for i, config in enumerate(configs):
+        by_winsor.setdefault(config.get('winsor', 0.0), []).append(i)
+    for q, idx in by_winsor.items():
+        W = np.array([config_weights(configs[i]) for i in idx])
+        r2, _ = cv_linear_r2(X @ W.T, y, fold, n_folds=resource, winsor=q)
+        scores[idx] = r2
+    return scores
+
+
+def make_config(weights, winsor=0.0):
+    config = dict(zip(SCORE_FEATURES, np.round(weights, 4).tolist()))
+    config['winsor'] = float(winsor)
+    return config
+
+
+def random_sampler(seed=42, alpha=1.0):
+    """随机配置：权重取 Dirichlet(alpha) 分布（和为 1），winsor 从 WINSOR_CHOICES 中随机选；首个配置为等权基线"""
+    rng = np.random.default_rng(seed)
+    state = {'first': True}
+    
+    def sample(n):
+        weights = rng.dirichlet(np.full(len(SCORE_FEATURES), alpha), size=n)
+        winsor = rng.choice(WINSOR_CHOICES, size=n)
+        configs = [make_config(w, q) for w, q in zip(weights, winsor)]
+        if state['first'] and configs:
+            configs[0] = make_config(np.full(len(SCORE_FEATURES), 1 / len(SCORE_FEATURES)))
+            state['first'] = False
+        return configs
+    
+    return sample
+
+
+def grid_sampler(step):
+    """网格配置：simplex_grid × WINSOR_CHOICES，按顺序分批取出直到耗尽"""
+    grid = simplex_grid(len(SCORE_FEATURES), step)
+    total = len(grid) * len(WINSOR_CHOICES)
+    state = {'pos': 0}
+    
+    def sample(n):
+        idx = range(state['pos'], min(state['pos'] + n, total))
+        state['pos'] += len(idx)
+        return [make_config(grid[i % len(grid)], WINSOR_CHOICES[i // len(grid)]) for i in idx]
+    
+    return sample
+
+
+def classify_risk(score, medium, low):
+    """score >= low 为 low，>= medium 为 medium，否则 high；medium/low 可为阈值数组（逐列判定）"""
+    score = np.asarray(score, dtype='float64')[:, None]
+    return np.where(score >= low, 0, np.where(score >= medium, 1, 2))
+
+
+def best_thresholds(score, labels, candidates):
+    """在候选 (medium, low) 阈值对中选准确率最高的一组"""
+    pairs = np.array([(m, l) for m, l in itertools.combinations(candidates, 2)])
+    if not len(pairs):
+        return (float(candidates[0]), float(candidates[0])), 0.0
+    acc = (classify_risk(score, pairs[:, 0], pairs[:, 1]) == labels[:, None]).mean(axis=0)
+    i = int(acc.argmax())
+    return (float(pairs[i, 0]), float(pairs[i, 1])), float(acc[i])
+
 
 class SiteSelectionMLOptimizer:
-    def __init__(self):
+    def __init__(self, snapshot=None, model_dir=None, jobs=DEFAULT_JOBS, folds=5, grid_step=0.05,
+                 match_km=0.3, min_labeled=30, search='halving', budget=DEFAULT_BUDGET, trials=None,
+                 eta=3, patience=5, seed=42):
+        self.snapshot = Path(snapshot) if snapshot else None
+        self.model_dir = Path(model_dir) if model_dir else ROOT / 'ml_models'
+        self.jobs = max(1, jobs)
+        self.folds = folds
+        self.grid_step = grid_step
+        self.match_km = match_km
+        self.min_labeled = min_labeled
+        if search not in STRATEGIES:
+            raise ValueError(f"不支持的搜索策略: {search}")
+        self.search = search
+        self.budget = budget
+        # halving 为初始配置数，random 为最多试验数
+        self.trials = trials or (6561 if search == 'halving' else 20000)
+        self.eta = eta
+        self.patience = patience
+        self.seed = seed
         self.models = {}
         self.model_performance = {}
         self.feature_importance = {}
-        
+        self.timings = {}
+    
+    @staticmethod
+    def _read_table(directory, name):
+        """快照表：优先 Parquet，其次 CSV"""
+        for suffix, reader in (('.parquet', pd.read_parquet), ('.csv', pd.read_csv)):
+            path = directory / f'{name}{suffix}'
+            if path.exists():
+                return reader(path)
+        raise FileNotFoundError(f"快照中缺少 {name}.parquet / {name}.csv: {directory}")
+    
+    def load_tables(self):
+        """读取意向铺位与门店营收原始表"""
+        if self.snapshot:
+            print(f"📦 从快照加载: {self.snapshot}")
+            return self._read_table(self.snapshot, 'candidates'), self._read_table(self.snapshot, 'stores')
+        from lib.mssql import fetch_df
+        print(f"🗄️ 从 {DW} 加载意向铺位与门店营收...")
+        return fetch_df(CANDIDATES_SQL, DW), fetch_df(STORES_SQL, DW)
+    
+    def export_snapshot(self, directory):
+        """把数据库中的训练原始表导出为 Parquet 快照"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        candidates, stores = self.load_tables()
+        candidates.to_parquet(directory / 'candidates.parquet', index=False)
+        stores.to_parquet(directory / 'stores.parquet', index=False)
+        print(f"✅ 快照已导出到 {directory}: 意向铺位 {len(candidates)} 条，门店 {len(stores)} 条")
+    
     def load_real_data(self):
-        """加载真实的意向铺位数据"""
+        """加载意向铺位特征，并与附近已开业门店的实际月营收配对"""
         print("📊 加载真实数据...")
-        
-        # 基于我们同步的271条数据生成训练数据
-        cities = ['北京市', '上海市', '广州市', '深圳市', '大连市', '沈阳市', '未知']
-        districts = ['朝阳区', '海淀区', '浦东新区', '天河区', '南山区', '甘井子区', '未知']
-        risk_levels = ['low', 'medium', 'high']
-        
-        np.random.seed(42)
-        n_samples = 271
-        
-        data = []
-        for i in range(n_samples):
-            # 基础特征
-            city = np.random.choice(cities)
-            district = np.random.choice(districts)
-            rent_amount = np.random.uniform(1000, 50000)
-            area_size = np.random.uniform(20, 200)
-            
-            # 基于城市和区域的评分特征
-            if city in ['北京市', '上海市']:
-                base_score = np.random.uniform(60, 90)
-                poi_density = np.random.uniform(70, 95)
-                traffic_score = np.random.uniform(80, 100)
-                population_score = np.random.uniform(75, 95)
-            elif city in ['广州市', '深圳市']:
-                base_score = np.random.uniform(55, 85)
-                poi_density = np.random.uniform(60, 90)
-                traffic_score = np.random.uniform(70, 95)
-                population_score = np.random.uniform(65, 90)
-            else:
-                base_score = np.random.uniform(40, 75)
-                poi_density = np.random.uniform(40, 80)
-                traffic_score = np.random.uniform(50, 85)
-                population_score = np.random.uniform(45, 80)
-            
-            competition_score = np.random.uniform(60, 95)
-            rental_cost_score = max(0, 100 - (rent_amount / 500))
-            
-            # 计算总分
-            overall_score = (poi_density * 0.2 + 
-                           traffic_score * 0.2 + 
-                           population_score * 0.2 + 
-                           competition_score * 0.2 + 
-                           rental_cost_score * 0.2)
-            
-            # 预测收入（基于评分）
-            predicted_revenue = base_score * 1000 + np.random.normal(0, 10000)
-            predicted_revenue = max(10000, predicted_revenue)
-            
-            # 置信度（基于数据质量）
-            confidence_score = min(0.95, max(0.6, overall_score / 100 + np.random.normal(0, 0.1)))
-            
-            # 风险等级
-            if overall_score >= 80:
-                risk_level = 'low'
-            elif overall_score >= 60:
-                risk_level = 'medium'
-            else:
-                risk_level = 'high'
-            
-            data.append({
-                'shop_name': f'店铺_{i+1}',
-                'province': '未知',
-                'city': city,
-                'district': district,
-                'rent_amount': rent_amount,
-                'area_size': area_size,
-                'analysis_score': overall_score,
-                'predicted_revenue': predicted_revenue,
-                'confidence_score': confidence_score,
-                'risk_level': risk_level,
-                'poi_density_score': poi_density,
-                'traffic_score': traffic_score,
-                'population_score': population_score,
-                'competition_score': competition_score,
-                'rental_cost_score': rental_cost_score
-            })
-        
-        self.data = data
-        print(f"✅ 加载了 {len(self.data)} 条真实数据")
+        start = time.perf_counter()
+        candidates, stores = self.load_tables()
+        
+        df = candidates.copy()
+        for col in SCORE_FEATURES + ['rent_amount', 'area_size', 'analysis_score', 'predicted_revenue',
+                                     'confidence_score', 'longitude', 'latitude']:
+            df[col] = pd.to_numeric(df[col], errors='coerce') if col in df else np.nan
+        df = df.dropna(subset=SCORE_FEATURES).reset_index(drop=True)
+        
+        # 候选点坐标：经纬度列缺失时解析 location 文本
+        lng, lat = finalize_coordinates(df['longitude'], df['latitude'])
+        if 'location' in df:
+            p_lng, p_lat = parse_location(df['location'])
+            missing = np.isnan(lng)
+            lng, lat = np.where(missing, p_lng, lng), np.where(missing, p_lat, lat)
+        
+        stores = stores.copy()
+        stores['monthly_revenue'] = pd.to_numeric(stores['monthly_revenue'], errors='coerce')
+        days = pd.to_numeric(stores.get('revenue_days'), errors='coerce')
+        stores = stores[(stores['monthly_revenue'] > 0) & (days.fillna(0) >= MIN_REVENUE_DAYS)]
+        index = StoreIndex(pd.to_numeric(stores['longitude'], errors='coerce'),
+                           pd.to_numeric(stores['latitude'], errors='coerce'),
+                           store_ids=stores['store_id'].to_numpy())
+        spatial = index.score(lng, lat, radii_km=(self.match_km,), cannibal_radius_km=self.match_km)
+        matched = spatial['nearest_km'].to_numpy() <= self.match_km
+        revenue = stores.drop_duplicates('store_id').set_index('store_id')['monthly_revenue']
+        df['store_id'] = np.where(matched, spatial['nearest_store_id'], np.nan)
+        df['actual_revenue'] = df['store_id'].map(revenue)
+        
+        labeled = df['actual_revenue'].notna()
+        if labeled.sum() >= self.min_labeled:
+            self.target = 'store_actual'
+            self.data = df[labeled].reset_index(drop=True)
+            self.y = self.data['actual_revenue'].to_numpy(dtype='float64')
+        else:
+            # 已开业配对样本不足，退回意向铺位自身的营收估计
+            self.target = 'candidate_estimate'
+            self.data = df[df['predicted_revenue'].notna()].reset_index(drop=True)
+            self.y = self.data['predicted_revenue'].to_numpy(dtype='float64')
+        if len(self.data) < self.folds * 2:
+            raise ValueError(f"可用训练样本过少: {len(self.data)} 条（意向铺位 {len(candidates)} 条，"
+                             f"配对门店 {int(labeled.sum())} 条）")
+        
+        self.X = self.data[SCORE_FEATURES].to_numpy(dtype='float64')
+        self.fold = make_folds(len(self.data), self.folds)
+        self.timings['load'] = time.perf_counter() - start
+        print(f"✅ 加载了 {len(candidates)} 条意向铺位，{int(labeled.sum())} 条与已开业门店配对，"
+              f"训练样本 {len(self.data)} 条（标签: {self.target}）")
         return self.data
     
-    def train_simple_models(self):
-        """训练简化的机器学习模型"""
+    def risk_labels(self):
+        """风险标签：实际营收按三分位划分（高营收为 low），无实际营收时用意向铺位的 risk_level"""
+        if self.target == 'store_actual':
+            low_cut, high_cut = np.quantile(self.y, [1 / 3, 2 / 3])
+            return np.where(self.y >= high_cut, 0, np.where(self.y >= low_cut, 1, 2)), np.ones(len(self.y), bool)
+        level = self.data['risk_level'].astype(str).str.lower() if 'risk_level' in self.data \
+            else pd.Series('', index=self.data.index)
+        labels = level.map({name: i for i, name in enumerate(RISK_LEVELS)})
+        return labels.fillna(-1).to_numpy(dtype='int64'), labels.notna().to_numpy()
+    
+    def train_simple_models(self, weights=None, winsor=0.0):
+        """按给定评分权重（默认等权）与营收标签截断分位数训练营收、置信度与风险模型"""
         print("🤖 开始训练机器学习模型...")
+        start = time.perf_counter()
+        w = np.full(len(SCORE_FEATURES), 1 / len(SCORE_FEATURES)) if weights is None else np.asarray(weights)
+        score = self.X @ w
         
-        # 计算特征统计
-        scores = [item['analysis_score'] for item in self.data]
-        revenues = [item['predicted_revenue'] for item in self.data]
-        confidences = [item['confidence_score'] for item in self.data]
-        
-        # 1. 收入预测模型（基于评分的线性回归）
-        score_revenue_corr = np.corrcoef(scores, revenues)[0, 1]
+        # 1. 收入预测模型（评分的一元线性回归，R² 为样本外）
+        cv_r2, oof = cv_linear_r2(score, self.y, self.fold, winsor=winsor)
+        coefficient, intercept = np.polyfit(score, winsorize(self.y, winsor), 1)
         revenue_model = {
             'type': 'linear_regression',
-            'coefficient': score_revenue_corr,
-            'intercept': np.mean(revenues) - score_revenue_corr * np.mean(scores),
-            'r2': score_revenue_corr ** 2
+            'coefficient': float(coefficient),
+            'intercept': float(intercept),
+            'winsor_quantile': float(winsor),
+            'r2': float(cv_r2[0])
         }
         
-        # 2. 评分预测模型（基于特征的加权平均）
+        # 2. 评分模型（五项子评分加权）
         score_model = {
             'type': 'weighted_average',
-            'weights': {
-                'poi_density_score': 0.2,
-                'traffic_score': 0.2,
-                'population_score': 0.2,
-                'competition_score': 0.2,
-                'rental_cost_score': 0.2
-            },
-            'r2': 0.85  # 模拟R²值
+            'weights': {name: float(round(v, 4)) for name, v in zip(SCORE_FEATURES, w)},
+            'r2': float(cv_r2[0])
         }
         
-        # 3. 置信度预测模型
+        # 3. 置信度模型：拟合营收预测的样本外准确度；无实际营收时拟合意向铺位的 confidence_score
+        if self.target == 'store_actual':
+            conf_y = np.clip(1 - np.abs(self.y - oof[:, 0]) / np.maximum(np.abs(self.y), 1e-9), 0, 1)
+            conf_ok = np.ones(len(conf_y), bool)
+        else:
+            conf_y = self.data['confidence_score'].to_numpy(dtype='float64')
+            conf_ok = ~np.isnan(conf_y)
+        if conf_ok.sum() >= self.folds * 2:
+            conf_r2, _ = cv_linear_r2(score[conf_ok] / 100, conf_y[conf_ok], self.fold[conf_ok])
+            score_factor, base_confidence = np.polyfit(score[conf_ok] / 100, conf_y[conf_ok], 1)
+        else:
+            conf_r2, score_factor, base_confidence = np.zeros(1), 0.3, 0.7
         confidence_model = {
             'type': 'sigmoid',
-            'base_confidence': 0.7,
-            'score_factor': 0.3,
-            'r2': 0.78
+            'base_confidence': float(base_confidence),
+            'score_factor': float(score_factor),
+            'r2': float(conf_r2[0])
         }
         
-        # 4. 风险等级分类模型
+        # 4. 风险等级阈值：候选阈值取评分分位点，训练折选阈值、测试折评估
+        labels, ok = self.risk_labels()
+        candidates = np.unique(np.round(np.quantile(score, np.linspace(0.05, 0.95, 19)), 2))
+        hits = 0
+        for f in np.unique(self.fold):
+            train, test = ok & (self.fold != f), ok & (self.fold == f)
+            if not train.any() or not test.any():
+                continue
+            (medium, low), _ = best_thresholds(score[train], labels[train], candidates)
+            hits += int((classify_risk(score[test], medium, low)[:, 0] == labels[test]).sum())
+        (medium, low), _ = best_thresholds(score[ok], labels[ok], candidates) if ok.any() else ((60.0, 80.0), 0.0)
         risk_model = {
             'type': 'threshold',
             'thresholds': {
-                'low': 80,
-                'medium': 60,
+                'low': low,
+                'medium': medium,
                 'high': 0
             },
-            'accuracy': 0.92
+            'accuracy': float(hits / ok.sum()) if ok.any() else 0.0
         }
         
         self.models = {
@@ -156,7 +399,7 @@ class SiteSelectionMLOptimizer:
             'risk': risk_model
         }
         
-        # 模型性能
+        # 模型性能（均为样本外指标）
         self.model_performance = {
             'revenue': {'r2': revenue_model['r2'], 'model': 'LinearRegression'},
             'score': {'r2': score_model['r2'], 'model': 'WeightedAverage'},
@@ -164,79 +407,106 @@ class SiteSelectionMLOptimizer:
             'risk': {'accuracy': risk_model['accuracy'], 'model': 'Threshold'}
         }
         
-        # 特征重要性
         self.feature_importance = {
-            'revenue': {
-                'analysis_score': 0.8,
-                'rent_amount': 0.1,
-                'area_size': 0.05,
-                'city': 0.05
-            },
+            'revenue': self.revenue_importance(),
             'score': score_model['weights']
         }
-        
-        print("✅ 所有模型训练完成")
-        
+        self.timings['train'] = self.timings.get('train', 0) + time.perf_counter() - start
+        print(f"✅ 所有模型训练完成（收入 R² {revenue_model['r2']:.3f}，风险准确率 {risk_model['accuracy']:.3f}）")
+    
+    def revenue_importance(self):
+        """营收多元线性回归的标准化系数绝对值占比（子评分、租金、面积、城市均值编码）"""
+        cols = {name: self.X[:, i] for i, name in enumerate(SCORE_FEATURES)}
+        for name in ('rent_amount', 'area_size'):
+            values = self.data[name].to_numpy(dtype='float64')
+            cols[name] = np.where(np.isnan(values), np.nanmedian(values) if (~np.isnan(values)).any() else 0, values)
+        if 'city' in self.data:
+            city_mean = pd.Series(self.y).groupby(self.data['city'].fillna('未知').to_numpy()).transform('mean')
+            cols['city'] = city_mean.to_numpy()
+        names = list(cols)
+        Z = np.column_stack([cols[n] for n in names])
+        std = Z.std(axis=0)
+        Z = np.divide(Z - Z.mean(axis=0), std, out=np.zeros_like(Z), where=std > 0)
+        coef, *_ = np.linalg.lstsq(np.column_stack([np.ones(len(Z)), Z]), self.y, rcond=None)
+        weight = np.abs(coef[1:])
+        total = weight.sum()
+        return {n: float(round(v / total, 4)) if total > 0 else 0.0 for n, v in zip(names, weight)}
+    
     def optimize_hyperparameters(self):
-        """超参数优化"""
-        print("🔍 开始超参数优化...")
-        
-        # 优化收入预测模型
-        best_r2 = self.model_performance['revenue']['r2']
-        optimized_revenue_model = self.models['revenue'].copy()
-        
-        # 尝试不同的权重组合
-        weight_combinations = [
-            {'poi': 0.25, 'traffic': 0.25, 'population': 0.25, 'competition': 0.15, 'rental': 0.1},
-            {'poi': 0.2, 'traffic': 0.3, 'population': 0.2, 'competition': 0.2, 'rental': 0.1},
-            {'poi': 0.15, 'traffic': 0.2, 'population': 0.3, 'competition': 0.2, 'rental': 0.15}
-        ]
-        
-        best_weights = None
-        best_score_r2 = 0
-        
-        for weights in weight_combinations:
-            # 模拟不同权重组合的评分
-            simulated_r2 = 0.8 + np.random.normal(0, 0.05)
-            if simulated_r2 > best_score_r2:
-                best_score_r2 = simulated_r2
-                best_weights = weights
-        
-        if best_weights:
-            optimized_score_model = self.models['score'].copy()
-            optimized_score_model['weights'] = best_weights
-            optimized_score_model['r2'] = best_score_r2
-            
-            self.models['score_optimized'] = optimized_score_model
-            self.model_performance['score_optimized'] = {
-                'r2': best_score_r2,
-                'best_weights': best_weights
-            }
-            
-            print(f"最佳评分模型权重: {best_weights}")
-            print(f"最佳交叉验证得分: {best_score_r2:.3f}")
+        """超参数优化：在墙钟预算内并行搜索评分权重与营收标签截断分位数，以最佳配置重新训练
         
+        - halving: 随机配置先用 1 折评估，每轮保留前 1/eta 并增加折数，最后一轮为完整 k 折
+        - random:  随机配置分批完整 k 折评估，连续 patience 轮无提升时早停
+        - grid:    步长 grid_step 的权重网格 × 截断分位数，逐批完整 k 折评估
+        每个试验写入 ml_models/search_trials.jsonl
+        """
+        print("🔍 开始超参数优化...")
+        start = time.perf_counter()
+        run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+        log = TrialLog(str(self.model_dir / TRIALS_FILE), run_id, self.search)
+        common = dict(jobs=self.jobs, budget_s=self.budget, initializer=_init_search_worker,
+                      initargs=(self.X, self.y, self.fold), log=log)
+        try:
+            if self.search == 'halving':
+                summary = successive_halving(search_objective, random_sampler(self.seed),
+                                             halving_resources(self.folds, self.eta), n_configs=self.trials,
+                                             eta=self.eta, **common)
+            elif self.search == 'random':
+                summary = random_search(search_objective, random_sampler(self.seed), self.folds,
+                                        max_trials=self.trials, patience=self.patience, **common)
+            else:
+                summary = random_search(search_objective, grid_sampler(self.grid_step), self.folds,
+                                        max_trials=10 ** 9, patience=0, strategy='grid', **common)
+        finally:
+            log.close()
+        self.timings['search'] = time.perf_counter() - start
+        
+        baseline = self.model_performance['score']['r2']
+        best = summary['best_params']
+        self.search_summary = {
+            **summary,
+            'run_id': run_id,
+            'folds': self.folds,
+            'jobs': self.jobs,
+            'baseline_r2': baseline,
+            'trials_log': TRIALS_FILE
+        }
+        print(f"📐 {summary['trials']} 个试验（{self.search}，{self.jobs} 个进程，预算 {self.budget:g}s），"
+              f"耗时 {self.timings['search']:.2f}s，停止原因: {summary['stopped']}")
+        
+        # 低资源轮次的得分不可与基线直接比较，以完整 k 折重新训练后的 R² 为准
+        if best is not None:
+            previous = (self.models, self.model_performance, self.feature_importance)
+            self.train_simple_models(config_weights(best), best.get('winsor', 0.0))
+            if self.model_performance['score']['r2'] > baseline:
+                print(f"最佳评分模型权重: {self.models['score']['weights']}，"
+                      f"营收截断分位数: {best.get('winsor', 0.0):g}")
+            else:
+                self.models, self.model_performance, self.feature_importance = previous
+                print("等权重已是最优，保留基线模型")
+        print(f"最佳交叉验证得分: {self.model_performance['score']['r2']:.3f}")
+    
     def save_models(self):
         """保存训练好的模型"""
         print("💾 保存模型...")
         
-        model_dir = 'ml_models'
+        model_dir = self.model_dir
         os.makedirs(model_dir, exist_ok=True)
         
         # 保存模型
-        with open(f'{model_dir}/models.json', 'w', encoding='utf-8') as f:
+        with open(model_dir / 'models.json', 'w', encoding='utf-8') as f:
             json.dump(self.models, f, ensure_ascii=False, indent=2)
         
         # 保存模型性能
-        with open(f'{model_dir}/model_performance.json', 'w', encoding='utf-8') as f:
+        with open(model_dir / 'model_performance.json', 'w', encoding='utf-8') as f:
             json.dump(self.model_performance, f, ensure_ascii=False, indent=2)
         
         # 保存特征重要性
-        with open(f'{model_dir}/feature_importance.json', 'w', encoding='utf-8') as f:
+        with open(model_dir / 'feature_importance.json', 'w', encoding='utf-8') as f:
             json.dump(self.feature_importance, f, ensure_ascii=False, indent=2)
         
         print(f"✅ 模型已保存到 {model_dir} 目录")
-        
+    
     def generate_model_report(self):
         """生成模型报告"""
         print("📋 生成模型报告...")
@@ -245,11 +515,15 @@ class SiteSelectionMLOptimizer:
             'training_time': datetime.now().isoformat(),
             'data_summary': {
                 'total_samples': len(self.data),
-                'features_count': 9,
-                'target_variables': ['revenue', 'score', 'confidence', 'risk']
+                'features_count': len(self.feature_importance.get('revenue', {})),
+                'target_variables': ['revenue', 'score', 'confidence', 'risk'],
+                'revenue_target': self.target,
+                'cv_folds': self.folds
             },
             'model_performance': self.model_performance,
             'feature_importance': self.feature_importance,
+            'hyperparameter_search': getattr(self, 'search_summary', None),
+            'timings': {k: round(v, 3) for k, v in self.timings.items()},
             'recommendations': []
         }
         
@@ -264,8 +538,11 @@ class SiteSelectionMLOptimizer:
         else:
             report['recommendations'].append("评分预测模型需要优化")
         
+        if self.target != 'store_actual':
+            report['recommendations'].append("与已开业门店配对的样本不足，模型基于意向铺位的营收估计训练")
+        
         # 保存报告
-        with open('ml_models/model_report.json', 'w', encoding='utf-8') as f:
+        with open(self.model_dir / 'model_report.json', 'w', encoding='utf-8') as f:
             json.dump(report, f, ensure_ascii=False, indent=2)
         
         print("✅ 模型报告已生成")
@@ -322,12 +599,12 @@ class OptimizedMLPredictionService {
 
 module.exports = OptimizedMLPredictionService;
 '''
-        
-        with open('ml_models/OptimizedMLPredictionService.js', 'w', encoding='utf-8') as f:
+
+        with open(self.model_dir / 'OptimizedMLPredictionService.js', 'w', encoding='utf-8') as f:
             f.write(api_code)
         
         print("✅ 预测API接口已创建")
-        
+    
     def run_optimization(self):
         """运行完整的模型优化流程"""
         print("🚀 开始机器学习模型优化...")
@@ -336,7 +613,7 @@ module.exports = OptimizedMLPredictionService;
         # 1. 加载数据
         self.load_real_data()
         
-        # 2. 训练模型
+        # 2. 训练模型（等权重基线）
         self.train_simple_models()
         
         # 3. 超参数优化
@@ -362,6 +639,35 @@ module.exports = OptimizedMLPredictionService;
         
         return report
 
+
+def main():
+    parser = argparse.ArgumentParser(description="选址预测模型训练与超参数优化")
+    parser.add_argument('--snapshot', help="离线训练：快照目录（candidates / stores 的 .parquet 或 .csv）")
+    parser.add_argument('--export-snapshot', help="从数据库导出 Parquet 快照到该目录后退出")
+    parser.add_argument('--output-dir', help="模型输出目录，默认 ml_models/")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help="交叉验证并行进程数（ML_OPTIMIZER_JOBS）")
+    parser.add_argument('--folds', type=int, default=5, help="交叉验证折数")
+    parser.add_argument('--search', choices=STRATEGIES, default='halving', help="超参数搜索策略")
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help="搜索墙钟预算（秒，ML_SEARCH_BUDGET）")
+    parser.add_argument('--trials', type=int, help="halving 的初始配置数（默认 6561）/ random 的最多试验数（默认 20000）")
+    parser.add_argument('--eta', type=int, default=3, help="逐次减半每轮保留 1/eta")
+    parser.add_argument('--patience', type=int, default=5, help="随机搜索连续多少轮无提升时早停")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--grid-step', type=float, default=0.05, help="网格搜索的评分权重步长")
+    parser.add_argument('--match-km', type=float, default=0.3, help="意向铺位与已开业门店的配对距离（km）")
+    parser.add_argument('--min-labeled', type=int, default=30, help="使用门店实际营收所需的最少配对样本数")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
+    optimizer = SiteSelectionMLOptimizer(snapshot=args.snapshot, model_dir=args.output_dir, jobs=args.jobs,
+                                         folds=args.folds, grid_step=args.grid_step, match_km=args.match_km,
+                                         min_labeled=args.min_labeled, search=args.search, budget=args.budget,
+                                         trials=args.trials, eta=args.eta, patience=args.patience, seed=args.seed)
+    if args.export_snapshot:
+        optimizer.export_snapshot(args.export_snapshot)
+        return
+    return optimizer.run_optimization()
+
+
 if __name__ == '__main__':
-    optimizer = SiteSelectionMLOptimizer()
-    report = optimizer.run_optimization()
\ No newline at end of file
+    main()
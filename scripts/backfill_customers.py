@@ -4,8 +4,12 @@
 补齐 hotdog2030.customers 中缺失的客户姓名 / 手机号，并写入不存在的客户。
 """
 
+import sys
+from pathlib import Path
 from textwrap import dedent
-import pymssql
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "etl"))
+from lib.mssql import MSSQLConnector  # noqa: E402
 
 RDS_CONFIG = {
     "server": "rm-uf660d00xovkm30678o.sqlserver.rds.aliyuncs.com",
@@ -116,57 +120,62 @@ def run_set_based_backfill():
         """
     )
 
-    conn = pymssql.connect(**RDS_CONFIG)
-    cur = conn.cursor()
+    connector = MSSQLConnector(
+        host=RDS_CONFIG["server"],
+        port=RDS_CONFIG["port"],
+        user=RDS_CONFIG["user"],
+        password=RDS_CONFIG["password"],
+    )
+    with connector.get_conn(RDS_CONFIG["database"]) as conn:
+        cur = conn.cursor()
 
-    print(">>> Running UPDATE to backfill missing names/phones...")
-    cur.execute(update_sql)
-    print(f"Updated rows: {cur.rowcount}")
-    conn.commit()
+        print(">>> Running UPDATE to backfill missing names/phones...")
+        cur.execute(update_sql)
+        print(f"Updated rows: {cur.rowcount}")
+        conn.commit()
 
-    print(">>> Inserting new customers that only存在于源系统...")
-    cur.execute(insert_sql)
-    print(f"Inserted rows: {cur.rowcount}")
-    conn.commit()
+        print(">>> Inserting new customers that only存在于源系统...")
+        cur.execute(insert_sql)
+        print(f"Inserted rows: {cur.rowcount}")
+        conn.commit()
 
-    cleanup_sql = [
-        """
-        UPDATE c
-        SET customer_name = NULL
-        FROM customers c
-        WHERE customer_name IS NOT NULL
-          AND (
-            customer_name LIKE N'%店长%'
-            OR customer_name LIKE N'%经理%'
-            OR EXISTS (
-                SELECT 1 FROM stores s
-                WHERE s.director IS NOT NULL
-                  AND LTRIM(RTRIM(s.director)) = LTRIM(RTRIM(c.customer_name))
-            )
-          );
-        """,
-        """
-        UPDATE c
-        SET phone = NULL
-        FROM customers c
-        WHERE phone IS NOT NULL
-          AND (
-            LEN(phone) < 6
-            OR EXISTS (
-                SELECT 1 FROM stores s
-                WHERE s.director_phone IS NOT NULL
-                  AND LTRIM(RTRIM(s.director_phone)) = LTRIM(RTRIM(c.phone))
-            )
-          );
-        """
-    ]
+        cleanup_sql = [
+            """
+            UPDATE c
+            SET customer_name = NULL
+            FROM customers c
+            WHERE customer_name IS NOT NULL
+              AND (
+                customer_name LIKE N'%店长%'
+                OR customer_name LIKE N'%经理%'
+                OR EXISTS (
+                    SELECT 1 FROM stores s
+                    WHERE s.director IS NOT NULL
+                      AND LTRIM(RTRIM(s.director)) = LTRIM(RTRIM(c.customer_name))
+                )
+              );
+            """,
+            """
+            UPDATE c
+            SET phone = NULL
+            FROM customers c
+            WHERE phone IS NOT NULL
+              AND (
+                LEN(phone) < 6
+                OR EXISTS (
+                    SELECT 1 FROM stores s
+                    WHERE s.director_phone IS NOT NULL
+                      AND LTRIM(RTRIM(s.director_phone)) = LTRIM(RTRIM(c.phone))
+                )
+              );
+            """
+        ]
 
-    for sql_stmt in cleanup_sql:
-        cur.execute(sql_stmt)
-        conn.commit()
+        for sql_stmt in cleanup_sql:
+            cur.execute(sql_stmt)
+            conn.commit()
 
-    cur.close()
-    conn.close()
+        cur.close()
     print("✅ Set-based backfill complete.")
 
 
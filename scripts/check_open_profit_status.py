@@ -2,8 +2,12 @@
 Quick diagnostic script to verify store open dates and order profit backfill status.
 """
 
-import pymssql
+import sys
 from contextlib import closing
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "etl"))
+from lib.mssql import MSSQLConnector  # noqa: E402
 
 DB_CONFIG = {
     "server": "rm-uf660d00xovkm30678o.sqlserver.rds.aliyuncs.com",
@@ -24,14 +28,12 @@ def fetch_all(cursor, query: str):
 
 
 def main():
-    with closing(
-        pymssql.connect(
-            host=DB_CONFIG["server"],
-            user=DB_CONFIG["user"],
-            password=DB_CONFIG["password"],
-            database=DB_CONFIG["database"],
-        )
-    ) as conn:
+    connector = MSSQLConnector(
+        host=DB_CONFIG["server"],
+        user=DB_CONFIG["user"],
+        password=DB_CONFIG["password"],
+    )
+    with connector.get_conn(DB_CONFIG["database"]) as conn:
         with closing(conn.cursor(as_dict=True)) as cursor:
             store_summary = fetch_one(
                 cursor,
@@ -4,9 +4,13 @@ import logging
 import sys
 import time
 import threading
+from pathlib import Path
 
 import pymssql
 
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'etl'))
+from lib.mssql import MSSQLConnector  # noqa: E402
+
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 
 CONFIG = {
@@ -32,16 +36,18 @@ def timeout_handler():
     sys.exit(1)
 
 
-def get_conn(db: str) -> pymssql.Connection:
-    conn = pymssql.connect(
-        server=CONFIG['server'],
-        port=CONFIG['port'],
-        user=CONFIG['user'],
-        password=CONFIG['password'],
-        database=db,
-        timeout=CONFIG['timeout'],
-    )
-    return conn
+CONNECTOR = MSSQLConnector(
+    host=CONFIG['server'],
+    port=CONFIG['port'],
+    user=CONFIG['user'],
+    password=CONFIG['password'],
+    timeout=CONFIG['timeout'],
+)
+
+
+def get_conn(db: str):
+    """Borrow a connection from the shared ETL connection pool."""
+    return CONNECTOR.get_conn(db)
 
 
 def ensure_staging(conn: pymssql.Connection):
@@ -158,18 +164,16 @@ def main():
     
     try:
         logging.info('开始利润同步...')
-        conn = get_conn('hotdog2030')
-        
-        logging.info('准备临时表...')
-        ensure_staging(conn)
-        
-        logging.info('聚合利润数据（这可能需要几分钟）...')
-        insert_all_sources(conn)
-        
-        logging.info('更新订单利润字段...')
-        apply_profit_update(conn)
+        with get_conn('hotdog2030') as conn:
+            logging.info('准备临时表...')
+            ensure_staging(conn)
+            
+            logging.info('聚合利润数据（这可能需要几分钟）...')
+            insert_all_sources(conn)
+            
+            logging.info('更新订单利润字段...')
+            apply_profit_update(conn)
         
-        conn.close()
         timeout_timer.cancel()  # 取消超时
         elapsed = time.time() - start_time
         logging.info(f'✅ 利润同步完成! (耗时 {elapsed:.1f} 秒)')
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 """Sync store opening dates from cyrg2025/cyrgweixin Shop tables into hotdog2030.stores.open_date."""
 import logging
+import sys
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, Optional
 
-import pymssql
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'etl'))
+from lib.mssql import MSSQLConnector  # noqa: E402
 
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 
@@ -30,17 +33,20 @@ SOURCE_QUERIES = {
 }
 
 
-def get_conn(db: str) -> pymssql.Connection:
-    return pymssql.connect(server=CONFIG['server'], port=CONFIG['port'], user=CONFIG['user'], password=CONFIG['password'], database=db)
+CONNECTOR = MSSQLConnector(host=CONFIG['server'], port=CONFIG['port'], user=CONFIG['user'], password=CONFIG['password'])
+
+
+def get_conn(db: str):
+    """Borrow a connection from the shared ETL connection pool."""
+    return CONNECTOR.get_conn(db)
 
 
 def fetch_open_dates(database: str, query: str) -> Dict[int, datetime]:
     logging.info('Fetching shop opening info from %s ...', database)
-    conn = get_conn(database)
-    cursor = conn.cursor(as_dict=True)
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
+    with get_conn(database) as conn:
+        cursor = conn.cursor(as_dict=True)
+        cursor.execute(query)
+        rows = cursor.fetchall()
     mapping: Dict[int, datetime] = {}
     for row in rows:
         store_id = row['store_id']
@@ -58,26 +64,25 @@ def update_hotdog(open_dates: Dict[int, datetime]):
     if not open_dates:
         logging.warning('No open dates to update.')
         return
-    conn = get_conn('hotdog2030')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM stores WITH (NOLOCK)')
-    existing_ids = {row[0] for row in cursor.fetchall()}
-
-    updates = []
-    missing = []
-    for store_id, open_date in open_dates.items():
-        if store_id in existing_ids:
-            updates.append((open_date, store_id))
-        else:
-            missing.append(store_id)
-
-    logging.info('Updating %s stores with open_date ...', len(updates))
-    if updates:
-        cursor.executemany('UPDATE stores SET open_date=%s WHERE id=%s', updates)
-        conn.commit()
-    if missing:
-        logging.warning('No matching store IDs in hotdog2030 for %s entries (showing first 10): %s', len(missing), missing[:10])
-    conn.close()
+    with get_conn('hotdog2030') as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM stores WITH (NOLOCK)')
+        existing_ids = {row[0] for row in cursor.fetchall()}
+
+        updates = []
+        missing = []
+        for store_id, open_date in open_dates.items():
+            if store_id in existing_ids:
+                updates.append((open_date, store_id))
+            else:
+                missing.append(store_id)
+
+        logging.info('Updating %s stores with open_date ...', len(updates))
+        if updates:
+            cursor.executemany('UPDATE stores SET open_date=%s WHERE id=%s', updates)
+            conn.commit()
+        if missing:
+            logging.warning('No matching store IDs in hotdog2030 for %s entries (showing first 10): %s', len(missing), missing[:10])
 
 
 def main():
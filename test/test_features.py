@@ -0,0 +1,55 @@
+"""
+门店日特征测试：第 t 天的特征不能依赖第 t 天的营收（训练时的目标）
+
+运行: python -m pytest -q test/test_features.py
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent / "etl"))
+from lib.features import build_features, feature_columns
+
+
+def sales(revenue_override=None):
+    rng = np.random.default_rng(3)
+    days = pd.date_range('2025-01-01', periods=60)
+    rows = []
+    for store_id in (1, 2):
+        # 留出空缺日，覆盖补 0 的自然日窗口
+        for day in days[rng.random(len(days)) > 0.2]:
+            rows.append((int(day.strftime('%Y%m%d')), store_id, float(rng.integers(100, 1000))))
+    df = pd.DataFrame(rows, columns=['date_key', 'store_id', 'revenue'])
+    if revenue_override:
+        for (date_key, store_id), value in revenue_override.items():
+            df.loc[(df['date_key'] == date_key) & (df['store_id'] == store_id), 'revenue'] = value
+    return df
+
+
+def test_features_do_not_depend_on_same_day_revenue():
+    base = build_features(sales())
+    t = base[base['store_id'] == 1].iloc[30]
+    key = (int(t['date_key']), 1)
+    changed = build_features(sales({key: t['revenue'] * 10 + 12345}))
+
+    cols = feature_columns()
+    row = (base['date_key'] == key[0]) & (base['store_id'] == 1)
+    pd.testing.assert_frame_equal(base.loc[row, cols].reset_index(drop=True),
+                                  changed.loc[row, cols].reset_index(drop=True))
+
+    # 之后的日期应当看到这次变化
+    later = (base['date_key'] > key[0]) & (base['store_id'] == 1)
+    assert not np.allclose(base.loc[later, 'rev_ma_7'].iloc[0], changed.loc[later, 'rev_ma_7'].iloc[0])
+    assert not np.allclose(base.loc[later, 'rev_ewm_7'].iloc[0], changed.loc[later, 'rev_ewm_7'].iloc[0])
+
+
+def test_rolling_mean_uses_previous_days():
+    df = pd.DataFrame({'date_key': [20250101, 20250102, 20250104], 'store_id': [1, 1, 1],
+                       'revenue': [10.0, 20.0, 40.0]})
+    f = build_features(df, keep_filled=True)
+    # 首日没有历史；01-04 的 7 日窗口为 01-01~01-03（01-03 补 0）
+    assert np.isnan(f['rev_ma_7'].iloc[0])
+    assert f['rev_ma_7'].tolist()[1:] == [10.0, 15.0, 10.0]
+    assert np.isnan(f['rev_ewm_7'].iloc[0])
@@ -0,0 +1,99 @@
+"""
+多源库主键归属测试：订单 / 明细 id 与 order_id 在两个源库间重叠时的去向
+源库查询用内存中的有效 id 集合替代，不需要连接数据库
+
+运行: python -m pytest -q test/test_source_priority.py
+"""
+import sys
+import importlib.util
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+ETL_DIR = Path(__file__).parent.parent / "etl"
+sys.path.append(str(ETL_DIR))
+from lib import source_priority
+
+
+def load_step(name):
+    spec = importlib.util.spec_from_file_location(name.replace('.py', ''), ETL_DIR / "steps" / name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# 各源库有效行的 id：Orders / OrderGoods
+LIVE = {
+    "cyrg2025": {"Orders": {100, 101}, "OrderGoods": {1, 4}},
+    "cyrgweixin": {"Orders": {100, 200}, "OrderGoods": {1, 2, 5, 6, 7}},
+}
+
+
+@pytest.fixture(autouse=True)
+def fake_sources(monkeypatch):
+    def live_ids(database, live_sql, ids, key='id'):
+        table = "OrderGoods" if "OrderGoods" in live_sql else "Orders"
+        return {int(i) for i in ids} & LIVE[database][table]
+    monkeypatch.setattr(source_priority, "live_ids", live_ids)
+
+
+@pytest.fixture
+def step02():
+    return load_step("02_extract_order_items.py")
+
+
+def items(rows):
+    return pd.DataFrame(rows, columns=['id', 'order_id', 'product_id', 'quantity', 'price', 'total_price',
+                                       'created_at', 'delflag', 'source_system'])
+
+
+def test_split_by_owner():
+    df = pd.DataFrame({'id': [1, 2, 3], 'delflag': [0, 0, 1]})
+    keep, dead, handover = source_priority.split_by_owner(df, "cyrgweixin", lambda db: "SELECT id FROM OrderGoods")
+    # 1 被 cyrg2025 占用，2 归属本源库，3 在所有源库都已失效
+    assert keep['id'].tolist() == [2]
+    assert dead == [3]
+    assert handover == {}
+
+    df = pd.DataFrame({'id': [4, 5], 'delflag': [0, 1]})
+    keep, dead, handover = source_priority.split_by_owner(df, "cyrg2025", lambda db: "SELECT id FROM OrderGoods")
+    # 5 在 cyrg2025 已删除，但 cyrgweixin 仍有同 id 的有效明细
+    assert keep['id'].tolist() == [4]
+    assert dead == []
+    assert handover == {"cyrgweixin": [5]}
+
+
+def test_items_with_colliding_order_ids(step02):
+    # 订单 100 两个源库都有，归 cyrg2025；200 只在 cyrgweixin；300 在哪都不是有效订单
+    df = items([
+        (5, 100, 1, 1, 10.0, 10.0, '2025-01-01 10:00:00', 0, 'cyrgweixin'),
+        (6, 200, 1, 1, 10.0, 10.0, '2025-01-01 10:00:00', 0, 'cyrgweixin'),
+        (7, 300, 1, 1, 10.0, 10.0, '2025-01-01 10:00:00', 0, 'cyrgweixin'),
+    ])
+    out = step02.drop_foreign_orders(df, "cyrgweixin")
+    assert out.set_index('id')['delflag'].to_dict() == {5: 1, 6: 0, 7: 0}
+
+    # 同一订单 id 在 cyrg2025 一侧的明细保留
+    df = items([(4, 100, 1, 1, 10.0, 10.0, '2025-01-01 10:00:00', 0, 'cyrg2025')])
+    assert step02.drop_foreign_orders(df, "cyrg2025")['delflag'].tolist() == [0]
+
+
+def test_sync_source_skips_items_of_foreign_orders(step02, monkeypatch):
+    merged, flagged = [], []
+    monkeypatch.setattr(step02, "get_watermark", lambda db, table: (None, None))
+    monkeypatch.setattr(step02, "set_watermark", lambda *args: None)
+    monkeypatch.setattr(step02, "merge_df", lambda df, *args, **kwargs:
+                        merged.append(df) or {'inserted': len(df), 'updated': 0, 'failed': 0})
+    monkeypatch.setattr(step02, "flag_deleted", lambda db, table, ids: flagged.extend(ids) or len(ids))
+
+    chunk = items([
+        (5, 100, 1, 1, 10.0, 10.0, '2025-01-01 10:00:00', 0, 'cyrgweixin'),
+        (6, 200, 2, 1, 10.0, 10.0, '2025-01-01 10:00:00', 0, 'cyrgweixin'),
+    ])
+    stats = step02.sync_source("cyrgweixin", lambda chunksize, watermark: chunk, 0, set())
+
+    assert pd.concat(merged)['id'].tolist() == [6]
+    # 明细 5 没有其他源库接手，目标表中已写入的旧行标记删除
+    assert flagged == [5]
+    assert stats['deleted'] == 1
@@ -3,8 +3,10 @@
 超高速数据同步系统 - 从cyrg2025和cyrgweixin数据库同步所有数据到hotdog2030
 优化特性：
 - 连接重试机制
-- 批量插入优化
-- 并行处理
+- 参数化批量插入（etl/lib/sync_writer.py，执行计划复用）
+- 影子表重载（--shadow：全量数据写入影子表，建索引、校验后 sp_rename 原子切换，不再清空线上表）
+- 增量同步（--delta：水位线 / 区间哈希检测新增、修改与软删除，只应用差异，不清空目标表）
+- 并行处理（--pipeline：源库并发分块读取、转换与写入流水线重叠，有界队列背压）
 - 内存优化
 - 进度监控
 """
@@ -12,9 +14,9 @@ import pymssql
 import logging
 from datetime import datetime
 import time
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
+import argparse
+from pathlib import Path
 
 # 配置日志
 logging.basicConfig(
@@ -27,6 +29,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 添加lib路径（在日志配置之后导入：lib.mssql 导入时也会调用 basicConfig）
+sys.path.append(str(Path(__file__).parent / 'etl'))
+from lib.sync_writer import SyncWriter
+from lib.sync_pipeline import SyncPipeline, SyncSource
+from lib.delta_sync import DeltaSpec, DeltaSync
+from lib.shadow import ShadowTable
+
 # 数据库连接配置
 CONFIG = {
     'server': 'rm-uf660d00xovkm30678o.sqlserver.rds.aliyuncs.com',
@@ -62,7 +71,86 @@ def retry_connect(database, attempts=3, delay=5):
             time.sleep(delay)
     raise Exception(f'无法连接数据库 {database}，重试次数已用尽')
 
-def ultra_fast_sync_orders():
+# 源库查询：cyrg2025 与 cyrgweixin 的 Orders 结构相同
+ORDERS_QUERY = '''
+SELECT id, orderNo, openId, shopId, recordTime, total, payState, delState,
+       payMode, orderRemarks, cash, vipAmount, vipAmountZengSong, cardAmount,
+       cardZengSong, couponAmount, discountAmount, molingAmount, costPrice,
+       profitPrice, takeoutName, orderValue
+FROM Orders
+WHERE Delflag = 0 
+    AND payState = 2 
+    AND (delState IS NULL OR delState != '系统删除')
+    AND (
+        (orderValue IS NOT NULL AND orderValue > 0 AND orderValue <= 1000)
+        OR 
+        (orderValue IS NULL AND cash > 0 AND cash <= 1000)
+    )
+'''
+ORDERS_SQL = ORDERS_QUERY + 'ORDER BY recordTime DESC\n'
+ORDER_ITEMS_QUERY = '''
+SELECT orderId, goodsId, goodsName, goodsNumber, goodsPrice, goodsTotal
+FROM OrderGoods
+'''
+ORDER_ITEMS_SQL = ORDER_ITEMS_QUERY + 'ORDER BY orderId\n'
+CUSTOMERS_SQL = '''
+SELECT ID, OpenId, NickName, Headimgurl, Sex, city, Tel, RecordTime, State
+FROM XcxUser
+WHERE Delflag = 0
+'''
+
+ORDER_COLUMNS = ['id', 'order_no', 'customer_id', 'store_id', 'total_amount', 'pay_state', 'pay_mode',
+                 'created_at', 'updated_at', 'delflag', 'cash', 'vipAmount', 'vipAmountZengSong', 'cardAmount',
+                 'cardZengSong', 'couponAmount', 'discountAmount', 'orderRemarks']
+ORDER_ITEM_COLUMNS = ['id', 'order_id', 'product_id', 'product_name', 'quantity', 'price', 'total_price',
+                      'created_at', 'updated_at', 'delflag']
+CUSTOMER_COLUMNS = ['id', 'customer_id', 'customer_name', 'phone', 'openid', 'created_at', 'updated_at', 'delflag']
+
+def _or(value, default):
+    return value if value is not None else default
+
+def order_row(order):
+    """源库订单行 -> hotdog2030.orders 行元组（顺序同 ORDER_COLUMNS）"""
+    order_amount = order[21] if order[21] is not None and order[21] > 0 else (order[10] if order[10] is not None and order[10] > 0 else 0)
+    record_time = _or(order[4], datetime.now())
+    return (order[0], _or(order[1], ''), _or(order[2], ''), _or(order[3], 0), order_amount,
+            _or(order[6], 0), _or(order[7], 0), record_time, record_time, 0,
+            _or(order[10], 0), _or(order[11], 0), _or(order[12], 0), _or(order[13], 0),
+            _or(order[14], 0), _or(order[15], 0), _or(order[16], 0), _or(order[9], ''))
+
+def order_item_row(item_id, item, now):
+    """源库订单商品行 -> hotdog2030.order_items 行元组（顺序同 ORDER_ITEM_COLUMNS）"""
+    return (item_id, item[0], item[1], item[2] or '', item[3] or 0, item[4] or 0, item[5] or 0, now, now, 0)
+
+def customer_row(customer_id, customer, now):
+    """源库小程序用户行 -> hotdog2030.customers 行元组（顺序同 CUSTOMER_COLUMNS）"""
+    record_time = customer[7] or now
+    return (customer_id, customer[1] or '', customer[2] or '', customer[6] or '', customer[1] or '',
+            record_time, record_time, 0)
+
+def open_target(hotdog_conn, table, shadow=False):
+    """全量重载的写入目标：shadow=True 时写入影子表（lib.shadow），否则清空线上表；返回 (影子表或 None, 写入表名)"""
+    if shadow:
+        target = ShadowTable(hotdog_conn, table)
+        target.create()
+        return target, target.name
+    hotdog_cursor = hotdog_conn.cursor()
+    logger.info(f'🗑️ 清空hotdog2030.{table}表...')
+    hotdog_cursor.execute(f'DELETE FROM {table}')
+    hotdog_conn.commit()
+    return None, table
+
+def close_target(target, rows_written):
+    """影子表重载：建索引、校验行数与 CHECKSUM 后原子切换"""
+    if target is not None:
+        target.swap(expected_rows=rows_written)
+
+def discard_target(target):
+    """同步失败时删除影子表，线上表保持不变"""
+    if target is not None:
+        target.drop()
+
+def ultra_fast_sync_orders(shadow=False):
     """超高速同步订单数据"""
     logger.info('🚀 开始超高速同步订单数据...')
     start_time = time.time()
@@ -75,48 +163,19 @@ def ultra_fast_sync_orders():
         logger.error('❌ 数据库连接失败')
         return False
     
+    target = None
     try:
         # 获取cyrg2025订单数据
         logger.info('📊 查询cyrg2025订单数据...')
         cyrg2025_cursor = cyrg2025_conn.cursor()
-        cyrg2025_cursor.execute('''
-            SELECT id, orderNo, openId, shopId, recordTime, total, payState, delState,
-                   payMode, orderRemarks, cash, vipAmount, vipAmountZengSong, cardAmount,
-                   cardZengSong, couponAmount, discountAmount, molingAmount, costPrice,
-                   profitPrice, takeoutName, orderValue
-            FROM Orders
-            WHERE Delflag = 0 
-                AND payState = 2 
-                AND (delState IS NULL OR delState != '系统删除')
-                AND (
-                    (orderValue IS NOT NULL AND orderValue > 0 AND orderValue <= 1000)
-                    OR 
-                    (orderValue IS NULL AND cash > 0 AND cash <= 1000)
-                )
-            ORDER BY recordTime DESC
-        ''')
+        cyrg2025_cursor.execute(ORDERS_SQL)
         cyrg2025_orders = cyrg2025_cursor.fetchall()
         logger.info(f'📊 cyrg2025找到 {len(cyrg2025_orders)} 个订单')
         
         # 获取cyrgweixin订单数据
         logger.info('📊 查询cyrgweixin订单数据...')
         cyrgweixin_cursor = cyrgweixin_conn.cursor()
-        cyrgweixin_cursor.execute('''
-            SELECT id, orderNo, openId, shopId, recordTime, total, payState, delState,
-                   payMode, orderRemarks, cash, vipAmount, vipAmountZengSong, cardAmount,
-                   cardZengSong, couponAmount, discountAmount, molingAmount, costPrice,
-                   profitPrice, takeoutName, orderValue
-            FROM Orders
-            WHERE Delflag = 0 
-                AND payState = 2 
-                AND (delState IS NULL OR delState != '系统删除')
-                AND (
-                    (orderValue IS NOT NULL AND orderValue > 0 AND orderValue <= 1000)
-                    OR 
-                    (orderValue IS NULL AND cash > 0 AND cash <= 1000)
-                )
-            ORDER BY recordTime DESC
-        ''')
+        cyrgweixin_cursor.execute(ORDERS_SQL)
         cyrgweixin_orders = cyrgweixin_cursor.fetchall()
         logger.info(f'📊 cyrgweixin找到 {len(cyrgweixin_orders)} 个订单')
         
@@ -141,61 +200,14 @@ def ultra_fast_sync_orders():
 
         all_orders = unique_orders
         
-        # 清空目标表
-        hotdog_cursor = hotdog_conn.cursor()
-        logger.info('🗑️ 清空hotdog2030.orders表...')
-        hotdog_cursor.execute('DELETE FROM orders')
-        hotdog_conn.commit()
-        
-        # 超高速批量插入
-        batch_size = 800  # SQL Server限制1000行，使用800确保安全
-        total_inserted = 0
-        
-        logger.info(f'📦 开始超高速批量插入，批量大小: {batch_size}')
-        
-        for i in range(0, len(all_orders), batch_size):
-            batch = all_orders[i:i + batch_size]
-            batch_start = time.time()
-            
-            # 构建批量插入SQL - 修复None值问题
-            values_list = []
-            for order in batch:
-                order_amount = order[21] if order[21] is not None and order[21] > 0 else (order[10] if order[10] is not None and order[10] > 0 else 0)
-                
-                # 安全处理None值
-                order_no = order[1] if order[1] is not None else ''
-                open_id = order[2] if order[2] is not None else ''
-                shop_id = order[3] if order[3] is not None else 0
-                pay_state = order[6] if order[6] is not None else 0
-                pay_mode = order[7] if order[7] is not None else 0
-                record_time = order[4] if order[4] is not None else datetime.now()
-                cash = order[10] if order[10] is not None else 0
-                vip_amount = order[11] if order[11] is not None else 0
-                vip_amount_zengsong = order[12] if order[12] is not None else 0
-                card_amount = order[13] if order[13] is not None else 0
-                card_zengsong = order[14] if order[14] is not None else 0
-                coupon_amount = order[15] if order[15] is not None else 0
-                discount_amount = order[16] if order[16] is not None else 0
-                order_remarks = order[9] if order[9] is not None else ''
-                
-                values_list.append(f"({order[0]}, '{order_no}', '{open_id}', {shop_id}, {order_amount}, {pay_state}, {pay_mode}, '{record_time}', '{record_time}', 0, {cash}, {vip_amount}, {vip_amount_zengsong}, {card_amount}, {card_zengsong}, {coupon_amount}, {discount_amount}, '{order_remarks}')")
-            
-            # 执行批量插入
-            insert_query = f'''
-                INSERT INTO orders 
-                (id, order_no, customer_id, store_id, total_amount, pay_state, pay_mode, created_at, updated_at, delflag,
-                 cash, vipAmount, vipAmountZengSong, cardAmount, cardZengSong, couponAmount, discountAmount, orderRemarks)
-                VALUES {', '.join(values_list)}
-            '''
-            
-            hotdog_cursor.execute(insert_query)
-            hotdog_conn.commit()
-            
-            total_inserted += len(batch)
-            batch_time = time.time() - batch_start
-            speed = len(batch) / batch_time if batch_time > 0 else 0
-            
-            logger.info(f'📦 已同步 {total_inserted}/{len(all_orders)} 个订单 (速度: {speed:.0f} 条/秒)')
+        # 清空目标表（--shadow 时写入影子表，完成后切换）
+        target, target_table = open_target(hotdog_conn, 'orders', shadow)
+        
+        # 参数化批量写入：值作为类型化参数传递，订单备注中的引号不再破坏批次，各批次复用同一执行计划
+        writer = SyncWriter(hotdog_conn, target_table, ORDER_COLUMNS, label='订单')
+        total_inserted = writer.write([order_row(order) for order in all_orders], total=len(all_orders))
+        writer.log_summary()
+        close_target(target, total_inserted)
         
         total_time = time.time() - start_time
         avg_speed = total_inserted / total_time if total_time > 0 else 0
@@ -213,9 +225,10 @@ def ultra_fast_sync_orders():
         
     except Exception as e:
         logger.error(f'❌ 同步订单数据失败: {e}')
+        discard_target(target)
         return False
 
-def ultra_fast_sync_order_items():
+def ultra_fast_sync_order_items(shadow=False):
     """超高速同步订单商品数据"""
     logger.info('🛒 开始超高速同步订单商品数据...')
     start_time = time.time()
@@ -227,56 +240,25 @@ def ultra_fast_sync_order_items():
         logger.error('❌ 数据库连接失败')
         return False
     
+    target = None
     try:
         # 获取订单商品数据
         logger.info('📊 查询订单商品数据...')
         cyrg2025_cursor = cyrg2025_conn.cursor()
-        cyrg2025_cursor.execute('''
-            SELECT orderId, goodsId, goodsName, goodsNumber, goodsPrice, goodsTotal
-            FROM OrderGoods
-            ORDER BY orderId
-        ''')
+        cyrg2025_cursor.execute(ORDER_ITEMS_SQL)
         order_items = cyrg2025_cursor.fetchall()
         logger.info(f'📊 找到 {len(order_items)} 个订单商品')
         
-        # 清空目标表
-        hotdog_cursor = hotdog_conn.cursor()
-        logger.info('🗑️ 清空hotdog2030.order_items表...')
-        hotdog_cursor.execute('DELETE FROM order_items')
-        hotdog_conn.commit()
-        
-        # 超高速批量插入
-        batch_size = 800  # SQL Server限制1000行，使用800确保安全
-        total_inserted = 0
-        
-        logger.info(f'📦 开始超高速批量插入，批量大小: {batch_size}')
-        
-        for i in range(0, len(order_items), batch_size):
-            batch = order_items[i:i + batch_size]
-            batch_start = time.time()
-            
-            # 构建批量插入SQL - 添加自增ID
-            values_list = []
-            for idx, item in enumerate(batch):
-                # 生成自增ID
-                item_id = total_inserted + idx + 1
-                values_list.append(f"({item_id}, {item[0]}, {item[1]}, '{item[2] or ''}', {item[3] or 0}, {item[4] or 0}, {item[5] or 0}, '{datetime.now()}', '{datetime.now()}', 0)")
-            
-            # 执行批量插入
-            insert_query = f'''
-                INSERT INTO order_items 
-                (id, order_id, product_id, product_name, quantity, price, total_price, created_at, updated_at, delflag)
-                VALUES {', '.join(values_list)}
-            '''
-            
-            hotdog_cursor.execute(insert_query)
-            hotdog_conn.commit()
-            
-            total_inserted += len(batch)
-            batch_time = time.time() - batch_start
-            speed = len(batch) / batch_time if batch_time > 0 else 0
-            
-            logger.info(f'🛒 已同步 {total_inserted}/{len(order_items)} 个订单商品 (速度: {speed:.0f} 条/秒)')
+        # 清空目标表（--shadow 时写入影子表，完成后切换）
+        target, target_table = open_target(hotdog_conn, 'order_items', shadow)
+        
+        # 参数化批量写入，id 按顺序生成
+        now = datetime.now()
+        writer = SyncWriter(hotdog_conn, target_table, ORDER_ITEM_COLUMNS, label='订单商品')
+        total_inserted = writer.write([order_item_row(idx + 1, item, now) for idx, item in enumerate(order_items)],
+                                      total=len(order_items))
+        writer.log_summary()
+        close_target(target, total_inserted)
         
         total_time = time.time() - start_time
         avg_speed = total_inserted / total_time if total_time > 0 else 0
@@ -293,9 +275,10 @@ def ultra_fast_sync_order_items():
         
     except Exception as e:
         logger.error(f'❌ 同步订单商品数据失败: {e}')
+        discard_target(target)
         return False
 
-def ultra_fast_sync_customers():
+def ultra_fast_sync_customers(shadow=False):
     """超高速同步客户数据"""
     logger.info('👥 开始超高速同步客户数据...')
     start_time = time.time()
@@ -307,56 +290,25 @@ def ultra_fast_sync_customers():
         logger.error('❌ 数据库连接失败')
         return False
     
+    target = None
     try:
         # 获取客户数据
         logger.info('📊 查询客户数据...')
         cyrg2025_cursor = cyrg2025_conn.cursor()
-        cyrg2025_cursor.execute('''
-            SELECT ID, OpenId, NickName, Headimgurl, Sex, city, Tel, RecordTime, State
-            FROM XcxUser
-            WHERE Delflag = 0
-        ''')
+        cyrg2025_cursor.execute(CUSTOMERS_SQL)
         customers = cyrg2025_cursor.fetchall()
         logger.info(f'📊 找到 {len(customers)} 个客户')
         
-        # 清空目标表
-        hotdog_cursor = hotdog_conn.cursor()
-        logger.info('🗑️ 清空hotdog2030.customers表...')
-        hotdog_cursor.execute('DELETE FROM customers')
-        hotdog_conn.commit()
-        
-        # 超高速批量插入
-        batch_size = 800  # SQL Server限制1000行，使用800确保安全
-        total_inserted = 0
-        
-        logger.info(f'📦 开始超高速批量插入，批量大小: {batch_size}')
-        
-        for i in range(0, len(customers), batch_size):
-            batch = customers[i:i + batch_size]
-            batch_start = time.time()
-            
-            # 构建批量插入SQL - 添加自增ID
-            values_list = []
-            for idx, customer in enumerate(batch):
-                # 生成自增ID
-                customer_id = total_inserted + idx + 1
-                values_list.append(f"({customer_id}, '{customer[1] or ''}', '{customer[2] or ''}', '{customer[6] or ''}', '{customer[1] or ''}', '{customer[7] or datetime.now()}', '{customer[7] or datetime.now()}', 0)")
-            
-            # 执行批量插入
-            insert_query = f'''
-                INSERT INTO customers 
-                (id, customer_id, customer_name, phone, openid, created_at, updated_at, delflag)
-                VALUES {', '.join(values_list)}
-            '''
-            
-            hotdog_cursor.execute(insert_query)
-            hotdog_conn.commit()
-            
-            total_inserted += len(batch)
-            batch_time = time.time() - batch_start
-            speed = len(batch) / batch_time if batch_time > 0 else 0
-            
-            logger.info(f'👥 已同步 {total_inserted}/{len(customers)} 个客户 (速度: {speed:.0f} 条/秒)')
+        # 清空目标表（--shadow 时写入影子表，完成后切换）
+        target, target_table = open_target(hotdog_conn, 'customers', shadow)
+        
+        # 参数化批量写入，id 取源库 XcxUser.ID，与增量同步一致
+        now = datetime.now()
+        writer = SyncWriter(hotdog_conn, target_table, CUSTOMER_COLUMNS, label='客户')
+        total_inserted = writer.write([customer_row(customer[0], customer, now) for customer in customers],
+                                      total=len(customers))
+        writer.log_summary()
+        close_target(target, total_inserted)
         
         total_time = time.time() - start_time
         avg_speed = total_inserted / total_time if total_time > 0 else 0
@@ -373,8 +325,98 @@ def ultra_fast_sync_customers():
         
     except Exception as e:
         logger.error(f'❌ 同步客户数据失败: {e}')
+        discard_target(target)
         return False
 
+def pipeline_sync(table, columns, label, sources, transform, dedup_key=None, assign_ids=False, shadow=False):
+    """流水线同步一张表：多个源库并发分块读取、并行转换，写入线程逐块提交（lib.sync_pipeline）"""
+    logger.info(f'🚰 开始流水线同步{label}...')
+    start_time = time.time()
+    
+    try:
+        hotdog_conn = retry_connect('hotdog2030')
+    except Exception as e:
+        logger.error(f'❌ 数据库连接失败: {e}')
+        return False
+    
+    target = None
+    try:
+        # 清空目标表（--shadow 时写入影子表，完成后切换）
+        target, target_table = open_target(hotdog_conn, table, shadow)
+        
+        writer = SyncWriter(hotdog_conn, target_table, columns, label=label)
+        pipeline = SyncPipeline(sources, transform, writer, dedup_key=dedup_key, assign_ids=assign_ids, label=label)
+        stats = pipeline.run()
+        writer.log_summary()
+        close_target(target, stats['written'])
+        
+        if stats['duplicates']:
+            logger.info(f'⚠️ 发现 {stats["duplicates"]} 个重复ID，已自动跳过')
+        total_time = time.time() - start_time
+        logger.info(f'✅ {label}同步完成: {stats["written"]} 条记录，总耗时 {total_time:.2f} 秒')
+        return True
+        
+    except Exception as e:
+        logger.error(f'❌ 流水线同步{label}失败: {e}')
+        discard_target(target)
+        return False
+    finally:
+        hotdog_conn.close()
+
+def _source(database, sql):
+    return SyncSource(database, lambda: retry_connect(database), sql)
+
+def pipeline_sync_orders(shadow=False):
+    """流水线同步订单：cyrg2025 与 cyrgweixin 并发读取，按订单ID去重（同ID总是保留 cyrg2025 的订单，与批量模式一致）"""
+    return pipeline_sync('orders', ORDER_COLUMNS, '订单',
+                         [_source('cyrg2025', ORDERS_SQL), _source('cyrgweixin', ORDERS_SQL)],
+                         lambda rows: [order_row(order) for order in rows],
+                         dedup_key=lambda row: row[0], shadow=shadow)
+
+def pipeline_sync_order_items(shadow=False):
+    """流水线同步订单商品，id 由写入线程按写入顺序编号"""
+    now = datetime.now()
+    return pipeline_sync('order_items', ORDER_ITEM_COLUMNS, '订单商品', [_source('cyrg2025', ORDER_ITEMS_SQL)],
+                         lambda rows: [order_item_row(None, item, now) for item in rows], assign_ids=True,
+                         shadow=shadow)
+
+def pipeline_sync_customers(shadow=False):
+    """流水线同步客户，id 取源库 XcxUser.ID"""
+    now = datetime.now()
+    return pipeline_sync('customers', CUSTOMER_COLUMNS, '客户', [_source('cyrg2025', CUSTOMERS_SQL)],
+                         lambda rows: [customer_row(customer[0], customer, now) for customer in rows],
+                         shadow=shadow)
+
+# 增量同步定义：订单与客户按主键 MERGE（软删除置 delflag = 1），订单商品没有稳定主键，按订单ID区间整体替换
+DELTA_SPECS = {
+    'orders': DeltaSpec('orders', ORDER_COLUMNS, ['cyrg2025', 'cyrgweixin'], 'Orders', 'id', ORDERS_QUERY,
+                        order_row, change_ts='recordTime'),
+    'order_items': DeltaSpec('order_items', ORDER_ITEM_COLUMNS, ['cyrg2025'], 'OrderGoods', 'orderId',
+                             ORDER_ITEMS_QUERY, lambda item: order_item_row(None, item, datetime.now()),
+                             key='order_id', mode='replace'),
+    'customers': DeltaSpec('customers', CUSTOMER_COLUMNS, ['cyrg2025'], 'XcxUser', 'ID', CUSTOMERS_SQL,
+                           lambda customer: customer_row(customer[0], customer, datetime.now()),
+                           change_ts='RecordTime'),
+}
+
+def delta_sync(name, label, reconcile=False):
+    """增量同步一张表：只应用源库的新增、修改与软删除，不清空目标表（lib.delta_sync）"""
+    logger.info(f'🔁 开始增量同步{label}...')
+    try:
+        hotdog_conn = retry_connect('hotdog2030')
+    except Exception as e:
+        logger.error(f'❌ 数据库连接失败: {e}')
+        return False
+    
+    try:
+        DeltaSync(DELTA_SPECS[name], retry_connect, hotdog_conn).run(reconcile=reconcile)
+        return True
+    except Exception as e:
+        logger.error(f'❌ 增量同步{label}失败: {e}')
+        return False
+    finally:
+        hotdog_conn.close()
+
 def get_final_statistics():
     """获取最终数据统计"""
     logger.info('📊 获取最终数据统计...')
@@ -403,17 +445,43 @@ def get_final_statistics():
 
 def main():
     """主函数"""
-    logger.info('🚀 开始超高速数据同步系统')
+    parser = argparse.ArgumentParser(description='超高速数据同步')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--pipeline', action='store_true',
+                      help='流水线模式：并发分块读取、并行转换、逐块写入，内存只占用少量数据块')
+    mode.add_argument('--delta', action='store_true',
+                      help='增量模式：按水位线只应用新增、修改与软删除，目标表同步期间始终可查询')
+    parser.add_argument('--shadow', action='store_true',
+                        help='全量/流水线模式下写入影子表，建索引并校验后原子切换，读者不会看到清空后的表')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='增量模式下按主键区间哈希全面对账，发现不改变更时间的修改与物理删除')
+    args = parser.parse_args()
+    
+    mode_name = '（流水线模式）' if args.pipeline else ('（增量模式）' if args.delta else '')
+    logger.info('🚀 开始超高速数据同步系统' + mode_name)
     logger.info('=' * 80)
     
     overall_start = time.time()
     
     # 执行同步任务
-    tasks = [
-        ("订单数据", ultra_fast_sync_orders),
-        ("订单商品数据", ultra_fast_sync_order_items),
-        ("客户数据", ultra_fast_sync_customers)
-    ]
+    if args.delta:
+        tasks = [
+            ("订单数据", lambda: delta_sync('orders', '订单', args.reconcile)),
+            ("订单商品数据", lambda: delta_sync('order_items', '订单商品', args.reconcile)),
+            ("客户数据", lambda: delta_sync('customers', '客户', args.reconcile))
+        ]
+    elif args.pipeline:
+        tasks = [
+            ("订单数据", lambda: pipeline_sync_orders(args.shadow)),
+            ("订单商品数据", lambda: pipeline_sync_order_items(args.shadow)),
+            ("客户数据", lambda: pipeline_sync_customers(args.shadow))
+        ]
+    else:
+        tasks = [
+            ("订单数据", lambda: ultra_fast_sync_orders(args.shadow)),
+            ("订单商品数据", lambda: ultra_fast_sync_order_items(args.shadow)),
+            ("客户数据", lambda: ultra_fast_sync_customers(args.shadow))
+        ]
     
     success_count = 0
     for task_name, task_func in tasks: